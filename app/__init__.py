@@ -1,3 +1,10 @@
-from .agent import root_agent
+__all__ = ["root_agent"]
 
-__all__ = ["root_agent"]
\ No newline at end of file
+
+def __getattr__(name):
+    # Imported on first access so that lightweight modules such as `app.schema_catalog`
+    # can be used without building the whole agent.
+    if name == "root_agent":
+        from .agent import root_agent
+        return root_agent
+    raise AttributeError(f"module {__name__!r} has no attribute {name!r}")
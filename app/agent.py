@@ -1,77 +1,318 @@
 from google.adk.agents import Agent, LlmAgent, SequentialAgent
-from google.adk.tools.bigquery import BigQueryCredentialsConfig, BigQueryToolset
-import google.auth
+from google.adk.planners import BuiltInPlanner
+from google.adk.tools.base_toolset import BaseToolset
+from google.adk.tools.tool_context import ToolContext
 import dotenv
+import functools
+import threading
+from typing import Optional
 
-from google import genai
-
-from .prompts import COMPRAS_AGENT_PROMPT, CALIDAD_AGENT_PROMPT, PEDIDOS_AGENT_PROMPT
+from . import telemetry
+from .agent_config import AGENT_PROFILE, load_profile
+from .documents import query_gcs_document, query_gcs_documents, search_document_pages
+from .local_mirror import LOCAL_MIRROR_ENABLED, LocalMirror
+from .product_index import ProductResolver
+from .rate_limit import RateLimitedGemini
+from .result_store import RESULT_BUFFER_ENABLED, RESULT_MAX_ROWS, ResultStore
+from .router import build_router
+from .sql_cache import EXECUTE_SQL_TOOL, SQL_CACHE_ENABLED, SqlResultCache
+from .sql_guard import SQL_GUARD_DEFAULT_LIMIT, SQL_GUARD_ENABLED, SqlGuard
+from .prompts import (
+    COMPRAS_AGENT_PROMPT, CALIDAD_AGENT_PROMPT, PEDIDOS_AGENT_PROMPT,
+    SCHEMA_CATALOG, compile_prompt,
+)
 
 dotenv.load_dotenv()
 
-credentials, _ = google.auth.default()
-credentials_config = BigQueryCredentialsConfig(credentials=credentials)
-bigquery_toolset = BigQueryToolset(
-  credentials_config=credentials_config
-)
+# Writes spans and metrics to TELEMETRY_FILE when it is set (local runs); a no-op otherwise.
+telemetry.configure_file_exporter()
+
+# Credentials, clients and the toolset are created on first use rather than at import, so
+# importing the agent (CLI commands, Agent Engine cold starts) does not wait on google.auth.
+_init_lock = threading.RLock()
+
+@functools.lru_cache(maxsize=None)
+def _default_credentials():
+    import google.auth
+    credentials, _ = google.auth.default()
+    return credentials
+
+def get_credentials():
+    with _init_lock:
+        return _default_credentials()
+
+@functools.lru_cache(maxsize=None)
+def _bigquery_client(project: str):
+    from google.cloud import bigquery
+    return bigquery.Client(project=project, credentials=get_credentials())
+
+def bigquery_client(project: str):
+    """BigQuery client for metadata lookups and dry runs made outside the toolset."""
+    with _init_lock:
+        return _bigquery_client(project)
+
+class LazyBigQueryToolset(BaseToolset):
+    """BigQueryToolset built with the default credentials the first time the agent lists its tools."""
+
+    def __init__(self):
+        super().__init__()
+        self._toolset = None
+
+    def _get_toolset(self):
+        with _init_lock:
+            if self._toolset is None:
+                from google.adk.tools.bigquery import BigQueryCredentialsConfig, BigQueryToolset
+                from google.adk.tools.bigquery.config import BigQueryToolConfig
+                # Large results are summarized by `result_store`, so the tool may fetch up to RESULT_MAX_ROWS rows.
+                tool_config = BigQueryToolConfig(max_query_result_rows=RESULT_MAX_ROWS) if RESULT_BUFFER_ENABLED else None
+                self._toolset = BigQueryToolset(
+                    credentials_config=BigQueryCredentialsConfig(credentials=get_credentials()),
+                    bigquery_tool_config=tool_config,
+                )
+            return self._toolset
+
+    async def get_tools(self, readonly_context=None):
+        tools = await self._get_toolset().get_tools(readonly_context)
+        if sql_guard.enabled:
+            # BigQuery enforces the guard's byte budget on the job too, not only the dry-run estimate.
+            from google.adk.tools import FunctionTool
+            tools = [FunctionTool(execute_sql) if tool.name == EXECUTE_SQL_TOOL else tool for tool in tools]
+        return tools
+
+    async def close(self):
+        if self._toolset is not None:
+            await self._toolset.close()
+
+    def __getstate__(self):
+        # The deployed agent resolves its own credentials instead of shipping the local ones.
+        return {**self.__dict__, "_toolset": None}
+
+bigquery_toolset = LazyBigQueryToolset()
+
+# Rows a query returns: the BigQuery tool's default of 50, or RESULT_MAX_ROWS when `result_store` summarizes them.
+QUERY_MAX_ROWS = RESULT_MAX_ROWS if RESULT_BUFFER_ENABLED else 50
+
+local_mirror = LocalMirror(bigquery_client, max_rows=QUERY_MAX_ROWS, enabled=LOCAL_MIRROR_ENABLED)
+# With large results buffered, the LIMIT added to open-ended queries only caps what is fetched.
+sql_guard = SqlGuard(bigquery_client, catalog=SCHEMA_CATALOG, enabled=SQL_GUARD_ENABLED,
+                     default_limit=max(SQL_GUARD_DEFAULT_LIMIT, RESULT_MAX_ROWS) if RESULT_BUFFER_ENABLED
+                     else SQL_GUARD_DEFAULT_LIMIT, local_engine=local_mirror)
+sql_cache = SqlResultCache(bigquery_client, enabled=SQL_CACHE_ENABLED)
+result_store = ResultStore(bigquery_client, enabled=RESULT_BUFFER_ENABLED)
+
+product_resolver = ProductResolver(bigquery_client)
+
+def execute_sql(project_id: str, query: str) -> dict:
+    """
+    Run a BigQuery SQL query in the project and return the result.
+
+    Args:
+        project_id (str): The GCP project id in which the query should be executed.
+        query (str): The BigQuery SQL query to be executed.
+
+    Returns:
+        dict: Dictionary representing the result of the query, with its "status" and "rows".
+        If the result contains the key "result_is_likely_truncated" with value True, there may be
+        additional rows matching the query not returned in the result.
+    """
+    return sql_guard.execute_sql(project_id, query, max_rows=QUERY_MAX_ROWS)
+
+async def resolve_product(reference: str, max_results: int = 5) -> dict:
+    """
+    Resolves a product mention to its exact identifiers before writing SQL.
+    Accepts our internal reference (Ematn), the supplier reference (Idnlf) or part of the product name (Txz01),
+    tolerating typos, accents and case differences.
 
-genai_client = genai.Client(vertexai=True, project='ocr-digitalizacion-425708', location='europe-west1')
+    Args:
+        reference (str): The product reference or name as the user wrote it.
+        max_results (int): Maximum number of candidate products to return.
+
+    Returns:
+        dict: The candidate products ranked by relevance, each with its exact Ematn, Idnlf and Txz01 values,
+        the kind of match (exact, prefix, contains or fuzzy) and a score between 0 and 1.
+    """
+    return await product_resolver.resolve(reference, max_results)
+
+async def get_result_rows(result_id: str, offset: int = 0, limit: int = 50, columns: Optional[list[str]] = None,
+                          order_by: str = "", descending: bool = False, tool_context: ToolContext = None) -> dict:
+    """
+    Returns a page of rows of a large query result summarized by execute_sql, without running the query again.
+
+    Args:
+        result_id (str): The result_id returned by execute_sql, filter_result or aggregate_result.
+        offset (int): Index of the first row to return.
+        limit (int): Maximum number of rows to return (at most 100).
+        columns (list[str]): Optional columns to return; all of them when empty.
+        order_by (str): Optional column to sort the result by before paging.
+        descending (bool): Sort in descending order.
+
+    Returns:
+        dict: The rows of the page, the total row count and the offset of the next page (null on the last one).
+    """
+    return await result_store.rows(result_id, offset, limit, columns, order_by, descending, tool_context.state)
 
-def query_gcs_document(gcs_file_path: str, question: str) -> str:
+async def filter_result(result_id: str, filters: list[str], order_by: str = "", descending: bool = False,
+                        tool_context: ToolContext = None) -> dict:
     """
-    Reads a document directly from a Google Cloud Storage (GCS) URI and answers a question about its content.
+    Keeps the rows of a large query result that match every filter, without running the query again.
 
     Args:
-        gcs_file_path (str): The full GCS path to the file, e.g., 'gs://my-bucket/documents/report.pdf'.
-        question (str): The specific question to ask about the document's content.
+        result_id (str): The result_id returned by execute_sql, filter_result or aggregate_result.
+        filters (list[str]): Conditions as "<column> <operator> <value>", e.g. ["Menge > 100", "Txz01 contains 'vitamina'",
+            "Lifnr in ('100234', '100981')", "Eindt >= '2024-01-01'"]. Operators: =, !=, >, >=, <, <=, contains,
+            starts_with, in, not in, is null, is not null.
+        order_by (str): Optional column to sort the filtered rows by.
+        descending (bool): Sort in descending order.
 
     Returns:
-        str: The answer to the question based on the document's content, or an error message if the file cannot be accessed.
+        dict: The matching rows when they are few; otherwise a summary with a new result_id for further paging,
+        filtering or aggregation.
     """
-    
+    return await result_store.filter(result_id, filters, order_by, descending, tool_context.state)
 
+async def aggregate_result(result_id: str, aggregations: list[str], group_by: Optional[list[str]] = None,
+                           filters: Optional[list[str]] = None, order_by: str = "", descending: bool = True,
+                           tool_context: ToolContext = None) -> dict:
+    """
+    Aggregates a large query result locally (like GROUP BY), without running the query again.
+
+    Args:
+        result_id (str): The result_id returned by execute_sql, filter_result or aggregate_result.
+        aggregations (list[str]): "count" or "<function>:<column>" with function count_distinct, sum, mean, min or max,
+            e.g. ["count", "sum:Menge", "count_distinct:Ebeln"]. Output columns are named "<column>_<function>".
+        group_by (list[str]): Optional columns to group by; the whole result is aggregated when empty.
+        filters (list[str]): Optional conditions applied before aggregating, in the same format as filter_result.
+        order_by (str): Optional output column to sort by, e.g. "Menge_sum".
+        descending (bool): Sort in descending order.
+
+    Returns:
+        dict: The aggregated rows when they are few; otherwise a summary with a new result_id.
+    """
+    return await result_store.aggregate(result_id, aggregations, group_by, filters, order_by, descending,
+                                        tool_context.state)
+
+result_tools = [get_result_rows, filter_result, aggregate_result]
+
+# Stages run in order around every tool call of the sub-agents. The guard rewrites the
+# query before the cache keys on it, and annotates the response after the cache stored it.
+# Cache misses are answered by the local mirror when its tables are fresh, else by BigQuery.
+# The result store runs last, so the cache keeps whole results and the summary keeps the notes.
+before_tool_stages = [sql_guard.before_tool_callback, sql_cache.before_tool_callback, local_mirror.before_tool_callback]
+after_tool_stages = [sql_cache.after_tool_callback, sql_guard.after_tool_callback, result_store.after_tool_callback]
+
+# The agents reference these module-level functions rather than the stages' bound methods,
+# so the deployed agent pickles by reference and never tries to serialize locks or caches.
+async def before_tool_callback(tool, args, tool_context):
+    """Runs the before stages in order; the first response returned replaces the tool call."""
+    telemetry.start_tool_span(tool, args, tool_context)
+    for stage in before_tool_stages:
+        response = await stage(tool, args, tool_context)
+        if response is not None:
+            hit = stage == sql_cache.before_tool_callback
+            telemetry.annotate_tool_span(tool_context, **{
+                "tool.short_circuit": getattr(stage, "__self__", stage).__class__.__name__,
+                "cache.outcome": "hit" if hit else "miss" if sql_cache.is_pending(tool_context.function_call_id) else None,
+            })
+            return response
+    if sql_cache.is_pending(tool_context.function_call_id):
+        telemetry.annotate_tool_span(tool_context, **{"cache.outcome": "miss"})
+    return None
+
+async def after_tool_callback(tool, args, tool_context, tool_response):
+    """Runs the after stages in order; the first response returned replaces the tool response."""
     try:
-        file_part = genai.types.Part.from_uri(file_uri=gcs_file_path, mime_type='application/pdf')
+        for stage in after_tool_stages:
+            response = await stage(tool, args, tool_context, tool_response)
+            if response is not None:
+                return response
+        return None
+    finally:
+        telemetry.end_tool_span(tool, tool_context, tool_response, **{
+            "db.bytes_processed": sql_guard.pop_estimate(tool_context.function_call_id),
+        })
 
-        response = genai_client.models.generate_content( 
-            model='gemini-2.5-flash',
-            contents=[str(question), file_part],
-        )
+# Spans and token counts per sub-agent run; the router says whether it or the orchestrator model routed it.
+def before_agent_callback(callback_context):
+    telemetry.start_agent_span(callback_context, routed_by=router.routed_by(callback_context.invocation_id))
+    return None
 
-        return response.text
+def after_agent_callback(callback_context):
+    telemetry.end_agent_span(callback_context)
+    return None
 
-    except Exception as e:
-        print(f"An error occurred: {e}")
-        return f"Error: Failed to access or process the file at {gcs_file_path}."
+def after_model_callback(callback_context, llm_response):
+    telemetry.record_model_usage(callback_context, model_settings[callback_context.agent_name].model, llm_response)
+    return None
+
+# Model, thinking budget, output cap and temperature of each agent, from the AGENT_PROFILE profile.
+model_settings = load_profile(AGENT_PROFILE)["agents"]
+# One model object per Gemini model: every request shares the process-wide Gemini rate limiter
+# with the document tools, instead of each agent bursting into the quota on its own.
+gemini_models = {model: RateLimitedGemini(model=model) for model in sorted({s.model for s in model_settings.values()})}
+
+def model_options(agent_name: str) -> dict:
+    """LlmAgent arguments for the agent's settings; ADK takes the thinking budget through a planner."""
+    settings = model_settings[agent_name]
+    thinking_config = settings.thinking_config()
+    return {
+        "model": gemini_models[settings.model],
+        "generate_content_config": settings.generate_content_config(thinking=False),
+        "planner": BuiltInPlanner(thinking_config=thinking_config) if thinking_config else None,
+    }
 
 calidad_agent = LlmAgent(
-    model="gemini-2.5-flash",
+    **model_options("calidad_agent"),
     name="calidad_agent",
     description="Agent that answers question about quality documents by executing SQL queries.",
     instruction=CALIDAD_AGENT_PROMPT,
-    tools=[bigquery_toolset, query_gcs_document]
+    tools=[bigquery_toolset, *result_tools, search_document_pages, query_gcs_document, query_gcs_documents],
+    before_tool_callback=before_tool_callback,
+    after_tool_callback=after_tool_callback,
+    before_agent_callback=before_agent_callback,
+    after_agent_callback=after_agent_callback,
+    after_model_callback=after_model_callback,
 )
 
 compras_agent = LlmAgent(
-    model="gemini-2.5-flash",
+    **model_options("compras_agent"),
     name="compras_agent",
     description="Agent that answers question about buys by executing SQL queries.",
     instruction=COMPRAS_AGENT_PROMPT,
-    tools=[bigquery_toolset, query_gcs_document]
+    tools=[bigquery_toolset, *result_tools, search_document_pages, query_gcs_document, query_gcs_documents,
+           resolve_product],
+    before_tool_callback=before_tool_callback,
+    after_tool_callback=after_tool_callback,
+    before_agent_callback=before_agent_callback,
+    after_agent_callback=after_agent_callback,
+    after_model_callback=after_model_callback,
 )
 
 pedidos_agent = LlmAgent(
-    model="gemini-2.5-flash",
+    **model_options("pedidos_agent"),
     name="pedidos_agent",
     description="Agent that answers question about orders by executing SQL queries.",
     instruction=PEDIDOS_AGENT_PROMPT,
-    tools=[bigquery_toolset, query_gcs_document]
+    tools=[bigquery_toolset, *result_tools, search_document_pages, query_gcs_document, query_gcs_documents,
+           resolve_product],
+    before_tool_callback=before_tool_callback,
+    after_tool_callback=after_tool_callback,
+    before_agent_callback=before_agent_callback,
+    after_agent_callback=after_agent_callback,
+    after_model_callback=after_model_callback,
 )
 
 
 
+router = build_router()
+
+def router_before_model_callback(callback_context, llm_request):
+    return router.before_model_callback(callback_context, llm_request)
+
+def router_after_model_callback(callback_context, llm_response):
+    return router.after_model_callback(callback_context, llm_response)
+
 root_agent = Agent(
- model="gemini-2.5-flash",
+ **model_options("bigquery_agent"),
  name="bigquery_agent",
  description="Agent that answers questions about BigQuery data by executing SQL queries.",
  instruction=(
@@ -85,7 +326,17 @@ root_agent = Agent(
     """
  ),
  sub_agents=[calidad_agent, compras_agent, pedidos_agent],
+ # Confident questions are transferred by the router without calling the orchestrator model.
+ before_model_callback=router_before_model_callback,
+ after_model_callback=router_after_model_callback,
 )
 
+def apply_schema_catalog(catalog: dict):
+    """Re-renders the sub-agent instructions with a freshly refreshed schema catalog."""
+    calidad_agent.instruction = compile_prompt("calidad_agent", catalog)
+    compras_agent.instruction = compile_prompt("compras_agent", catalog)
+    pedidos_agent.instruction = compile_prompt("pedidos_agent", catalog)
+    sql_guard.catalog = catalog
+
 def get_bigquery_agent():
  return root_agent
\ No newline at end of file
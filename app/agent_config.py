@@ -0,0 +1,96 @@
+import functools
+import os
+from dataclasses import dataclass, fields
+from typing import Optional
+
+import dotenv
+from google.genai import types
+
+dotenv.load_dotenv()
+
+# Profile of `agent_profiles.yaml` the agents and document tools are built with.
+AGENT_PROFILE = os.getenv("AGENT_PROFILE", "default")
+AGENT_PROFILES_FILE = os.getenv("AGENT_PROFILES_FILE",
+                                os.path.join(os.path.dirname(os.path.abspath(__file__)), "agent_profiles.yaml"))
+
+SECTIONS = ("agents", "tools")
+
+
+@dataclass(frozen=True)
+class ModelSettings:
+    """Model and generation settings of one agent or tool; None leaves the model's default."""
+    model: str
+    thinking_budget: Optional[int] = None
+    max_output_tokens: Optional[int] = None
+    temperature: Optional[float] = None
+
+    def thinking_config(self) -> Optional[types.ThinkingConfig]:
+        if self.thinking_budget is None:
+            return None
+        return types.ThinkingConfig(thinking_budget=self.thinking_budget)
+
+    def generate_content_config(self, thinking: bool = True, **kwargs) -> Optional[types.GenerateContentConfig]:
+        """Request config with these settings; ADK agents take the thinking config through a planner instead."""
+        settings = {"temperature": self.temperature, "max_output_tokens": self.max_output_tokens,
+                    "thinking_config": self.thinking_config() if thinking else None, **kwargs}
+        settings = {key: value for key, value in settings.items() if value is not None}
+        return types.GenerateContentConfig(**settings) if settings else None
+
+    def describe(self) -> str:
+        """The model followed by the settings that are set, e.g. "gemini-2.5-flash;thinking_budget=0"."""
+        return ";".join([self.model] + [f"{f.name}={getattr(self, f.name)}" for f in fields(self)[1:]
+                                        if getattr(self, f.name) is not None])
+
+
+@functools.lru_cache(maxsize=None)
+def _read(path: str) -> dict:
+    import yaml
+    with open(path, "r", encoding="utf-8") as f:
+        return yaml.safe_load(f) or {}
+
+
+def profile_names(path: str = AGENT_PROFILES_FILE) -> list:
+    return list((_read(path).get("profiles") or {}).keys())
+
+
+def _settings(owner: str, values: dict) -> ModelSettings:
+    known = {f.name for f in fields(ModelSettings)}
+    unknown = sorted(set(values) - known)
+    if unknown:
+        raise ValueError(f"Unknown settings for {owner}: {', '.join(unknown)}. Expected: {', '.join(sorted(known))}.")
+    if not values.get("model"):
+        raise ValueError(f"No model set for {owner}.")
+    # Thinking tokens count towards max_output_tokens, so a budget at or above the cap leaves
+    # no room for the answer.
+    thinking_budget, max_output_tokens = values.get("thinking_budget"), values.get("max_output_tokens")
+    if thinking_budget is not None and max_output_tokens is not None and thinking_budget >= max_output_tokens:
+        raise ValueError(f"thinking_budget ({thinking_budget}) of {owner} must be lower than "
+                         f"max_output_tokens ({max_output_tokens}): thinking tokens count towards it.")
+    return ModelSettings(**values)
+
+
+@functools.lru_cache(maxsize=None)
+def load_profile(name: str = AGENT_PROFILE, path: str = AGENT_PROFILES_FILE) -> dict:
+    """{"agents": {name: ModelSettings}, "tools": {name: ModelSettings}} of profile `name` over `base`."""
+    document = _read(path)
+    profiles = document.get("profiles") or {}
+    if name not in profiles:
+        raise ValueError(f"Unknown agent profile '{name}' in {path}. Available: {', '.join(profiles)}.")
+    base, overrides = document.get("base") or {}, profiles[name] or {}
+    profile = {}
+    for section in SECTIONS:
+        changes = overrides.get(section) or {}
+        unknown = sorted(set(changes) - set(base.get(section) or {}))
+        if unknown:
+            raise ValueError(f"Profile '{name}' sets {section} missing from base: {', '.join(unknown)}.")
+        profile[section] = {owner: _settings(f"{owner} ({name})", {**(values or {}), **(changes.get(owner) or {})})
+                            for owner, values in (base.get(section) or {}).items()}
+    return profile
+
+
+def agent_settings(agent_name: str, profile: str = AGENT_PROFILE) -> ModelSettings:
+    return load_profile(profile)["agents"][agent_name]
+
+
+def tool_settings(tool_name: str, profile: str = AGENT_PROFILE) -> ModelSettings:
+    return load_profile(profile)["tools"][tool_name]
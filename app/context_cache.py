@@ -0,0 +1,192 @@
+import asyncio
+import os
+import time
+from dataclasses import dataclass, field
+from typing import Optional
+
+import cachetools
+import dotenv
+from google.genai import types
+
+from .rate_limit import error_code
+
+dotenv.load_dotenv()
+
+# Number of questions about the same document before its context is cached.
+CONTEXT_CACHE_MIN_HITS = int(os.getenv("CONTEXT_CACHE_MIN_HITS", "2"))
+# Server-side lifetime of a context cache (seconds).
+CONTEXT_CACHE_TTL = int(os.getenv("CONTEXT_CACHE_TTL", "900"))
+# Caches unused for this long are deleted before they expire, to stop storage billing (seconds).
+CONTEXT_CACHE_IDLE_TIMEOUT = int(os.getenv("CONTEXT_CACHE_IDLE_TIMEOUT", "300"))
+# Documents whose hit counts are tracked; the least recently seen ones are forgotten first.
+CONTEXT_CACHE_MAX_DOCUMENTS = int(os.getenv("CONTEXT_CACHE_MAX_DOCUMENTS", "4096"))
+# Wait before trying again to cache a document after a transient failure; doubles with every failure (seconds).
+CONTEXT_CACHE_RETRY_BACKOFF = float(os.getenv("CONTEXT_CACHE_RETRY_BACKOFF", "60"))
+CONTEXT_CACHE_ENABLED = os.getenv("CONTEXT_CACHE_ENABLED", "true").lower() == "true"
+
+
+@dataclass
+class CachedDocument:
+    name: str
+    expire_time: float
+    last_used: float
+    uses: int = 0
+
+
+@dataclass
+class _DocumentState:
+    hits: int = 0
+    cached: Optional[CachedDocument] = None
+    # Set when the model refused to cache the document (400, e.g. below the minimum token count).
+    uncacheable: bool = False
+    # Transient failures (timeouts, 5xx, 429) in a row, and when caching may be tried again.
+    failures: int = 0
+    retry_at: float = 0.0
+    lock: asyncio.Lock = field(default_factory=asyncio.Lock)
+
+
+class _DocumentStates(cachetools.LRUCache):
+    """LRU of document states that remembers the live caches of evicted documents, so they get deleted."""
+
+    def __init__(self, maxsize: int):
+        super().__init__(maxsize=maxsize)
+        self.evicted = []
+
+    def popitem(self):
+        key, state = super().popitem()
+        if state.cached is not None:
+            self.evicted.append(state.cached.name)
+        return key, state
+
+
+class DocumentContextManager:
+    """Creates and tracks explicit Gemini context caches for frequently queried PDFs.
+
+    Every lookup counts as a hit on the document. Once a `storage_uri` reaches
+    `min_hits`, its PDF is uploaded once into a context cache and later questions
+    only send the question text plus the `cached_content` name. Documents are tracked
+    per (GCS URI, object generation), so an overwritten PDF gets a new cache instead
+    of being answered from the old content. Caches are deleted when they expire or
+    stay idle for `idle_timeout` seconds, and when their document is evicted from the
+    `max_documents` tracked. A document the model refuses to cache (400) is not tried
+    again; after any other failure it is retried once `retry_backoff` has passed.
+
+    The client is passed on each call so the manager works with any object exposing
+    `aio.caches.create` / `aio.caches.delete` (including fakes that record calls).
+    """
+
+    def __init__(self, model: str, min_hits: int = CONTEXT_CACHE_MIN_HITS, ttl: int = CONTEXT_CACHE_TTL,
+                 idle_timeout: int = CONTEXT_CACHE_IDLE_TIMEOUT, max_documents: int = CONTEXT_CACHE_MAX_DOCUMENTS,
+                 retry_backoff: float = CONTEXT_CACHE_RETRY_BACKOFF, enabled: bool = True, clock=time.time):
+        self.model = model
+        self.min_hits = min_hits
+        self.ttl = ttl
+        self.idle_timeout = idle_timeout
+        self.retry_backoff = retry_backoff
+        self.enabled = enabled
+        self._clock = clock
+        self._documents = _DocumentStates(max_documents)
+        self.created = 0
+        self.deleted = 0
+        self.cached_calls = 0
+        self.failures = 0
+
+    async def cached_content(self, client, gcs_uri: str, generation, mime_type: str = "application/pdf"):
+        """Records a hit on this version of `gcs_uri` and returns the name of its context cache, if there is one.
+
+        Nothing is cached while the object generation is unknown (None).
+        """
+        if not self.enabled or generation is None:
+            return None
+        await self.purge_expired(client)
+
+        key = (gcs_uri, str(generation))
+        state = self._documents.get(key)
+        if state is None:
+            state = self._documents[key] = _DocumentState()
+            while self._documents.evicted:
+                await self._delete(client, self._documents.evicted.pop())
+        state.hits += 1
+        async with state.lock:
+            now = self._clock()
+            if (state.cached is None and not state.uncacheable and now >= state.retry_at
+                    and state.hits >= self.min_hits):
+                state.cached = await self._create(client, gcs_uri, mime_type, state)
+            if state.cached is None:
+                return None
+            state.cached.last_used = now
+            state.cached.uses += 1
+            self.cached_calls += 1
+            return state.cached.name
+
+    async def _create(self, client, gcs_uri: str, mime_type: str, state: _DocumentState):
+        try:
+            cache = await client.aio.caches.create(
+                model=self.model,
+                config=types.CreateCachedContentConfig(
+                    contents=[types.Content(role="user", parts=[types.Part.from_uri(file_uri=gcs_uri, mime_type=mime_type)])],
+                    ttl=f"{self.ttl}s",
+                    display_name=f"doc-{os.path.basename(gcs_uri)}"[:128],
+                ),
+            )
+        except Exception as e:
+            print(f"Could not create context cache for {gcs_uri}: {e}")
+            self.failures += 1
+            if error_code(e) == 400:
+                state.uncacheable = True
+            else:
+                state.failures += 1
+                state.retry_at = self._clock() + self.retry_backoff * 2 ** min(state.failures - 1, 6)
+            return None
+        state.failures = 0
+        self.created += 1
+        now = self._clock()
+        return CachedDocument(name=cache.name, expire_time=now + self.ttl, last_used=now)
+
+    async def invalidate(self, client, gcs_uri: str):
+        """Drops the context caches of every version of a document, e.g. after a call through one failed."""
+        for key in [k for k in list(self._documents.keys()) if k[0] == gcs_uri]:
+            state = self._documents.pop(key, None)
+            if state is not None and state.cached is not None:
+                await self._delete(client, state.cached.name)
+
+    async def purge_expired(self, client):
+        """Forgets expired caches and deletes the ones that have been idle for too long."""
+        now = self._clock()
+        for state in list(self._documents.values()):
+            cached = state.cached
+            if cached is None:
+                continue
+            if now >= cached.expire_time:
+                # Already gone on the server side.
+                state.cached = None
+                state.hits = 0
+            elif now - cached.last_used >= self.idle_timeout:
+                state.cached = None
+                state.hits = 0
+                await self._delete(client, cached.name)
+
+    async def close(self, client):
+        """Deletes every live context cache."""
+        for state in self._documents.values():
+            if state.cached is not None:
+                await self._delete(client, state.cached.name)
+                state.cached = None
+        self._documents.clear()
+
+    async def _delete(self, client, name: str):
+        try:
+            await client.aio.caches.delete(name=name)
+            self.deleted += 1
+        except Exception as e:
+            print(f"Could not delete context cache {name}: {e}")
+
+    def stats(self) -> dict:
+        return {
+            "documents": len(self._documents),
+            "live_caches": sum(1 for s in self._documents.values() if s.cached is not None),
+            "created": self.created,
+            "deleted": self.deleted,
+            "cached_calls": self.cached_calls,
+            "failures": self.failures,
+        }
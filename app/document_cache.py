@@ -0,0 +1,271 @@
+import asyncio
+import hashlib
+import json
+import os
+import re
+import threading
+import time
+import unicodedata
+
+import cachetools
+import dotenv
+
+dotenv.load_dotenv()
+
+DOCUMENT_CACHE_ENABLED = os.getenv("DOCUMENT_CACHE_ENABLED", "true").lower() == "true"
+# Answers older than this are never served (seconds).
+DOCUMENT_CACHE_TTL = float(os.getenv("DOCUMENT_CACHE_TTL", str(7 * 24 * 3600)))
+DOCUMENT_CACHE_MAX_ENTRIES = int(os.getenv("DOCUMENT_CACHE_MAX_ENTRIES", "1024"))
+# Optional persistent tier: a local directory or a gs://bucket/prefix URI.
+DOCUMENT_CACHE_DIR = os.getenv("DOCUMENT_CACHE_DIR")
+DOCUMENT_CACHE_GCS_URI = os.getenv("DOCUMENT_CACHE_GCS_URI")
+DOCUMENT_CACHE_DISK_MAX_ENTRIES = int(os.getenv("DOCUMENT_CACHE_DISK_MAX_ENTRIES", "20000"))
+# How long an object's generation is trusted before asking GCS again (seconds).
+GENERATION_TTL = float(os.getenv("DOCUMENT_CACHE_GENERATION_TTL", "60"))
+
+
+def normalize_question(question: str) -> str:
+    """Case, accent-composition, whitespace and trailing-punctuation insensitive form of a question."""
+    text = unicodedata.normalize("NFKC", str(question)).casefold()
+    text = re.sub(r"\s+", " ", text).strip()
+    return text.strip("¿?¡!. ")
+
+
+def split_gcs_uri(uri: str) -> tuple:
+    if not uri.startswith("gs://"):
+        raise ValueError(f"Not a GCS URI: {uri}")
+    bucket, _, name = uri[len("gs://"):].partition("/")
+    return bucket, name
+
+
+class DiskTier:
+    """Persistent tier storing one JSON file per entry in a local directory."""
+
+    def __init__(self, directory: str, max_entries: int = DOCUMENT_CACHE_DISK_MAX_ENTRIES):
+        self.directory = directory
+        self.max_entries = max_entries
+        os.makedirs(directory, exist_ok=True)
+
+    def _path(self, key: str) -> str:
+        return os.path.join(self.directory, f"{key}.json")
+
+    def get(self, key: str):
+        try:
+            with open(self._path(key), "r", encoding="utf-8") as f:
+                return json.load(f)
+        except (FileNotFoundError, ValueError):
+            return None
+
+    def put(self, key: str, entry: dict):
+        tmp_path = f"{self._path(key)}.{os.getpid()}.{threading.get_ident()}.tmp"
+        with open(tmp_path, "w", encoding="utf-8") as f:
+            json.dump(entry, f, ensure_ascii=False)
+        os.replace(tmp_path, self._path(key))
+        self._evict()
+
+    def delete(self, key: str):
+        try:
+            os.remove(self._path(key))
+        except FileNotFoundError:
+            pass
+
+    def _evict(self):
+        entries = [e for e in os.scandir(self.directory) if e.name.endswith(".json")]
+        if len(entries) <= self.max_entries:
+            return
+        entries.sort(key=lambda e: e.stat().st_mtime)
+        for entry in entries[:len(entries) - self.max_entries]:
+            try:
+                os.remove(entry.path)
+            except FileNotFoundError:
+                pass
+
+
+class GcsTier:
+    """Persistent tier storing one JSON object per entry under a GCS prefix.
+
+    Size-based eviction is left to the bucket's lifecycle rules; TTL is enforced on read.
+    """
+
+    def __init__(self, uri: str, storage_client=None):
+        self.bucket_name, prefix = split_gcs_uri(uri.rstrip("/") + "/")
+        self.prefix = prefix
+        self._storage_client = storage_client
+
+    def _blob(self, key: str):
+        if self._storage_client is None:
+            from google.cloud import storage
+            self._storage_client = storage.Client()
+        return self._storage_client.bucket(self.bucket_name).blob(f"{self.prefix}{key}.json")
+
+    def get(self, key: str):
+        from google.api_core import exceptions
+        try:
+            return json.loads(self._blob(key).download_as_bytes())
+        except (exceptions.NotFound, ValueError):
+            return None
+
+    def put(self, key: str, entry: dict):
+        self._blob(key).upload_from_string(json.dumps(entry, ensure_ascii=False), content_type="application/json")
+
+    def delete(self, key: str):
+        from google.api_core import exceptions
+        try:
+            self._blob(key).delete()
+        except exceptions.NotFound:
+            pass
+
+
+class DocumentAnswerCache:
+    """Two-tier cache of document answers.
+
+    Entries are keyed by (GCS URI, object generation, model, normalized question), so a
+    re-uploaded PDF never serves a stale answer. The in-memory tier is an LRU bounded by
+    `max_entries` with a TTL; the optional persistent tier survives restarts and is shared
+    between replicas when it lives in GCS.
+    """
+
+    def __init__(self, ttl: float = DOCUMENT_CACHE_TTL, max_entries: int = DOCUMENT_CACHE_MAX_ENTRIES,
+                 persistent_tier=None, storage_client=None, clock=time.time, enabled: bool = True):
+        self.enabled = enabled
+        self.ttl = ttl
+        self.persistent_tier = persistent_tier
+        self._memory = cachetools.TTLCache(maxsize=max_entries, ttl=ttl, timer=clock)
+        self._generations = cachetools.TTLCache(maxsize=max_entries, ttl=GENERATION_TTL, timer=clock)
+        self._sizes = cachetools.TTLCache(maxsize=max_entries, ttl=GENERATION_TTL, timer=clock)
+        self._storage_client = storage_client
+        self._clock = clock
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.persistent_hits = 0
+        self.misses = 0
+        self.stores = 0
+
+    def get_storage_client(self):
+        if self._storage_client is None:
+            from google.cloud import storage
+            self._storage_client = storage.Client()
+        return self._storage_client
+
+    def object_generation(self, gcs_uri: str):
+        """Returns the current generation (or etag) of a GCS object, or None if it cannot be read."""
+        with self._lock:
+            if gcs_uri in self._generations:
+                return self._generations[gcs_uri]
+        bucket, name = split_gcs_uri(gcs_uri)
+        blob = self.get_storage_client().bucket(bucket).get_blob(name)
+        if blob is None:
+            return None
+        generation = str(blob.generation or blob.etag)
+        with self._lock:
+            self._generations[gcs_uri] = generation
+            self._sizes[gcs_uri] = blob.size
+        return generation
+
+    def object_size(self, gcs_uri: str):
+        """Size in bytes of an object whose generation was looked up recently, or None."""
+        with self._lock:
+            return self._sizes.get(gcs_uri)
+
+    async def make_key(self, gcs_uri: str, model: str, question: str):
+        """Builds the cache key, or returns None when caching is disabled or the object version is unknown."""
+        if not self.enabled:
+            return None
+        try:
+            generation = await asyncio.to_thread(self.object_generation, gcs_uri)
+        except Exception as e:
+            print(f"Document cache disabled for {gcs_uri}: {e}")
+            return None
+        if generation is None:
+            return None
+        raw = json.dumps([gcs_uri, generation, model, normalize_question(question)], ensure_ascii=False)
+        return hashlib.sha256(raw.encode("utf-8")).hexdigest()
+
+    def get(self, key: str):
+        with self._lock:
+            cached = self._memory.get(key)
+            if cached is not None:
+                answer, created = cached
+                # Promoted entries keep their creation time: the memory TTL restarts on insertion.
+                if self._clock() - created <= self.ttl:
+                    self.hits += 1
+                    return answer
+                del self._memory[key]
+        entry = self._persistent_get(key)
+        with self._lock:
+            if entry is None:
+                self.misses += 1
+                return None
+            self.persistent_hits += 1
+            self._memory[key] = (entry["answer"], entry.get("created", 0))
+        return entry["answer"]
+
+    def put(self, key: str, answer: str):
+        created = self._clock()
+        with self._lock:
+            self._memory[key] = (answer, created)
+            self.stores += 1
+        if self.persistent_tier is not None:
+            try:
+                self.persistent_tier.put(key, {"answer": answer, "created": created})
+            except Exception as e:
+                print(f"Could not persist document cache entry: {e}")
+
+    async def aget(self, key: str):
+        """Like `get`, but keeps persistent-tier I/O off the event loop."""
+        if self.persistent_tier is None:
+            return self.get(key)
+        return await asyncio.to_thread(self.get, key)
+
+    async def aput(self, key: str, answer: str):
+        """Like `put`, but keeps persistent-tier I/O off the event loop."""
+        if self.persistent_tier is None:
+            return self.put(key, answer)
+        return await asyncio.to_thread(self.put, key, answer)
+
+    def _persistent_get(self, key: str):
+        if self.persistent_tier is None:
+            return None
+        try:
+            entry = self.persistent_tier.get(key)
+        except Exception as e:
+            print(f"Could not read document cache entry: {e}")
+            return None
+        if entry is None:
+            return None
+        if self._clock() - entry.get("created", 0) > self.ttl:
+            try:
+                self.persistent_tier.delete(key)
+            except Exception as e:
+                print(f"Could not delete expired document cache entry: {e}")
+            return None
+        return entry
+
+    def clear(self):
+        with self._lock:
+            self._memory.clear()
+            self._generations.clear()
+            self._sizes.clear()
+
+    def stats(self) -> dict:
+        with self._lock:
+            lookups = self.hits + self.persistent_hits + self.misses
+            return {
+                "hits": self.hits,
+                "persistent_hits": self.persistent_hits,
+                "misses": self.misses,
+                "stores": self.stores,
+                "entries": len(self._memory),
+                "hit_rate": (self.hits + self.persistent_hits) / lookups if lookups else 0.0,
+            }
+
+
+def build_persistent_tier():
+    if DOCUMENT_CACHE_GCS_URI:
+        return GcsTier(DOCUMENT_CACHE_GCS_URI)
+    if DOCUMENT_CACHE_DIR:
+        return DiskTier(DOCUMENT_CACHE_DIR)
+    return None
+
+
+document_cache = DocumentAnswerCache(persistent_tier=build_persistent_tier(), enabled=DOCUMENT_CACHE_ENABLED)
@@ -0,0 +1,407 @@
+import asyncio
+import math
+import os
+import threading
+import weakref
+
+import dotenv
+import httpx
+from google import genai
+from google.genai import types
+from opentelemetry import trace
+
+from .agent_config import AGENT_PROFILE, tool_settings
+from .context_cache import CONTEXT_CACHE_ENABLED, DocumentContextManager
+from .document_cache import document_cache, split_gcs_uri
+from .page_store import STATUS_OK, page_store
+from .pdf_chunks import PageHintError, chunk_pages, describe_pages, extract_pages, page_count, parse_page_hint
+from .rate_limit import RateLimitError, estimate_tokens, gemini_limiter
+from .telemetry import tracer, usage_attributes
+
+dotenv.load_dotenv()
+
+GENAI_PROJECT = 'ocr-digitalizacion-425708'
+GENAI_LOCATION = 'europe-west1'
+# Model and generation settings of every document request, from the AGENT_PROFILE profile.
+DOCUMENT_SETTINGS = tool_settings("query_gcs_document", AGENT_PROFILE)
+DOCUMENT_MODEL = DOCUMENT_SETTINGS.model
+
+# Max number of document requests in flight per event loop (i.e. per replica worker).
+DOCUMENT_MAX_CONCURRENCY = int(os.getenv("DOCUMENT_MAX_CONCURRENCY", "8"))
+
+# Compare the page store's generation of a document with GCS before answering from it.
+DOCUMENT_STORE_CHECK_GENERATION = os.getenv("DOCUMENT_STORE_CHECK_GENERATION", "true").lower() == "true"
+
+# Fan-out limits for `query_gcs_documents`.
+BATCH_MAX_CONCURRENCY = int(os.getenv("DOCUMENT_BATCH_MAX_CONCURRENCY", "8"))
+BATCH_MAX_DOCUMENTS = int(os.getenv("DOCUMENT_BATCH_MAX_DOCUMENTS", "50"))
+
+DOCUMENT_CHUNKING_ENABLED = os.getenv("DOCUMENT_CHUNKING_ENABLED", "true").lower() == "true"
+# Large-document mode: PDFs of at least this size are downloaded to count their pages (bytes)...
+DOCUMENT_CHUNKED_MIN_BYTES = int(os.getenv("DOCUMENT_CHUNKED_MIN_BYTES", str(8 * 1024 ** 2)))
+# ...and answered chunk by chunk (map-reduce) when they have more pages than this.
+DOCUMENT_CHUNKED_MIN_PAGES = int(os.getenv("DOCUMENT_CHUNKED_MIN_PAGES", "80"))
+DOCUMENT_CHUNK_PAGES = int(os.getenv("DOCUMENT_CHUNK_PAGES", "40"))
+# Chunks of one document queried at the same time.
+DOCUMENT_CHUNK_MAX_CONCURRENCY = int(os.getenv("DOCUMENT_CHUNK_MAX_CONCURRENCY", "4"))
+# Input tokens Gemini counts per PDF page, used to reserve quota for page-range chunks.
+DOCUMENT_PAGE_TOKENS = int(os.getenv("DOCUMENT_PAGE_TOKENS", "258"))
+
+CHUNK_NOT_FOUND = "NO_ENCONTRADO"
+CHUNK_PROMPT = """Las páginas adjuntas son las páginas {pages} de un documento de {total_pages} páginas.
+Responde a la pregunta usando solo estas páginas e indica en qué página aparece cada dato.
+Si estas páginas no contienen información para responderla, responde exactamente {not_found}.
+
+Pregunta: {question}"""
+REDUCE_PROMPT = """Varias partes de un documento de {total_pages} páginas se han consultado por separado con la misma pregunta.
+Combina sus respuestas en una sola respuesta completa y sin repeticiones, conservando las páginas citadas.
+Si las respuestas se contradicen, indícalo con las páginas de cada versión.
+
+Pregunta: {question}
+
+{answers}"""
+
+# HTTP connection pool shared by every call made through `get_genai_client()`.
+HTTP_MAX_CONNECTIONS = int(os.getenv("GENAI_HTTP_MAX_CONNECTIONS", "32"))
+HTTP_MAX_KEEPALIVE_CONNECTIONS = int(os.getenv("GENAI_HTTP_MAX_KEEPALIVE_CONNECTIONS", "16"))
+HTTP_KEEPALIVE_EXPIRY = float(os.getenv("GENAI_HTTP_KEEPALIVE_EXPIRY", "60"))
+
+
+def build_http_options(**kwargs) -> types.HttpOptions:
+    """Returns HttpOptions whose sync and async httpx clients reuse a tuned connection pool."""
+    limits = httpx.Limits(
+        max_connections=HTTP_MAX_CONNECTIONS,
+        max_keepalive_connections=HTTP_MAX_KEEPALIVE_CONNECTIONS,
+        keepalive_expiry=HTTP_KEEPALIVE_EXPIRY,
+    )
+    return types.HttpOptions(
+        client_args={"limits": limits},
+        async_client_args={"limits": limits},
+        **kwargs,
+    )
+
+
+# Created on first use so importing the agent does not resolve credentials or open a pool.
+genai_client = None
+_genai_client_lock = threading.Lock()
+
+
+def get_genai_client() -> genai.Client:
+    global genai_client
+    if genai_client is None:
+        with _genai_client_lock:
+            if genai_client is None:
+                genai_client = genai.Client(
+                    vertexai=True,
+                    project=GENAI_PROJECT,
+                    location=GENAI_LOCATION,
+                    http_options=build_http_options(),
+                )
+    return genai_client
+
+document_context_manager = DocumentContextManager(DOCUMENT_MODEL, enabled=CONTEXT_CACHE_ENABLED)
+
+# One limiter per event loop, dropped with its loop: loops running in other threads keep theirs.
+_semaphores = weakref.WeakKeyDictionary()
+
+
+def _document_semaphore() -> asyncio.Semaphore:
+    """Returns the concurrency limiter bound to the running event loop."""
+    loop = asyncio.get_running_loop()
+    semaphore = _semaphores.get(loop)
+    if semaphore is None:
+        semaphore = _semaphores[loop] = asyncio.Semaphore(DOCUMENT_MAX_CONCURRENCY)
+    return semaphore
+
+
+async def _generate(client, contents: list, config=None, estimated_tokens: int = None):
+    """A document request through the Gemini rate limiter shared with the agents' model."""
+    if estimated_tokens is None:
+        estimated_tokens = estimate_tokens(contents, config)
+    config = DOCUMENT_SETTINGS.generate_content_config(**(config.model_dump(exclude_none=True) if config else {}))
+    return await gemini_limiter.call(
+        lambda: client.aio.models.generate_content(model=DOCUMENT_MODEL, contents=contents, config=config),
+        estimated_tokens, caller="documents", idempotent=True)
+
+
+async def _object_generation(gcs_file_path: str):
+    """The object's current generation, shared with the answer cache's lookups, or None if unknown."""
+    try:
+        return await asyncio.to_thread(document_cache.object_generation, gcs_file_path)
+    except Exception as e:
+        print(f"Could not read the generation of {gcs_file_path}: {e}")
+        return None
+
+
+async def _generate_document_answer(gcs_file_path: str, question: str):
+    client = get_genai_client()
+    generation = await _object_generation(gcs_file_path) if document_context_manager.enabled else None
+    cached_content = await document_context_manager.cached_content(client, gcs_file_path, generation)
+    if cached_content is not None:
+        try:
+            trace.get_current_span().set_attribute("context_cache.used", True)
+            return await _generate(client, [str(question)],
+                                   config=types.GenerateContentConfig(cached_content=cached_content))
+        except RateLimitError:
+            raise
+        except Exception as e:
+            print(f"Context cache {cached_content} failed, sending the full document: {e}")
+            await document_context_manager.invalidate(client, gcs_file_path)
+
+    file_part = types.Part.from_uri(file_uri=gcs_file_path, mime_type='application/pdf')
+    return await _generate(client, [str(question), file_part])
+
+
+def _object_size(gcs_file_path: str):
+    size = document_cache.object_size(gcs_file_path)
+    if size is None:
+        bucket, name = split_gcs_uri(gcs_file_path)
+        blob = document_cache.get_storage_client().bucket(bucket).get_blob(name)
+        size = blob.size if blob is not None else None
+    return size
+
+
+def _download(gcs_file_path: str) -> bytes:
+    bucket, name = split_gcs_uri(gcs_file_path)
+    return document_cache.get_storage_client().bucket(bucket).blob(name).download_as_bytes()
+
+
+def _add_usage(totals: dict, usage_metadata):
+    for key, value in usage_attributes(usage_metadata).items():
+        if value:
+            totals[key] = totals.get(key, 0) + value
+
+
+async def _answer_in_chunks(gcs_file_path: str, question: str, data: bytes, pages: list, total_pages: int,
+                            usage: dict) -> str:
+    """Map-reduce: asks every page-range chunk in parallel, then merges the answers that found something."""
+    client = get_genai_client()
+    chunks = chunk_pages(pages, DOCUMENT_CHUNK_PAGES)
+    trace.get_current_span().set_attribute("document.chunks", len(chunks))
+    chunk_documents = await asyncio.to_thread(extract_pages, data, chunks)
+    semaphore = asyncio.Semaphore(DOCUMENT_CHUNK_MAX_CONCURRENCY)
+
+    async def ask(chunk: list, chunk_document: bytes) -> str:
+        prompt = CHUNK_PROMPT.format(pages=describe_pages(chunk), total_pages=total_pages,
+                                     not_found=CHUNK_NOT_FOUND, question=question)
+        async with semaphore, _document_semaphore():
+            response = await _generate(
+                client, [prompt, types.Part.from_bytes(data=chunk_document, mime_type='application/pdf')],
+                estimated_tokens=estimate_tokens(prompt) + DOCUMENT_PAGE_TOKENS * len(chunk),
+            )
+        _add_usage(usage, response.usage_metadata)
+        return (response.text or "").strip()
+
+    outcomes = await asyncio.gather(*[ask(c, d) for c, d in zip(chunks, chunk_documents)], return_exceptions=True)
+    failed = [c for c, o in zip(chunks, outcomes) if isinstance(o, Exception)]
+    if len(failed) == len(chunks):
+        raise outcomes[0]
+    for chunk, outcome in zip(chunks, outcomes):
+        if isinstance(outcome, Exception):
+            print(f"Pages {describe_pages(chunk)} of {gcs_file_path} failed: {outcome}")
+    answers = [(c, o) for c, o in zip(chunks, outcomes)
+               if not isinstance(o, Exception) and o and CHUNK_NOT_FOUND not in o]
+
+    if not answers:
+        answer = f"No se ha encontrado información para responder en las páginas {describe_pages(pages)} del documento."
+    elif len(answers) == 1:
+        answer = answers[0][1]
+    else:
+        prompt = REDUCE_PROMPT.format(total_pages=total_pages, question=question, answers="\n\n".join(
+            f"Respuesta de las páginas {describe_pages(c)}:\n{a}" for c, a in answers))
+        async with _document_semaphore():
+            response = await _generate(client, [prompt])
+        _add_usage(usage, response.usage_metadata)
+        answer = response.text
+    if failed:
+        answer += f"\n\n(No se pudieron leer las páginas {describe_pages([p for c in failed for p in c])}.)"
+    return answer
+
+
+async def _generate_answer(gcs_file_path: str, question: str, pages: str, size, usage: dict) -> str:
+    """Sends the whole PDF in one request, or page-range chunks when it is large or a page hint is given."""
+    span = trace.get_current_span()
+    if pages or (DOCUMENT_CHUNKING_ENABLED and (size or 0) >= DOCUMENT_CHUNKED_MIN_BYTES):
+        data = await asyncio.to_thread(_download, gcs_file_path)
+        total_pages = await asyncio.to_thread(page_count, data)
+        span.set_attribute("document.pages", total_pages)
+        selected = parse_page_hint(pages, total_pages) if pages else list(range(1, total_pages + 1))
+        if pages or total_pages > DOCUMENT_CHUNKED_MIN_PAGES:
+            span.set_attribute("document.mode", "chunked")
+            return await _answer_in_chunks(gcs_file_path, question, data, selected, total_pages, usage)
+
+    span.set_attribute("document.mode", "single")
+    async with _document_semaphore():
+        response = await _generate_document_answer(gcs_file_path, question)
+    _add_usage(usage, response.usage_metadata)
+    return response.text
+
+
+async def _answer_document(gcs_file_path: str, question: str, pages: str = "") -> str:
+    """Answers a question about a GCS document, raising on failure."""
+    with tracer.start_as_current_span("query_gcs_document.answer", attributes={
+        "gcs.uri": gcs_file_path,
+        "gen_ai.request.model": DOCUMENT_MODEL,
+    }) as span:
+        cache_question = f"{question} [páginas {pages}]" if pages else question
+        # Answers are only reused under the same model and generation settings.
+        cache_key = await document_cache.make_key(gcs_file_path, DOCUMENT_SETTINGS.describe(), cache_question)
+        if cache_key is not None:
+            cached_answer = await document_cache.aget(cache_key)
+            if cached_answer is not None:
+                span.set_attribute("cache.outcome", "hit")
+                return cached_answer
+        span.set_attribute("cache.outcome", "miss" if cache_key is not None else "disabled")
+
+        size = None
+        if DOCUMENT_CHUNKING_ENABLED:
+            try:
+                size = await asyncio.to_thread(_object_size, gcs_file_path)
+            except Exception as e:
+                print(f"Could not read the size of {gcs_file_path}, sending it whole: {e}")
+        if size is not None:
+            span.set_attribute("document.size_bytes", size)
+        usage = {}
+        try:
+            answer = await _generate_answer(gcs_file_path, question, pages, size, usage)
+        finally:
+            span.set_attributes(usage)
+
+        if cache_key is not None and answer:
+            await document_cache.aput(cache_key, answer)
+
+        return answer
+
+
+async def query_gcs_document(gcs_file_path: str, question: str, pages: str = "") -> str:
+    """
+    Reads a document directly from a Google Cloud Storage (GCS) URI and answers a question about its content.
+    Large documents are read in page ranges in parallel and the partial answers are combined.
+
+    Args:
+        gcs_file_path (str): The full GCS path to the file, e.g., 'gs://my-bucket/documents/report.pdf'.
+        question (str): The specific question to ask about the document's content.
+        pages (str): Optional pages to read when you know where the answer is, e.g. '12', '10-25' or '3, 40-'.
+            Leave empty to read the whole document.
+
+    Returns:
+        str: The answer to the question based on the document's content, or an error message if the file cannot be accessed.
+    """
+    try:
+        return await _answer_document(gcs_file_path, question, pages)
+
+    except PageHintError as e:
+        return f"Error: {e}"
+    except RateLimitError as e:
+        print(f"An error occurred: {e}")
+        return (f"Error: The model is over its request quota and {gcs_file_path} could not be read after several "
+                f"retries. Do not call this tool again right away: answer with the data you have or ask the user to "
+                f"retry in about {math.ceil(e.retry_after)} seconds.")
+    except Exception as e:
+        print(f"An error occurred: {e}")
+        return f"Error: Failed to access or process the file at {gcs_file_path}."
+
+
+async def query_gcs_documents(gcs_file_paths: list[str], questions: list[str]) -> dict:
+    """
+    Answers one or more questions about several documents stored in Google Cloud Storage (GCS) in a single call.
+    Use it instead of calling `query_gcs_document` once per document.
+
+    Args:
+        gcs_file_paths (list[str]): The full GCS paths of the files, e.g., ['gs://my-bucket/a.pdf', 'gs://my-bucket/b.pdf'].
+        questions (list[str]): The questions to ask about every document.
+
+    Returns:
+        dict: One entry per document with its answers (one per question) or the error that prevented reading it,
+        plus the number of documents that succeeded and failed.
+    """
+    gcs_file_paths = list(dict.fromkeys(gcs_file_paths))
+    if len(gcs_file_paths) > BATCH_MAX_DOCUMENTS:
+        return {
+            "status": "ERROR",
+            "error_details": f"Too many documents ({len(gcs_file_paths)}). Ask about at most {BATCH_MAX_DOCUMENTS} per call.",
+        }
+
+    semaphore = asyncio.Semaphore(BATCH_MAX_CONCURRENCY)
+
+    async def answer(gcs_file_path: str, question: str) -> str:
+        async with semaphore:
+            return await _answer_document(gcs_file_path, question)
+
+    async def process(gcs_file_path: str) -> dict:
+        outcomes = await asyncio.gather(*[answer(gcs_file_path, q) for q in questions], return_exceptions=True)
+        result = {"gcs_file_path": gcs_file_path, "answers": [], "errors": []}
+        for question, outcome in zip(questions, outcomes):
+            if isinstance(outcome, Exception):
+                print(f"An error occurred: {outcome}")
+                result["errors"].append({"question": question, "error": f"Failed to access or process the file: {outcome}"})
+            else:
+                result["answers"].append({"question": question, "answer": outcome})
+        if not result["errors"]:
+            del result["errors"]
+        return result
+
+    results = await asyncio.gather(*[process(path) for path in gcs_file_paths])
+    failed = sum(1 for r in results if "errors" in r)
+    return {
+        "status": "SUCCESS" if not failed else "PARTIAL_FAILURE",
+        "succeeded": len(results) - failed,
+        "failed": failed,
+        "results": results,
+    }
+
+
+async def _page_store_outcome(gcs_file_path: str) -> str:
+    """Whether the page store can answer for a document: "fresh", "not_ingested", "no_text" or "stale"."""
+    document = await asyncio.to_thread(page_store.document, gcs_file_path)
+    if document is None:
+        return "not_ingested"
+    if document["status"] != STATUS_OK:
+        return "no_text"
+    if DOCUMENT_STORE_CHECK_GENERATION:
+        try:
+            generation = await asyncio.to_thread(document_cache.object_generation, gcs_file_path)
+        except Exception as e:
+            print(f"Could not check the generation of {gcs_file_path}, using the page store: {e}")
+            generation = document["generation"]
+        if generation != document["generation"]:
+            return "stale"
+    return "fresh"
+
+
+async def search_document_pages(question: str, gcs_file_path: str = "", max_results: int = 5) -> dict:
+    """
+    Searches the text of the PDF documents, extracted page by page in advance, and returns the pages that best
+    match a question. It takes milliseconds, so use it before reading a PDF with `query_gcs_document`.
+    When a document is given but its text is not available or no page matches, the document is read with
+    `query_gcs_document` and its answer is returned instead.
+
+    Args:
+        question (str): The question or the words to look for, e.g., 'punto de inflamación'.
+        gcs_file_path (str): Optional GCS path of the document to search in, e.g., 'gs://my-bucket/documents/report.pdf'.
+            Leave empty to search every extracted document.
+        max_results (int): Maximum number of pages to return.
+
+    Returns:
+        dict: With "source" set to "page_store", the matching pages (document path, page number, text and score).
+        With "source" set to "query_gcs_document", the answer read from the PDF.
+    """
+    span = trace.get_current_span()
+    outcome = await _page_store_outcome(gcs_file_path) if gcs_file_path else "fresh"
+    matches = []
+    if outcome == "fresh":
+        matches = await asyncio.to_thread(page_store.search, question, gcs_file_path or None, max_results)
+        if not matches:
+            outcome = "no_match"
+    span.set_attribute("page_store.outcome", "hit" if matches else outcome)
+    if matches or not gcs_file_path:
+        return {"status": "SUCCESS", "source": "page_store", "matches": matches}
+
+    answer = await query_gcs_document(gcs_file_path, question)
+    return {
+        "status": "ERROR" if answer.startswith("Error:") else "SUCCESS",
+        "source": "query_gcs_document",
+        "page_store": outcome,
+        "gcs_file_path": gcs_file_path,
+        "answer": answer,
+    }
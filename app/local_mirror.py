@@ -0,0 +1,554 @@
+"""Local DuckDB mirror of the agent tables, so `execute_sql` answers without a BigQuery job.
+
+`sync()` snapshots every table of `demo_agente_alifarma` the agents query into a Parquet
+file in LOCAL_MIRROR_DIR and loads it into an in-memory DuckDB database. A table is only
+downloaded again when its last-modified time in BigQuery changed. A query is answered
+locally only while every table it reads was confirmed up to date in the last
+LOCAL_MIRROR_MAX_STALENESS seconds and its SQL translates to DuckDB; anything else
+(stale or unknown tables, BigQuery features the translation does not cover, divisions
+that could divide by zero, DuckDB errors) runs on BigQuery as before.
+
+duckdb and pyarrow are imported on first use, so importing the agent does not pay for them.
+"""
+import asyncio
+import collections
+import decimal
+import functools
+import hashlib
+import json
+import os
+import re
+import tempfile
+import threading
+import time
+
+import dotenv
+
+from .schema_catalog import AGENT_TABLES, CATALOG_DATASET, CATALOG_PROJECT
+from .sql_cache import EXECUTE_SQL_TOOL
+
+dotenv.load_dotenv()
+
+LOCAL_MIRROR_ENABLED = os.getenv("LOCAL_MIRROR_ENABLED", "false").lower() == "true"
+LOCAL_MIRROR_DIR = os.getenv("LOCAL_MIRROR_DIR", os.path.join(tempfile.gettempdir(), "alifarma_mirror"))
+# Queries are only answered locally from tables confirmed unchanged this recently (seconds).
+LOCAL_MIRROR_MAX_STALENESS = float(os.getenv("LOCAL_MIRROR_MAX_STALENESS", "600"))
+# Minimum time between background checks for modified tables (seconds).
+LOCAL_MIRROR_CHECK_INTERVAL = float(os.getenv("LOCAL_MIRROR_CHECK_INTERVAL", "60"))
+# Tables larger than this in BigQuery are not mirrored (bytes).
+LOCAL_MIRROR_MAX_TABLE_BYTES = int(os.getenv("LOCAL_MIRROR_MAX_TABLE_BYTES", str(512 * 1024 ** 2)))
+
+MIRROR_TABLES = sorted({name for tables in AGENT_TABLES.values() for name in tables})
+MANIFEST_FILE = "manifest.json"
+
+# BigQuery features without a DuckDB equivalent of the same meaning: such queries run on BigQuery.
+_UNSUPPORTED = re.compile(
+    r"\b(?:INFORMATION_SCHEMA|FOR\s+SYSTEM_TIME|UNNEST|STRUCT|ARRAY|PIVOT|UNPIVOT|TABLESAMPLE|REGEXP_EXTRACT|"
+    r"REGEXP_EXTRACT_ALL|REGEXP_REPLACE|FORMAT|DAYOFWEEK|WEEK|ISOWEEK|ISOYEAR)\b|"
+    r"\b(?:OFFSET|ORDINAL|SAFE_OFFSET|SAFE_ORDINAL)\s*\(|\b(?:SAFE|ML|AI|NET|KEYS|HLL_COUNT)\s*\.|@",
+    re.IGNORECASE,
+)
+# BigQuery raises on division by zero where DuckDB returns NULL: only a non-zero number literal is a safe divisor.
+_DIVISION = re.compile(r"/(?!\s*(?:\d+\.?\d*|\.\d+)(?:[eE][+-]?\d+)?(?![\w.(]))")
+_ZERO_DIVISOR = re.compile(r"/\s*(?:0+\.?0*|\.0+)(?:[eE][+-]?\d+)?(?![\w.(])")
+_NAME_PART = r"(?:`[^`]*`|[A-Za-z_]\w*)"
+_QUALIFIED_NAME = re.compile(rf"(?<![\w.]){_NAME_PART}(?:\.{_NAME_PART})*")
+_UNQUALIFIED_TABLE = re.compile(r"\b(?:FROM|JOIN)\s+([A-Za-z_]\w*)\b(?!\s*\.)", re.IGNORECASE)
+_STRING = re.compile(r"\x01(\d+)\x01")
+_AS = re.compile(r"\bAS\b", re.IGNORECASE)
+_EXCEPT_COLUMNS = re.compile(r"\*\s*EXCEPT\s*\(", re.IGNORECASE)
+_DATE_PARTS = {"DAY", "MONTH", "QUARTER", "YEAR"}
+_INTERVAL = re.compile(r"^INTERVAL\s+(.+?)\s+(DAY|WEEK|MONTH|QUARTER|YEAR)$", re.IGNORECASE | re.DOTALL)
+_TYPES = {
+    "INT64": "BIGINT", "INT": "BIGINT", "INTEGER": "BIGINT", "BIGINT": "BIGINT", "SMALLINT": "BIGINT",
+    "TINYINT": "BIGINT", "BYTEINT": "BIGINT", "FLOAT64": "DOUBLE", "NUMERIC": "DECIMAL(38, 9)",
+    "DECIMAL": "DECIMAL(38, 9)", "BOOL": "BOOLEAN", "BOOLEAN": "BOOLEAN", "BYTES": "BLOB", "DATE": "DATE",
+    "DATETIME": "TIMESTAMP", "TIMESTAMP": "TIMESTAMPTZ", "TIME": "TIME",
+}
+
+# Session settings and BigQuery functions missing in DuckDB, defined as macros.
+_SETUP = [
+    "SET default_null_order = 'nulls_first_on_asc_last_on_desc'",
+    "SET TimeZone = 'UTC'",
+    "SET ieee_floating_point_ops = false",
+    "SET python_enable_replacements = false",
+    "CREATE MACRO format_date(fmt, d) AS strftime(d, fmt)",
+    "CREATE MACRO format_timestamp(fmt, t) AS strftime(t, fmt)",
+    "CREATE MACRO parse_date(fmt, s) AS CAST(strptime(s, fmt) AS DATE)",
+    "CREATE MACRO regexp_contains(s, pattern) AS regexp_matches(s, pattern)",
+    "CREATE MACRO safe_divide(a, b) AS CASE WHEN b = 0 THEN NULL ELSE a / b END",
+    "CREATE MACRO logical_and(x) AS bool_and(x)",
+    "CREATE MACRO logical_or(x) AS bool_or(x)",
+    # CAST(NUMERIC AS STRING) in BigQuery has no trailing zeros.
+    "CREATE MACRO bq_to_string(x) AS CASE WHEN typeof(x) LIKE 'DECIMAL%' AND CAST(x AS VARCHAR) LIKE '%.%' "
+    "THEN rtrim(rtrim(CAST(x AS VARCHAR), '0'), '.') ELSE CAST(x AS VARCHAR) END",
+    # Agent SQL can only read the mirrored tables: no files, no extensions, no settings changes.
+    "SET enable_external_access = false",
+    "SET lock_configuration = true",
+]
+
+
+class UnsupportedQuery(ValueError):
+    pass
+
+
+class NotMirrored(UnsupportedQuery):
+    pass
+
+
+def _strip_literals(query: str) -> tuple:
+    """The query with comments removed and every string literal replaced by a numbered placeholder."""
+    code, strings = [], []
+    i = 0
+    while i < len(query):
+        char = query[i]
+        if query.startswith("--", i) or char == "#":
+            end = query.find("\n", i)
+            i = len(query) if end < 0 else end
+            code.append(" ")
+        elif query.startswith("/*", i):
+            end = query.find("*/", i + 2)
+            if end < 0:
+                raise UnsupportedQuery("unterminated comment")
+            i = end + 2
+            code.append(" ")
+        elif char in "'\"":
+            if query.startswith(char * 3, i) or (i and query[i - 1] in "rRbB" and (i == 1 or not query[i - 2].isalnum())):
+                raise UnsupportedQuery("raw, bytes or triple-quoted string")
+            end = query.find(char, i + 1)
+            if end < 0:
+                raise UnsupportedQuery("unterminated string")
+            text = query[i + 1:end]
+            if "\\" in text:
+                raise UnsupportedQuery("escaped string")
+            code.append(f"\x01{len(strings)}\x01")
+            strings.append(text)
+            i = end + 1
+        elif char == "`":
+            end = query.find("`", i + 1)
+            if end < 0:
+                raise UnsupportedQuery("unterminated identifier")
+            code.append(query[i:end + 1])
+            i = end + 1
+        else:
+            code.append(char)
+            i += 1
+    return "".join(code), strings
+
+
+def _closing(code: str, start: int) -> int:
+    """Index of the parenthesis closing the one at `start`."""
+    depth = 0
+    for i in range(start, len(code)):
+        if code[i] == "(":
+            depth += 1
+        elif code[i] == ")":
+            depth -= 1
+            if depth == 0:
+                return i
+    raise UnsupportedQuery("unbalanced parentheses")
+
+
+def _split_arguments(text: str) -> list:
+    arguments, depth, start = [], 0, 0
+    for i, char in enumerate(text):
+        depth += char == "("
+        depth -= char == ")"
+        if char == "," and depth == 0:
+            arguments.append(text[start:i].strip())
+            start = i + 1
+    arguments.append(text[start:].strip())
+    return arguments if arguments != [""] else []
+
+
+def _cast(arguments: list, function: str) -> str:
+    text = arguments[0] if len(arguments) == 1 else ""
+    splits = [m for m in _AS.finditer(text) if text[:m.start()].count("(") == text[:m.start()].count(")")]
+    if not splits:
+        raise UnsupportedQuery(f"{function} syntax")
+    expression, type_name = text[:splits[-1].start()].strip(), text[splits[-1].end():].strip().upper()
+    if type_name == "STRING":
+        return f"bq_to_string({expression})"
+    if type_name not in _TYPES:
+        raise UnsupportedQuery(f"{function} to {type_name}")
+    return f"{'TRY_CAST' if function == 'SAFE_CAST' else 'CAST'}({expression} AS {_TYPES[type_name]})"
+
+
+def _date_part(text: str) -> str:
+    part = text.strip().upper()
+    if part not in _DATE_PARTS:
+        raise UnsupportedQuery(f"date part {part}")
+    return part.lower()
+
+
+def _date_add(arguments: list, sign: str) -> str:
+    interval = _INTERVAL.match(arguments[1]) if len(arguments) == 2 else None
+    if not interval:
+        raise UnsupportedQuery("DATE_ADD / DATE_SUB syntax")
+    return f"CAST(({arguments[0]}) {sign} INTERVAL ({interval.group(1)}) {interval.group(2).upper()} AS DATE)"
+
+
+def _arity(function, count: int):
+    def rewrite(arguments: list) -> str:
+        if len(arguments) != count:
+            raise UnsupportedQuery("function arguments")
+        return function(arguments)
+    return rewrite
+
+
+_REWRITES = {
+    "CAST": lambda arguments: _cast(arguments, "CAST"),
+    "SAFE_CAST": lambda arguments: _cast(arguments, "SAFE_CAST"),
+    "DATE_TRUNC": _arity(lambda a: f"CAST(date_trunc('{_date_part(a[1])}', {a[0]}) AS DATE)", 2),
+    "DATE_DIFF": _arity(lambda a: f"date_diff('{_date_part(a[2])}', {a[1]}, {a[0]})", 3),
+    "DATE_ADD": lambda arguments: _date_add(arguments, "+"),
+    "DATE_SUB": lambda arguments: _date_add(arguments, "-"),
+    "CURRENT_DATE": _arity(lambda a: "current_date", 0),
+}
+_CALL = re.compile(r"(?<![\w.])(" + "|".join(_REWRITES) + r")\s*\(", re.IGNORECASE)
+
+
+def _rewrite_calls(code: str) -> str:
+    parts, position = [], 0
+    while True:
+        match = _CALL.search(code, position)
+        if not match:
+            parts.append(code[position:])
+            return "".join(parts)
+        end = _closing(code, match.end() - 1)
+        arguments = [_rewrite_calls(a) for a in _split_arguments(code[match.end():end])]
+        parts.append(code[position:match.start()])
+        parts.append(_REWRITES[match.group(1).upper()](arguments))
+        position = end + 1
+
+
+@functools.lru_cache(maxsize=512)
+def to_duckdb(query: str, project: str = CATALOG_PROJECT, dataset: str = CATALOG_DATASET,
+              tables: tuple = tuple(MIRROR_TABLES)) -> tuple:
+    """Translates a BigQuery SELECT over the mirrored tables to DuckDB.
+
+    Returns (sql, referenced tables); raises UnsupportedQuery (NotMirrored for other tables)
+    when the query must run on BigQuery.
+    """
+    code, strings = _strip_literals(query)
+    code = code.strip().rstrip(";").strip()
+    if ";" in code:
+        raise UnsupportedQuery("multiple statements")
+    first_word = code.lstrip("(").split(None, 1)[0].upper() if code else ""
+    if first_word not in ("SELECT", "WITH"):
+        raise UnsupportedQuery(f"{first_word or 'empty'} statement")
+    unsupported = _UNSUPPORTED.search(code)
+    if unsupported:
+        raise UnsupportedQuery(" ".join(unsupported.group(0).upper().split()).rstrip(" ."))
+    if _DIVISION.search(code) or _ZERO_DIVISOR.search(code):
+        raise UnsupportedQuery("division (use SAFE_DIVIDE)")
+
+    for name in _UNQUALIFIED_TABLE.findall(code):
+        if name in tables:
+            # BigQuery rejects tables without a dataset: let it report the error.
+            raise UnsupportedQuery(f"unqualified table {name}")
+
+    referenced = set()
+
+    def table_name(match) -> str:
+        names = []
+        for part in re.findall(_NAME_PART, match.group(0)):
+            names.extend(part[1:-1].split(".") if part.startswith("`") else [part])
+        if len(names) >= 3 or (len(names) == 2 and names[0] == dataset):
+            if names[-3:-1] in ([project, dataset], [dataset]) and names[-1] in tables and len(names) <= 3:
+                referenced.add(names[-1])
+                return f'"{names[-1]}"'
+            raise NotMirrored(".".join(names))
+        return ".".join(".".join(f'"{n}"' for n in p[1:-1].split(".")) if p.startswith("`") else p
+                        for p in re.findall(_NAME_PART, match.group(0)))
+
+    code = _QUALIFIED_NAME.sub(table_name, code)
+    code = _EXCEPT_COLUMNS.sub("* EXCLUDE (", _rewrite_calls(code))
+    sql = _STRING.sub(lambda m: "'" + strings[int(m.group(1))].replace("'", "''") + "'", code)
+    return sql, sorted(referenced)
+
+
+def _value(value):
+    # BigQuery returns NUMERIC values without trailing zeros; the rest as the BigQuery tool converts them.
+    if isinstance(value, decimal.Decimal):
+        return format(value.normalize(), "f")
+    try:
+        json.dumps(value)
+        return value
+    except (TypeError, ValueError):
+        return str(value)
+
+
+def _column_names(description) -> list:
+    # BigQuery names unaliased expressions f0_, f1_, ...; DuckDB uses the expression text.
+    names, anonymous = [], 0
+    for column in description:
+        if re.fullmatch(r"[A-Za-z_]\w*", column[0]):
+            names.append(column[0])
+        else:
+            names.append(f"f{anonymous}_")
+            anonymous += 1
+    return names
+
+
+class LocalMirror:
+    """DuckDB copy of the agent tables, wired in as an ADK before-tool stage.
+
+    Each table's snapshot is tagged with its BigQuery last-modified time. Checks of those
+    times run in the background every `check_interval`, and before a query whose tables
+    were not confirmed within `max_staleness`; a table found modified is downloaded
+    again in the background while its queries go to BigQuery.
+    """
+
+    def __init__(self, client_factory, project: str = CATALOG_PROJECT, dataset: str = CATALOG_DATASET,
+                 tables: list = None, max_rows: int = 50, max_staleness: float = LOCAL_MIRROR_MAX_STALENESS,
+                 check_interval: float = LOCAL_MIRROR_CHECK_INTERVAL, max_table_bytes: int = LOCAL_MIRROR_MAX_TABLE_BYTES,
+                 directory: str = LOCAL_MIRROR_DIR, enabled: bool = True, clock=time.time):
+        self.client_factory = client_factory
+        self.project = project
+        self.dataset = dataset
+        self.tables = tables or MIRROR_TABLES
+        self.max_rows = max_rows
+        self.max_staleness = max_staleness
+        self.check_interval = check_interval
+        self.max_table_bytes = max_table_bytes
+        self.directory = directory
+        self.enabled = enabled
+        self.clock = clock
+        # table -> snapshot: BigQuery modified time, Parquet path, rows, when it was last confirmed up to date.
+        self._snapshots = {}
+        self._connection = None
+        self._lock = threading.RLock()
+        self._sync_lock = threading.Lock()
+        self._last_check = None
+        self._sync_task = None
+        self.served = 0
+        self.fallbacks = collections.Counter()
+        self.downloaded = 0
+
+    def _connect(self):
+        with self._lock:
+            if self._connection is None:
+                import duckdb
+                connection = duckdb.connect(":memory:")
+                for statement in _SETUP:
+                    connection.execute(statement)
+                self._connection = connection
+            return self._connection
+
+    def _path(self, table: str, modified: str) -> str:
+        version = hashlib.sha256(modified.encode("utf-8")).hexdigest()[:12]
+        return os.path.join(self.directory, f"{table}-{version}.parquet")
+
+    def _read_manifest(self) -> dict:
+        try:
+            with open(os.path.join(self.directory, MANIFEST_FILE), encoding="utf-8") as f:
+                return json.load(f)
+        except (OSError, ValueError):
+            return {}
+
+    def _write_manifest(self, manifest: dict):
+        path = os.path.join(self.directory, MANIFEST_FILE)
+        with open(path + ".tmp", "w", encoding="utf-8") as f:
+            json.dump(manifest, f, indent=2)
+        os.replace(path + ".tmp", path)
+
+    def _download(self, client, table, name: str, modified: str) -> dict:
+        import pyarrow.parquet as pq
+        arrow = client.list_rows(table).to_arrow()
+        path = self._path(name, modified)
+        os.makedirs(self.directory, exist_ok=True)
+        pq.write_table(arrow, path + ".tmp")
+        os.replace(path + ".tmp", path)
+        return {"modified": modified, "path": path, "rows": arrow.num_rows, "synced_at": self.clock()}
+
+    def _load(self, name: str, snapshot: dict):
+        import pyarrow.parquet as pq
+        arrow = pq.read_table(snapshot["path"])
+        connection = self._connect()
+        with self._lock:
+            connection.register("_snapshot", arrow)
+            try:
+                connection.execute(f'CREATE OR REPLACE TABLE "{name}" AS SELECT * FROM _snapshot')
+            finally:
+                connection.unregister("_snapshot")
+
+    def _sweep(self, manifest: dict):
+        """Deletes Parquet files of superseded snapshots."""
+        current = {os.path.basename(s["path"]) for s in manifest.values()}
+        for name in os.listdir(self.directory):
+            if name.endswith(".parquet") and name not in current:
+                try:
+                    os.remove(os.path.join(self.directory, name))
+                except OSError:
+                    pass
+
+    def _remote_modified(self, client, name: str):
+        table = client.get_table(f"{self.project}.{self.dataset}.{name}")
+        return table, table.modified.isoformat() if table.modified else ""
+
+    def confirm(self, tables: list) -> list:
+        """Checks the tables' BigQuery modified times; returns the ones whose snapshot is out of date."""
+        client = self.client_factory(self.project)
+        changed = []
+        for name in tables:
+            checked_at = self.clock()
+            _, modified = self._remote_modified(client, name)
+            with self._lock:
+                snapshot = self._snapshots.get(name)
+                if snapshot is not None and modified and snapshot["modified"] == modified:
+                    snapshot["checked_at"] = checked_at
+                else:
+                    changed.append(name)
+                    if snapshot is not None:
+                        snapshot["checked_at"] = None
+        return changed
+
+    def sync(self, force: bool = False) -> dict:
+        """Downloads the tables modified since their snapshot and loads them into DuckDB."""
+        with self._sync_lock:
+            client = self.client_factory(self.project)
+            manifest = self._read_manifest()
+            report = {"downloaded": [], "unchanged": [], "skipped": {}, "errors": {}}
+            for name in self.tables:
+                checked_at = self.clock()
+                try:
+                    table, modified = self._remote_modified(client, name)
+                    snapshot = self._snapshots.get(name) or manifest.get(name)
+                    if (not force and snapshot and modified and snapshot["modified"] == modified
+                            and os.path.exists(snapshot["path"])):
+                        if name not in self._snapshots:
+                            self._load(name, snapshot)
+                        report["unchanged"].append(name)
+                    else:
+                        with self._lock:
+                            if name in self._snapshots:
+                                self._snapshots[name]["checked_at"] = None
+                        if (table.num_bytes or 0) > self.max_table_bytes:
+                            report["skipped"][name] = f"{table.num_bytes} bytes"
+                            continue
+                        snapshot = self._download(client, table, name, modified)
+                        self._load(name, snapshot)
+                        manifest[name] = snapshot
+                        report["downloaded"].append(name)
+                        self.downloaded += 1
+                    with self._lock:
+                        self._snapshots[name] = {**snapshot, "checked_at": checked_at}
+                except Exception as e:
+                    print(f"Could not sync {name} to the local mirror: {e}")
+                    report["errors"][name] = str(e)
+            if report["downloaded"]:
+                self._write_manifest(manifest)
+                self._sweep(manifest)
+            self._last_check = self.clock()
+            return report
+
+    def _stale(self, tables: list) -> list:
+        now = self.clock()
+        with self._lock:
+            return [t for t in tables if t not in self._snapshots or self._snapshots[t]["checked_at"] is None
+                    or now - self._snapshots[t]["checked_at"] > self.max_staleness]
+
+    def prepare(self, project_id: str, query: str) -> tuple:
+        """The DuckDB SQL and tables of a query the mirror can answer; raises UnsupportedQuery otherwise."""
+        sql, tables = to_duckdb(query, self.project, self.dataset, tuple(self.tables))
+        with self._lock:
+            missing = [t for t in tables if t not in self._snapshots]
+        if missing:
+            raise NotMirrored(", ".join(missing))
+        with self._lock:
+            cursor = self._connect().cursor()
+        try:
+            cursor.execute("EXPLAIN " + sql)
+        finally:
+            cursor.close()
+        return sql, tables
+
+    def can_serve(self, project_id: str, query: str) -> bool:
+        """True if the query would be answered locally right now (it skips the BigQuery dry run)."""
+        if not self.enabled or project_id != self.project:
+            return False
+        try:
+            _, tables = self.prepare(project_id, query)
+        except Exception:
+            return False
+        return not self._stale(tables)
+
+    def execute(self, sql: str) -> dict:
+        with self._lock:
+            cursor = self._connect().cursor()
+        try:
+            cursor.execute(sql)
+            names = _column_names(cursor.description)
+            rows = [{name: _value(v) for name, v in zip(names, row)} for row in cursor.fetchmany(self.max_rows)]
+        finally:
+            cursor.close()
+        response = {"status": "SUCCESS", "rows": rows}
+        if len(rows) == self.max_rows:
+            response["result_is_likely_truncated"] = True
+        return response
+
+    def _start_sync(self):
+        if self._sync_task is None or self._sync_task.done():
+            self._sync_task = asyncio.get_running_loop().create_task(asyncio.to_thread(self.sync))
+
+    def _fallback(self, reason: str):
+        with self._lock:
+            self.fallbacks[reason] += 1
+        return None
+
+    async def before_tool_callback(self, tool, args: dict, tool_context):
+        """Answers `execute_sql` from the mirror; returning None lets the query run on BigQuery."""
+        if not self.enabled or tool.name != EXECUTE_SQL_TOOL or not args.get("query"):
+            return None
+        if self._last_check is None or self.clock() - self._last_check >= self.check_interval:
+            self._start_sync()
+        if args.get("project_id") != self.project:
+            return self._fallback("other_project")
+        try:
+            sql, tables = await asyncio.to_thread(self.prepare, args["project_id"], args["query"])
+        except NotMirrored:
+            return self._fallback("not_mirrored")
+        except UnsupportedQuery:
+            return self._fallback("unsupported")
+        except Exception:
+            # DuckDB could not plan it: a function or syntax the translation does not cover.
+            return self._fallback("unsupported")
+        stale = self._stale(tables)
+        if stale:
+            try:
+                changed = await asyncio.to_thread(self.confirm, stale)
+            except Exception as e:
+                print(f"Could not check the local mirror: {e}")
+                return self._fallback("stale")
+            if changed:
+                self._start_sync()
+                return self._fallback("stale")
+        try:
+            response = await asyncio.to_thread(self.execute, sql)
+        except Exception as e:
+            print(f"Local mirror query failed, running it on BigQuery: {e}")
+            return self._fallback("error")
+        with self._lock:
+            self.served += 1
+        return response
+
+    def status(self) -> dict:
+        """Per-table snapshot rows, BigQuery modified time and seconds since it was confirmed up to date."""
+        now = self.clock()
+        with self._lock:
+            return {name: {
+                "rows": snapshot["rows"],
+                "modified": snapshot["modified"],
+                "confirmed_ago_s": None if snapshot["checked_at"] is None else round(now - snapshot["checked_at"], 1),
+                "fresh": snapshot["checked_at"] is not None and now - snapshot["checked_at"] <= self.max_staleness,
+            } for name, snapshot in sorted(self._snapshots.items())}
+
+    def stats(self) -> dict:
+        with self._lock:
+            return {
+                "tables": len(self._snapshots),
+                "served": self.served,
+                "fallbacks": dict(self.fallbacks),
+                "downloaded": self.downloaded,
+            }
@@ -0,0 +1,195 @@
+"""Local store of the text of every page of the agent's PDFs, with a full-text index.
+
+Filled offline by `python configure_and_deploy.py ingest_documents` and shipped inside
+`app/`, so the deployed agent answers most document questions with a SQLite FTS5 lookup
+instead of a multimodal model call on the raw PDF. Each document is stored with the GCS
+generation its text was extracted from, so re-uploaded PDFs are re-ingested and never
+answered from stale text.
+"""
+import contextlib
+import os
+import re
+import sqlite3
+import time
+import unicodedata
+
+import dotenv
+
+dotenv.load_dotenv()
+
+DOCUMENT_STORE_FILE = os.getenv(
+    "DOCUMENT_STORE_FILE", os.path.join(os.path.dirname(os.path.abspath(__file__)), "document_store.sqlite3"))
+# Characters of each matching page returned to the agent.
+DOCUMENT_STORE_MAX_PAGE_CHARS = int(os.getenv("DOCUMENT_STORE_MAX_PAGE_CHARS", "3000"))
+
+_SCHEMA = """
+CREATE TABLE IF NOT EXISTS documents (
+    storage_uri TEXT PRIMARY KEY,
+    generation TEXT,
+    pages INTEGER NOT NULL DEFAULT 0,
+    text_chars INTEGER NOT NULL DEFAULT 0,
+    status TEXT NOT NULL,
+    error TEXT,
+    ingested_at REAL NOT NULL
+);
+
+CREATE TABLE IF NOT EXISTS pages (
+    id INTEGER PRIMARY KEY,
+    storage_uri TEXT NOT NULL,
+    page INTEGER NOT NULL,
+    text TEXT NOT NULL
+);
+CREATE INDEX IF NOT EXISTS pages_document ON pages (storage_uri, page);
+
+CREATE VIRTUAL TABLE IF NOT EXISTS pages_fts USING fts5(
+    text, content='pages', content_rowid='id', tokenize='unicode61 remove_diacritics 2'
+);
+"""
+
+# Words too common in questions to help ranking.
+STOPWORDS = {
+    "que", "cual", "cuales", "como", "cuando", "donde", "quien", "cuanto", "cuantos", "cuanta", "cuantas",
+    "del", "las", "los", "una", "uno", "unos", "unas", "por", "para", "con", "sin", "sobre", "entre", "este",
+    "esta", "estos", "estas", "ese", "esa", "hay", "tiene", "tienen", "son", "estan", "segun", "the", "and",
+    "what", "which",
+}
+
+# Outcome of a document's ingestion: text extracted, a PDF without extractable text (scanned), or failed.
+STATUS_OK = "ok"
+STATUS_NO_TEXT = "no_text"
+STATUS_FAILED = "failed"
+
+
+def match_query(question: str) -> str:
+    """FTS5 query matching any of the significant words of a question."""
+    text = unicodedata.normalize("NFKD", str(question).lower())
+    text = "".join(c for c in text if not unicodedata.combining(c))
+    words = [w for w in dict.fromkeys(re.findall(r"[a-z0-9]+", text)) if len(w) >= 3 and w not in STOPWORDS]
+    return " OR ".join(f'"{w}"' for w in words)
+
+
+class PageStore:
+    def __init__(self, path: str = DOCUMENT_STORE_FILE):
+        self.path = path
+
+    def exists(self) -> bool:
+        return os.path.exists(self.path)
+
+    def _connect(self, readonly: bool = False) -> sqlite3.Connection:
+        if readonly:
+            conn = sqlite3.connect(f"file:{self.path}?mode=ro", uri=True, timeout=30)
+        else:
+            conn = sqlite3.connect(self.path, timeout=30, isolation_level=None)
+            conn.executescript(_SCHEMA)
+        conn.row_factory = sqlite3.Row
+        return conn
+
+    @contextlib.contextmanager
+    def _transaction(self):
+        conn = self._connect()
+        try:
+            conn.execute("BEGIN IMMEDIATE")
+            try:
+                yield conn
+            except BaseException:
+                conn.execute("ROLLBACK")
+                raise
+            conn.execute("COMMIT")
+        finally:
+            conn.close()
+
+    def _query(self, sql: str, params=()) -> list:
+        if not self.exists():
+            return []
+        conn = self._connect(readonly=True)
+        try:
+            return [dict(row) for row in conn.execute(sql, params)]
+        finally:
+            conn.close()
+
+    def generations(self) -> dict:
+        """storage_uri -> generation of every document ingested successfully (with or without text)."""
+        return {row["storage_uri"]: row["generation"] for row in self._query(
+            "SELECT storage_uri, generation FROM documents WHERE status != ?", (STATUS_FAILED,))}
+
+    def document(self, storage_uri: str):
+        rows = self._query("SELECT * FROM documents WHERE storage_uri = ?", (storage_uri,))
+        return rows[0] if rows else None
+
+    def replace_document(self, storage_uri: str, generation: str, page_texts: list):
+        """Stores the text of every page of one document version, replacing any previous one."""
+        text_chars = sum(len(t.strip()) for t in page_texts)
+        status = STATUS_OK if text_chars else STATUS_NO_TEXT
+        with self._transaction() as conn:
+            self._delete_pages(conn, storage_uri)
+            for page, text in enumerate(page_texts, start=1):
+                if not text.strip():
+                    continue
+                cursor = conn.execute("INSERT INTO pages (storage_uri, page, text) VALUES (?, ?, ?)",
+                                      (storage_uri, page, text))
+                conn.execute("INSERT INTO pages_fts (rowid, text) VALUES (?, ?)", (cursor.lastrowid, text))
+            conn.execute(
+                "INSERT OR REPLACE INTO documents (storage_uri, generation, pages, text_chars, status, error, ingested_at) "
+                "VALUES (?, ?, ?, ?, ?, NULL, ?)", (storage_uri, generation, len(page_texts), text_chars, status, time.time()))
+
+    def mark_failed(self, storage_uri: str, generation: str, error: str):
+        with self._transaction() as conn:
+            conn.execute(
+                "INSERT INTO documents (storage_uri, generation, status, error, ingested_at) VALUES (?, ?, ?, ?, ?) "
+                "ON CONFLICT (storage_uri) DO UPDATE SET status = excluded.status, error = excluded.error, "
+                "ingested_at = excluded.ingested_at",
+                (storage_uri, generation, STATUS_FAILED, error[:1000], time.time()))
+
+    def remove_document(self, storage_uri: str):
+        with self._transaction() as conn:
+            self._delete_pages(conn, storage_uri)
+            conn.execute("DELETE FROM documents WHERE storage_uri = ?", (storage_uri,))
+
+    @staticmethod
+    def _delete_pages(conn, storage_uri: str):
+        for row in conn.execute("SELECT id, text FROM pages WHERE storage_uri = ?", (storage_uri,)).fetchall():
+            conn.execute("INSERT INTO pages_fts (pages_fts, rowid, text) VALUES ('delete', ?, ?)", (row["id"], row["text"]))
+        conn.execute("DELETE FROM pages WHERE storage_uri = ?", (storage_uri,))
+
+    def search(self, question: str, storage_uri: str = None, limit: int = 5) -> list:
+        """Pages that best match a question (BM25), optionally within one document."""
+        query = match_query(question)
+        if not query:
+            return []
+        sql = ("SELECT p.storage_uri, p.page, p.text, bm25(pages_fts) AS rank FROM pages_fts "
+               "JOIN pages p ON p.id = pages_fts.rowid WHERE pages_fts MATCH ?")
+        params = [query]
+        if storage_uri is not None:
+            sql += " AND p.storage_uri = ?"
+            params.append(storage_uri)
+        sql += " ORDER BY rank LIMIT ?"
+        params.append(limit)
+        return [{
+            "gcs_file_path": row["storage_uri"],
+            "page": row["page"],
+            "text": row["text"][:DOCUMENT_STORE_MAX_PAGE_CHARS],
+            "score": round(-row["rank"], 3),
+        } for row in self._query(sql, params)]
+
+    def compact(self):
+        """Merges the index segments and reclaims free space, so the shipped file stays small."""
+        conn = self._connect()
+        try:
+            conn.execute("INSERT INTO pages_fts (pages_fts) VALUES ('optimize')")
+            conn.execute("VACUUM")
+        finally:
+            conn.close()
+
+    def stats(self) -> dict:
+        by_status = {row["status"]: row["count"] for row in self._query(
+            "SELECT status, COUNT(*) AS count FROM documents GROUP BY status")}
+        pages = self._query("SELECT COUNT(*) AS count FROM pages")
+        return {
+            "path": self.path,
+            "documents": by_status,
+            "pages": pages[0]["count"] if pages else 0,
+            "size_bytes": os.path.getsize(self.path) if self.exists() else 0,
+        }
+
+
+page_store = PageStore()
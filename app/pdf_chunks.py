@@ -0,0 +1,81 @@
+"""Page ranges and page-range chunks of PDF documents, for the large-document mode of `query_gcs_document`.
+
+pypdf is imported on first use, so importing the agent does not pay for it.
+"""
+import io
+import re
+
+
+class PageHintError(ValueError):
+    pass
+
+
+def page_count(data: bytes) -> int:
+    from pypdf import PdfReader
+    return len(PdfReader(io.BytesIO(data)).pages)
+
+
+def extract_page_texts(data: bytes) -> list:
+    """The text of every page, in order; empty for pages without a text layer (scanned images)."""
+    from pypdf import PdfReader
+    reader = PdfReader(io.BytesIO(data))
+    texts = []
+    for page in reader.pages:
+        try:
+            texts.append(page.extract_text() or "")
+        except Exception:
+            texts.append("")
+    return texts
+
+
+def parse_page_hint(hint: str, total_pages: int) -> list:
+    """Turns a hint like "12", "10-25" or "3, 7-9, 40-" into sorted 1-based page numbers within the document."""
+    pages = set()
+    for part in re.split(r"[,;\s]+", str(hint).strip()):
+        if not part:
+            continue
+        match = re.fullmatch(r"(\d+)?(?:-(\d*))?", part)
+        if not match or not match.group(0) or (match.group(1) is None and not match.group(2)):
+            raise PageHintError(f"Invalid page range '{part}'. Use e.g. '12', '10-25' or '40-'.")
+        start = int(match.group(1) or 1)
+        if "-" in part:
+            end = int(match.group(2)) if match.group(2) else total_pages
+        else:
+            end = start
+        pages.update(range(max(start, 1), min(end, total_pages) + 1))
+    if not pages:
+        raise PageHintError(f"The page hint '{hint}' selects no pages of a {total_pages}-page document.")
+    return sorted(pages)
+
+
+def chunk_pages(pages: list, chunk_size: int) -> list:
+    """Splits page numbers into chunks of at most `chunk_size` pages, each one contiguous."""
+    chunks, current = [], []
+    for page in pages:
+        if current and (len(current) == chunk_size or page != current[-1] + 1):
+            chunks.append(current)
+            current = []
+        current.append(page)
+    if current:
+        chunks.append(current)
+    return chunks
+
+
+def describe_pages(pages: list) -> str:
+    """"3-5, 9" style description of page numbers."""
+    return ", ".join(f"{c[0]}-{c[-1]}" if len(c) > 1 else str(c[0]) for c in chunk_pages(pages, len(pages) or 1))
+
+
+def extract_pages(data: bytes, chunks: list) -> list:
+    """One standalone PDF (as bytes) per chunk of 1-based page numbers."""
+    from pypdf import PdfReader, PdfWriter
+    reader = PdfReader(io.BytesIO(data))
+    documents = []
+    for pages in chunks:
+        writer = PdfWriter()
+        for page in pages:
+            writer.add_page(reader.pages[page - 1])
+        output = io.BytesIO()
+        writer.write(output)
+        documents.append(output.getvalue())
+    return documents
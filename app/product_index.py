@@ -0,0 +1,204 @@
+import asyncio
+import bisect
+import collections
+import heapq
+import os
+import re
+import threading
+import time
+import unicodedata
+
+import dotenv
+
+dotenv.load_dotenv()
+
+PRODUCT_INDEX_PROJECT = 'ocr-digitalizacion-425708'
+PRODUCT_INDEX_DATASET = 'demo_agente_alifarma'
+# Tables the product references are read from.
+PRODUCT_TABLES = ["compras_confirmacion_orden_compra", "compras_packing_list", "pedidos"]
+PRODUCT_FIELDS = ["Ematn", "Idnlf", "Txz01"]
+# Minimum time between checks for modified source tables (seconds).
+PRODUCT_INDEX_REFRESH_INTERVAL = float(os.getenv("PRODUCT_INDEX_REFRESH_INTERVAL", "300"))
+# Fuzzy matching only scans the rarest trigrams of a query, skipping very common ones.
+MAX_QUERY_TRIGRAMS = 12
+MAX_FUZZY_POSTINGS = 2000
+MIN_FUZZY_SIMILARITY = 0.4
+
+
+def normalize(text) -> str:
+    text = unicodedata.normalize("NFKD", str(text or "").casefold())
+    text = "".join(c for c in text if not unicodedata.combining(c))
+    return re.sub(r"[^a-z0-9]+", " ", text).strip()
+
+
+def trigrams(text: str) -> set:
+    padded = f"  {text} "
+    return {padded[i:i + 3] for i in range(len(padded) - 2)}
+
+
+class ProductIndex:
+    """Immutable exact / prefix / word / trigram index over (Ematn, Idnlf, Txz01) product triples.
+
+    Lookups rank exact key matches first, then key prefixes, then products whose fields
+    contain every word of the reference (what `LIKE '%term%'` finds), then fuzzy trigram
+    matches by similarity. Later stages only run while the result is not full. The index
+    is never mutated after it is built, so it can be swapped for a fresh one while
+    lookups are running.
+    """
+
+    def __init__(self, products=()):
+        self.products = sorted({tuple("" if v is None else str(v) for v in p) for p in products})
+        self._exact = collections.defaultdict(list)
+        self._words = collections.defaultdict(set)
+        self._postings = collections.defaultdict(list)
+        self._trigram_counts = {}
+        prefix = []
+        for product_id, product in enumerate(self.products):
+            for field, value in zip(PRODUCT_FIELDS, product):
+                key = normalize(value)
+                if not key:
+                    continue
+                self._exact[key].append(product_id)
+                prefix.append((key, product_id))
+                for word in key.split():
+                    self._words[word].add(product_id)
+                grams = trigrams(key)
+                self._trigram_counts[(product_id, field)] = len(grams)
+                for gram in grams:
+                    self._postings[gram].append((product_id, field))
+        prefix.sort()
+        self._prefix = prefix
+
+    def __len__(self) -> int:
+        return len(self.products)
+
+    def search(self, reference: str, limit: int = 5) -> list:
+        query = normalize(reference)
+        if not query:
+            return []
+        # product_id -> (tier, similarity, kind of match); higher tiers always rank first.
+        scores = {}
+
+        for product_id in self._exact.get(query, ()):
+            scores[product_id] = (3, 1.0, "exact")
+
+        position = bisect.bisect_left(self._prefix, (query, -1))
+        while position < len(self._prefix) and self._prefix[position][0].startswith(query) and len(scores) < limit:
+            key, product_id = self._prefix[position]
+            scores.setdefault(product_id, (2, len(query) / len(key), "prefix"))
+            position += 1
+
+        # An exact key is unambiguous: looser matches would only add noise.
+        if len(scores) < limit and query not in self._exact:
+            self._containing(query, scores, limit)
+
+        if len(scores) < limit and query not in self._exact:
+            self._fuzzy(query, scores)
+
+        best = heapq.nlargest(limit, scores.items(), key=lambda item: item[1][:2])
+        results = []
+        for product_id, (_, similarity, match) in best:
+            result = dict(zip(PRODUCT_FIELDS, self.products[product_id]))
+            result.update({"match": match, "score": round(similarity, 3)})
+            results.append(result)
+        return results
+
+    def _containing(self, query: str, scores: dict, limit: int):
+        word_sets = sorted((self._words.get(w, set()) for w in set(query.split())), key=len)
+        if not word_sets or not word_sets[0]:
+            return
+        # Walk the rarest word's products and stop as soon as enough contain every word.
+        for product_id in word_sets[0]:
+            if product_id not in scores and all(product_id in words for words in word_sets[1:]):
+                scores[product_id] = (1, 1.0, "contains")
+                if len(scores) >= limit:
+                    break
+
+    def _fuzzy(self, query: str, scores: dict):
+        query_grams = trigrams(query)
+        # Trigrams shared by too many products add little signal but dominate the lookup cost.
+        rare_grams = sorted((g for g in query_grams if 0 < len(self._postings.get(g, ())) <= MAX_FUZZY_POSTINGS),
+                            key=lambda g: len(self._postings[g]))
+        shared = collections.Counter()
+        for gram in rare_grams[:MAX_QUERY_TRIGRAMS]:
+            shared.update(self._postings[gram])
+        for (product_id, field), count in shared.items():
+            # Dice similarity rewards close matches; coverage rewards the query appearing inside a long name.
+            dice = 2 * count / (len(query_grams) + self._trigram_counts[(product_id, field)])
+            coverage = count / len(query_grams)
+            similarity = (dice + coverage) / 2
+            if similarity >= MIN_FUZZY_SIMILARITY and scores.get(product_id, (0, 0.0))[:2] < (0, similarity):
+                scores[product_id] = (0, similarity, "fuzzy")
+
+
+def load_products(client, project: str, dataset: str, table: str) -> list:
+    columns = ", ".join(f"CAST({c} AS STRING) AS {c}" for c in PRODUCT_FIELDS)
+    query = f"SELECT DISTINCT {columns} FROM `{project}.{dataset}.{table}`"
+    return [tuple(row[c] for c in PRODUCT_FIELDS) for row in client.query_and_wait(query)]
+
+
+class ProductResolver:
+    """Keeps a ProductIndex in sync with the compras and pedidos tables.
+
+    Each source table is re-read only when its last-modified time changed, and a new
+    index is swapped in only when the set of products changed. Lookups never wait on
+    BigQuery once the first load is done.
+    """
+
+    def __init__(self, client_factory, project: str = PRODUCT_INDEX_PROJECT, dataset: str = PRODUCT_INDEX_DATASET,
+                 tables: list = None, refresh_interval: float = PRODUCT_INDEX_REFRESH_INTERVAL, clock=time.time):
+        self.client_factory = client_factory
+        self.project = project
+        self.dataset = dataset
+        self.tables = tables or PRODUCT_TABLES
+        self.refresh_interval = refresh_interval
+        self.index = ProductIndex()
+        self._clock = clock
+        self._table_products = {}
+        self._table_modified = {}
+        self._last_check = None
+        self._refresh_lock = threading.Lock()
+        self._refresh_task = None
+
+    def refresh(self) -> dict:
+        """Re-reads modified source tables and applies the changes to the index."""
+        with self._refresh_lock:
+            client = self.client_factory(self.project)
+            changed = []
+            for table in self.tables:
+                try:
+                    modified = client.get_table(f"{self.project}.{self.dataset}.{table}").modified
+                    if table in self._table_products and self._table_modified.get(table) == modified:
+                        continue
+                    self._table_products[table] = load_products(client, self.project, self.dataset, table)
+                    self._table_modified[table] = modified
+                    changed.append(table)
+                except Exception as e:
+                    print(f"Could not load products from {table}: {e}")
+            added = removed = 0
+            if changed:
+                products = {p for rows in self._table_products.values() for p in rows}
+                current = set(self.index.products)
+                added, removed = len(products - current), len(current - products)
+                if added or removed:
+                    self.index = ProductIndex(products)
+            # With nothing loaded, the next lookup retries at once instead of serving an empty index.
+            if self._table_products:
+                self._last_check = self._clock()
+            return {"changed_tables": changed, "added": added, "removed": removed, "products": len(self.index)}
+
+    async def _ensure_fresh(self):
+        if self._last_check is None:
+            await asyncio.to_thread(self.refresh)
+        elif self._clock() - self._last_check >= self.refresh_interval and (
+                self._refresh_task is None or self._refresh_task.done()):
+            # Serve from the current index while the refresh runs.
+            self._refresh_task = asyncio.get_running_loop().create_task(asyncio.to_thread(self.refresh))
+
+    async def resolve(self, reference: str, max_results: int = 5) -> dict:
+        """Ranked candidate products for a reference, refreshing the index when it is stale."""
+        try:
+            await self._ensure_fresh()
+        except Exception as e:
+            return {"status": "ERROR", "error_details": f"Product index unavailable: {e}"}
+        return {"status": "SUCCESS", "matches": self.index.search(reference, limit=max_results)}
@@ -0,0 +1,428 @@
+"""Process-wide client-side rate limiting of the Gemini requests.
+
+The orchestrator, the sub-agents and the document tools share one project quota of
+gemini-2.5-flash. Every request first reserves one request and its estimated tokens in
+two token buckets (requests and tokens per minute), so bursts wait here instead of coming
+back as 429 RESOURCE_EXHAUSTED. Throttled requests are retried with jittered exponential
+backoff, or after the delay the server asks for. A 429 also drains the buckets and cuts
+their rate, which successful requests then restore a little every second, so a quota
+configured too high converges to the real one instead of feeding a retry storm.
+
+The state is guarded by a threading lock and waits use `asyncio.sleep`, so one limiter
+serves every event loop and thread of the process.
+"""
+import asyncio
+import collections
+import os
+import random
+import re
+import threading
+import time
+from functools import cached_property
+
+import dotenv
+from google.adk.models.google_llm import Gemini
+from opentelemetry import trace
+
+from .schema_catalog import CHARS_PER_TOKEN
+from .telemetry import model_hedges, model_queue_wait, model_throttled
+
+dotenv.load_dotenv()
+
+GEMINI_RATE_LIMIT_ENABLED = os.getenv("GEMINI_RATE_LIMIT_ENABLED", "true").lower() == "true"
+# Quota of one replica process (divide the project quota by the number of replicas); 0 disables a bucket.
+GEMINI_RPM = float(os.getenv("GEMINI_RPM", "300"))
+GEMINI_TPM = float(os.getenv("GEMINI_TPM", "1000000"))
+# Seconds of quota that can be spent in a single burst.
+GEMINI_BURST_SECONDS = float(os.getenv("GEMINI_BURST_SECONDS", "5"))
+GEMINI_MAX_RETRIES = int(os.getenv("GEMINI_MAX_RETRIES", "5"))
+GEMINI_BACKOFF_BASE = float(os.getenv("GEMINI_BACKOFF_BASE", "1"))
+GEMINI_BACKOFF_MAX = float(os.getenv("GEMINI_BACKOFF_MAX", "32"))
+# Adaptive rate: a 429 multiplies the rates by GEMINI_RATE_DECREASE, down to GEMINI_MIN_RATE_FACTOR of the
+# configured ones, and every second of successful requests gives back GEMINI_RATE_RECOVERY of them.
+GEMINI_RATE_DECREASE = float(os.getenv("GEMINI_RATE_DECREASE", "0.7"))
+GEMINI_MIN_RATE_FACTOR = float(os.getenv("GEMINI_MIN_RATE_FACTOR", "0.1"))
+GEMINI_RATE_RECOVERY = float(os.getenv("GEMINI_RATE_RECOVERY", "0.02"))
+# Hedging: an idempotent request still running after the GEMINI_HEDGE_QUANTILE of the recent latencies
+# (at least GEMINI_HEDGE_MIN_DELAY seconds) is sent again if there is spare quota; the first answer wins.
+GEMINI_HEDGING_ENABLED = os.getenv("GEMINI_HEDGING_ENABLED", "false").lower() == "true"
+GEMINI_HEDGE_QUANTILE = float(os.getenv("GEMINI_HEDGE_QUANTILE", "0.9"))
+GEMINI_HEDGE_MIN_DELAY = float(os.getenv("GEMINI_HEDGE_MIN_DELAY", "2"))
+# Tokens assumed for a document part (file URI or inline bytes) whose size the caller does not give.
+GEMINI_FILE_TOKENS = int(os.getenv("GEMINI_FILE_TOKENS", "8000"))
+
+# Responses worth retrying: quota exhausted and transient server errors.
+RETRYABLE_CODES = {429, 500, 502, 503, 504}
+_STATUS_CODES = {"RESOURCE_EXHAUSTED": 429, "INTERNAL": 500, "UNAVAILABLE": 503, "DEADLINE_EXCEEDED": 504}
+# Latencies needed before a caller's requests are hedged.
+_HEDGE_MIN_SAMPLES = 20
+
+
+class RateLimitError(Exception):
+    """A request still throttled (429) after every retry; `retry_after` is the suggested wait in seconds."""
+
+    def __init__(self, message: str, retry_after: float):
+        super().__init__(message)
+        self.retry_after = retry_after
+
+
+def error_code(error):
+    """HTTP code of a failed Gemini request (google.genai APIError or its text), or None."""
+    code = getattr(error, "code", None)
+    if isinstance(code, int):
+        return code
+    status = getattr(error, "status", None)
+    if status in _STATUS_CODES:
+        return _STATUS_CODES[status]
+    match = re.match(r"(\d{3}) ([A-Z_]+)\b", str(error))
+    return int(match.group(1)) if match else None
+
+
+def _find_retry_delay(value):
+    if isinstance(value, dict):
+        if isinstance(value.get("retryDelay"), str):
+            return value["retryDelay"]
+        value = list(value.values())
+    if isinstance(value, list):
+        for item in value:
+            found = _find_retry_delay(item)
+            if found is not None:
+                return found
+    return None
+
+
+def retry_hint(error):
+    """Seconds the server asked to wait: a Retry-After header, a google.rpc.RetryInfo or "retry in Ns"."""
+    headers = getattr(getattr(error, "response", None), "headers", None)
+    try:
+        if headers and headers.get("retry-after"):
+            return float(headers.get("retry-after"))
+    except (TypeError, ValueError):
+        pass
+    delay = _find_retry_delay(getattr(error, "details", None))
+    if delay is not None:
+        match = re.fullmatch(r"([\d.]+)s", delay.strip())
+        if match:
+            return float(match.group(1))
+    match = re.search(r"retry in ([\d.]+)\s*s", str(error), re.IGNORECASE)
+    return float(match.group(1)) if match else None
+
+
+def estimate_tokens(contents, config=None) -> int:
+    """Rough input tokens of a request: its text at CHARS_PER_TOKEN plus GEMINI_FILE_TOKENS per document part."""
+    chars = 0
+    files = 0
+    items = [contents, getattr(config, "system_instruction", None)]
+    while items:
+        item = items.pop()
+        if item is None:
+            continue
+        if isinstance(item, str):
+            chars += len(item)
+        elif isinstance(item, (list, tuple)):
+            items.extend(item)
+        elif getattr(item, "parts", None) is not None:
+            items.extend(item.parts)
+        else:
+            if getattr(item, "inline_data", None) is not None or getattr(item, "file_data", None) is not None:
+                files += 1
+            chars += len(getattr(item, "text", None) or "")
+            for attribute in ("function_call", "function_response"):
+                value = getattr(item, attribute, None)
+                if value is not None:
+                    chars += len(str(value))
+    return -(-chars // CHARS_PER_TOKEN) + files * GEMINI_FILE_TOKENS
+
+
+class TokenBucket:
+    """Refills `per_minute * scale` units per minute up to `burst_seconds` of them.
+
+    Reservations are taken at once and may leave the level negative: the caller waits
+    until the refill covers the debt, so waiters are served in order without polling.
+    """
+
+    def __init__(self, per_minute: float, burst_seconds: float, now: float):
+        self.per_minute = per_minute
+        self.capacity = max(1.0, per_minute / 60 * burst_seconds)
+        self.level = self.capacity
+        self.scale = 1.0
+        self.updated = now
+
+    @property
+    def enabled(self) -> bool:
+        return self.per_minute > 0
+
+    def _rate(self) -> float:
+        return self.per_minute * self.scale / 60
+
+    def _refill(self, now: float):
+        if now > self.updated:
+            self.level = min(self.capacity, self.level + (now - self.updated) * self._rate())
+            self.updated = now
+
+    def reserve(self, amount: float, now: float) -> float:
+        """Takes `amount` (at most a full bucket) and returns the seconds to wait before using it."""
+        if not self.enabled:
+            return 0.0
+        self._refill(now)
+        self.level -= min(amount, self.capacity)
+        return max(0.0, self.updated - now) + max(0.0, -self.level / self._rate())
+
+    def try_take(self, amount: float, now: float) -> bool:
+        if not self.enabled:
+            return True
+        self._refill(now)
+        if self.updated > now or self.level < amount:
+            return False
+        self.level -= amount
+        return True
+
+    def adjust(self, amount: float, now: float):
+        """Charges (or refunds, when negative) the difference between estimated and actual usage."""
+        if self.enabled:
+            self._refill(now)
+            self.level = min(self.capacity, self.level - amount)
+
+    def set_scale(self, scale: float, now: float):
+        self._refill(now)
+        self.scale = scale
+
+    def drain(self, until: float):
+        """Spends the burst allowance and stops refilling until `until`."""
+        self.level = min(self.level, 0.0)
+        self.updated = max(self.updated, until)
+
+
+class GeminiRateLimiter:
+    def __init__(self, rpm: float = GEMINI_RPM, tpm: float = GEMINI_TPM, burst_seconds: float = GEMINI_BURST_SECONDS,
+                 max_retries: int = GEMINI_MAX_RETRIES, backoff_base: float = GEMINI_BACKOFF_BASE,
+                 backoff_max: float = GEMINI_BACKOFF_MAX, rate_decrease: float = GEMINI_RATE_DECREASE,
+                 min_rate_factor: float = GEMINI_MIN_RATE_FACTOR,
+                 rate_recovery: float = GEMINI_RATE_RECOVERY, hedging: bool = GEMINI_HEDGING_ENABLED,
+                 hedge_quantile: float = GEMINI_HEDGE_QUANTILE, hedge_min_delay: float = GEMINI_HEDGE_MIN_DELAY,
+                 enabled: bool = GEMINI_RATE_LIMIT_ENABLED, clock=time.monotonic, sleep=asyncio.sleep):
+        self._clock = clock
+        self._sleep = sleep
+        now = clock()
+        self.requests = TokenBucket(rpm, burst_seconds, now)
+        self.tokens = TokenBucket(tpm, burst_seconds, now)
+        self.max_retries = max_retries
+        self.backoff_base = backoff_base
+        self.backoff_max = backoff_max
+        self.rate_decrease = rate_decrease
+        self.min_rate_factor = min_rate_factor
+        self.rate_recovery = rate_recovery
+        self.hedging = hedging
+        self.hedge_quantile = hedge_quantile
+        self.hedge_min_delay = hedge_min_delay
+        self.enabled = enabled
+        self.rate_factor = 1.0
+        self._last_decrease = float("-inf")
+        self._last_increase = now
+        self._latencies = {}
+        self._stats = collections.Counter()
+        self._lock = threading.Lock()
+
+    def _set_rate_factor(self, factor: float, now: float):
+        self.rate_factor = factor
+        self.requests.set_scale(factor, now)
+        self.tokens.set_scale(factor, now)
+
+    async def acquire(self, estimated_tokens: int = 0, caller: str = "") -> float:
+        """Reserves one request and its estimated tokens, waits until they are available and returns the wait."""
+        with self._lock:
+            now = self._clock()
+            wait = max(self.requests.reserve(1, now), self.tokens.reserve(estimated_tokens, now))
+            self._stats["requests"] += 1
+            if wait > 0:
+                self._stats["queued"] += 1
+                self._stats["queue_wait_s"] += wait
+                self._stats["queue_wait_max_s"] = max(self._stats["queue_wait_max_s"], wait)
+        if wait > 0:
+            await self._sleep(wait)
+        model_queue_wait.record(wait, {"caller": caller})
+        return wait
+
+    def _throttled(self, code: int, hint, caller: str, reserved_at: float):
+        model_throttled.add(1, {"caller": caller, "http.status_code": code})
+        with self._lock:
+            self._stats["throttled"] += 1
+            if code != 429:
+                return
+            now = self._clock()
+            # Requests reserved before the last decrease were paced at the old rate: their 429s are no news.
+            if reserved_at >= self._last_decrease:
+                self._last_decrease = self._last_increase = now
+                self._set_rate_factor(max(self.min_rate_factor, self.rate_factor * self.rate_decrease), now)
+            until = now + (hint or 0.0)
+            self.requests.drain(until)
+            self.tokens.drain(until)
+
+    def _succeeded(self, caller: str, latency: float, estimated_tokens: int, response):
+        usage = getattr(response, "usage_metadata", None)
+        actual = getattr(usage, "total_token_count", None) if usage is not None else None
+        with self._lock:
+            now = self._clock()
+            if actual:
+                self.tokens.adjust(actual - estimated_tokens, now)
+            if self.rate_factor < 1.0:
+                recovered = self.rate_recovery * (now - self._last_increase)
+                self._set_rate_factor(min(1.0, self.rate_factor + recovered), now)
+            self._last_increase = now
+            self._latencies.setdefault(caller, collections.deque(maxlen=200)).append(latency)
+
+    def _backoff(self, attempt: int, hint) -> float:
+        if hint is not None:
+            return hint + random.uniform(0, self.backoff_base)
+        return random.uniform(0, min(self.backoff_max, self.backoff_base * 2 ** attempt))
+
+    async def call(self, request, estimated_tokens: int = 0, caller: str = "", idempotent: bool = False):
+        """Awaits `request()` within the limits, retrying throttled and transient failures.
+
+        `request` creates a new awaitable on every call. Idempotent requests may be hedged.
+        Raises RateLimitError when the request is still throttled after every retry.
+        """
+        if not self.enabled:
+            return await request()
+        waited = 0.0
+        attempt = 0
+        while True:
+            reserved_at = self._clock()
+            waited += await self.acquire(estimated_tokens, caller)
+            started = time.perf_counter()
+            try:
+                if idempotent and self.hedging:
+                    response = await self._hedged(request, estimated_tokens, caller)
+                else:
+                    response = await request()
+            except Exception as e:
+                code = error_code(e)
+                if code not in RETRYABLE_CODES:
+                    raise
+                hint = retry_hint(e)
+                self._throttled(code, hint, caller, reserved_at)
+                delay = self._backoff(attempt, hint)
+                if attempt >= self.max_retries:
+                    with self._lock:
+                        self._stats["gave_up"] += 1
+                    if code == 429:
+                        raise RateLimitError(f"Gemini quota exhausted after {attempt + 1} attempts: {e}", delay) from e
+                    raise
+                attempt += 1
+                with self._lock:
+                    self._stats["retries"] += 1
+                await self._sleep(delay)
+                continue
+            self._succeeded(caller, time.perf_counter() - started, estimated_tokens, response)
+            trace.get_current_span().set_attributes({"rate_limit.queue_wait_s": round(waited, 3),
+                                                     "rate_limit.retries": attempt})
+            return response
+
+    def _hedge_delay(self, caller: str):
+        with self._lock:
+            latencies = sorted(self._latencies.get(caller, ()))
+        if len(latencies) < _HEDGE_MIN_SAMPLES:
+            return None
+        return max(self.hedge_min_delay, latencies[min(len(latencies) - 1, int(len(latencies) * self.hedge_quantile))])
+
+    def _try_reserve(self, estimated_tokens: int) -> bool:
+        """Takes quota for a hedge only if it is available now and the limiter is not backing off."""
+        with self._lock:
+            now = self._clock()
+            if self.rate_factor < 1.0 or not self.requests.try_take(1, now):
+                return False
+            if not self.tokens.try_take(estimated_tokens, now):
+                self.requests.adjust(-1, now)
+                return False
+            return True
+
+    async def _hedged(self, request, estimated_tokens: int, caller: str):
+        delay = self._hedge_delay(caller)
+        primary = asyncio.ensure_future(request())
+        tasks = {primary: "primary"}
+        try:
+            if delay is None:
+                return await asyncio.shield(primary)
+            done, _ = await asyncio.wait({primary}, timeout=delay)
+            if done or not self._try_reserve(estimated_tokens):
+                return await asyncio.shield(primary)
+            tasks[asyncio.ensure_future(request())] = "hedge"
+            with self._lock:
+                self._stats["hedges"] += 1
+            pending = set(tasks)
+            while pending:
+                done, pending = await asyncio.wait(pending, return_when=asyncio.FIRST_COMPLETED)
+                for task in done:
+                    if task.exception() is None:
+                        model_hedges.add(1, {"caller": caller, "winner": tasks[task]})
+                        if tasks[task] == "hedge":
+                            with self._lock:
+                                self._stats["hedge_wins"] += 1
+                        return task.result()
+            return primary.result()
+        finally:
+            for task in tasks:
+                if not task.done():
+                    task.cancel()
+
+    def stats(self) -> dict:
+        with self._lock:
+            stats = dict(self._stats)
+            rate_factor = self.rate_factor
+        requests = stats.get("requests", 0)
+        return {
+            "rpm": self.requests.per_minute,
+            "tpm": self.tokens.per_minute,
+            "rate_factor": round(rate_factor, 3),
+            **{key: stats.get(key, 0) for key in ("requests", "queued", "throttled", "retries", "gave_up",
+                                                   "hedges", "hedge_wins")},
+            "queue_wait_mean_s": round(stats.get("queue_wait_s", 0) / requests, 3) if requests else 0.0,
+            "queue_wait_max_s": round(stats.get("queue_wait_max_s", 0), 3),
+        }
+
+    def reset_stats(self):
+        with self._lock:
+            self._stats.clear()
+
+
+gemini_limiter = GeminiRateLimiter()
+
+
+class _Proxy:
+    """Forwards every attribute to `target` except the ones given as overrides."""
+
+    def __init__(self, target, **overrides):
+        self._target = target
+        self.__dict__.update(overrides)
+
+    def __getattr__(self, name):
+        return getattr(self._target, name)
+
+
+class LimitedModels(_Proxy):
+    """`client.aio.models` whose generate calls go through a rate limiter."""
+
+    def __init__(self, models, limiter: GeminiRateLimiter, caller: str):
+        super().__init__(models)
+        self._limiter = limiter
+        self._caller = caller
+
+    async def generate_content(self, *, model, contents, config=None, **kwargs):
+        return await self._limiter.call(
+            lambda: self._target.generate_content(model=model, contents=contents, config=config, **kwargs),
+            estimate_tokens(contents, config), caller=self._caller, idempotent=True)
+
+    async def generate_content_stream(self, *, model, contents, config=None, **kwargs):
+        # Only opening the stream is retried: a stream that fails halfway is not replayed.
+        return await self._limiter.call(
+            lambda: self._target.generate_content_stream(model=model, contents=contents, config=config, **kwargs),
+            estimate_tokens(contents, config), caller=self._caller)
+
+
+class RateLimitedGemini(Gemini):
+    """Gemini model of the agents, sharing `gemini_limiter` with the document tools."""
+
+    @cached_property
+    def api_client(self):
+        client = Gemini.api_client.func(self)
+        return _Proxy(client, aio=_Proxy(client.aio, models=LimitedModels(client.aio.models, gemini_limiter, "agents")))
@@ -0,0 +1,486 @@
+"""Large `execute_sql` results kept next to the agent instead of in the model context.
+
+A result with more than RESULT_INLINE_MAX_ROWS rows (or RESULT_INLINE_MAX_BYTES of JSON)
+is stored as an Arrow table under a result id. The model gets a summary instead: the row
+count, per-column statistics and the first rows. The follow-up tools page, filter and
+aggregate the stored table locally with Arrow compute kernels, without running the query
+again. Tables are kept in memory up to RESULT_BUFFER_MAX_BYTES; beyond that, the least
+recently used ones are spilled to Parquet files in RESULT_BUFFER_DIR. How every result was
+built is kept in the session state, so a replica that does not hold a table rebuilds it;
+query results also keep their row count and digest there, and a rebuild that no longer
+matches the summary the model saw is refused instead of served.
+
+pyarrow is imported on first use, so importing the agent does not pay for it.
+"""
+import asyncio
+import collections
+import hashlib
+import json
+import os
+import re
+import tempfile
+import threading
+import time
+
+import dotenv
+
+from .sql_cache import EXECUTE_SQL_TOOL
+
+dotenv.load_dotenv()
+
+RESULT_BUFFER_ENABLED = os.getenv("RESULT_BUFFER_ENABLED", "true").lower() == "true"
+# Rows fetched per query (the BigQuery tool's row cap); larger results are reported as truncated.
+RESULT_MAX_ROWS = int(os.getenv("RESULT_MAX_ROWS", "20000"))
+# Results up to this size are returned to the model whole, as before.
+RESULT_INLINE_MAX_ROWS = int(os.getenv("RESULT_INLINE_MAX_ROWS", "50"))
+RESULT_INLINE_MAX_BYTES = int(os.getenv("RESULT_INLINE_MAX_BYTES", str(16 * 1024)))
+# Rows shown in a summary and the most rows a follow-up returns at once.
+RESULT_PREVIEW_ROWS = int(os.getenv("RESULT_PREVIEW_ROWS", "10"))
+RESULT_PAGE_MAX_ROWS = int(os.getenv("RESULT_PAGE_MAX_ROWS", "100"))
+# Characters kept of every text value shown to the model.
+RESULT_MAX_VALUE_CHARS = int(os.getenv("RESULT_MAX_VALUE_CHARS", "200"))
+RESULT_BUFFER_MAX_BYTES = int(os.getenv("RESULT_BUFFER_MAX_BYTES", str(256 * 1024 ** 2)))
+RESULT_BUFFER_TTL = float(os.getenv("RESULT_BUFFER_TTL", "3600"))
+RESULT_BUFFER_DIR = os.getenv("RESULT_BUFFER_DIR", os.path.join(tempfile.gettempdir(), "alifarma_results"))
+
+# Session state key holding how a result was built.
+STATE_PREFIX = "result:"
+
+AGGREGATIONS = {"count", "count_distinct", "sum", "mean", "min", "max"}
+_FILTER = re.compile(
+    r"^\s*`?(\w+)`?\s+(is\s+not\s+null|is\s+null|not\s+in|in|contains|starts_with|=|==|!=|<>|>=|<=|>|<)\s*(.*?)\s*$",
+    re.IGNORECASE,
+)
+
+
+class ResultQueryError(ValueError):
+    pass
+
+
+def _result_id(recipe: dict) -> str:
+    return "r" + hashlib.sha256(json.dumps(recipe, sort_keys=True).encode("utf-8")).hexdigest()[:12]
+
+
+def _json_safe(value):
+    # Same conversion as the BigQuery tool, so a rebuilt table matches the original one.
+    try:
+        json.dumps(value)
+        return value
+    except (TypeError, ValueError):
+        return str(value)
+
+
+def table_digest(table) -> str:
+    """Digest of the rows of a table, independent of their order (BigQuery does not fix it without ORDER BY)."""
+    import pyarrow as pa
+    import pyarrow.ipc as ipc
+    try:
+        table = table.sort_by([(name, "ascending") for name in table.column_names]).combine_chunks()
+    except (pa.ArrowNotImplementedError, pa.ArrowInvalid, pa.ArrowTypeError):
+        # ARRAY and STRUCT columns cannot be sorted: add up per-row hashes instead.
+        total = 0
+        for row in table.to_pylist():
+            row_hash = hashlib.sha256(json.dumps(row, sort_keys=True, default=str).encode("utf-8")).digest()
+            total = (total + int.from_bytes(row_hash[:16], "big")) % (1 << 128)
+        return f"{total:032x}"
+    sink = pa.BufferOutputStream()
+    with ipc.new_stream(sink, table.schema) as writer:
+        writer.write_table(table)
+    return hashlib.sha256(sink.getvalue()).hexdigest()
+
+
+def rows_to_table(rows: list):
+    import pyarrow as pa
+    return pa.Table.from_pylist(rows)
+
+
+def _short(value):
+    if isinstance(value, str) and len(value) > RESULT_MAX_VALUE_CHARS:
+        return value[:RESULT_MAX_VALUE_CHARS] + "…"
+    if isinstance(value, float):
+        return round(value, 6)
+    return value
+
+
+def table_rows(table) -> list:
+    return [{k: _short(v) for k, v in row.items()} for row in table.to_pylist()]
+
+
+def _column(table, name: str) -> str:
+    """The table column matching `name`, ignoring case."""
+    for column in table.column_names:
+        if column.lower() == str(name).strip().strip("`").lower():
+            return column
+    raise ResultQueryError(f"Unknown column '{name}'. Columns: {', '.join(table.column_names)}.")
+
+
+def _as_number(array, name: str):
+    """The column as float64, also when it holds numbers as text (NUMERIC values arrive as text)."""
+    import pyarrow as pa
+    import pyarrow.compute as pc
+    try:
+        return pc.cast(array, pa.float64())
+    except (pa.ArrowInvalid, pa.ArrowNotImplementedError):
+        raise ResultQueryError(f"Column '{name}' is not numeric.") from None
+
+
+def column_stats(table) -> list:
+    """Compact statistics of every column: type, nulls, distinct values, min/max, sum/mean or top values."""
+    import pyarrow as pa
+    import pyarrow.compute as pc
+    stats = []
+    for name in table.column_names:
+        array = table.column(name)
+        entry = {"name": name, "type": str(array.type), "nulls": array.null_count}
+        if pa.types.is_null(array.type):
+            stats.append(entry)
+            continue
+        entry["distinct"] = pc.count_distinct(array).as_py()
+        if pa.types.is_integer(array.type) or pa.types.is_floating(array.type):
+            minmax = pc.min_max(array).as_py()
+            entry.update(min=minmax["min"], max=minmax["max"], sum=_short(pc.sum(array).as_py()),
+                         mean=_short(pc.mean(array).as_py()))
+        elif pa.types.is_string(array.type) or pa.types.is_large_string(array.type):
+            minmax = pc.min_max(array).as_py()
+            entry.update(min=_short(minmax["min"]), max=_short(minmax["max"]))
+            if entry["distinct"] < len(array):
+                counts = pc.value_counts(array).to_pylist()
+                counts.sort(key=lambda c: c["counts"], reverse=True)
+                entry["top"] = [{"value": _short(c["values"]), "count": c["counts"]} for c in counts[:5]]
+        elif pa.types.is_boolean(array.type):
+            entry["true"] = pc.sum(array).as_py() or 0
+        stats.append(entry)
+    return stats
+
+
+def _literal(text: str):
+    text = text.strip()
+    if len(text) >= 2 and text[0] == text[-1] and text[0] in "'\"":
+        return text[1:-1]
+    try:
+        return int(text)
+    except ValueError:
+        pass
+    try:
+        return float(text)
+    except ValueError:
+        return text
+
+
+def _compare(array, name: str, op: str, value):
+    import pyarrow as pa
+    import pyarrow.compute as pc
+    functions = {"=": pc.equal, "==": pc.equal, "!=": pc.not_equal, "<>": pc.not_equal,
+                 ">": pc.greater, ">=": pc.greater_equal, "<": pc.less, "<=": pc.less_equal}
+    if isinstance(value, (int, float)) and not isinstance(value, bool):
+        array = _as_number(array, name)
+    elif not (pa.types.is_string(array.type) or pa.types.is_large_string(array.type)):
+        array = pc.cast(array, pa.string())
+        value = str(value)
+    return functions[op](array, value)
+
+
+def apply_filters(table, filters: list):
+    """Rows matching every filter, each written as "<column> <op> <value>".
+
+    Operators: =, !=, >, >=, <, <=, contains, starts_with (both case-insensitive),
+    in / not in (value list in parentheses), is null, is not null.
+    """
+    import pyarrow as pa
+    import pyarrow.compute as pc
+    mask = None
+    for text in filters or []:
+        match = _FILTER.match(str(text))
+        if not match:
+            raise ResultQueryError(f"Invalid filter '{text}'. Use e.g. \"Menge > 100\" or \"Txz01 contains 'vitamina'\".")
+        name, op, value = match.group(1), " ".join(match.group(2).lower().split()), match.group(3)
+        name = _column(table, name)
+        array = table.column(name)
+        if op == "is null":
+            condition = pc.is_null(array)
+        elif op == "is not null":
+            condition = pc.is_valid(array)
+        elif op in ("contains", "starts_with"):
+            text_array = pc.cast(array, pa.string())
+            pattern = str(_literal(value))
+            function = pc.match_substring if op == "contains" else pc.starts_with
+            condition = function(text_array, pattern, ignore_case=True)
+        elif op in ("in", "not in"):
+            values = [_literal(v) for v in re.split(r"\s*,\s*", value.strip().strip("()")) if v]
+            if values and all(isinstance(v, (int, float)) for v in values):
+                condition = pc.is_in(_as_number(array, name), value_set=pa.array([float(v) for v in values]))
+            else:
+                condition = pc.is_in(pc.cast(array, pa.string()), value_set=pa.array([str(v) for v in values]))
+            if op == "not in":
+                condition = pc.invert(condition)
+        else:
+            condition = _compare(array, name, op, _literal(value))
+        condition = pc.fill_null(condition, False)
+        mask = condition if mask is None else pc.and_(mask, condition)
+    return table if mask is None else table.filter(mask)
+
+
+def sort_table(table, order_by: str, descending: bool):
+    """The table sorted by one column; text columns holding numbers (NUMERIC values) sort as numbers."""
+    import pyarrow as pa
+    import pyarrow.compute as pc
+    if not order_by:
+        return table
+    name = _column(table, order_by)
+    order = "descending" if descending else "ascending"
+    array = table.column(name)
+    if pa.types.is_string(array.type) or pa.types.is_large_string(array.type):
+        try:
+            array = pc.cast(array, pa.float64())
+        except (pa.ArrowInvalid, pa.ArrowNotImplementedError):
+            pass
+        else:
+            return table.take(pc.sort_indices(array, sort_keys=[("", order)]))
+    return table.sort_by([(name, order)])
+
+
+def aggregate(table, aggregations: list, group_by: list = None):
+    """Groups by `group_by` (or the whole table) and computes "count" or "<function>:<column>" aggregations.
+
+    Functions: count, count_distinct, sum, mean, min, max. Output columns are named
+    "<column>_<function>" ("count" for the row count).
+    """
+    import pyarrow as pa
+    keys = [_column(table, k) for k in (group_by or [])]
+    specs = []
+    numeric = {}
+    for text in aggregations or ["count"]:
+        function, _, name = str(text).strip().partition(":")
+        function = function.strip().lower()
+        if function not in AGGREGATIONS:
+            raise ResultQueryError(f"Unknown aggregation '{text}'. Use count, or one of "
+                                   f"{', '.join(sorted(AGGREGATIONS - {'count'}))} as '<function>:<column>'.")
+        if function == "count" and not name:
+            specs.append(([], "count_all"))
+            continue
+        column = _column(table, name)
+        if function in ("sum", "mean"):
+            numeric[column] = True
+        specs.append((column, function))
+    columns = {}
+    for name in table.column_names:
+        array = table.column(name)
+        if numeric.get(name):
+            array = _as_number(array, name)
+        columns[name] = array
+    grouped = pa.table(columns).group_by(keys).aggregate(specs)
+    grouped = grouped.rename_columns(["count" if c == "count_all" else c for c in grouped.column_names])
+    # Keys first, like a GROUP BY result.
+    return grouped.select(keys + [c for c in grouped.column_names if c not in keys])
+
+
+class ResultStore:
+    """Arrow tables of large `execute_sql` results, wired in as the last ADK after-tool stage."""
+
+    def __init__(self, client_factory, max_bytes: int = RESULT_BUFFER_MAX_BYTES, ttl: float = RESULT_BUFFER_TTL,
+                 directory: str = RESULT_BUFFER_DIR, enabled: bool = True, clock=time.time):
+        self.client_factory = client_factory
+        self.max_bytes = max_bytes
+        self.ttl = ttl
+        self.directory = directory
+        self.enabled = enabled
+        self.clock = clock
+        self._tables = collections.OrderedDict()
+        self._bytes = 0
+        self._lock = threading.Lock()
+        self.buffered = 0
+        self.spilled = 0
+        self.rebuilt = 0
+        self.rebuild_mismatches = 0
+
+    def _path(self, result_id: str) -> str:
+        return os.path.join(self.directory, f"{result_id}.parquet")
+
+    def put(self, result_id: str, table):
+        spill = []
+        with self._lock:
+            previous = self._tables.pop(result_id, None)
+            if previous is not None:
+                self._bytes -= previous[0].nbytes
+            self._tables[result_id] = (table, self.clock())
+            self._bytes += table.nbytes
+            while self._bytes > self.max_bytes and len(self._tables) > 1:
+                spilled_id, (spilled_table, created) = self._tables.popitem(last=False)
+                self._bytes -= spilled_table.nbytes
+                if self.clock() - created < self.ttl:
+                    spill.append((spilled_id, spilled_table))
+        for spilled_id, spilled_table in spill:
+            self._spill(spilled_id, spilled_table)
+
+    def _spill(self, result_id: str, table):
+        import pyarrow.parquet as pq
+        try:
+            os.makedirs(self.directory, exist_ok=True)
+            pq.write_table(table, self._path(result_id) + ".tmp")
+            os.replace(self._path(result_id) + ".tmp", self._path(result_id))
+            with self._lock:
+                self.spilled += 1
+            self._sweep()
+        except OSError as e:
+            print(f"Could not spill result {result_id}: {e}")
+
+    def _sweep(self):
+        """Deletes spilled results older than the TTL."""
+        for name in os.listdir(self.directory):
+            path = os.path.join(self.directory, name)
+            try:
+                if self.clock() - os.path.getmtime(path) > self.ttl:
+                    os.remove(path)
+            except OSError:
+                pass
+
+    def get(self, result_id: str):
+        """The table of a result, from memory or its Parquet spill; None if this process does not have it."""
+        with self._lock:
+            entry = self._tables.get(result_id)
+            if entry is not None:
+                if self.clock() - entry[1] < self.ttl:
+                    self._tables.move_to_end(result_id)
+                    return entry[0]
+                del self._tables[result_id]
+                self._bytes -= entry[0].nbytes
+        path = self._path(result_id)
+        if os.path.exists(path) and self.clock() - os.path.getmtime(path) < self.ttl:
+            import pyarrow.parquet as pq
+            table = pq.read_table(path)
+            self.put(result_id, table)
+            return table
+        return None
+
+    def _fetch(self, project_id: str, query: str):
+        rows = self.client_factory(project_id).query_and_wait(query, project=project_id, max_results=RESULT_MAX_ROWS)
+        return rows_to_table([{k: _json_safe(v) for k, v in row.items()} for row in rows])
+
+    def _build(self, recipe: dict, state):
+        if "query" in recipe:
+            return self._fetch(recipe["project_id"], recipe["query"])
+        table = self.table(recipe["source"], state)
+        table = apply_filters(table, recipe.get("filters"))
+        if recipe.get("aggregations") is not None:
+            table = aggregate(table, recipe["aggregations"], recipe.get("group_by"))
+        return sort_table(table, recipe.get("order_by"), recipe.get("descending", False))
+
+    def table(self, result_id: str, state):
+        """The table of a result, rebuilt from the session state when this process does not hold it."""
+        table = self.get(result_id)
+        if table is not None:
+            return table
+        recipe = state.get(STATE_PREFIX + result_id) if state is not None else None
+        if recipe is None:
+            raise ResultQueryError(f"Unknown result_id '{result_id}'. Run the query again with execute_sql.")
+        table = self._build(recipe, state)
+        if "digest" in recipe and (table.num_rows, table_digest(table)) != (recipe["row_count"], recipe["digest"]):
+            with self._lock:
+                self.rebuild_mismatches += 1
+            raise ResultQueryError(
+                f"Result '{result_id}' is no longer available and its query now returns different data "
+                f"({table.num_rows} rows instead of {recipe['row_count']}, or changed values). "
+                "Run the query again with execute_sql and answer from the new result.")
+        self.put(result_id, table)
+        with self._lock:
+            self.rebuilt += 1
+        return table
+
+    def _store(self, recipe: dict, table, state) -> str:
+        result_id = _result_id(recipe)
+        # The same query run again may return newer data: never read back an older spill of it.
+        if os.path.exists(self._path(result_id)):
+            os.remove(self._path(result_id))
+        self.put(result_id, table)
+        if state is not None:
+            if "query" in recipe:
+                # A rebuild re-runs the query: only serve it if it still returns these rows.
+                recipe = {**recipe, "row_count": table.num_rows, "digest": table_digest(table)}
+            state[STATE_PREFIX + result_id] = recipe
+        with self._lock:
+            self.buffered += 1
+        return result_id
+
+    def respond(self, recipe: dict, table, state, extra: dict = None) -> dict:
+        """The whole table when it is small; otherwise a summary of the table, stored under a result id."""
+        response = {"status": "SUCCESS", **(extra or {})}
+        if table.num_rows <= RESULT_INLINE_MAX_ROWS:
+            rows = table_rows(table)
+            if len(json.dumps(rows, default=str)) <= RESULT_INLINE_MAX_BYTES:
+                return {**response, "rows": rows}
+        result_id = self._store(recipe, table, state)
+        return {
+            **response,
+            "result_id": result_id,
+            "row_count": table.num_rows,
+            "columns": column_stats(table),
+            "first_rows": table_rows(table.slice(0, RESULT_PREVIEW_ROWS)),
+            "note": (f"The result has {table.num_rows} rows; only the first {min(RESULT_PREVIEW_ROWS, table.num_rows)} "
+                     f"are shown. Do not run the query again: use get_result_rows, filter_result or aggregate_result "
+                     f"with result_id '{result_id}'."),
+        }
+
+    async def after_tool_callback(self, tool, args: dict, tool_context, tool_response):
+        """Replaces a large `execute_sql` result with its summary."""
+        if not self.enabled or tool.name != EXECUTE_SQL_TOOL or not isinstance(tool_response, dict):
+            return None
+        rows = tool_response.get("rows")
+        if tool_response.get("status") != "SUCCESS" or not isinstance(rows, list):
+            return None
+        if len(rows) <= RESULT_INLINE_MAX_ROWS and len(json.dumps(rows, default=str)) <= RESULT_INLINE_MAX_BYTES:
+            return None
+        table = await asyncio.to_thread(rows_to_table, rows)
+        recipe = {"project_id": args.get("project_id"), "query": args.get("query")}
+        extra = {k: v for k, v in tool_response.items() if k not in ("status", "rows")}
+        return await asyncio.to_thread(self.respond, recipe, table, tool_context.state, extra)
+
+    async def rows(self, result_id: str, offset: int, limit: int, columns: list, order_by: str, descending: bool,
+                   state) -> dict:
+        def run():
+            table = sort_table(self.table(result_id, state), order_by, descending)
+            if columns:
+                table = table.select([_column(table, c) for c in columns])
+            start = max(int(offset), 0)
+            page = table.slice(start, max(1, min(int(limit), RESULT_PAGE_MAX_ROWS)))
+            end = start + page.num_rows
+            return {"status": "SUCCESS", "result_id": result_id, "row_count": table.num_rows, "offset": start,
+                    "rows": table_rows(page), "next_offset": end if end < table.num_rows else None}
+        return await self._run(run)
+
+    async def filter(self, result_id: str, filters: list, order_by: str, descending: bool, state) -> dict:
+        def run():
+            recipe = {"source": result_id, "filters": list(filters or []), "order_by": order_by,
+                      "descending": descending}
+            table = self._build(recipe, state)
+            return self.respond(recipe, table, state, {"source_result_id": result_id})
+        return await self._run(run)
+
+    async def aggregate(self, result_id: str, aggregations: list, group_by: list, filters: list, order_by: str,
+                        descending: bool, state) -> dict:
+        def run():
+            recipe = {"source": result_id, "filters": list(filters or []), "aggregations": list(aggregations or []),
+                      "group_by": list(group_by or []), "order_by": order_by, "descending": descending}
+            table = self._build(recipe, state)
+            return self.respond(recipe, table, state, {"source_result_id": result_id})
+        return await self._run(run)
+
+    @staticmethod
+    async def _run(operation) -> dict:
+        try:
+            return await asyncio.to_thread(operation)
+        except ResultQueryError as e:
+            return {"status": "ERROR", "error_details": str(e)}
+        except Exception as e:
+            print(f"Result operation failed: {e}")
+            return {"status": "ERROR", "error_details": f"{type(e).__name__}: {e}"}
+
+    def stats(self) -> dict:
+        with self._lock:
+            return {
+                "tables_in_memory": len(self._tables),
+                "bytes_in_memory": self._bytes,
+                "buffered": self.buffered,
+                "spilled": self.spilled,
+                "rebuilt": self.rebuilt,
+                "rebuild_mismatches": self.rebuild_mismatches,
+            }
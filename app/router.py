@@ -0,0 +1,257 @@
+import collections
+import json
+import math
+import os
+import re
+import threading
+import time
+import unicodedata
+import zlib
+
+import cachetools
+import dotenv
+from google.adk.models import LlmResponse
+from google.genai import types
+
+dotenv.load_dotenv()
+
+ROUTER_ENABLED = os.getenv("ROUTER_ENABLED", "true").lower() == "true"
+ROUTER_EXAMPLES_FILE = os.path.join(os.path.dirname(os.path.abspath(__file__)), "routing_examples.jsonl")
+
+ROUTES = ["calidad_agent", "compras_agent", "pedidos_agent"]
+
+# ADK rewrites another agent's events as user-role messages starting with this prefix.
+FOR_CONTEXT_PREFIX = "For context:"
+
+# Minimum confidence for each route to skip the orchestrator model. Routes that are easy
+# to confuse with the others need a higher bar.
+ROUTE_THRESHOLDS = {
+    "calidad_agent": float(os.getenv("ROUTER_THRESHOLD_CALIDAD", "0.75")),
+    "compras_agent": float(os.getenv("ROUTER_THRESHOLD_COMPRAS", "0.8")),
+    "pedidos_agent": float(os.getenv("ROUTER_THRESHOLD_PEDIDOS", "0.8")),
+}
+
+# (pattern, weight) per route, matched against the normalized question.
+KEYWORD_RULES = {
+    "calidad_agent": [
+        (r"\balergen", 3), (r"\bgluten\b", 2), (r"\blactosa\b", 1), (r"\bcertificad", 2), (r"\banalisis\b", 2),
+        (r"\bficha (de )?seguridad\b", 3), (r"\bficha tecnica\b", 3), (r"\bseguridad\b", 1), (r"\bpictograma", 3),
+        (r"\b(gmo|ogm|transgenic|geneticamente)", 3), (r"\bcalidad\b", 3), (r"\bespecificacion", 2),
+        (r"\blote", 1), (r"\balmacenamiento\b", 2), (r"\btransporte\b", 1), (r"\briesgo", 2),
+        (r"\bfuera de especificacion\b", 3), (r"\blimite", 1),
+    ],
+    "compras_agent": [
+        (r"\bcompra", 3), (r"\bcomprad", 3), (r"\bproveedor", 2), (r"\borden(es)? de compra\b", 4),
+        (r"\bconfirmacion", 2), (r"\balbaran", 3), (r"\bpacking\b", 3), (r"\bhan llegado\b", 2),
+        (r"\brecibid", 2), (r"\brecepcion", 2), (r"\badquisicion", 3), (r"\bebeln\b", 3),
+    ],
+    "pedidos_agent": [
+        (r"\bpedido", 3), (r"\bclientes?\b", 3), (r"\bnos (han )?(pedido|encargado)", 3), (r"\bventa", 2),
+        (r"\borden(es)? de pedido\b", 4), (r"\blineas? de pedido\b", 3), (r"\bencargo", 2),
+    ],
+}
+
+
+def normalize(text: str) -> str:
+    text = unicodedata.normalize("NFKD", str(text).casefold())
+    return "".join(c for c in text if not unicodedata.combining(c))
+
+
+class KeywordClassifier:
+    """Weighted keyword rules. Confidence is the winning route's share of the matched weight."""
+
+    name = "keywords"
+
+    def __init__(self, rules: dict = None, min_weight: float = 2):
+        self.rules = {route: [(re.compile(p), w) for p, w in patterns]
+                      for route, patterns in (rules or KEYWORD_RULES).items()}
+        self.min_weight = min_weight
+
+    def classify(self, text: str) -> tuple:
+        text = normalize(text)
+        scores = {route: sum(w for pattern, w in patterns if pattern.search(text))
+                  for route, patterns in self.rules.items()}
+        route = max(scores, key=scores.get)
+        total = sum(scores.values())
+        if scores[route] < self.min_weight:
+            return route, 0.0
+        return route, scores[route] / total
+
+
+class CentroidClassifier:
+    """Small local embedding classifier: hashed character n-gram vectors, nearest route centroid.
+
+    Trained from labelled example questions; needs no model download or network access.
+    Confidence is a softmax over cosine similarities to each route centroid.
+    """
+
+    name = "centroid"
+
+    def __init__(self, dimensions: int = 2048, ngram: int = 4, temperature: float = 0.05,
+                 min_similarity: float = 0.25):
+        self.dimensions = dimensions
+        self.ngram = ngram
+        self.temperature = temperature
+        # Questions this far from every centroid are off-topic: no confidence at all.
+        self.min_similarity = min_similarity
+        self.centroids = {}
+
+    def embed(self, text: str) -> dict:
+        text = f" {re.sub(r'[^a-z0-9]+', ' ', normalize(text)).strip()} "
+        vector = collections.Counter(zlib.crc32(text[i:i + self.ngram].encode()) % self.dimensions
+                                     for i in range(len(text) - self.ngram + 1))
+        norm = math.sqrt(sum(v * v for v in vector.values())) or 1.0
+        return {k: v / norm for k, v in vector.items()}
+
+    def fit(self, examples: list) -> "CentroidClassifier":
+        sums = collections.defaultdict(collections.Counter)
+        for text, route in examples:
+            sums[route].update(self.embed(text))
+        for route, total in sums.items():
+            norm = math.sqrt(sum(v * v for v in total.values())) or 1.0
+            self.centroids[route] = {k: v / norm for k, v in total.items()}
+        return self
+
+    def classify(self, text: str) -> tuple:
+        if not self.centroids:
+            return None, 0.0
+        vector = self.embed(text)
+        similarities = {route: sum(v * centroid.get(k, 0.0) for k, v in vector.items())
+                        for route, centroid in self.centroids.items()}
+        best = max(similarities.values())
+        weights = {route: math.exp((s - best) / self.temperature) for route, s in similarities.items()}
+        route = max(weights, key=weights.get)
+        if best < self.min_similarity:
+            return route, 0.0
+        return route, weights[route] / sum(weights.values())
+
+
+def load_examples(path: str = ROUTER_EXAMPLES_FILE) -> list:
+    """Labelled (question, route) pairs, one JSON object per line."""
+    try:
+        with open(path, "r", encoding="utf-8") as f:
+            return [(e["question"], e["route"]) for e in map(json.loads, f) if e.get("question")]
+    except FileNotFoundError:
+        return []
+
+
+class Router:
+    """Routes a user question straight to a sub-agent when a classifier is confident enough.
+
+    Classifiers are tried in order and the first one whose confidence reaches the
+    route's threshold decides. Otherwise the question is left to the orchestrator model,
+    whose own transfer decision is then compared with the router's best guess to track
+    shadow accuracy.
+    """
+
+    def __init__(self, classifiers: list, thresholds: dict = None, default_threshold: float = 0.8,
+                 enabled: bool = True):
+        self.classifiers = classifiers
+        self.thresholds = thresholds or ROUTE_THRESHOLDS
+        self.default_threshold = default_threshold
+        self.enabled = enabled
+        self._lock = threading.Lock()
+        self._guesses = {}
+        # How each recent invocation reached its sub-agent: a classifier name or "orchestrator".
+        self._routed_by = cachetools.TTLCache(maxsize=1024, ttl=600)
+        self.direct = collections.Counter()
+        self.fallbacks = 0
+        self.shadow_agreements = 0
+        self.shadow_disagreements = 0
+        self.classify_seconds = 0.0
+        self.decisions = 0
+
+    def decide(self, text: str) -> dict:
+        """Returns {"route", "confidence", "classifier", "guess"}; route is None when unsure."""
+        start = time.perf_counter()
+        guess, guess_confidence = None, 0.0
+        decision = {"route": None, "confidence": 0.0, "classifier": None}
+        for classifier in self.classifiers:
+            route, confidence = classifier.classify(text)
+            if route is None:
+                continue
+            if confidence > guess_confidence:
+                guess, guess_confidence = route, confidence
+            if confidence >= self.thresholds.get(route, self.default_threshold):
+                decision = {"route": route, "confidence": confidence, "classifier": classifier.name}
+                break
+        decision["guess"] = guess
+        with self._lock:
+            self.classify_seconds += time.perf_counter() - start
+            self.decisions += 1
+        return decision
+
+    def before_model_callback(self, callback_context, llm_request):
+        """Answers the orchestrator's model call with a transfer when the route is clear.
+
+        Only the invocation's own user turn is classified, and only once: when a sub-agent
+        hands control back, ADK replays its events as a user-role "For context:" message,
+        which must reach the orchestrator model instead of bouncing back to that sub-agent.
+        """
+        if not self.enabled or not llm_request.contents:
+            return None
+        with self._lock:
+            if callback_context.invocation_id in self._routed_by:
+                return None
+        last = llm_request.contents[-1]
+        if last.role != "user" or not last.parts or any(p.function_response for p in last.parts):
+            return None
+        content = callback_context.user_content
+        if content is None or not content.parts:
+            return None
+        text = " ".join(p.text for p in content.parts if p.text)
+        if not text.strip() or text.lstrip().startswith(FOR_CONTEXT_PREFIX):
+            return None
+
+        decision = self.decide(text)
+        with self._lock:
+            if decision["route"] is None:
+                self.fallbacks += 1
+                self._guesses[callback_context.invocation_id] = decision["guess"]
+                self._routed_by[callback_context.invocation_id] = "orchestrator"
+                return None
+            self.direct[decision["route"]] += 1
+            self._routed_by[callback_context.invocation_id] = decision["classifier"]
+        return LlmResponse(content=types.Content(role="model", parts=[types.Part(
+            function_call=types.FunctionCall(name="transfer_to_agent", args={"agent_name": decision["route"]}),
+        )]))
+
+    def after_model_callback(self, callback_context, llm_response):
+        """Compares the orchestrator's transfer with what the router would have picked."""
+        with self._lock:
+            guess = self._guesses.pop(callback_context.invocation_id, None)
+        if guess is None or not llm_response.content or not llm_response.content.parts:
+            return None
+        for part in llm_response.content.parts:
+            if part.function_call and part.function_call.name == "transfer_to_agent":
+                with self._lock:
+                    if (part.function_call.args or {}).get("agent_name") == guess:
+                        self.shadow_agreements += 1
+                    else:
+                        self.shadow_disagreements += 1
+        return None
+
+    def routed_by(self, invocation_id: str):
+        """The classifier that routed an invocation, "orchestrator" if the model did, or None if unknown."""
+        with self._lock:
+            return self._routed_by.get(invocation_id)
+
+    def stats(self) -> dict:
+        with self._lock:
+            direct = sum(self.direct.values())
+            shadow = self.shadow_agreements + self.shadow_disagreements
+            return {
+                "direct": dict(self.direct),
+                "fallbacks": self.fallbacks,
+                "direct_rate": direct / (direct + self.fallbacks) if direct + self.fallbacks else 0.0,
+                "shadow_accuracy": self.shadow_agreements / shadow if shadow else None,
+                "mean_classify_us": 1e6 * self.classify_seconds / self.decisions if self.decisions else 0.0,
+            }
+
+
+def build_router(enabled: bool = ROUTER_ENABLED) -> Router:
+    classifiers = [KeywordClassifier()]
+    examples = load_examples()
+    if examples:
+        classifiers.append(CentroidClassifier().fit(examples))
+    return Router(classifiers, enabled=enabled)
@@ -0,0 +1,155 @@
+import datetime
+import hashlib
+import json
+import os
+from concurrent.futures import ThreadPoolExecutor
+
+CATALOG_PROJECT = 'ocr-digitalizacion-425708'
+CATALOG_DATASET = 'demo_agente_alifarma'
+CATALOG_FILE = os.path.join(os.path.dirname(os.path.abspath(__file__)), "schema_catalog.json")
+
+# Tables whose schema is rendered into each sub-agent's instruction.
+AGENT_TABLES = {
+    "calidad_agent": ["calidad_alergenos", "calidad_ficha_seguridad", "calidad_ficha_tecnica", "calidad_gmo"],
+    "compras_agent": ["compras_confirmacion_orden_compra", "compras_packing_list"],
+    "pedidos_agent": ["pedidos"],
+}
+
+# Rough characters-per-token ratio used for the savings report.
+CHARS_PER_TOKEN = 4
+
+
+def _column(field, prefix: str = "") -> list:
+    columns = [[f"{prefix}{field.name}", field.field_type, field.description or ""]]
+    for sub_field in field.fields or ():
+        columns.extend(_column(sub_field, prefix=f"{prefix}{field.name}."))
+    return columns
+
+
+def _snapshot_table(client, table_ref: str) -> dict:
+    table = client.get_table(table_ref)
+    columns = []
+    for field in table.schema:
+        columns.extend(_column(field))
+    return {
+        "description": table.description or "",
+        "columns": columns,
+        "modified": table.modified.isoformat() if table.modified else None,
+        # Size of what `get_table_info` would have returned to the model.
+        "metadata_chars": len(json.dumps(table.to_api_repr())),
+    }
+
+
+def fingerprint(tables: dict) -> str:
+    """Hash of the schema content only, so unrelated metadata changes do not bump the version."""
+    content = {name: [table["description"], table["columns"]] for name, table in sorted(tables.items())}
+    return hashlib.sha256(json.dumps(content, sort_keys=True).encode("utf-8")).hexdigest()
+
+
+def fetch_tables(client=None, project: str = CATALOG_PROJECT, dataset: str = CATALOG_DATASET) -> dict:
+    """Reads column names, types and descriptions of every agent table from BigQuery."""
+    if client is None:
+        from google.cloud import bigquery
+        client = bigquery.Client(project=project)
+    names = sorted({name for tables in AGENT_TABLES.values() for name in tables})
+    with ThreadPoolExecutor(max_workers=len(names)) as executor:
+        snapshots = executor.map(lambda name: _snapshot_table(client, f"{project}.{dataset}.{name}"), names)
+    return dict(zip(names, snapshots))
+
+
+def load_catalog(path: str = CATALOG_FILE):
+    try:
+        with open(path, "r", encoding="utf-8") as f:
+            return json.load(f)
+    except FileNotFoundError:
+        return None
+
+
+def save_catalog(catalog: dict, path: str = CATALOG_FILE):
+    tmp_path = f"{path}.tmp"
+    with open(tmp_path, "w", encoding="utf-8") as f:
+        json.dump(catalog, f, ensure_ascii=False, indent=1)
+    os.replace(tmp_path, path)
+
+
+def diff_tables(old: dict, new: dict) -> list:
+    """Human readable list of schema changes between two snapshots."""
+    changes = []
+    for name in sorted(set(old) | set(new)):
+        if name not in old:
+            changes.append(f"+ table {name}")
+        elif name not in new:
+            changes.append(f"- table {name}")
+        else:
+            old_columns = {c[0]: c[1:] for c in old[name]["columns"]}
+            new_columns = {c[0]: c[1:] for c in new[name]["columns"]}
+            for column in sorted(set(old_columns) | set(new_columns)):
+                if column not in old_columns:
+                    changes.append(f"+ {name}.{column}")
+                elif column not in new_columns:
+                    changes.append(f"- {name}.{column}")
+                elif old_columns[column] != new_columns[column]:
+                    changes.append(f"~ {name}.{column}")
+            if old[name]["description"] != new[name]["description"]:
+                changes.append(f"~ {name} (description)")
+    return changes
+
+
+def refresh_catalog(client=None, path: str = CATALOG_FILE, write: bool = True) -> tuple:
+    """Snapshots the schemas and writes a new catalog version if they changed.
+
+    Returns:
+        tuple: (catalog, changes). `changes` is empty when the stored catalog is up to date.
+    """
+    current = load_catalog(path)
+    tables = fetch_tables(client)
+    new_fingerprint = fingerprint(tables)
+    if current is not None and current.get("fingerprint") == new_fingerprint:
+        return current, []
+
+    changes = diff_tables(current["tables"] if current else {}, tables)
+    catalog = {
+        "version": (current or {}).get("version", 0) + 1,
+        "fingerprint": new_fingerprint,
+        "generated_at": datetime.datetime.now(datetime.timezone.utc).isoformat(),
+        "project": CATALOG_PROJECT,
+        "dataset": CATALOG_DATASET,
+        "tables": tables,
+    }
+    if write:
+        save_catalog(catalog, path)
+    return catalog, changes
+
+
+def render_table_fields(table_name: str, catalog: dict):
+    """Compact one-line-per-column rendering of a table schema, or None if it is not in the catalog."""
+    if not catalog or table_name not in catalog.get("tables", {}):
+        return None
+    lines = []
+    for name, field_type, description in catalog["tables"][table_name]["columns"]:
+        lines.append(f"{name} {field_type}" + (f": {description}" if description else ""))
+    return "\n".join(lines)
+
+
+def savings_report(catalog: dict, instructions: dict = None) -> dict:
+    """Estimates what the catalog saves on the first question of a conversation, per agent.
+
+    Without the catalog each table costs one `get_table_info` call whose full table
+    resource lands in the model context, plus at least one extra LLM turn to make those
+    calls. With it, only the rendered column list is added to the instruction.
+    """
+    report = {}
+    for agent_name, table_names in AGENT_TABLES.items():
+        tables = [catalog["tables"][t] for t in table_names if t in catalog.get("tables", {})]
+        metadata_tokens = sum(t["metadata_chars"] for t in tables) // CHARS_PER_TOKEN
+        rendered_tokens = sum(len(render_table_fields(t, catalog) or "") for t in table_names) // CHARS_PER_TOKEN
+        report[agent_name] = {
+            "tool_calls_saved": len(tables),
+            "llm_turns_saved": 1 if tables else 0,
+            "metadata_tokens_avoided": metadata_tokens,
+            "catalog_tokens_added": rendered_tokens,
+            "net_tokens_saved": metadata_tokens - rendered_tokens,
+        }
+        if instructions and agent_name in instructions:
+            report[agent_name]["instruction_tokens"] = len(instructions[agent_name]) // CHARS_PER_TOKEN
+    return report
@@ -0,0 +1,234 @@
+import asyncio
+import copy
+import hashlib
+import json
+import os
+import re
+import threading
+import time
+
+import cachetools
+import dotenv
+import sqlparse
+from sqlparse import tokens as T
+
+dotenv.load_dotenv()
+
+SQL_CACHE_ENABLED = os.getenv("SQL_CACHE_ENABLED", "true").lower() == "true"
+SQL_CACHE_TTL = float(os.getenv("SQL_CACHE_TTL", "3600"))
+SQL_CACHE_MAX_ENTRIES = int(os.getenv("SQL_CACHE_MAX_ENTRIES", "512"))
+# Results whose JSON form is larger than this are never cached (bytes).
+SQL_CACHE_MAX_ENTRY_BYTES = int(os.getenv("SQL_CACHE_MAX_ENTRY_BYTES", str(256 * 1024)))
+# How long a table's last-modified time is trusted before asking BigQuery again (seconds).
+SQL_CACHE_TABLE_CHECK_INTERVAL = float(os.getenv("SQL_CACHE_TABLE_CHECK_INTERVAL", "30"))
+
+EXECUTE_SQL_TOOL = "execute_sql"
+
+# Queries whose result depends on when or by whom they run.
+_NON_DETERMINISTIC = re.compile(
+    r"\b(CURRENT_DATE|CURRENT_DATETIME|CURRENT_TIME|CURRENT_TIMESTAMP|NOW|RAND|GENERATE_UUID|SESSION_USER)\b",
+    re.IGNORECASE,
+)
+_TABLE_REFERENCE = re.compile(
+    r"\b(?:FROM|JOIN)\s+(?:\(\s*)*(`[^`]+`|[A-Za-z_][\w-]*(?:\.[A-Za-z_][\w-]*){1,2})",
+    re.IGNORECASE,
+)
+# Keywords a parenthesis can follow without being a function call: FROM (subquery), IN (...), USING (...).
+_CLAUSE_KEYWORDS = {"FROM", "JOIN", "IN", "AS", "ON", "USING", "EXISTS", "WHERE", "AND", "OR", "NOT", "UNNEST"}
+
+
+def canonicalize_sql(sql: str) -> str:
+    """Whitespace, comment and case-normalized SQL. String and number literals are kept verbatim."""
+    parts = []
+    for token in sqlparse.parse(sql.strip().rstrip(";"))[0].flatten():
+        if token.ttype in T.Comment or token.ttype in T.Whitespace or token.ttype in T.Newline:
+            if parts and parts[-1] != " ":
+                parts.append(" ")
+            continue
+        value = token.value
+        if token.ttype in T.Keyword or token.ttype in T.Operator or token.ttype in T.Name.Builtin:
+            value = value.upper()
+        elif token.ttype in T.Name and not value.startswith("`"):
+            value = value.lower()
+        parts.append(value)
+    return "".join(parts).strip()
+
+
+def _is_insignificant(token) -> bool:
+    return token.is_whitespace or token.ttype in T.Comment
+
+
+def _table_clauses(sql: str) -> str:
+    """The SQL with literals, comments and the FROM inside function calls (EXTRACT(YEAR FROM d)) blanked out."""
+    tokens = [token for statement in sqlparse.parse(sql) for token in statement.flatten()]
+    parts = []
+    calls = []  # One entry per open parenthesis: True if it is a function call's.
+    previous = None
+    for i, token in enumerate(tokens):
+        if _is_insignificant(token):
+            parts.append(" ")
+            continue
+        if token.ttype in T.String:
+            parts.append("''")
+        elif token.match(T.Punctuation, "("):
+            following = next((t for t in tokens[i + 1:] if not _is_insignificant(t)), None)
+            subquery = following is not None and following.ttype in (T.DML, T.CTE)
+            call = not subquery and previous is not None and (
+                previous.ttype in T.Name
+                or (previous.ttype in T.Keyword and previous.normalized not in _CLAUSE_KEYWORDS))
+            calls.append(call)
+            parts.append(token.value)
+        elif token.match(T.Punctuation, ")"):
+            if calls:
+                calls.pop()
+            parts.append(token.value)
+        elif calls and calls[-1] and token.ttype in T.Keyword and token.normalized.split()[-1] in ("FROM", "JOIN"):
+            parts.append(" ")
+        else:
+            parts.append(token.value)
+        previous = token
+    return "".join(parts)
+
+
+def referenced_tables(sql: str, default_project: str) -> list:
+    """Fully qualified `project.dataset.table` names referenced in FROM / JOIN clauses."""
+    tables = set()
+    for match in _TABLE_REFERENCE.finditer(_table_clauses(sql)):
+        names = [part.strip("`") for part in match.group(1).strip("`").split(".")]
+        if len(names) == 2:
+            names = [default_project] + names
+        if len(names) == 3:
+            tables.add(".".join(names))
+    return sorted(tables)
+
+
+class SqlResultCache:
+    """LRU + TTL cache of `execute_sql` results, wired in as ADK tool callbacks.
+
+    The key is the canonical SQL plus the last-modified time of every referenced table,
+    so a load into any of them invalidates the entries that read it. Queries that are
+    non-deterministic, reference tables that cannot be resolved, fail, or produce a
+    result larger than `max_entry_bytes` are never cached.
+    """
+
+    def __init__(self, client_factory, ttl: float = SQL_CACHE_TTL, max_entries: int = SQL_CACHE_MAX_ENTRIES,
+                 max_entry_bytes: int = SQL_CACHE_MAX_ENTRY_BYTES,
+                 table_check_interval: float = SQL_CACHE_TABLE_CHECK_INTERVAL, enabled: bool = True, clock=time.time):
+        self.client_factory = client_factory
+        self.max_entry_bytes = max_entry_bytes
+        self.enabled = enabled
+        self._entries = cachetools.TTLCache(maxsize=max_entries, ttl=ttl, timer=clock)
+        self._modified = cachetools.TTLCache(maxsize=1024, ttl=table_check_interval, timer=clock)
+        # Keys of in-flight misses by function call id; bounded in case a tool call never completes.
+        self._pending = cachetools.TTLCache(maxsize=1024, ttl=600, timer=clock)
+        self._lock = threading.Lock()
+        self._tasks = set()
+        self.hits = 0
+        self.misses = 0
+        self.stores = 0
+        self.skipped = 0
+        self.bytes_billed_saved = 0
+
+    def _table_modified(self, table: str) -> str:
+        with self._lock:
+            if table in self._modified:
+                return self._modified[table]
+        modified = self.client_factory(table.split(".")[0]).get_table(table).modified
+        modified = modified.isoformat() if modified else ""
+        with self._lock:
+            self._modified[table] = modified
+        return modified
+
+    def make_key(self, project_id: str, query: str):
+        """Cache key of a query, or None if the query must not be cached."""
+        if _NON_DETERMINISTIC.search(query):
+            return None
+        tables = referenced_tables(query, project_id)
+        if not tables or any("INFORMATION_SCHEMA" in t.upper() for t in tables):
+            return None
+        versions = [[table, self._table_modified(table)] for table in tables]
+        raw = json.dumps([project_id, canonicalize_sql(query), versions])
+        return hashlib.sha256(raw.encode("utf-8")).hexdigest()
+
+    def _estimate_bytes(self, project_id: str, query: str) -> int:
+        from google.cloud import bigquery
+        job = self.client_factory(project_id).query(query, project=project_id,
+                                                    job_config=bigquery.QueryJobConfig(dry_run=True))
+        return job.total_bytes_processed or 0
+
+    async def before_tool_callback(self, tool, args: dict, tool_context):
+        """Serves `execute_sql` from the cache; returning None lets the query run."""
+        if not self.enabled or tool.name != EXECUTE_SQL_TOOL:
+            return None
+        project_id, query = args.get("project_id"), args.get("query")
+        if not project_id or not query:
+            return None
+        try:
+            key = await asyncio.to_thread(self.make_key, project_id, query)
+        except Exception as e:
+            print(f"SQL cache disabled for this query: {e}")
+            key = None
+        with self._lock:
+            if key is None:
+                self.skipped += 1
+                return None
+            entry = self._entries.get(key)
+            if entry is None:
+                self.misses += 1
+                self._pending[tool_context.function_call_id] = key
+                return None
+            self.hits += 1
+            self.bytes_billed_saved += entry["bytes_processed"]
+        return copy.deepcopy(entry["response"])
+
+    async def after_tool_callback(self, tool, args: dict, tool_context, tool_response):
+        """Stores successful `execute_sql` results of queries that missed the cache."""
+        if tool.name != EXECUTE_SQL_TOOL:
+            return None
+        with self._lock:
+            key = self._pending.pop(tool_context.function_call_id, None)
+        if key is None or not isinstance(tool_response, dict) or tool_response.get("status") != "SUCCESS":
+            return None
+        if len(json.dumps(tool_response, default=str)) > self.max_entry_bytes:
+            with self._lock:
+                self.skipped += 1
+            return None
+        entry = {"response": copy.deepcopy(tool_response), "bytes_processed": 0}
+        with self._lock:
+            self._entries[key] = entry
+            self.stores += 1
+        # The bytes a hit saves are only needed for reporting: estimate them off the response path.
+        task = asyncio.get_running_loop().create_task(
+            self._fill_bytes_processed(entry, args["project_id"], args["query"]))
+        self._tasks.add(task)
+        task.add_done_callback(self._tasks.discard)
+        return None
+
+    async def _fill_bytes_processed(self, entry: dict, project_id: str, query: str):
+        try:
+            entry["bytes_processed"] = await asyncio.to_thread(self._estimate_bytes, project_id, query)
+        except Exception as e:
+            print(f"Could not estimate bytes processed for a cached query: {e}")
+
+    def is_pending(self, function_call_id: str) -> bool:
+        """True while a call that missed the cache waits for its result to be stored."""
+        with self._lock:
+            return function_call_id in self._pending
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+            self._modified.clear()
+
+    def stats(self) -> dict:
+        with self._lock:
+            lookups = self.hits + self.misses
+            return {
+                "hits": self.hits,
+                "misses": self.misses,
+                "stores": self.stores,
+                "skipped": self.skipped,
+                "entries": len(self._entries),
+                "hit_rate": self.hits / lookups if lookups else 0.0,
+                "bytes_billed_saved": self.bytes_billed_saved,
+            }
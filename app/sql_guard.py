@@ -0,0 +1,281 @@
+import asyncio
+import json
+import os
+import re
+import threading
+import time
+import unicodedata
+
+import cachetools
+import dotenv
+import sqlparse
+from sqlparse import sql as S
+from sqlparse import tokens as T
+
+from .sql_cache import EXECUTE_SQL_TOOL, canonicalize_sql, referenced_tables
+
+dotenv.load_dotenv()
+
+SQL_GUARD_ENABLED = os.getenv("SQL_GUARD_ENABLED", "true").lower() == "true"
+# Queries estimated to scan more than this are rejected before they run (bytes).
+SQL_GUARD_MAX_BYTES_BILLED = int(os.getenv("SQL_GUARD_MAX_BYTES_BILLED", str(1024 ** 3)))
+# LIMIT appended to queries that have none.
+SQL_GUARD_DEFAULT_LIMIT = int(os.getenv("SQL_GUARD_DEFAULT_LIMIT", "100"))
+# Columns never selected when a `SELECT *` is pruned (comma separated, case-insensitive).
+SQL_GUARD_WIDE_COLUMNS = {c.strip().lower() for c in os.getenv("SQL_GUARD_WIDE_COLUMNS", "").split(",") if c.strip()}
+
+# Columns kept in every pruned `SELECT *`: product and order identifiers and the PDF path (rule `documento_pdf`).
+KEY_COLUMNS = {"ematn", "idnlf", "txz01", "ebeln", "storage_uri"}
+
+
+class SqlGuardError(Exception):
+    pass
+
+
+def _words(text: str) -> set:
+    text = unicodedata.normalize("NFKD", text.lower())
+    text = "".join(c for c in text if not unicodedata.combining(c))
+    return {w for w in re.findall(r"[a-z0-9_]+", text) if len(w) >= 4}
+
+
+def _json_value(value):
+    try:
+        json.dumps(value)
+    except (TypeError, ValueError):
+        return str(value)
+    return value
+
+
+def _parse_select(query: str) -> S.Statement:
+    statements = [s for s in sqlparse.parse(query) if s.token_first(skip_cm=True)]
+    if len(statements) != 1:
+        raise SqlGuardError("Only one SQL statement per call is allowed.")
+    return statements[0]
+
+
+def has_top_level_limit(statement: S.Statement) -> bool:
+    return any(t.ttype in T.Keyword and t.normalized == "LIMIT" for t in statement.tokens)
+
+
+def add_limit(query: str, limit: int) -> str:
+    return f"{query.strip().rstrip(';').rstrip()}\nLIMIT {limit}"
+
+
+def select_star_token(statement: S.Statement):
+    """The `*` of a top-level `SELECT * FROM <one table>`, or None."""
+    tokens = [t for t in statement.tokens if not t.is_whitespace]
+    if len(tokens) < 4 or tokens[0].normalized != "SELECT":
+        return None
+    if tokens[1].ttype is not T.Wildcard or tokens[2].normalized != "FROM":
+        return None
+    if any(t.ttype in T.Keyword and "JOIN" in t.normalized for t in statement.flatten()):
+        return None
+    # A subquery, with or without an alias, is not a catalog table.
+    if isinstance(tokens[3], S.Parenthesis) or (
+            isinstance(tokens[3], S.Identifier) and any(isinstance(t, S.Parenthesis) for t in tokens[3].tokens)):
+        return None
+    return tokens[1]
+
+
+def relevant_columns(columns: list, question: str) -> list:
+    """Catalog columns a question needs: identifiers plus the ones its words mention."""
+    question_words = _words(question)
+    selected = []
+    for name, _, description in columns:
+        if name.lower() in SQL_GUARD_WIDE_COLUMNS:
+            continue
+        if name.lower() in KEY_COLUMNS or _words(f"{name} {description}") & question_words:
+            selected.append(name)
+    if not [c for c in selected if c.lower() not in KEY_COLUMNS]:
+        # The question did not mention any column: keep everything but the wide ones.
+        selected = [name for name, _, _ in columns if name.lower() not in SQL_GUARD_WIDE_COLUMNS]
+    return selected
+
+
+class SqlGuard:
+    """Pre-execution stage for `execute_sql`, wired in as ADK tool callbacks.
+
+    Before a query runs it is parsed and, when needed, rewritten in place: a top-level
+    `SELECT *` over a single table becomes the catalog columns the user's question needs
+    and a `LIMIT` is appended when there is none. A dry run then estimates the bytes the
+    query scans and anything over `max_bytes_billed` is rejected; queries the
+    `local_engine` will answer without BigQuery skip the dry run. Only a dry run BigQuery
+    refuses (400 Bad Request) rejects the query: when it fails for any other reason the
+    query runs anyway, capped by the `maximum_bytes_billed` that `execute_sql` sets on the
+    real job. Rejections go back to the agent as the tool's error response;
+    rewrites are explained in a `sql_guard` entry added to the tool response.
+    """
+
+    def __init__(self, client_factory, catalog: dict = None, max_bytes_billed: int = SQL_GUARD_MAX_BYTES_BILLED,
+                 default_limit: int = SQL_GUARD_DEFAULT_LIMIT, enabled: bool = True, local_engine=None,
+                 clock=time.time):
+        self.client_factory = client_factory
+        self.catalog = catalog
+        self.local_engine = local_engine
+        self.max_bytes_billed = max_bytes_billed
+        self.default_limit = default_limit
+        self.enabled = enabled
+        self._dry_runs = cachetools.TTLCache(maxsize=512, ttl=300, timer=clock)
+        self._notes = cachetools.TTLCache(maxsize=1024, ttl=600, timer=clock)
+        self._estimates = cachetools.TTLCache(maxsize=1024, ttl=600, timer=clock)
+        self._lock = threading.Lock()
+        self.checked = 0
+        self.rejected = 0
+        self.limits_added = 0
+        self.stars_pruned = 0
+        self.bytes_rejected = 0
+        self.dry_run_failures = 0
+
+    def dry_run_bytes(self, project_id: str, query: str) -> int:
+        key = (project_id, canonicalize_sql(query))
+        with self._lock:
+            if key in self._dry_runs:
+                return self._dry_runs[key]
+        from google.cloud import bigquery
+        job = self.client_factory(project_id).query(
+            query, project=project_id, job_config=bigquery.QueryJobConfig(dry_run=True, use_query_cache=False))
+        total_bytes = job.total_bytes_processed or 0
+        with self._lock:
+            self._dry_runs[key] = total_bytes
+        return total_bytes
+
+    def _catalog_columns(self, project_id: str, query: str):
+        tables = referenced_tables(query, project_id)
+        if len(tables) != 1 or not self.catalog:
+            return None
+        project, dataset, table = tables[0].split(".")
+        if (project, dataset) != (self.catalog.get("project"), self.catalog.get("dataset")):
+            return None
+        entry = self.catalog.get("tables", {}).get(table)
+        return entry["columns"] if entry else None
+
+    def rewrite(self, project_id: str, query: str, question: str = "") -> tuple:
+        """Returns (query, notes) with `SELECT *` pruned and a LIMIT added where applicable."""
+        notes = []
+        statement = _parse_select(query)
+        if statement.get_type() != "SELECT":
+            return query, notes
+
+        star = select_star_token(statement)
+        columns = self._catalog_columns(project_id, query) if star is not None else None
+        if columns:
+            selected = relevant_columns(columns, question)
+            if len(selected) < len(columns):
+                star.value = ", ".join(selected)
+                query = str(statement)
+                statement = _parse_select(query)
+                notes.append(f"SELECT * was replaced by the columns relevant to the question: {', '.join(selected)}. "
+                             "Select other columns explicitly if you need them.")
+                with self._lock:
+                    self.stars_pruned += 1
+
+        if self.default_limit and not has_top_level_limit(statement):
+            query = add_limit(query, self.default_limit)
+            notes.append(f"LIMIT {self.default_limit} was added because the query had none. "
+                         "Use aggregations or an explicit LIMIT if you need more rows.")
+            with self._lock:
+                self.limits_added += 1
+        return query, notes
+
+    def check(self, project_id: str, query: str, question: str = "") -> tuple:
+        """Rewrites and budgets a query. Returns (query, notes, estimated_bytes); raises SqlGuardError to reject.
+
+        `estimated_bytes` is None when the dry run failed for a reason other than the query itself.
+        """
+        from google.api_core import exceptions
+        with self._lock:
+            self.checked += 1
+        query, notes = self.rewrite(project_id, query, question)
+        if self.local_engine is not None and self.local_engine.can_serve(project_id, query):
+            return query, notes, 0
+        try:
+            estimated_bytes = self.dry_run_bytes(project_id, query)
+        except exceptions.BadRequest as e:
+            raise SqlGuardError(f"The query is not valid: {e}")
+        except Exception as e:
+            # Timeouts, permissions or transient errors say nothing about the SQL: the job's own
+            # maximum_bytes_billed still enforces the budget.
+            print(f"SQL guard dry run failed, running the query with its bytes-billed cap: {e}")
+            with self._lock:
+                self.dry_run_failures += 1
+            return query, notes, None
+        if estimated_bytes > self.max_bytes_billed:
+            with self._lock:
+                self.rejected += 1
+                self.bytes_rejected += estimated_bytes
+            raise SqlGuardError(
+                f"The query would scan {estimated_bytes / 1024 ** 2:.1f} MB, above the budget of "
+                f"{self.max_bytes_billed / 1024 ** 2:.1f} MB per query. Select fewer columns or filter "
+                "on partitioned or clustered fields and try again.")
+        return query, notes, estimated_bytes
+
+    async def before_tool_callback(self, tool, args: dict, tool_context):
+        """Rewrites `args["query"]` in place, or short-circuits the call with an error response."""
+        if not self.enabled or tool.name != EXECUTE_SQL_TOOL or not args.get("query") or not args.get("project_id"):
+            return None
+        question = ""
+        if tool_context.user_content and tool_context.user_content.parts:
+            question = " ".join(p.text for p in tool_context.user_content.parts if p.text)
+        original_query = args["query"]
+        try:
+            query, notes, estimated_bytes = await asyncio.to_thread(self.check, args["project_id"], original_query, question)
+        except SqlGuardError as e:
+            return {"status": "ERROR", "error_details": f"Query rejected by the SQL guard: {e}"}
+        args["query"] = query
+        with self._lock:
+            self._estimates[tool_context.function_call_id] = estimated_bytes
+        if query != original_query:
+            with self._lock:
+                self._notes[tool_context.function_call_id] = {
+                    "rewritten_query": query,
+                    "notes": notes,
+                    **({"estimated_bytes_processed": estimated_bytes} if estimated_bytes is not None else {}),
+                }
+        return None
+
+    async def after_tool_callback(self, tool, args: dict, tool_context, tool_response):
+        """Tells the agent how its query was rewritten. Annotates the response in place."""
+        with self._lock:
+            notes = self._notes.pop(tool_context.function_call_id, None)
+        if notes is not None and isinstance(tool_response, dict):
+            tool_response["sql_guard"] = notes
+        return None
+
+    def pop_estimate(self, function_call_id: str):
+        """The bytes the dry run estimated for a call that passed the guard, or None."""
+        with self._lock:
+            return self._estimates.pop(function_call_id, None)
+
+    def execute_sql(self, project_id: str, query: str, max_rows: int = 50) -> dict:
+        """Runs a read-only query with the job capped at `max_bytes_billed` bytes billed.
+
+        Answers like ADK's `execute_sql` tool, which it replaces: that tool takes no job
+        config, so the query runs on the guard's own client with one set on every job.
+        """
+        from google.cloud import bigquery
+        try:
+            bq_client = self.client_factory(project_id)
+            dry_run = bq_client.query(query, project=project_id, job_config=bigquery.QueryJobConfig(dry_run=True))
+            if dry_run.statement_type != "SELECT":
+                return {"status": "ERROR", "error_details": "Read-only mode only supports SELECT statements."}
+            row_iterator = bq_client.query_and_wait(
+                query, project=project_id, max_results=max_rows,
+                job_config=bigquery.QueryJobConfig(maximum_bytes_billed=self.max_bytes_billed))
+            rows = [{key: _json_value(value) for key, value in row.items()} for row in row_iterator]
+        except Exception as e:
+            return {"status": "ERROR", "error_details": str(e)}
+        result = {"status": "SUCCESS", "rows": rows}
+        if max_rows is not None and len(rows) == max_rows:
+            result["result_is_likely_truncated"] = True
+        return result
+
+    def stats(self) -> dict:
+        with self._lock:
+            return {
+                "checked": self.checked,
+                "rejected": self.rejected,
+                "limits_added": self.limits_added,
+                "stars_pruned": self.stars_pruned,
+                "bytes_rejected": self.bytes_rejected,
+                "dry_run_failures": self.dry_run_failures,
+            }
@@ -0,0 +1,234 @@
+import base64
+import json
+import os
+import threading
+import time
+
+import cachetools
+import dotenv
+from opentelemetry import metrics, trace
+
+dotenv.load_dotenv()
+
+# When set, spans and metrics are also written to this file as OTLP/JSON, one export per line.
+TELEMETRY_FILE = os.getenv("TELEMETRY_FILE", "")
+TELEMETRY_METRICS_INTERVAL = float(os.getenv("TELEMETRY_METRICS_INTERVAL", "10"))
+
+tracer = trace.get_tracer("alifarma.agent")
+meter = metrics.get_meter("alifarma.agent")
+
+tool_duration = meter.create_histogram("agent.tool.duration", unit="s", description="Tool call duration")
+tool_calls = meter.create_counter("agent.tool.calls", description="Tool calls by tool, status and cache outcome")
+model_tokens = meter.create_counter("agent.model.tokens", description="Model tokens by agent and kind")
+agent_duration = meter.create_histogram("agent.run.duration", unit="s", description="Sub-agent run duration")
+model_queue_wait = meter.create_histogram("agent.model.queue_wait", unit="s",
+                                          description="Time a model request waited for the client-side rate limiter")
+model_throttled = meter.create_counter("agent.model.throttled",
+                                       description="Model requests rejected by the server (429, 5xx) and retried or failed")
+model_hedges = meter.create_counter("agent.model.hedges", description="Hedged duplicate model requests by winner")
+
+
+class _OpenSpans:
+    """Spans started in a before callback and ended in the matching after callback.
+
+    Each entry also accumulates attributes until the span ends. Bounded, so a call that
+    never completes (the tool raised) cannot leak memory.
+    """
+
+    def __init__(self):
+        self._entries = cachetools.TTLCache(maxsize=1024, ttl=600)
+        self._lock = threading.Lock()
+
+    def start(self, key, span):
+        with self._lock:
+            self._entries[key] = {"span": span, "started": time.perf_counter(), "attributes": {}}
+
+    def get(self, key):
+        with self._lock:
+            return self._entries.get(key)
+
+    def pop(self, key):
+        with self._lock:
+            return self._entries.pop(key, None)
+
+
+_tool_spans = _OpenSpans()
+_agent_spans = _OpenSpans()
+
+
+def _end(entry: dict, attributes: dict = None) -> float:
+    attributes = {**entry["attributes"], **(attributes or {})}
+    entry["span"].set_attributes({k: v for k, v in attributes.items() if v is not None})
+    entry["span"].end()
+    return time.perf_counter() - entry["started"]
+
+
+def usage_attributes(usage_metadata) -> dict:
+    if usage_metadata is None:
+        return {}
+    return {
+        "gen_ai.usage.input_tokens": usage_metadata.prompt_token_count,
+        "gen_ai.usage.output_tokens": usage_metadata.candidates_token_count,
+        "gen_ai.usage.cached_tokens": usage_metadata.cached_content_token_count,
+        "gen_ai.usage.thoughts_tokens": usage_metadata.thoughts_token_count,
+    }
+
+
+def start_tool_span(tool, args: dict, tool_context):
+    attributes = {
+        "tool.name": tool.name,
+        "agent.name": tool_context.agent_name,
+        "invocation.id": tool_context.invocation_id,
+    }
+    if args.get("query"):
+        attributes["db.statement"] = str(args["query"])[:4000]
+    if args.get("gcs_file_path"):
+        attributes["gcs.uri"] = args["gcs_file_path"]
+    if args.get("gcs_file_paths"):
+        attributes["gcs.documents"] = len(args["gcs_file_paths"])
+    _tool_spans.start(tool_context.function_call_id, tracer.start_span(f"tool {tool.name}", attributes=attributes))
+
+
+def annotate_tool_span(tool_context, **attributes):
+    """Adds attributes to the open span of a tool call (e.g. which stage answered it)."""
+    entry = _tool_spans.get(tool_context.function_call_id)
+    if entry is not None:
+        entry["attributes"].update(attributes)
+
+
+def end_tool_span(tool, tool_context, tool_response, **attributes):
+    entry = _tool_spans.pop(tool_context.function_call_id)
+    if entry is None:
+        return
+    status = "OK"
+    error = None
+    if isinstance(tool_response, dict):
+        status = tool_response.get("status", status)
+        if isinstance(tool_response.get("row_count"), int):
+            attributes["db.rows"] = tool_response["row_count"]
+        elif isinstance(tool_response.get("rows"), list):
+            attributes["db.rows"] = len(tool_response["rows"])
+        error = tool_response.get("error_details")
+    elif isinstance(tool_response, str) and tool_response.startswith("Error:"):
+        status, error = "ERROR", tool_response
+    if error:
+        entry["span"].set_status(trace.Status(trace.StatusCode.ERROR, str(error)[:500]))
+    attributes["tool.status"] = status
+    duration = _end(entry, attributes)
+    cache_outcome = entry["attributes"].get("cache.outcome") or attributes.get("cache.outcome") or "none"
+    tool_duration.record(duration, {"tool.name": tool.name})
+    tool_calls.add(1, {"tool.name": tool.name, "tool.status": str(status), "cache.outcome": cache_outcome})
+
+
+def start_agent_span(callback_context, routed_by: str = None):
+    attributes = {
+        "agent.name": callback_context.agent_name,
+        "invocation.id": callback_context.invocation_id,
+    }
+    if routed_by:
+        attributes["agent.routed_by"] = routed_by
+    span = tracer.start_span(f"agent {callback_context.agent_name}", attributes=attributes)
+    _agent_spans.start((callback_context.invocation_id, callback_context.agent_name), span)
+
+
+def end_agent_span(callback_context):
+    entry = _agent_spans.pop((callback_context.invocation_id, callback_context.agent_name))
+    if entry is not None:
+        agent_duration.record(_end(entry), {"agent.name": callback_context.agent_name})
+
+
+def record_model_usage(callback_context, model: str, llm_response):
+    """Adds the token counts of a model response to the agent span and the token counter."""
+    usage = {k: v for k, v in usage_attributes(llm_response.usage_metadata).items() if v}
+    entry = _agent_spans.get((callback_context.invocation_id, callback_context.agent_name))
+    if entry is not None:
+        entry["attributes"]["gen_ai.request.model"] = model
+        entry["attributes"]["gen_ai.calls"] = entry["attributes"].get("gen_ai.calls", 0) + 1
+        for key, value in usage.items():
+            entry["attributes"][key] = entry["attributes"].get(key, 0) + value
+    for key, value in usage.items():
+        model_tokens.add(value, {"agent.name": callback_context.agent_name, "gen_ai.request.model": model,
+                                 "token.kind": key.rsplit(".", 1)[-1]})
+
+
+_configured = False
+_configure_lock = threading.Lock()
+
+
+def configure_file_exporter(path: str = TELEMETRY_FILE, metrics_interval: float = TELEMETRY_METRICS_INTERVAL) -> bool:
+    """Installs tracer and meter providers that write OTLP/JSON lines to `path`.
+
+    Does nothing when `path` is empty or a provider was already configured here. When
+    the agent runs on Agent Engine with tracing enabled, spans still go to Cloud Trace.
+    """
+    global _configured
+    if not path:
+        return False
+    with _configure_lock:
+        if _configured:
+            return True
+        from opentelemetry.sdk.metrics import MeterProvider
+        from opentelemetry.sdk.metrics.export import PeriodicExportingMetricReader
+        from opentelemetry.sdk.resources import Resource
+        from opentelemetry.sdk.trace import TracerProvider
+        from opentelemetry.sdk.trace.export import BatchSpanProcessor
+
+        from .telemetry_export import OtlpJsonFileMetricExporter, OtlpJsonFileSpanExporter
+
+        resource = Resource.create({"service.name": "alifarma-agent"})
+        tracer_provider = trace.get_tracer_provider()
+        if not hasattr(tracer_provider, "add_span_processor"):
+            tracer_provider = TracerProvider(resource=resource)
+            trace.set_tracer_provider(tracer_provider)
+        tracer_provider.add_span_processor(BatchSpanProcessor(OtlpJsonFileSpanExporter(path)))
+        reader = PeriodicExportingMetricReader(OtlpJsonFileMetricExporter(path),
+                                               export_interval_millis=metrics_interval * 1000)
+        metrics.set_meter_provider(MeterProvider(resource=resource, metric_readers=[reader]))
+        _configured = True
+        return True
+
+
+def force_flush():
+    """Exports pending spans and metrics now (e.g. before a short script exits)."""
+    for provider in (trace.get_tracer_provider(), metrics.get_meter_provider()):
+        if hasattr(provider, "force_flush"):
+            provider.force_flush()
+
+
+def load_spans(path: str) -> list:
+    """Flattens the spans of an OTLP/JSON lines file into dicts with name, ids, times and attributes."""
+    spans = []
+    with open(path, "r", encoding="utf-8") as f:
+        for line in f:
+            line = line.strip()
+            if not line:
+                continue
+            export = json.loads(line)
+            for resource_spans in export.get("resourceSpans", []):
+                for scope_spans in resource_spans.get("scopeSpans", []):
+                    for span in scope_spans.get("spans", []):
+                        spans.append({
+                            "name": span["name"],
+                            "trace_id": _hex_id(span.get("traceId")),
+                            "span_id": _hex_id(span.get("spanId")),
+                            "parent_span_id": _hex_id(span.get("parentSpanId")),
+                            "start": int(span.get("startTimeUnixNano", 0)) / 1e9,
+                            "end": int(span.get("endTimeUnixNano", 0)) / 1e9,
+                            "attributes": {a["key"]: _attribute_value(a.get("value", {}))
+                                           for a in span.get("attributes", [])},
+                        })
+    return spans
+
+
+def _hex_id(value: str):
+    # OTLP/JSON as produced by protobuf's json_format carries ids as base64 bytes.
+    return base64.b64decode(value).hex() if value else None
+
+
+def _attribute_value(value: dict):
+    for key in ("stringValue", "boolValue", "doubleValue"):
+        if key in value:
+            return value[key]
+    if "intValue" in value:
+        return int(value["intValue"])
+    return None
@@ -0,0 +1,57 @@
+import json
+import threading
+
+from google.protobuf import json_format
+from opentelemetry.exporter.otlp.proto.common.metrics_encoder import encode_metrics
+from opentelemetry.exporter.otlp.proto.common.trace_encoder import encode_spans
+from opentelemetry.sdk.metrics.export import AggregationTemporality, MetricExporter, MetricExportResult
+from opentelemetry.sdk.trace.export import SpanExporter, SpanExportResult
+
+# One lock per process: spans and metrics share the file and each export must stay on one line.
+_file_lock = threading.Lock()
+
+
+def _append(path: str, message) -> bool:
+    line = json.dumps(json_format.MessageToDict(message), separators=(",", ":"))
+    try:
+        with _file_lock, open(path, "a", encoding="utf-8") as f:
+            f.write(line + "\n")
+        return True
+    except OSError as e:
+        print(f"Could not write telemetry to {path}: {e}")
+        return False
+
+
+class OtlpJsonFileSpanExporter(SpanExporter):
+    """Appends each batch of spans to a file as one OTLP/JSON ExportTraceServiceRequest per line."""
+
+    def __init__(self, path: str):
+        self.path = path
+
+    def export(self, spans) -> SpanExportResult:
+        ok = _append(self.path, encode_spans(spans))
+        return SpanExportResult.SUCCESS if ok else SpanExportResult.FAILURE
+
+    def shutdown(self):
+        pass
+
+    def force_flush(self, timeout_millis: int = 30000) -> bool:
+        return True
+
+
+class OtlpJsonFileMetricExporter(MetricExporter):
+    """Appends each metrics collection to a file as one OTLP/JSON ExportMetricsServiceRequest per line."""
+
+    def __init__(self, path: str):
+        super().__init__(preferred_temporality={}, preferred_aggregation={})
+        self.path = path
+
+    def export(self, metrics_data, timeout_millis: float = 10_000, **kwargs) -> MetricExportResult:
+        ok = _append(self.path, encode_metrics(metrics_data))
+        return MetricExportResult.SUCCESS if ok else MetricExportResult.FAILURE
+
+    def force_flush(self, timeout_millis: float = 10_000) -> bool:
+        return True
+
+    def shutdown(self, timeout_millis: float = 30_000, **kwargs):
+        pass
@@ -0,0 +1,443 @@
+"""Offline benchmark of the agents over a golden question set per domain.
+
+Every question of `agent_bench_questions.jsonl` runs in process through `root_agent`
+(entry "root", routing included) and directly through its sub-agent (entry "sub"), in a
+new session, against:
+
+- a scripted model: a stub behind the agents' Gemini models that plays the question's
+  script (the tools to call and their arguments, step by step), then answers from the
+  tool responses with the question's `answer` template. It counts the input and output
+  tokens of every request like the rate limiter estimates them, tool declarations included;
+- a local SQL engine: the fixture tables of `agent_bench_fixtures.py` in SQLite, serving
+  the real BigQuery toolset, the SQL guard, the SQL cache, the result store and the
+  product resolver (and the local mirror, when LOCAL_MIRROR_ENABLED is set).
+
+Nothing reaches Google Cloud. Per question and entry it records the tool calls, the model
+turns, the input and output tokens, whether the answer contains the expected text, and
+the wall-clock time per stage as the median of `--repeat` runs:
+
+- routing: the orchestrator's part of the run (router or model call, and the transfer);
+- model: time in the model client (the stub and the rate limiter);
+- tools: tool calls, including the guard, cache and result store callbacks;
+- sql: time in the SQL engine, dry runs included;
+- framework: the rest of the run (ADK, sessions, request building).
+
+The report is compared with the stored baseline: a wrong answer, a model turn or tool
+call more, tokens or stage times above the tolerances (per question and summed over the
+set) are regressions, and the script exits with status 1. Timings are only comparable
+with a baseline recorded on the same machine.
+
+Usage:
+    python benchmarks/agent_bench.py [--domains pedidos compras] [--repeat 5]
+    python benchmarks/agent_bench.py --update-baseline
+"""
+import argparse
+import asyncio
+import json
+import logging
+import os
+import re
+import statistics
+import sys
+import tempfile
+import time
+from types import SimpleNamespace
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from google.genai import types
+from opentelemetry import trace
+from opentelemetry.sdk.trace import TracerProvider
+from opentelemetry.sdk.trace.export import SimpleSpanProcessor
+from opentelemetry.sdk.trace.export.in_memory_span_exporter import InMemorySpanExporter
+
+from agent_bench_fixtures import DATASET, PROJECT, FixtureBigQueryClient
+from app.rate_limit import LimitedModels, estimate_tokens
+from app.schema_catalog import CHARS_PER_TOKEN, fetch_tables, fingerprint
+
+BENCH_DIR = os.path.dirname(os.path.abspath(__file__))
+DEFAULT_QUESTIONS_FILE = os.path.join(BENCH_DIR, "agent_bench_questions.jsonl")
+DEFAULT_BASELINE_FILE = os.path.join(BENCH_DIR, "agent_bench_baseline.json")
+APP_NAME = "agent_bench"
+ENTRIES = ["root", "sub"]
+STAGES = ["total", "routing", "model", "tools", "sql", "framework"]
+COUNT_METRICS = ["llm_turns", "tool_calls"]
+TOKEN_METRICS = ["input_tokens", "output_tokens"]
+TRANSFER_TOOL = "transfer_to_agent"
+
+_PLACEHOLDER = re.compile(r"\{((?:last|\d+)(?:\.[^{}.\s]+)*)\}")
+
+
+def load_questions(path: str = DEFAULT_QUESTIONS_FILE, domains: list = None) -> list:
+    with open(path, "r", encoding="utf-8") as f:
+        questions = [json.loads(line) for line in f if line.strip()]
+    return [q for q in questions if not domains or q["domain"] in domains]
+
+
+def lookup(path: str, responses: list):
+    """Value at `path` ("last" or a response index, then keys and list indexes) of the tool responses."""
+    keys = path.split(".")
+    value = responses[-1 if keys[0] == "last" else int(keys[0])]
+    for key in keys[1:]:
+        value = value[int(key)] if isinstance(value, list) else value[key]
+    return value
+
+
+def _text(value) -> str:
+    if isinstance(value, float):
+        return str(int(value)) if value.is_integer() else str(round(value, 2))
+    return str(value)
+
+
+def fill(value, responses: list):
+    """Replaces "{path}" placeholders; a string that is only a placeholder takes the value's type."""
+    if isinstance(value, str):
+        whole = _PLACEHOLDER.fullmatch(value)
+        if whole:
+            return lookup(whole.group(1), responses)
+        return _PLACEHOLDER.sub(lambda m: _text(lookup(m.group(1), responses)), value)
+    if isinstance(value, list):
+        return [fill(v, responses) for v in value]
+    if isinstance(value, dict):
+        return {k: fill(v, responses) for k, v in value.items()}
+    return value
+
+
+def declaration_tokens(config) -> int:
+    chars = sum(len(tool.model_dump_json(exclude_none=True)) for tool in (getattr(config, "tools", None) or []))
+    return -(-chars // CHARS_PER_TOKEN)
+
+
+class ScriptedModels:
+    """`client.aio.models` stand-in that plays the golden scripts.
+
+    The orchestrator transfers to the question's sub-agent. A sub-agent calls the tools of
+    the next step of its script (several calls in one step run in parallel) and, once every
+    step ran, answers with the `answer` template filled from the tool responses.
+    """
+
+    def __init__(self, questions: list, orchestrator: str, latency: float = 0.0):
+        self.scripts = {q["question"]: q for q in questions}
+        self.orchestrator = orchestrator
+        self.latency = latency
+        self.calls = []
+
+    def _progress(self, contents: list) -> tuple:
+        """(script, steps already run, tool responses so far) of the conversation in `contents`."""
+        start, script = None, None
+        for index, content in enumerate(contents):
+            text = " ".join(p.text for p in content.parts or [] if p.text).strip()
+            if content.role == "user" and text in self.scripts:
+                start, script = index, self.scripts[text]
+        if script is None:
+            raise ValueError("The conversation does not contain a golden question.")
+        steps, responses = 0, []
+        for content in contents[start + 1:]:
+            calls = [p.function_call for p in content.parts or [] if p.function_call]
+            if content.role == "model" and any(c.name != TRANSFER_TOOL for c in calls):
+                steps += 1
+            responses.extend(p.function_response.response for p in content.parts or []
+                             if p.function_response and p.function_response.name != TRANSFER_TOOL)
+        return script, steps, responses
+
+    def _next_parts(self, agent_name: str, contents: list) -> list:
+        script, steps, responses = self._progress(contents)
+        if agent_name == self.orchestrator:
+            return [types.Part(function_call=types.FunctionCall(name=TRANSFER_TOOL, args={"agent_name": script["agent"]}))]
+        try:
+            if steps < len(script["steps"]):
+                step = script["steps"][steps]
+                return [types.Part(function_call=types.FunctionCall(name=call["tool"], args=fill(call["args"], responses)))
+                        for call in (step if isinstance(step, list) else [step])]
+            return [types.Part(text=fill(script["answer"], responses))]
+        except (LookupError, TypeError, ValueError) as e:
+            last = json.dumps(responses[-1] if responses else None, default=str, ensure_ascii=False)[:300]
+            return [types.Part(text=f"No he podido responder ({type(e).__name__}: {e}). Última respuesta: {last}")]
+
+    async def generate_content(self, model, contents, config=None):
+        agent_name = ((config.labels if config else None) or {}).get("adk_agent_name", "")
+        parts = self._next_parts(agent_name, contents)
+        if self.latency:
+            await asyncio.sleep(self.latency)
+        input_tokens = estimate_tokens(contents, config) + declaration_tokens(config)
+        output_tokens = estimate_tokens([types.Content(role="model", parts=parts)])
+        self.calls.append({"agent": agent_name, "input_tokens": input_tokens, "output_tokens": output_tokens})
+        return types.GenerateContentResponse(
+            candidates=[types.Candidate(content=types.Content(role="model", parts=parts),
+                                        finish_reason=types.FinishReason.STOP)],
+            usage_metadata=types.GenerateContentResponseUsageMetadata(
+                prompt_token_count=input_tokens, candidates_token_count=output_tokens,
+                total_token_count=input_tokens + output_tokens))
+
+
+class TimedModels:
+    """Measures the time of the model requests of every agent, rate limiter included."""
+
+    def __init__(self, models):
+        self.models = models
+        self.seconds = {}
+
+    async def generate_content(self, **kwargs):
+        agent_name = ((kwargs["config"].labels if kwargs.get("config") else None) or {}).get("adk_agent_name", "")
+        start = time.perf_counter()
+        try:
+            return await self.models.generate_content(**kwargs)
+        finally:
+            self.seconds[agent_name] = self.seconds.get(agent_name, 0.0) + time.perf_counter() - start
+
+
+def install_span_exporter() -> InMemorySpanExporter:
+    exporter = InMemorySpanExporter()
+    provider = trace.get_tracer_provider()
+    if not hasattr(provider, "add_span_processor"):
+        provider = TracerProvider()
+        trace.set_tracer_provider(provider)
+    provider.add_span_processor(SimpleSpanProcessor(exporter))
+    return exporter
+
+
+def wire_offline(agent, questions: list, latency: float) -> SimpleNamespace:
+    """Points the agent module at the fixture engine and the scripted model."""
+    from google.adk.tools.bigquery import BigQueryCredentialsConfig, BigQueryToolset
+    from google.adk.tools.bigquery import client as bigquery_tool_client
+    from google.adk.tools.bigquery.config import BigQueryToolConfig
+    from google.auth.credentials import AnonymousCredentials
+
+    from app import rate_limit
+    from app.result_store import RESULT_BUFFER_ENABLED, RESULT_MAX_ROWS
+
+    engine = FixtureBigQueryClient()
+    bigquery_tool_client.get_bigquery_client = lambda **kwargs: engine
+    agent.bigquery_toolset._toolset = BigQueryToolset(
+        credentials_config=BigQueryCredentialsConfig(credentials=AnonymousCredentials()),
+        bigquery_tool_config=BigQueryToolConfig(max_query_result_rows=RESULT_MAX_ROWS) if RESULT_BUFFER_ENABLED else None)
+    for stage in (agent.sql_guard, agent.sql_cache, agent.result_store, agent.product_resolver, agent.local_mirror):
+        stage.client_factory = lambda project: engine
+    if agent.local_mirror.enabled:
+        # Snapshots of the fixture tables never mix with those of a real mirror.
+        agent.local_mirror.directory = tempfile.mkdtemp(prefix="agent_bench_mirror_")
+        agent.local_mirror.sync()
+
+    # The sub-agent instructions and the guard use the fixture schemas, whatever catalog is on disk.
+    tables = fetch_tables(engine, PROJECT, DATASET)
+    agent.apply_schema_catalog({"version": 1, "fingerprint": fingerprint(tables), "project": PROJECT,
+                                "dataset": DATASET, "tables": tables})
+
+    # Requests follow one another with no real quota behind them: the limiter would only add waits.
+    rate_limit.gemini_limiter.enabled = False
+    scripted = ScriptedModels(questions, agent.root_agent.name, latency)
+    timed = TimedModels(LimitedModels(scripted, rate_limit.gemini_limiter, "agents"))
+    for model in agent.gemini_models.values():
+        model.__dict__["api_client"] = SimpleNamespace(vertexai=True, aio=SimpleNamespace(models=timed))
+    return SimpleNamespace(engine=engine, scripted=scripted, timed=timed)
+
+
+async def run_question(agent, runners: dict, wiring, spans: InMemorySpanExporter, question: dict, entry: str) -> dict:
+    """Runs one question in a new session and measures it."""
+    runner = runners["root" if entry == "root" else question["agent"]]
+    session = await runner.session_service.create_session(app_name=APP_NAME, user_id="bench")
+    agent.sql_cache.clear()
+    spans.clear()
+    wiring.scripted.calls.clear()
+    wiring.timed.seconds.clear()
+    sql_start = wiring.engine.sql_seconds
+
+    tools, answer, answered_by, invocation_id = {}, "", None, None
+    start = time.perf_counter()
+    async for event in runner.run_async(user_id="bench", session_id=session.id, new_message=types.Content(
+            role="user", parts=[types.Part(text=question["question"])])):
+        invocation_id = event.invocation_id
+        for call in event.get_function_calls():
+            if call.name != TRANSFER_TOOL:
+                tools[call.name] = tools.get(call.name, 0) + 1
+        if event.is_final_response() and event.content and event.content.parts:
+            answer = "".join(p.text or "" for p in event.content.parts)
+            answered_by = event.author
+    total = time.perf_counter() - start
+
+    durations = {}
+    for span in spans.get_finished_spans():
+        durations.setdefault(span.name, []).append((span.end_time - span.start_time) / 1e9)
+    tool_seconds = sum(sum(values) for name, values in durations.items()
+                       if name.startswith("execute_tool ") and name != f"execute_tool {TRANSFER_TOOL}"
+                       and name != "execute_tool (merged)")
+    # The orchestrator's run minus the sub-agent's: its model call or the router, and the transfer.
+    routing = 0.0
+    if entry == "root":
+        routing = max(sum(durations.get(f"agent_run [{agent.root_agent.name}]", [])) - sum(
+            sum(durations.get(f"agent_run [{name}]", [])) for name in runners if name != "root"), 0.0)
+    model = sum(seconds for name, seconds in wiring.timed.seconds.items() if name != agent.root_agent.name)
+    calls = wiring.scripted.calls
+    return {
+        "agent": answered_by,
+        "routed_by": agent.router.routed_by(invocation_id) if entry == "root" else None,
+        "correct": answered_by == question["agent"] and all(text in answer for text in question["expect"]),
+        "answer": answer[:300],
+        "llm_turns": len(calls),
+        "tool_calls": sum(tools.values()),
+        "tools": tools,
+        "input_tokens": sum(c["input_tokens"] for c in calls),
+        "output_tokens": sum(c["output_tokens"] for c in calls),
+        "seconds": {
+            "total": total,
+            "routing": routing,
+            "model": model,
+            "tools": tool_seconds,
+            "sql": wiring.engine.sql_seconds - sql_start,
+            "framework": max(total - routing - model - tool_seconds, 0.0),
+        },
+    }
+
+
+def _median_seconds(runs: list) -> dict:
+    return {stage: round(statistics.median(run["seconds"][stage] for run in runs), 5) for stage in STAGES}
+
+
+async def run_all(agent, questions: list, args, spans: InMemorySpanExporter) -> dict:
+    from google.adk.runners import InMemoryRunner
+
+    wiring = wire_offline(agent, questions, args.model_latency)
+    runners = {"root": InMemoryRunner(agent=agent.root_agent, app_name=APP_NAME)}
+    for sub_agent in agent.root_agent.sub_agents:
+        runners[sub_agent.name] = InMemoryRunner(agent=sub_agent, app_name=APP_NAME)
+
+    for _ in range(args.warmup):
+        for question in questions:
+            for entry in args.entries:
+                await run_question(agent, runners, wiring, spans, question, entry)
+
+    results = {}
+    for question in questions:
+        results[question["id"]] = {}
+        for entry in args.entries:
+            runs = [await run_question(agent, runners, wiring, spans, question, entry) for _ in range(args.repeat)]
+            # Everything but the timings is deterministic: the first run stands for all of them.
+            results[question["id"]][entry] = {**runs[0], "seconds": _median_seconds(runs)}
+    return results
+
+
+def totals(results: dict) -> dict:
+    summary = {}
+    for per_entry in results.values():
+        for entry, metrics in per_entry.items():
+            total = summary.setdefault(entry, {"questions": 0, "correct": 0, **{m: 0 for m in COUNT_METRICS + TOKEN_METRICS},
+                                               "seconds": {stage: 0.0 for stage in STAGES}})
+            total["questions"] += 1
+            total["correct"] += int(metrics["correct"])
+            for metric in COUNT_METRICS + TOKEN_METRICS:
+                total[metric] += metrics[metric]
+            for stage in STAGES:
+                total["seconds"][stage] = round(total["seconds"][stage] + metrics["seconds"][stage], 5)
+    return summary
+
+
+def _compare_metrics(name: str, current: dict, baseline: dict, args, regressions: list, improvements: list):
+    for metric in COUNT_METRICS:
+        if current[metric] > baseline[metric]:
+            regressions.append(f"{name}: {metric} {baseline[metric]} -> {current[metric]}")
+        elif current[metric] < baseline[metric]:
+            improvements.append(f"{name}: {metric} {baseline[metric]} -> {current[metric]}")
+    for metric in TOKEN_METRICS:
+        if current[metric] > baseline[metric] * (1 + args.token_tolerance):
+            regressions.append(f"{name}: {metric} {baseline[metric]} -> {current[metric]}")
+        elif current[metric] < baseline[metric] * (1 - args.token_tolerance):
+            improvements.append(f"{name}: {metric} {baseline[metric]} -> {current[metric]}")
+    for stage in STAGES:
+        before, after = baseline["seconds"][stage], current["seconds"][stage]
+        if abs(after - before) < args.min_time_delta:
+            continue
+        if after > before * (1 + args.time_tolerance):
+            regressions.append(f"{name}: {stage} {before * 1000:.1f} ms -> {after * 1000:.1f} ms")
+        elif after < before / (1 + args.time_tolerance):
+            improvements.append(f"{name}: {stage} {before * 1000:.1f} ms -> {after * 1000:.1f} ms")
+
+
+def compare(report: dict, baseline: dict, args) -> dict:
+    """Regressions and improvements of `report` against `baseline`, per question and over the whole set."""
+    regressions, improvements, new = [], [], []
+    for question_id, per_entry in report["results"].items():
+        for entry, metrics in per_entry.items():
+            name = f"{question_id}/{entry}"
+            if not metrics["correct"]:
+                regressions.append(f"{name}: wrong answer from {metrics['agent']}: {metrics['answer'][:120]}")
+            before = baseline.get("results", {}).get(question_id, {}).get(entry)
+            if before is None:
+                new.append(name)
+                continue
+            _compare_metrics(name, metrics, before, args, regressions, improvements)
+    # Totals over the questions both runs have, so a subset of domains compares like for like.
+    common = {q: {e: m for e, m in per_entry.items() if e in report["results"][q]}
+              for q, per_entry in baseline.get("results", {}).items() if q in report["results"]}
+    current = totals({q: {e: report["results"][q][e] for e in per_entry} for q, per_entry in common.items()})
+    for entry, metrics in totals(common).items():
+        _compare_metrics(f"all/{entry}", current[entry], metrics, args, regressions, improvements)
+    return {"regressions": regressions, "improvements": improvements, "new": new}
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark the agents offline over the golden question set.")
+    parser.add_argument("--questions", default=DEFAULT_QUESTIONS_FILE, help="Golden question set (JSONL).")
+    parser.add_argument("--domains", nargs="+", choices=["calidad", "compras", "pedidos"], help="Only these domains.")
+    parser.add_argument("--entries", nargs="+", choices=ENTRIES, default=ENTRIES,
+                        help="Run through root_agent, directly through the sub-agent, or both.")
+    parser.add_argument("--repeat", type=int, default=5, help="Runs per question and entry; timings are their median.")
+    parser.add_argument("--warmup", type=int, default=1, help="Unmeasured passes over the set first.")
+    parser.add_argument("--model-latency", type=float, default=0.0, help="Latency of the scripted model (seconds).")
+    parser.add_argument("--baseline", default=DEFAULT_BASELINE_FILE, help="Baseline report to compare with.")
+    parser.add_argument("--update-baseline", action="store_true", help="Write this run as the new baseline.")
+    parser.add_argument("--token-tolerance", type=float, default=0.0,
+                        help="Allowed relative token increase; token counts are deterministic.")
+    parser.add_argument("--time-tolerance", type=float, default=0.5, help="Allowed relative increase of a stage time.")
+    parser.add_argument("--min-time-delta", type=float, default=0.005,
+                        help="Time differences below this are noise and never flagged (seconds).")
+    args = parser.parse_args()
+
+    # The scripted model answers with function calls; genai warns about non-text parts on every one.
+    logging.getLogger("google_genai.types").setLevel(logging.ERROR)
+    spans = install_span_exporter()
+    from app import agent
+
+    questions = load_questions(args.questions, args.domains)
+    results = asyncio.run(run_all(agent, questions, args, spans))
+    report = {
+        "config": {"questions": len(questions), "entries": args.entries, "repeat": args.repeat,
+                   "model_latency": args.model_latency},
+        "results": results,
+        "totals": totals(results),
+    }
+    for entry, total in report["totals"].items():
+        print(f"{entry}: {total['correct']}/{total['questions']} correct, {total['llm_turns']} model turns, "
+              f"{total['tool_calls']} tool calls, {total['input_tokens']} input tokens, "
+              f"{total['seconds']['total'] * 1000:.0f} ms", file=sys.stderr)
+
+    if args.update_baseline:
+        wrong = [f"{q}/{e}" for q, per_entry in results.items() for e, m in per_entry.items() if not m["correct"]]
+        if wrong:
+            print(f"Not writing a baseline with wrong answers: {', '.join(wrong)}", file=sys.stderr)
+            print(json.dumps(report, indent=2, ensure_ascii=False))
+            sys.exit(1)
+        with open(args.baseline, "w", encoding="utf-8") as f:
+            json.dump(report, f, indent=1, ensure_ascii=False)
+            f.write("\n")
+        print(f"Baseline written to {args.baseline}", file=sys.stderr)
+        print(json.dumps(report, indent=2, ensure_ascii=False))
+        return
+
+    if os.path.exists(args.baseline):
+        with open(args.baseline, "r", encoding="utf-8") as f:
+            report["comparison"] = compare(report, json.load(f), args)
+    else:
+        print(f"No baseline at {args.baseline}: run with --update-baseline to record one.", file=sys.stderr)
+    print(json.dumps(report, indent=2, ensure_ascii=False))
+
+    comparison = report.get("comparison", {})
+    for line in comparison.get("improvements", []):
+        print(f"improved: {line}", file=sys.stderr)
+    for line in comparison.get("regressions", []):
+        print(f"REGRESSION: {line}", file=sys.stderr)
+    if comparison.get("regressions") or not all(m["correct"] for q in results.values() for m in q.values()):
+        sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,44 @@
+"""Cold-import budget check for the agent package and the CLI.
+
+Imports each module in a fresh interpreter and fails (exit code 1) if its import time
+or the number of modules it pulls in exceeds the budget in
+`configure_and_deploy.IMPORT_BUDGETS`. Budgets can be overridden with the
+IMPORT_BUDGET_* environment variables. Import time is noisy: run it a few times
+before trusting a failure.
+
+Usage:
+    python benchmarks/import_budget.py [--runs 3]
+"""
+import argparse
+import json
+import os
+import sys
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from configure_and_deploy import IMPORT_BUDGETS, profile_imports
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Check cold-import time and module count against their budgets.")
+    parser.add_argument("--runs", type=int, default=3, help="Cold imports per module; the fastest one is compared.")
+    args = parser.parse_args()
+
+    report = {}
+    for module, (max_seconds, max_modules) in IMPORT_BUDGETS.items():
+        runs = [profile_imports(module) for _ in range(args.runs)]
+        seconds = min(r["seconds"] for r in runs)
+        modules = max(r["modules"] for r in runs)
+        report[module] = {
+            "seconds": round(seconds, 3),
+            "max_seconds": max_seconds,
+            "modules": modules,
+            "max_modules": max_modules,
+            "ok": seconds <= max_seconds and modules <= max_modules,
+        }
+    print(json.dumps(report, indent=2))
+    sys.exit(0 if all(r["ok"] for r in report.values()) else 1)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,188 @@
+"""Benchmark and check of the large-document mode of `query_gcs_document`.
+
+Generates text PDFs locally and serves them through a stub GCS client. A stub model
+reads the pages it is sent, so an answer is only found if the right pages reach it.
+Its latency grows with the number of pages, and it fails above `--max-pages`, like a
+request over the model's token limit. Each document is asked the same question three
+ways:
+
+- single: the whole PDF in one request (chunking disabled);
+- chunked: page-range chunks queried in parallel, then merged;
+- hint: only the pages given in `pages`.
+
+Usage:
+    python benchmarks/large_document_bench.py --pages 40 300 --answer-page 237
+"""
+import argparse
+import asyncio
+import io
+import json
+import os
+import sys
+import time
+from types import SimpleNamespace
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from pypdf import PdfReader
+
+from app import documents
+from app.document_cache import DocumentAnswerCache
+
+QUESTION = "¿Cuál es el punto de inflamación del producto?"
+FACT = "Punto de inflamacion: 62 C"
+
+
+def make_pdf(page_texts: list) -> bytes:
+    """Minimal uncompressed PDF with one line of Helvetica text per page."""
+    objects = ["<< /Type /Catalog /Pages 2 0 R >>", None, "<< /Type /Font /Subtype /Type1 /BaseFont /Helvetica >>"]
+    kids = []
+    for text in page_texts:
+        stream = f"BT /F1 12 Tf 72 720 Td ({text}) Tj ET"
+        objects.append(f"<< /Length {len(stream)} >>\nstream\n{stream}\nendstream")
+        objects.append(f"<< /Type /Page /Parent 2 0 R /MediaBox [0 0 612 792] "
+                       f"/Resources << /Font << /F1 3 0 R >> >> /Contents {len(objects)} 0 R >>")
+        kids.append(f"{len(objects)} 0 R")
+    objects[1] = f"<< /Type /Pages /Kids [{' '.join(kids)}] /Count {len(kids)} >>"
+    out = io.BytesIO()
+    out.write(b"%PDF-1.4\n")
+    offsets = []
+    for number, body in enumerate(objects, start=1):
+        offsets.append(out.tell())
+        out.write(f"{number} 0 obj\n{body}\nendobj\n".encode("latin-1"))
+    xref = out.tell()
+    out.write(f"xref\n0 {len(objects) + 1}\n0000000000 65535 f \n".encode())
+    for offset in offsets:
+        out.write(f"{offset:010d} 00000 n \n".encode())
+    out.write(f"trailer\n<< /Size {len(objects) + 1} /Root 1 0 R >>\nstartxref\n{xref}\n%%EOF\n".encode())
+    return out.getvalue()
+
+
+def make_document(pages: int, answer_page: int) -> bytes:
+    return make_pdf([f"Pagina {i}. " + (FACT if i == answer_page else "Sin datos relevantes.") for i in range(1, pages + 1)])
+
+
+class StubStorage:
+    """GCS stand-in serving `objects` (URI -> bytes); `generations` holds each object's generation (default 1)."""
+
+    def __init__(self, objects: dict, delay: float = 0.0):
+        self.objects = objects
+        self.generations = {}
+        self.delay = delay
+        self.downloads = 0
+
+    def bucket(self, bucket_name: str):
+        storage = self
+
+        def blob(name):
+            uri = f"gs://{bucket_name}/{name}"
+
+            def download_as_bytes():
+                time.sleep(storage.delay)
+                storage.downloads += 1
+                return storage.objects[uri]
+            return SimpleNamespace(size=len(storage.objects.get(uri, b"")), generation=storage.generations.get(uri, 1),
+                                   etag="stub", download_as_bytes=download_as_bytes)
+
+        def get_blob(name):
+            return blob(name) if f"gs://{bucket_name}/{name}" in storage.objects else None
+        return SimpleNamespace(blob=blob, get_blob=get_blob)
+
+
+class StubModels:
+    """Answers from the PDF text it receives, taking `base_delay + page_delay * pages` seconds."""
+
+    def __init__(self, storage: StubStorage, base_delay: float, page_delay: float, max_pages: int):
+        self.storage = storage
+        self.base_delay = base_delay
+        self.page_delay = page_delay
+        self.max_pages = max_pages
+        self.calls = 0
+        self.in_flight = 0
+        self.max_in_flight = 0
+
+    async def generate_content(self, model, contents, config=None):
+        self.calls += 1
+        self.in_flight += 1
+        self.max_in_flight = max(self.max_in_flight, self.in_flight)
+        try:
+            prompt = contents[0]
+            pdf = None
+            for part in contents[1:]:
+                if part.inline_data is not None:
+                    pdf = part.inline_data.data
+                elif part.file_data is not None:
+                    pdf = self.storage.objects[part.file_data.file_uri]
+            if pdf is None:
+                # Reduce step: merge the partial answers.
+                await asyncio.sleep(self.base_delay)
+                return self._response("Combinado: " + prompt.split("\n\n", 2)[-1].replace("\n", " "), 200)
+            reader = PdfReader(io.BytesIO(pdf))
+            await asyncio.sleep(self.base_delay + self.page_delay * len(reader.pages))
+            if len(reader.pages) > self.max_pages:
+                raise RuntimeError(f"400 INVALID_ARGUMENT: {len(reader.pages)} pages exceed the input token limit")
+            text = " ".join(page.extract_text() for page in reader.pages)
+            found = [line for line in text.split("Pagina ") if FACT in line]
+            answer = f"{FACT} (pagina {found[0].split('.')[0]})" if found else documents.CHUNK_NOT_FOUND
+            return self._response(answer, 258 * len(reader.pages))
+        finally:
+            self.in_flight -= 1
+
+    @staticmethod
+    def _response(text: str, prompt_tokens: int):
+        return SimpleNamespace(text=text, usage_metadata=SimpleNamespace(
+            prompt_token_count=prompt_tokens, candidates_token_count=10,
+            cached_content_token_count=None, thoughts_token_count=None))
+
+
+async def ask(uri: str, pages: str = "") -> dict:
+    start = time.perf_counter()
+    answer = await documents.query_gcs_document(uri, QUESTION, pages=pages)
+    return {"seconds": round(time.perf_counter() - start, 3), "correct": FACT in answer, "answer": answer[:120]}
+
+
+async def run(args, storage: StubStorage, models: StubModels) -> dict:
+    report = {}
+    for pages in args.pages:
+        uri = f"gs://bench/sds_{pages}.pdf"
+        answer_page = min(args.answer_page, pages)
+        storage.objects[uri] = make_document(pages, answer_page)
+        entry = {"pages": pages, "size_bytes": len(storage.objects[uri])}
+        for mode, chunking, hint in [("single", False, ""), ("chunked", True, ""),
+                                     ("hint", True, f"{max(answer_page - 5, 1)}-{answer_page + 5}")]:
+            documents.DOCUMENT_CHUNKING_ENABLED = chunking
+            models.calls = models.max_in_flight = 0
+            entry[mode] = {**await ask(uri, hint), "model_calls": models.calls, "max_in_flight": models.max_in_flight}
+        report[uri] = entry
+    return report
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark the large-document mode of query_gcs_document.")
+    parser.add_argument("--pages", type=int, nargs="+", default=[40, 300], help="Page counts of the generated PDFs.")
+    parser.add_argument("--answer-page", type=int, default=237, help="Page holding the fact asked about.")
+    parser.add_argument("--base-delay", type=float, default=0.2, help="Stub model latency per request (seconds).")
+    parser.add_argument("--page-delay", type=float, default=0.01, help="Stub model latency per page (seconds).")
+    parser.add_argument("--max-pages", type=int, default=250, help="Pages above which the stub model fails.")
+    args = parser.parse_args()
+
+    storage = StubStorage({})
+    models = StubModels(storage, args.base_delay, args.page_delay, args.max_pages)
+    # Every question must reach the stub model: no answer cache and no context caches.
+    documents.document_cache = DocumentAnswerCache(storage_client=storage, enabled=False)
+    documents.document_context_manager.enabled = False
+    documents.genai_client = SimpleNamespace(aio=SimpleNamespace(models=models))
+    # Generated PDFs are small: chunk by page count only.
+    documents.DOCUMENT_CHUNKED_MIN_BYTES = 0
+
+    report = asyncio.run(run(args, storage, models))
+    print(json.dumps({
+        "chunk_pages": documents.DOCUMENT_CHUNK_PAGES,
+        "chunked_min_pages": documents.DOCUMENT_CHUNKED_MIN_PAGES,
+        "chunk_max_concurrency": documents.DOCUMENT_CHUNK_MAX_CONCURRENCY,
+        "documents": report,
+    }, indent=2, ensure_ascii=False))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,171 @@
+"""Benchmark of the local DuckDB mirror of the agent tables (`app/local_mirror.py`).
+
+Runs against the fixture tables of `agent_bench_fixtures.py` behind a local BigQuery
+stand-in whose jobs take `--bigquery-latency` seconds, and reports:
+
+- sync: the first full snapshot, a sync with no table modified, and an incremental sync
+  after a load into `pedidos` (only that table is downloaded again);
+- staleness: a query over a table modified since its last check goes to BigQuery;
+- per query (the golden questions' SQL plus queries using the BigQuery functions the
+  mirror translates): the median latency through BigQuery and through the mirror, whether
+  the mirror answered it or why it fell back, and whether both returned the same rows.
+
+Usage:
+    python benchmarks/local_mirror_bench.py [--bigquery-latency 1.0] [--repeat 5]
+"""
+import argparse
+import asyncio
+import datetime
+import json
+import os
+import statistics
+import sys
+import tempfile
+import time
+from types import SimpleNamespace
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from agent_bench_fixtures import DATASET, PRODUCTS, PROJECT, FixtureBigQueryClient
+from app.local_mirror import LocalMirror
+
+BENCH_DIR = os.path.dirname(os.path.abspath(__file__))
+TABLE = f"`{PROJECT}.{DATASET}."
+# Queries with BigQuery functions the golden questions do not use, each with the SQLite query giving the
+# same rows (the fixture engine does not translate these functions); regexp_replace must fall back.
+EXTRA_QUERIES = {
+    "date_trunc": (f"SELECT DATE_TRUNC(Erdat, MONTH) AS mes, COUNT(*) AS lineas FROM {TABLE}pedidos` "
+                   "GROUP BY mes ORDER BY mes",
+                   f"SELECT substr(Erdat, 1, 7) || '-01' AS mes, COUNT(*) AS lineas FROM {TABLE}pedidos` "
+                   "GROUP BY mes ORDER BY mes"),
+    "extract": (f"SELECT EXTRACT(YEAR FROM Bedat) AS anio, SUM(Menge) AS cantidad "
+                f"FROM {TABLE}compras_confirmacion_orden_compra` GROUP BY anio ORDER BY anio", None),
+    "date_diff": (f"SELECT Vbeln, DATE_DIFF(Edatu, Erdat, DAY) AS dias FROM {TABLE}pedidos` "
+                  "ORDER BY dias DESC, Vbeln LIMIT 5",
+                  f"SELECT Vbeln, julianday(Edatu) - julianday(Erdat) AS dias FROM {TABLE}pedidos` "
+                  "ORDER BY dias DESC, Vbeln LIMIT 5"),
+    "cast_string": (f"SELECT CAST(Netwr AS STRING) AS importe FROM {TABLE}pedidos` ORDER BY Netwr DESC LIMIT 3", None),
+    "join": (f"SELECT c.Ebeln, COUNT(p.Vbeln) AS albaranes FROM {TABLE}compras_confirmacion_orden_compra` c "
+             f"JOIN {TABLE}compras_packing_list` p ON p.Ebeln = c.Ebeln AND p.Ematn = c.Ematn "
+             "GROUP BY c.Ebeln ORDER BY albaranes DESC, c.Ebeln LIMIT 5", None),
+    "regexp_replace": (f"SELECT REGEXP_REPLACE(Txz01, 'a', 'o') AS nombre FROM {TABLE}pedidos` LIMIT 3",
+                       f"SELECT replace(Txz01, 'a', 'o') AS nombre FROM {TABLE}pedidos` LIMIT 3"),
+}
+
+
+def golden_queries(path: str) -> dict:
+    """The execute_sql queries of the golden questions, with product placeholders filled in."""
+    queries = {}
+    with open(path, encoding="utf-8") as f:
+        for line in f:
+            question = json.loads(line)
+            steps = [s for step in question["steps"] for s in (step if isinstance(step, list) else [step])]
+            for number, step in enumerate(s for s in steps if s["tool"] == "execute_sql"):
+                query = step["args"]["query"].replace("{0.matches.0.Ematn}", PRODUCTS[0][0])
+                queries[f"{question['id']}.{number}"] = (query, None)
+    return queries
+
+
+def normalized(rows: list) -> list:
+    """Row values by position, numbers compared as numbers (SQLite returns NUMERIC as floats)."""
+    def value(v):
+        try:
+            return round(float(v), 6)
+        except (TypeError, ValueError):
+            return v
+    return [[value(v) for v in row.values()] for row in rows]
+
+
+def median_seconds(function, repeat: int):
+    times, result = [], None
+    for _ in range(repeat):
+        start = time.perf_counter()
+        result = function()
+        times.append(time.perf_counter() - start)
+    return result, round(statistics.median(times), 4)
+
+
+def timed(function):
+    start = time.perf_counter()
+    result = function()
+    return result, round(time.perf_counter() - start, 4)
+
+
+def bench(latency: float, repeat: int, directory: str) -> dict:
+    engine = FixtureBigQueryClient(latency=latency)
+    mirror = LocalMirror(lambda project: engine, max_rows=50, directory=directory)
+    report = {"bigquery_latency_s": latency}
+
+    def load(table: str, count: int):
+        rows = [dict(row, Vbeln=f"99{row['Vbeln'][2:]}") for row in engine.rows[table][:count]]
+        engine.insert_rows(table, rows, datetime.datetime.now(datetime.timezone.utc))
+
+    tool = SimpleNamespace(name="execute_sql")
+    context = SimpleNamespace(function_call_id="bench", state={})
+    count = f"SELECT COUNT(*) AS lineas FROM {TABLE}pedidos`"
+
+    def serve(query: str):
+        return asyncio.run(mirror.before_tool_callback(tool, {"project_id": PROJECT, "query": query}, context))
+
+    full, full_s = timed(mirror.sync)
+    unchanged, unchanged_s = timed(mirror.sync)
+    load("pedidos", 10)
+    incremental, incremental_s = timed(mirror.sync)
+    report["sync"] = {
+        "full": {"seconds": full_s, "downloaded": len(full["downloaded"])},
+        "unchanged": {"seconds": unchanged_s, "downloaded": len(unchanged["downloaded"])},
+        "after_load": {"seconds": incremental_s, "downloaded": incremental["downloaded"]},
+    }
+
+    # A load after the last check: the next query re-checks the table, goes to BigQuery and starts a sync.
+    load("pedidos", 5)
+    mirror.max_staleness = 0
+    stale_response = serve(count)
+    mirror.max_staleness = 600
+    mirror.sync()
+    report["staleness"] = {
+        "modified_table_fell_back": stale_response is None,
+        "rows_after_sync": serve(count)["rows"][0]["lineas"],
+        "rows_in_bigquery": len(engine.rows["pedidos"]),
+        "status": mirror.status()["pedidos"],
+    }
+
+    queries = {**golden_queries(os.path.join(BENCH_DIR, "agent_bench_questions.jsonl")), **EXTRA_QUERIES}
+    results = {}
+    for name, (query, reference) in queries.items():
+        expected, bigquery_s = median_seconds(
+            lambda: engine.query_and_wait(reference or query, project=PROJECT, max_results=50), repeat)
+        before = dict(mirror.fallbacks)
+        response, mirror_s = median_seconds(lambda: serve(query), repeat)
+        entry = {"bigquery_s": bigquery_s, "mirror_s": mirror_s}
+        if response is None:
+            entry["fallback"] = next(r for r, n in mirror.fallbacks.items() if n > before.get(r, 0))
+        else:
+            entry["same_rows"] = normalized(response["rows"]) == normalized(expected)
+        results[name] = entry
+    served = [e for e in results.values() if "fallback" not in e]
+    report["queries"] = results
+    report["summary"] = {
+        "queries": len(results),
+        "served_locally": len(served),
+        "same_rows": sum(e["same_rows"] for e in served),
+        "median_bigquery_s": statistics.median(e["bigquery_s"] for e in served) if served else None,
+        "median_mirror_s": statistics.median(e["mirror_s"] for e in served) if served else None,
+        "stats": mirror.stats(),
+    }
+    return report
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark the local DuckDB mirror of the agent tables.")
+    parser.add_argument("--bigquery-latency", type=float, default=1.0,
+                        help="Simulated latency of every BigQuery job (seconds).")
+    parser.add_argument("--repeat", type=int, default=5, help="Runs per query; timings are their median.")
+    args = parser.parse_args()
+    with tempfile.TemporaryDirectory() as directory:
+        report = bench(args.bigquery_latency, args.repeat, directory)
+    print(json.dumps(report, indent=2, ensure_ascii=False))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,100 @@
+"""Benchmark of the page store: offline ingestion and `search_document_pages` versus reading the PDF.
+
+Generates text PDFs locally and serves them through a stub GCS client, then:
+
+1. ingests them into a temporary page store in parallel;
+2. runs the ingestion again (nothing changed: every document is skipped);
+3. re-uploads one document (new generation) and ingests again (only that one is re-extracted);
+4. asks questions with `search_document_pages` (local FTS lookup) and with
+   `query_gcs_document` against a stub model that takes `--model-delay` seconds.
+
+Usage:
+    python benchmarks/page_store_bench.py --documents 200 --pages 20 --workers 8 --processes 4
+"""
+import argparse
+import asyncio
+import json
+import os
+import sys
+import tempfile
+import time
+from types import SimpleNamespace
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+
+from large_document_bench import StubModels, StubStorage, make_pdf
+
+from app import documents
+from app.document_cache import DocumentAnswerCache
+from app.page_store import PageStore
+from ingest_documents import ingest
+from stats import summarize
+
+
+def make_document(index: int, pages: int) -> bytes:
+    return make_pdf([f"Pagina {p}. Certificado {index}: lote L{index:04d}-{p:03d}, alergeno "
+                     f"{'gluten' if (index + p) % 7 == 0 else 'ninguno'}, punto de inflamacion {40 + index % 50} C."
+                     for p in range(1, pages + 1)])
+
+
+async def ask(uris: list, questions: int, search: bool) -> list:
+    timings = []
+    for i in range(questions):
+        uri = uris[i % len(uris)]
+        start = time.perf_counter()
+        if search:
+            result = await documents.search_document_pages(f"lote L{i % len(uris):04d}-003", gcs_file_path=uri)
+            assert result["source"] == "page_store" and result["matches"], result
+        else:
+            await documents.query_gcs_document(uri, "¿Qué lote aparece en la página 3?")
+        timings.append(time.perf_counter() - start)
+    return timings
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark page store ingestion and lookups.")
+    parser.add_argument("--documents", type=int, default=200, help="Number of generated PDFs.")
+    parser.add_argument("--pages", type=int, default=20, help="Pages per PDF.")
+    parser.add_argument("--workers", type=int, default=8, help="Parallel downloads.")
+    parser.add_argument("--processes", type=int, default=4, help="Text extraction processes.")
+    parser.add_argument("--download-delay", type=float, default=0.02, help="Stub GCS download latency (seconds).")
+    parser.add_argument("--questions", type=int, default=50, help="Questions asked per mode.")
+    parser.add_argument("--model-delay", type=float, default=1.5, help="Stub model latency per request (seconds).")
+    args = parser.parse_args()
+
+    uris = [f"gs://bench/cert_{i:04d}.pdf" for i in range(args.documents)]
+    storage = StubStorage({uri: make_document(i, args.pages) for i, uri in enumerate(uris)}, delay=args.download_delay)
+    quiet = open(os.devnull, "w")
+
+    with tempfile.TemporaryDirectory() as directory:
+        store = PageStore(os.path.join(directory, "document_store.sqlite3"))
+        first = ingest(uris, store, storage, workers=args.workers, processes=args.processes, progress=quiet)
+        second = ingest(uris, store, storage, workers=args.workers, processes=args.processes, progress=quiet)
+        storage.generations[uris[0]] = 2
+        third = ingest(uris, store, storage, workers=args.workers, processes=args.processes, progress=quiet)
+
+        documents.page_store = store
+        documents.document_cache = DocumentAnswerCache(storage_client=storage, enabled=False)
+        documents.document_context_manager.enabled = False
+        documents.genai_client = SimpleNamespace(aio=SimpleNamespace(
+            models=StubModels(storage, base_delay=args.model_delay, page_delay=0, max_pages=10_000)))
+
+        async def run():
+            return await ask(uris, args.questions, search=True), await ask(uris, min(args.questions, 5), search=False)
+        search_timings, model_timings = asyncio.run(run())
+
+        print(json.dumps({
+            "documents": args.documents,
+            "pages_per_document": args.pages,
+            "first_ingest": {k: v for k, v in first.items() if k != "store"},
+            "second_ingest": {k: second[k] for k in ("unchanged", "ingested", "duration_s")},
+            "after_reupload": {k: third[k] for k in ("unchanged", "ingested", "duration_s")},
+            "store": {k: v for k, v in third["store"].items() if k != "path"},
+            "search_document_pages_s": summarize(search_timings, digits=4),
+            "query_gcs_document_s": summarize(model_timings, digits=4),
+        }, indent=2))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,206 @@
+"""Latency and token report of the agent profiles of `app/agent_profiles.yaml`.
+
+Runs the golden questions of `agent_bench_questions.jsonl` through `root_agent` once per
+profile, each profile in its own process with AGENT_PROFILE set (like a deployment), with the
+SQL tools served by the fixture tables of `agent_bench_fixtures.py`. The model requests go to
+Gemini for real, so the report shows what a profile costs:
+
+- per question: the answer's correctness, model turns, tool calls, input, output and thinking
+  tokens, and the seconds of the run, of the orchestrator (routing) and of the model requests;
+- per profile: the totals, the median, 90th percentile and maximum latency per question, and
+  the settings every agent and document tool was built with.
+
+Every request is checked against the profile: a model, thinking budget, output cap or
+temperature other than the configured one is listed under `mismatches`.
+
+With `--offline` the scripted model of `agent_bench.py` answers instead of Gemini: nothing
+leaves the machine and the tokens are estimates, which checks that each profile reaches the
+requests, but its latencies say nothing about the models.
+
+Usage:
+    python benchmarks/profile_report.py [--profiles default low-latency] [--domains pedidos] [--repeat 3]
+    python benchmarks/profile_report.py --offline
+"""
+import argparse
+import asyncio
+import json
+import logging
+import os
+import statistics
+import subprocess
+import sys
+from types import SimpleNamespace
+
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from agent_bench import (APP_NAME, DEFAULT_QUESTIONS_FILE, TimedModels, install_span_exporter, load_questions,
+                         run_question, wire_offline)
+from app.agent_config import AGENT_PROFILES_FILE, load_profile, profile_names
+
+METRICS = ["llm_turns", "tool_calls", "input_tokens", "output_tokens", "thinking_tokens"]
+
+
+class RecordedModels:
+    """`client.aio.models` of every model the agents use, recording each request and its usage."""
+
+    def __init__(self, models: dict):
+        self.models = models
+        self.calls = []
+
+    async def generate_content(self, model, contents, config=None):
+        response = await self.models[model].generate_content(model=model, contents=contents, config=config)
+        usage = response.usage_metadata
+        thinking = config.thinking_config if config else None
+        self.calls.append({
+            "agent": ((config.labels if config else None) or {}).get("adk_agent_name", ""),
+            "model": model,
+            "thinking_budget": thinking.thinking_budget if thinking else None,
+            "max_output_tokens": config.max_output_tokens if config else None,
+            "temperature": config.temperature if config else None,
+            "input_tokens": (usage.prompt_token_count or 0) if usage else 0,
+            "output_tokens": (usage.candidates_token_count or 0) if usage else 0,
+            "thinking_tokens": (usage.thoughts_token_count or 0) if usage else 0,
+        })
+        return response
+
+
+def mismatches(calls: list, settings: dict) -> list:
+    """Requests whose model or generation settings differ from the agent's settings in the profile."""
+    found = []
+    for call in calls:
+        expected = settings.get(call["agent"])
+        if expected is None:
+            continue
+        for name in ("model", "thinking_budget", "max_output_tokens", "temperature"):
+            if call[name] != getattr(expected, name):
+                found.append(f"{call['agent']}: {name} {call[name]} (expected {getattr(expected, name)})")
+    return sorted(set(found))
+
+
+def wire(agent, questions: list, offline: bool) -> SimpleNamespace:
+    """The fixture tables behind the tools; the scripted model (offline) or Gemini behind every agent."""
+    from app import rate_limit
+
+    wiring = wire_offline(agent, questions, 0.0)
+    if offline:
+        recorded = RecordedModels({model: wiring.timed.models for model in agent.gemini_models})
+    else:
+        # Real requests share the real quota: the limiter wire_offline turned off is needed again.
+        rate_limit.gemini_limiter.enabled = True
+        clients = {}
+        for model in agent.gemini_models.values():
+            model.__dict__.pop("api_client", None)
+            clients[model.model] = model.api_client.aio.models
+        recorded = RecordedModels(clients)
+    timed = TimedModels(recorded)
+    for model in agent.gemini_models.values():
+        model.__dict__["api_client"] = SimpleNamespace(vertexai=True, aio=SimpleNamespace(models=timed))
+    return SimpleNamespace(engine=wiring.engine, scripted=recorded, timed=timed)
+
+
+async def run_profile(agent, questions: list, args, spans) -> dict:
+    from google.adk.runners import InMemoryRunner
+
+    wiring = wire(agent, questions, args.offline)
+    runners = {"root": InMemoryRunner(agent=agent.root_agent, app_name=APP_NAME)}
+    for sub_agent in agent.root_agent.sub_agents:
+        runners[sub_agent.name] = InMemoryRunner(agent=sub_agent, app_name=APP_NAME)
+
+    results, calls = {}, []
+    for question in questions:
+        runs = []
+        for _ in range(args.repeat):
+            run = await run_question(agent, runners, wiring, spans, question, "root")
+            run["thinking_tokens"] = sum(c["thinking_tokens"] for c in wiring.scripted.calls)
+            calls.extend(wiring.scripted.calls)
+            runs.append(run)
+        # Model answers vary between runs: every metric is the median of the runs.
+        results[question["id"]] = {
+            "correct": sum(run["correct"] for run in runs),
+            "routed_by": runs[0]["routed_by"],
+            "answer": runs[0]["answer"],
+            **{metric: statistics.median(run[metric] for run in runs) for metric in METRICS},
+            "seconds": {stage: round(statistics.median(run["seconds"][stage] for run in runs), 3)
+                        for stage in ("total", "routing", "model")},
+        }
+    return {"results": results, "mismatches": mismatches(calls, agent.model_settings)}
+
+
+def summary(results: dict, repeat: int) -> dict:
+    latencies = sorted(entry["seconds"]["total"] for entry in results.values())
+    return {
+        "questions": len(results),
+        "correct_runs": f"{sum(entry['correct'] for entry in results.values())}/{len(results) * repeat}",
+        **{metric: sum(entry[metric] for entry in results.values()) for metric in METRICS},
+        "latency_s": {
+            "median": round(statistics.median(latencies), 3),
+            "p90": round(latencies[min(len(latencies) - 1, int(0.9 * len(latencies)))], 3),
+            "max": round(latencies[-1], 3),
+            "model": round(sum(entry["seconds"]["model"] for entry in results.values()), 3),
+            "routing": round(sum(entry["seconds"]["routing"] for entry in results.values()), 3),
+        },
+    }
+
+
+def profile_run(args):
+    """Child process: one profile, read from AGENT_PROFILE when the agent is imported."""
+    logging.getLogger("google_genai.types").setLevel(logging.ERROR)
+    spans = install_span_exporter()
+    from app import agent
+    from app.documents import DOCUMENT_SETTINGS
+
+    questions = load_questions(args.questions, args.domains)
+    report = asyncio.run(run_profile(agent, questions, args, spans))
+    report["settings"] = {name: settings.describe() for name, settings in agent.model_settings.items()}
+    report["settings"]["query_gcs_document"] = DOCUMENT_SETTINGS.describe()
+    report["summary"] = summary(report["results"], args.repeat)
+    print(json.dumps(report, ensure_ascii=False))
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Latency and token report of the agent profiles.")
+    parser.add_argument("--profiles", nargs="+", help="Profiles to compare (default: all of them).")
+    parser.add_argument("--questions", default=DEFAULT_QUESTIONS_FILE, help="Golden question set (JSONL).")
+    parser.add_argument("--domains", nargs="+", choices=["calidad", "compras", "pedidos"], help="Only these domains.")
+    parser.add_argument("--repeat", type=int, default=1, help="Runs per question; metrics are their median.")
+    parser.add_argument("--offline", action="store_true", help="Scripted model instead of Gemini.")
+    parser.add_argument("--run-profile", help=argparse.SUPPRESS)
+    args = parser.parse_args()
+    if args.run_profile:
+        profile_run(args)
+        return
+
+    profiles = args.profiles or profile_names()
+    for profile in profiles:
+        load_profile(profile, AGENT_PROFILES_FILE)
+    report = {"config": {"questions": args.questions, "domains": args.domains, "repeat": args.repeat,
+                         "offline": args.offline}, "profiles": {}}
+    child = [sys.executable, os.path.abspath(__file__), "--questions", args.questions, "--repeat", str(args.repeat)]
+    child += ["--domains", *args.domains] if args.domains else []
+    child += ["--offline"] if args.offline else []
+    failed = False
+    for profile in profiles:
+        print(f"Running profile '{profile}'...", file=sys.stderr)
+        process = subprocess.run(child + ["--run-profile", profile], capture_output=True, text=True,
+                                 env={**os.environ, "AGENT_PROFILE": profile})
+        if process.returncode != 0:
+            print(f"Profile '{profile}' failed:\n{process.stderr[-2000:]}", file=sys.stderr)
+            failed = True
+            continue
+        result = json.loads(process.stdout.strip().splitlines()[-1])
+        report["profiles"][profile] = result
+        total = result["summary"]
+        print(f"{profile}: {total['correct_runs']} correct, {total['llm_turns']} model turns, "
+              f"{total['input_tokens']} input / {total['output_tokens']} output / {total['thinking_tokens']} thinking "
+              f"tokens, latency median {total['latency_s']['median']} s, p90 {total['latency_s']['p90']} s"
+              + (f", {len(result['mismatches'])} settings mismatches" if result["mismatches"] else ""),
+              file=sys.stderr)
+        failed = failed or bool(result["mismatches"])
+    print(json.dumps(report, indent=2, ensure_ascii=False))
+    if failed:
+        sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,131 @@
+"""Benchmark: concurrent `query_gcs_document` calls against a local stub model endpoint.
+
+Starts a tiny HTTP server that answers every generateContent request after a fixed
+delay, points the shared genai client at it and runs the same N tool calls twice:
+one after another and concurrently. With the async tool the concurrent run should
+take roughly `ceil(N / DOCUMENT_MAX_CONCURRENCY) * delay` instead of `N * delay`.
+
+Usage:
+    python benchmarks/query_gcs_document_bench.py --calls 16 --delay 0.5
+"""
+import argparse
+import asyncio
+import json
+import os
+import sys
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from google import genai
+
+from app import documents
+
+
+class StubModelServer(ThreadingHTTPServer):
+    daemon_threads = True
+
+    def __init__(self, delay: float):
+        super().__init__(("127.0.0.1", 0), StubModelHandler)
+        self.delay = delay
+        self.lock = threading.Lock()
+        self.in_flight = 0
+        self.max_in_flight = 0
+        self.requests = 0
+
+    @property
+    def url(self) -> str:
+        return f"http://127.0.0.1:{self.server_address[1]}"
+
+
+class StubModelHandler(BaseHTTPRequestHandler):
+    protocol_version = "HTTP/1.1"
+
+    def do_POST(self):
+        server = self.server
+        self.rfile.read(int(self.headers.get("Content-Length", 0)))
+        with server.lock:
+            server.requests += 1
+            server.in_flight += 1
+            server.max_in_flight = max(server.max_in_flight, server.in_flight)
+        time.sleep(server.delay)
+        with server.lock:
+            server.in_flight -= 1
+
+        body = json.dumps({
+            "candidates": [{"content": {"role": "model", "parts": [{"text": "stub answer"}]}}],
+            "usageMetadata": {"promptTokenCount": 1000, "candidatesTokenCount": 2},
+        }).encode()
+        self.send_response(200)
+        self.send_header("Content-Type", "application/json")
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, format, *args):
+        pass
+
+
+async def run_sequential(calls: int) -> float:
+    start = time.perf_counter()
+    for i in range(calls):
+        await documents.query_gcs_document(f"gs://bench/doc_{i}.pdf", "¿Qué lote aparece en el certificado?")
+    return time.perf_counter() - start
+
+
+async def run_concurrent(calls: int) -> float:
+    start = time.perf_counter()
+    await asyncio.gather(*[
+        documents.query_gcs_document(f"gs://bench/doc_{i}.pdf", "¿Qué lote aparece en el certificado?")
+        for i in range(calls)
+    ])
+    return time.perf_counter() - start
+
+
+async def run(calls: int, server: StubModelServer) -> tuple:
+    # Both runs share one event loop: the pooled async HTTP client is bound to it.
+    sequential = await run_sequential(calls)
+    server.max_in_flight = 0
+    concurrent = await run_concurrent(calls)
+    return sequential, concurrent
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark concurrent query_gcs_document calls against a stub endpoint.")
+    parser.add_argument("--calls", type=int, default=16, help="Number of tool calls per run.")
+    parser.add_argument("--delay", type=float, default=0.5, help="Seconds the stub model takes per request.")
+    args = parser.parse_args()
+
+    server = StubModelServer(args.delay)
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+
+    # Every call must reach the stub: no answer cache, no GCS metadata lookups, no context caches,
+    # and no client-side quota (rate_limit_bench.py measures that).
+    documents.document_cache.enabled = False
+    documents.document_context_manager.enabled = False
+    documents.DOCUMENT_CHUNKING_ENABLED = False
+    documents.gemini_limiter.enabled = False
+    documents.genai_client = genai.Client(
+        api_key="stub",
+        http_options=documents.build_http_options(base_url=server.url),
+    )
+
+    sequential, concurrent = asyncio.run(run(args.calls, server))
+    server.shutdown()
+
+    print(json.dumps({
+        "calls": args.calls,
+        "stub_delay_s": args.delay,
+        "max_concurrency": documents.DOCUMENT_MAX_CONCURRENCY,
+        "sequential_s": round(sequential, 3),
+        "concurrent_s": round(concurrent, 3),
+        "speedup": round(sequential / concurrent, 2),
+        "max_in_flight": server.max_in_flight,
+        "stub_requests": server.requests,
+    }, indent=2))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,161 @@
+"""Benchmark of the shared Gemini rate limiter (`app/rate_limit.py`) against a stub model with a quota.
+
+The stub admits requests while its own per-minute request and token buckets allow it and
+answers 429 RESOURCE_EXHAUSTED otherwise, like Vertex AI. Concurrent workers send requests
+back to back for `--duration` seconds in these modes:
+
+- none: no client-side limiter; a throttled request is retried at once, like the agent
+  retrying after a generic tool error;
+- limiter: the limiter configured with the stub's quota;
+- overestimated: the limiter configured with 3x the real quota, which it has to discover
+  from the 429s;
+- hedging: fewer workers, well under quota, with a heavy latency tail; hedging disabled
+  and enabled.
+
+Usage:
+    python benchmarks/rate_limit_bench.py --rpm 600 --workers 40 --duration 15
+"""
+import argparse
+import asyncio
+import json
+import os
+import random
+import sys
+import time
+from types import SimpleNamespace
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from google.genai import errors
+
+from app.rate_limit import GeminiRateLimiter, LimitedModels
+from stats import summarize
+
+PROMPT = "x" * 2000
+
+
+class QuotaModel:
+    """`client.aio.models` stand-in enforcing `rpm` and `tpm` with a one-second burst."""
+
+    def __init__(self, rpm: float, tpm: float, latency: float, tail_probability: float = 0.0,
+                 tail_factor: float = 10.0, retry_hint: bool = False):
+        self.rpm = rpm
+        self.tpm = tpm
+        self.latency = latency
+        self.tail_probability = tail_probability
+        self.tail_factor = tail_factor
+        self.retry_hint = retry_hint
+        self.levels = [rpm / 60, tpm / 60]
+        self.updated = time.monotonic()
+        self.accepted = 0
+        self.rejected = 0
+
+    def _admit(self, tokens: int) -> bool:
+        now = time.monotonic()
+        elapsed, self.updated = now - self.updated, now
+        self.levels = [min(limit / 60, level + elapsed * limit / 60) for level, limit in zip(self.levels, (self.rpm, self.tpm))]
+        if self.levels[0] < 1 or self.levels[1] < tokens:
+            return False
+        self.levels = [self.levels[0] - 1, self.levels[1] - tokens]
+        return True
+
+    async def generate_content(self, model, contents, config=None):
+        tokens = sum(len(c) for c in contents) // 4 + 50
+        if not self._admit(tokens):
+            self.rejected += 1
+            await asyncio.sleep(0.05)
+            details = [{"@type": "type.googleapis.com/google.rpc.RetryInfo", "retryDelay": "1s"}] if self.retry_hint else []
+            raise errors.ClientError(429, {"error": {"code": 429, "status": "RESOURCE_EXHAUSTED",
+                                                     "message": "Resource exhausted.", "details": details}})
+        self.accepted += 1
+        slow = random.random() < self.tail_probability
+        await asyncio.sleep(self.latency * (self.tail_factor if slow else random.uniform(0.8, 1.2)))
+        return SimpleNamespace(text="ok", usage_metadata=SimpleNamespace(total_token_count=tokens))
+
+
+async def run_mode(models, workers: int, duration: float, retry_blindly: bool) -> dict:
+    latencies = []
+    failures = 0
+    per_second = {}
+    start = time.monotonic()
+    deadline = start + duration
+
+    async def request():
+        while True:
+            try:
+                return await models.generate_content(model="gemini-2.5-flash", contents=[PROMPT])
+            except errors.ClientError:
+                if not retry_blindly:
+                    raise
+
+    async def worker():
+        nonlocal failures
+        while time.monotonic() < deadline:
+            started = time.monotonic()
+            try:
+                await request()
+            except Exception:
+                failures += 1
+                continue
+            latencies.append(time.monotonic() - started)
+            second = int(time.monotonic() - start)
+            per_second[second] = per_second.get(second, 0) + 1
+
+    await asyncio.gather(*[worker() for _ in range(workers)])
+    elapsed = time.monotonic() - start
+    steady = [per_second.get(s, 0) for s in range(2, int(duration))]
+    return {
+        "completed": len(latencies),
+        "failed": failures,
+        "goodput_rps": round(len(latencies) / elapsed, 2),
+        "steady_rps_min_max": [min(steady), max(steady)] if steady else None,
+        "latency_s": summarize(latencies),
+    }
+
+
+async def scenario(name: str, args, limiter_rpm, workers: int, tail_probability: float = 0.0,
+                   hedging: bool = False) -> dict:
+    server = QuotaModel(args.rpm, args.tpm, args.latency, tail_probability=tail_probability, retry_hint=args.retry_hint)
+    if limiter_rpm is None:
+        models = server
+    else:
+        limiter = GeminiRateLimiter(rpm=limiter_rpm, tpm=args.tpm, burst_seconds=1, hedging=hedging,
+                                    hedge_min_delay=args.latency, enabled=True)
+        models = LimitedModels(server, limiter, "bench")
+    result = await run_mode(models, workers, args.duration, retry_blindly=limiter_rpm is None)
+    result["server"] = {"accepted": server.accepted, "rejected_429": server.rejected}
+    if limiter_rpm is not None:
+        result["limiter"] = limiter.stats()
+    print(f"{name}: {result['goodput_rps']} req/s, {server.rejected} x 429, "
+          f"p95 {result['latency_s']['p95']} s", file=sys.stderr)
+    return result
+
+
+async def run(args) -> dict:
+    quiet = args.hedge_workers
+    return {
+        "none": await scenario("none", args, None, args.workers),
+        "limiter": await scenario("limiter", args, args.rpm, args.workers),
+        "overestimated": await scenario("overestimated", args, args.rpm * 3, args.workers),
+        "tail_without_hedging": await scenario("tail_without_hedging", args, args.rpm, quiet, args.tail_probability),
+        "tail_with_hedging": await scenario("tail_with_hedging", args, args.rpm, quiet, args.tail_probability, True),
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark the Gemini rate limiter against a stub model with a quota.")
+    parser.add_argument("--rpm", type=float, default=600, help="Requests per minute the stub model admits.")
+    parser.add_argument("--tpm", type=float, default=600000, help="Tokens per minute the stub model admits.")
+    parser.add_argument("--workers", type=int, default=40, help="Concurrent callers.")
+    parser.add_argument("--duration", type=float, default=15, help="Seconds per mode.")
+    parser.add_argument("--latency", type=float, default=0.5, help="Stub model latency (seconds).")
+    parser.add_argument("--hedge-workers", type=int, default=3, help="Concurrent callers in the hedging modes.")
+    parser.add_argument("--tail-probability", type=float, default=0.05, help="Share of 10x slower requests in the hedging modes.")
+    parser.add_argument("--retry-hint", action="store_true", help="Send a RetryInfo delay with every 429.")
+    args = parser.parse_args()
+    report = asyncio.run(run(args))
+    print(json.dumps({"config": vars(args), "modes": report}, indent=2))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,105 @@
+"""Benchmark: `resolve_product` index lookups vs. the wildcard-SQL search of rule R2.
+
+Generates a synthetic catalog of order lines (1M rows by default, over a smaller set
+of distinct products), loads it into an in-memory SQLite table and into a ProductIndex,
+and times the same product references through both. SQLite stands in for the scan
+BigQuery does for `LOWER(col) LIKE '%term%'` over three columns; a real BigQuery job
+adds its own scheduling latency on top.
+
+Usage:
+    python benchmarks/resolve_product_bench.py --rows 1000000 --products 50000 --lookups 50
+"""
+import argparse
+import json
+import os
+import random
+import sqlite3
+import statistics
+import sys
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from app.product_index import ProductIndex
+
+WORDS = ["harina", "trigo", "maiz", "acido", "ascorbico", "citrico", "lactosa", "almidon", "gelatina", "sorbitol",
+         "glicerina", "estearato", "magnesio", "celulosa", "microcristalina", "talco", "sacarosa", "povidona",
+         "polvo", "granulado", "sin", "gluten", "saco", "bidon", "25kg", "1kg", "farmaceutico", "grado"]
+
+
+def synthetic_products(count: int, rng: random.Random) -> list:
+    products = []
+    for i in range(count):
+        name = " ".join(rng.choice(WORDS) for _ in range(rng.randint(3, 6)))
+        products.append((f"{100000 + i}", f"SUP-{rng.randint(1, 999):03d}-{i:06d}", name))
+    return products
+
+
+def percentile(values: list, q: float) -> float:
+    values = sorted(values)
+    return values[min(len(values) - 1, int(q * len(values)))]
+
+
+def summarize(latencies: list) -> dict:
+    return {
+        "p50_ms": round(percentile(latencies, 0.5) * 1000, 4),
+        "p95_ms": round(percentile(latencies, 0.95) * 1000, 4),
+        "mean_ms": round(statistics.mean(latencies) * 1000, 4),
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark resolve_product against wildcard SQL.")
+    parser.add_argument("--rows", type=int, default=1_000_000, help="Order lines in the synthetic catalog.")
+    parser.add_argument("--products", type=int, default=50_000, help="Distinct products among those rows.")
+    parser.add_argument("--lookups", type=int, default=50, help="Product references to look up.")
+    parser.add_argument("--seed", type=int, default=7)
+    args = parser.parse_args()
+
+    rng = random.Random(args.seed)
+    products = synthetic_products(args.products, rng)
+
+    db = sqlite3.connect(":memory:")
+    db.execute("CREATE TABLE pedidos (Ebeln TEXT, Ematn TEXT, Idnlf TEXT, Txz01 TEXT, Menge REAL)")
+    db.executemany(
+        "INSERT INTO pedidos VALUES (?, ?, ?, ?, ?)",
+        ((f"45{i:08d}", *rng.choice(products), rng.randint(1, 500)) for i in range(args.rows)),
+    )
+
+    start = time.perf_counter()
+    index = ProductIndex(products)
+    build_s = time.perf_counter() - start
+
+    references = []
+    for product in rng.sample(products, args.lookups):
+        kind = rng.randrange(3)
+        references.append(product[0] if kind == 0 else product[1] if kind == 1 else " ".join(product[2].split()[:2]))
+
+    index_latencies, sql_latencies = [], []
+    for reference in references:
+        start = time.perf_counter()
+        index.search(reference)
+        index_latencies.append(time.perf_counter() - start)
+
+        term = f"%{reference.lower()}%"
+        start = time.perf_counter()
+        db.execute(
+            "SELECT DISTINCT Ematn, Idnlf, Txz01 FROM pedidos "
+            "WHERE LOWER(Ematn) LIKE ? OR LOWER(Idnlf) LIKE ? OR LOWER(Txz01) LIKE ? LIMIT 50",
+            (term, term, term),
+        ).fetchall()
+        sql_latencies.append(time.perf_counter() - start)
+
+    index_summary, sql_summary = summarize(index_latencies), summarize(sql_latencies)
+    print(json.dumps({
+        "rows": args.rows,
+        "distinct_products": len(index),
+        "index_build_s": round(build_s, 2),
+        "index_lookup": index_summary,
+        "wildcard_sql_lookup": sql_summary,
+        "p50_speedup": round(sql_summary["p50_ms"] / max(index_summary["p50_ms"], 1e-6), 1),
+    }, indent=2))
+
+
+if __name__ == "__main__":
+    main()
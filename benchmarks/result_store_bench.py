@@ -0,0 +1,121 @@
+"""Benchmark of the large-result layer of `execute_sql` (`app/result_store.py`).
+
+Builds synthetic `pedidos` results shaped like the BigQuery tool's output (dates and
+NUMERIC values as text) and compares, for every size:
+
+- the JSON the model would receive with the whole result vs. the summary;
+- the time to summarize the result in the after-tool stage;
+- the time of the follow-up tools: a sorted page, a filter and a grouped aggregation;
+- a follow-up on another replica, which rebuilds the table from the session state with
+  a stub BigQuery client;
+- a follow-up after the table was spilled to Parquet.
+
+Usage:
+    python benchmarks/result_store_bench.py --rows 1000 20000 100000
+"""
+import argparse
+import asyncio
+import json
+import os
+import random
+import sys
+import tempfile
+import time
+from types import SimpleNamespace
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from app import result_store
+from app.result_store import ResultStore
+from app.schema_catalog import CHARS_PER_TOKEN
+
+PRODUCTS = ["Vitamina C 1000 mg", "Magnesio citrato", "Omega 3 capsulas", "Colageno hidrolizado", "Melatonina 1.9 mg",
+            "Zinc picolinato", "Probiotico 10 cepas", "Hierro bisglicinato", "Vitamina D3 2000 UI", "Ashwagandha KSM-66"]
+QUERY = "SELECT Vbeln, Posnr, Ematn, Txz01, Kunnr, Menge, Netwr, Erdat FROM `p.d.pedidos`"
+
+
+def make_rows(count: int, seed: int = 7) -> list:
+    rng = random.Random(seed)
+    return [{
+        "Vbeln": f"{4500000000 + i // 4}",
+        "Posnr": f"{(i % 4 + 1) * 10:06d}",
+        "Ematn": f"{100000 + rng.randrange(len(PRODUCTS) * 40):08d}",
+        "Txz01": rng.choice(PRODUCTS),
+        "Kunnr": f"C{rng.randrange(300):05d}",
+        "Menge": f"{rng.randrange(1, 2000)}.000",
+        "Netwr": round(rng.uniform(5, 5000), 2),
+        "Erdat": f"2024-{rng.randrange(1, 13):02d}-{rng.randrange(1, 29):02d}",
+    } for i in range(count)]
+
+
+def stub_client_factory(rows: list):
+    def query_and_wait(query, project=None, max_results=None):
+        return [SimpleNamespace(items=row.items) for row in rows[:max_results]]
+    return lambda project: SimpleNamespace(query_and_wait=query_and_wait)
+
+
+def tokens(value) -> int:
+    return len(json.dumps(value, default=str, ensure_ascii=False)) // CHARS_PER_TOKEN
+
+
+async def timed(coroutine):
+    start = time.perf_counter()
+    result = await coroutine
+    return result, round(time.perf_counter() - start, 4)
+
+
+async def bench(count: int, directory: str) -> dict:
+    rows = make_rows(count)
+    store = ResultStore(stub_client_factory(rows), directory=directory)
+    state = {}
+    tool = SimpleNamespace(name="execute_sql")
+    context = SimpleNamespace(state=state)
+    response = {"status": "SUCCESS", "rows": rows}
+    summary, summarize_s = await timed(store.after_tool_callback(
+        tool, {"project_id": "p", "query": QUERY}, context, response))
+    result_id = summary["result_id"]
+
+    page, page_s = await timed(store.rows(result_id, count // 2, 50, None, "Netwr", True, state))
+    filtered, filter_s = await timed(store.filter(result_id, ["Menge >= 1500", "Txz01 contains 'vitamina'"],
+                                                  "Erdat", False, state))
+    grouped, aggregate_s = await timed(store.aggregate(result_id, ["count", "sum:Menge", "count_distinct:Vbeln"],
+                                                       ["Txz01"], None, "Menge_sum", True, state))
+    expected = sum(float(r["Menge"]) for r in rows if r["Txz01"] == grouped["rows"][0]["Txz01"])
+
+    replica = ResultStore(stub_client_factory(rows), directory=os.path.join(directory, "replica"))
+    rebuilt, rebuild_s = await timed(replica.aggregate(result_id, ["sum:Menge"], ["Txz01"], None, "Menge_sum", True, state))
+
+    spilling = ResultStore(stub_client_factory(rows), max_bytes=1, directory=os.path.join(directory, "spill"))
+    await spilling.after_tool_callback(tool, {"project_id": "p", "query": QUERY + " LIMIT 1000000"}, context, response)
+    spilled_id = next(k for k in state if k != "result:" + result_id).removeprefix("result:")
+    await spilling.after_tool_callback(tool, {"project_id": "p", "query": QUERY}, context, response)
+    spilled_page, spilled_s = await timed(spilling.rows(spilled_id, 0, 10, None, "", False, state))
+
+    return {
+        "rows": count,
+        "full_result_tokens": tokens(response),
+        "summary_tokens": tokens(summary),
+        "summarize_s": summarize_s,
+        "page": {"seconds": page_s, "tokens": tokens(page), "next_offset": page["next_offset"]},
+        "filter": {"seconds": filter_s, "tokens": tokens(filtered),
+                   "rows": filtered.get("row_count", len(filtered.get("rows", [])))},
+        "aggregate": {"seconds": aggregate_s, "tokens": tokens(grouped), "groups": len(grouped["rows"]),
+                      "top_sum_correct": abs(grouped["rows"][0]["Menge_sum"] - expected) < 1e-6},
+        "other_replica": {"seconds": rebuild_s, "status": rebuilt["status"], "rebuilt": replica.stats()["rebuilt"]},
+        "after_spill": {"seconds": spilled_s, "status": spilled_page["status"], "spilled": spilling.stats()["spilled"]},
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark the large-result layer of execute_sql.")
+    parser.add_argument("--rows", type=int, nargs="+", default=[1000, 20000, 100000], help="Result sizes (rows).")
+    args = parser.parse_args()
+    # The tool fetches at most RESULT_MAX_ROWS rows; a rebuild capped below the result size would be refused.
+    result_store.RESULT_MAX_ROWS = max(result_store.RESULT_MAX_ROWS, *args.rows)
+    with tempfile.TemporaryDirectory() as directory:
+        report = [asyncio.run(bench(count, os.path.join(directory, str(count)))) for count in args.rows]
+    print(json.dumps(report, indent=2))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,70 @@
+"""Offline evaluation of the deterministic router on a labelled question set.
+
+Each line of the evaluation file is {"question": ..., "route": ...}; `route` is a
+sub-agent name, or "fallback" for questions the orchestrator model should handle.
+Reports how many questions skip the orchestrator (coverage), how many of those go to
+the right sub-agent (precision), per-route recall and the classification latency.
+
+Usage:
+    python benchmarks/router_eval.py [--file benchmarks/routing_eval.jsonl] [--keywords-only]
+"""
+import argparse
+import collections
+import json
+import os
+import sys
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from app.router import KeywordClassifier, Router, build_router, load_examples
+
+DEFAULT_EVAL_FILE = os.path.join(os.path.dirname(os.path.abspath(__file__)), "routing_eval.jsonl")
+
+
+def evaluate(router: Router, examples: list) -> dict:
+    routed = correct = 0
+    per_route = collections.defaultdict(lambda: {"total": 0, "routed": 0, "correct": 0})
+    mistakes = []
+    start = time.perf_counter()
+    for question, expected in examples:
+        decision = router.decide(question)
+        stats = per_route[expected]
+        stats["total"] += 1
+        if decision["route"] is None:
+            if expected == "fallback":
+                stats["correct"] += 1
+            continue
+        routed += 1
+        stats["routed"] += 1
+        if decision["route"] == expected:
+            correct += 1
+            stats["correct"] += 1
+        else:
+            mistakes.append({"question": question, "expected": expected, "routed_to": decision["route"],
+                             "classifier": decision["classifier"], "confidence": round(decision["confidence"], 3)})
+    elapsed = time.perf_counter() - start
+    return {
+        "questions": len(examples),
+        "coverage": round(routed / len(examples), 3),
+        "precision": round(correct / routed, 3) if routed else None,
+        # For "fallback" this is the share of off-topic questions left to the orchestrator.
+        "per_route_recall": {route: round(s["correct"] / s["total"], 3) for route, s in sorted(per_route.items())},
+        "mean_classify_us": round(1e6 * elapsed / len(examples), 1),
+        "mistakes": mistakes,
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Evaluate the deterministic router offline.")
+    parser.add_argument("--file", default=DEFAULT_EVAL_FILE, help="Labelled JSONL question set.")
+    parser.add_argument("--keywords-only", action="store_true", help="Disable the local embedding classifier.")
+    args = parser.parse_args()
+
+    examples = load_examples(args.file)
+    router = Router([KeywordClassifier()]) if args.keywords_only else build_router()
+    print(json.dumps(evaluate(router, examples), indent=2, ensure_ascii=False))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,102 @@
+"""Concurrent bulk session operations for a deployed agent engine.
+
+Creates, lists, fetches or deletes the sessions of many users at once through an ADK
+session service (`VertexAiSessionService` for a deployment, `InMemorySessionService`
+to try it offline), with at most `concurrency` requests in flight. Every item is timed
+and progress is printed as items complete.
+"""
+import asyncio
+import sys
+import time
+
+from stats import summarize
+
+OPERATIONS = ["create", "list", "get", "delete"]
+
+
+async def run_bulk(items: list, operation, concurrency: int = 16, label: str = "items", progress=None) -> dict:
+    """Runs `await operation(item)` for every item and returns per-item results and timings.
+
+    Failures do not stop the batch: they are reported per item.
+    """
+    progress = progress if progress is not None else sys.stderr
+    semaphore = asyncio.Semaphore(concurrency)
+    done = 0
+    start = time.perf_counter()
+
+    async def run(item) -> dict:
+        nonlocal done
+        async with semaphore:
+            item_start = time.perf_counter()
+            result = {"item": item}
+            try:
+                result["result"] = await operation(item)
+                result["ok"] = True
+            except Exception as e:
+                result["ok"] = False
+                result["error"] = f"{type(e).__name__}: {e}"
+            result["seconds"] = round(time.perf_counter() - item_start, 4)
+        done += 1
+        progress.write(f"\r{label}: {done}/{len(items)}")
+        progress.flush()
+        return result
+
+    results = await asyncio.gather(*[run(item) for item in items])
+    if items:
+        progress.write("\n")
+    failed = [r for r in results if not r["ok"]]
+    return {
+        "operation": label,
+        "total": len(results),
+        "succeeded": len(results) - len(failed),
+        "failed": len(failed),
+        "duration_s": round(time.perf_counter() - start, 3),
+        "item_seconds": summarize([r["seconds"] for r in results]),
+        "items": results,
+    }
+
+
+def _session_summary(session) -> dict:
+    return {"id": session.id, "user_id": session.user_id, "last_update_time": session.last_update_time}
+
+
+async def bulk_sessions(session_service, app_name: str, operation: str, user_ids: list, sessions_per_user: int = 1,
+                        concurrency: int = 16) -> dict:
+    """Applies a session operation to every user.
+
+    `create` creates `sessions_per_user` sessions per user, `list` lists each user's
+    sessions, and `get` / `delete` first list each user's sessions and then fetch or
+    delete every one of them.
+    """
+    if operation not in OPERATIONS:
+        raise ValueError(f"Unknown operation '{operation}'. Use one of {OPERATIONS}.")
+
+    if operation == "create":
+        async def create(user_id):
+            return _session_summary(await session_service.create_session(app_name=app_name, user_id=user_id))
+        items = [u for u in user_ids for _ in range(sessions_per_user)]
+        return await run_bulk(items, create, concurrency, label="create")
+
+    async def list_user(user_id):
+        response = await session_service.list_sessions(app_name=app_name, user_id=user_id)
+        return [_session_summary(s) for s in response.sessions]
+
+    listed = await run_bulk(user_ids, list_user, concurrency, label="list")
+    if operation == "list":
+        return listed
+
+    sessions = [(r["item"], s["id"]) for r in listed["items"] if r["ok"] for s in r["result"]]
+
+    if operation == "get":
+        async def get(item):
+            session = await session_service.get_session(app_name=app_name, user_id=item[0], session_id=item[1])
+            if session is None:
+                raise LookupError(f"Session {item[1]} not found.")
+            return {**_session_summary(session), "events": len(session.events), "state_keys": sorted(session.state)}
+        result = await run_bulk(sessions, get, concurrency, label="get")
+    else:
+        async def delete(item):
+            await session_service.delete_session(app_name=app_name, user_id=item[0], session_id=item[1])
+        result = await run_bulk(sessions, delete, concurrency, label="delete")
+    result["list"] = {k: v for k, v in listed.items() if k != "items"}
+    return result
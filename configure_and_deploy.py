@@ -1,76 +1,309 @@
 import json
 import argparse
 import asyncio
+import contextlib
+import functools
+import hashlib
 import os
-from vertexai.agent_engines import AdkApp
-import vertexai
+import subprocess
+import sys
+import threading
+import time
 
-from app.agent import root_agent
+import cachetools
 
-from google.adk.sessions import VertexAiSessionService
+# Vertex AI, ADK and the agent itself are imported by the commands that need them, so
+# commands like `hello` or `list_deployments` do not pay for importing the whole agent.
+from app.schema_catalog import CATALOG_FILE, load_catalog, refresh_catalog, savings_report
 
 GCP_PROJECT="alberto-gonzalez-sandbox"
 #GCP_PROJECT="667925560760"
 GCP_REGION= "europe-west1" #"us-central1"
 STAGING_BUCKET = "gs://2025_09_alifarma_agente_datos"
-ENGINE_FILE = "engine.json"
-
-client = vertexai.Client(project=GCP_PROJECT, location=GCP_REGION)
-vertexai.init(
-    project=GCP_PROJECT,
-    location=GCP_REGION,
-    staging_bucket=STAGING_BUCKET,
-)
-
-def save_engine(data: dict):
-    with open(ENGINE_FILE, "w") as f:
-        json.dump(data, f)
+REQUIREMENTS = [
+    "google-cloud-aiplatform[agent_engines,adk]==1.117.0",
+    "cloudpickle==3.1.1",
+    "pydantic==2.11.9",
+    "google-adk==1.15.1",
+    "cachetools==6.2.0",
+    "sqlparse==0.5.3",
+    "pypdf==5.1.0",
+    "pyarrow==26.0.0",
+    "duckdb==1.5.6",
+    "pyyaml==6.0.3",
+]
+EXTRA_PACKAGES = ["./app"]
+ENABLE_TRACING = True
+# Profile of app/agent_profiles.yaml (models, thinking budgets, output caps, temperatures) deployed by default.
+AGENT_PROFILE = os.getenv("AGENT_PROFILE", "default")
+# How long a fetched engine handle is reused before asking Vertex AI again (seconds).
+ENGINE_HANDLE_TTL = float(os.getenv("ENGINE_HANDLE_TTL", "300"))
+
+# Cold-import budgets checked by `import_profile --check`: (seconds, modules imported). tests/test_import_budget.py
+# always checks the module count, and the seconds only with IMPORT_BUDGET_CHECK_SECONDS=true. Measured on the lazy tree (app.agent: 4.3-5.1 s and 2955 modules under -X importtime, the CLI:
+# ~0.05 s and 80) plus a small margin; the eager tree imported app.agent with 3213 modules.
+IMPORT_BUDGETS = {
+    "app.agent": (float(os.getenv("IMPORT_BUDGET_AGENT_SECONDS", "5.5")), int(os.getenv("IMPORT_BUDGET_AGENT_MODULES", "3050"))),
+    "configure_and_deploy": (float(os.getenv("IMPORT_BUDGET_CLI_SECONDS", "0.25")), int(os.getenv("IMPORT_BUDGET_CLI_MODULES", "100"))),
+}
+
+# Instruction size budgets checked by `build_prompts --check` and before every deploy (tokens).
+PROMPT_TOKEN_BUDGETS = {
+    "calidad_agent": int(os.getenv("PROMPT_TOKEN_BUDGET_CALIDAD", "6000")),
+    "compras_agent": int(os.getenv("PROMPT_TOKEN_BUDGET_COMPRAS", "6000")),
+    "pedidos_agent": int(os.getenv("PROMPT_TOKEN_BUDGET_PEDIDOS", "6000")),
+}
+
+@functools.lru_cache(maxsize=None)
+def get_client():
+    """Vertex AI client, created (and the SDK initialized) on first use."""
+    import vertexai
+    vertexai.init(
+        project=GCP_PROJECT,
+        location=GCP_REGION,
+        staging_bucket=STAGING_BUCKET,
+    )
+    return vertexai.Client(project=GCP_PROJECT, location=GCP_REGION)
+
+_engine_handles = cachetools.TTLCache(maxsize=32, ttl=ENGINE_HANDLE_TTL)
+_engine_handles_lock = threading.Lock()
+
+def get_engine(resource_name: str):
+    """Remote engine handle, cached per resource name for ENGINE_HANDLE_TTL seconds."""
+    with _engine_handles_lock:
+        remote_app = _engine_handles.get(resource_name)
+    if remote_app is None:
+        remote_app = get_client().agent_engines.get(name=resource_name)
+        with _engine_handles_lock:
+            _engine_handles[resource_name] = remote_app
+    return remote_app
+
+def forget_engine(resource_name: str):
+    with _engine_handles_lock:
+        _engine_handles.pop(resource_name, None)
+
+@functools.lru_cache(maxsize=None)
+def get_registry():
+    """Local SQLite registry of engines and sessions (imports engine.json the first time)."""
+    from registry import Registry
+    return Registry()
 
 def load_engine() -> dict:
+    """Default resource name, agent name, deploy hash, user and session for commands given none."""
+    return get_registry().current()
+
+def refresh_schema_catalog(check: bool = False) -> bool:
+    """Snapshots the BigQuery table schemas into the catalog. Returns True if they changed."""
+    catalog, changes = refresh_catalog(write=not check)
+    if not changes:
+        print(f"Schema catalog v{catalog['version']} is up to date.")
+        return False
+    action = "would be updated" if check else f"updated to v{catalog['version']}"
+    print(f"Schema catalog {action} ({CATALOG_FILE}):")
+    for change in changes:
+        print(f"  {change}")
+    if not check:
+        from app.agent import apply_schema_catalog
+        apply_schema_catalog(catalog)
+    return True
+
+def ingest_documents(uris: list = None, workers: int = 8, processes: int = 4, limit: int = None,
+                     force: bool = False, prune: bool = False) -> dict:
+    """Extracts the page text of the agent's PDFs into the page store shipped in app/."""
+    from google.cloud import bigquery, storage
+
+    from app.page_store import page_store
+    from app.schema_catalog import AGENT_TABLES, CATALOG_DATASET, CATALOG_PROJECT
+    from ingest_documents import ingest, list_storage_uris
+
+    if not uris:
+        catalog = load_catalog()
+        tables = sorted({t for names in AGENT_TABLES.values() for t in names})
+        if catalog:
+            # Only the tables whose schema has the PDF path.
+            tables = [t for t in tables if any(c[0].lower() == "storage_uri" for c in catalog["tables"].get(t, {}).get("columns", []))]
+        uris = list_storage_uris(bigquery.Client(project=CATALOG_PROJECT), CATALOG_PROJECT, CATALOG_DATASET, tables)
+        print(f"Found {len(uris)} documents in {len(tables)} tables.")
+    if limit:
+        uris = uris[:limit]
+    report = ingest(uris, page_store, storage.Client(), workers=workers, processes=processes, force=force,
+                    prune=prune and limit is None)
+    print(json.dumps(report, indent=2))
+    return report
+
+def sync_local_mirror(force: bool = False) -> dict:
+    """Snapshots the agent tables modified since their last sync into the local DuckDB mirror (LOCAL_MIRROR_DIR)."""
+    from google.cloud import bigquery
+
+    from app.local_mirror import LocalMirror
+
+    mirror = LocalMirror(lambda project: bigquery.Client(project=project))
+    start = time.perf_counter()
+    report = mirror.sync(force=force)
+    print(json.dumps({**report, "seconds": round(time.perf_counter() - start, 2), "tables": mirror.status()}, indent=2))
+    return report
+
+def schema_report():
+    """Prints the estimated tool calls and tokens saved per question by the schema catalog."""
+    catalog = load_catalog()
+    if catalog is None:
+        print("No schema catalog found. Run refresh_schema_catalog first.")
+        return
+    from app.agent import calidad_agent, compras_agent, pedidos_agent
+    instructions = {agent.name: agent.instruction for agent in (calidad_agent, compras_agent, pedidos_agent)}
+    print(f"Schema catalog v{catalog['version']} ({catalog['generated_at']})")
+    print(json.dumps(savings_report(catalog, instructions), indent=2))
+
+def build_prompts(check: bool = False, count_tokens: bool = False) -> bool:
+    """Compiles the sub-agent instructions and prints their tokens per section.
+
+    With `count_tokens` the model's tokenizer is used (one Vertex AI call per section);
+    otherwise tokens are estimated from the length. With `check`, returns False if an
+    instruction is over its budget.
+    """
+    from app.prompts import estimate_tokens, prompt_report
+
+    counter = estimate_tokens
+    if count_tokens:
+        from app.documents import DOCUMENT_MODEL, get_genai_client
+
+        def counter(text: str) -> int:
+            return get_genai_client().models.count_tokens(model=DOCUMENT_MODEL, contents=text).total_tokens if text else 0
+
+    report = prompt_report(load_catalog(), count_tokens=counter)
+    within_budget = True
+    print(f"{'agent':<16} {'tokens':>7} {'budget':>7} {'shared prefix':>14}  sections")
+    for agent_name, entry in report.items():
+        budget = PROMPT_TOKEN_BUDGETS.get(agent_name)
+        over = budget is not None and entry["tokens"] > budget
+        within_budget = within_budget and not over
+        sections = ", ".join(f"{section}={tokens}" for section, tokens in entry["sections"].items())
+        print(f"{agent_name:<16} {entry['tokens']:>7} {budget or '-':>7} {entry['shared_prefix_tokens']:>14}  {sections}"
+              + ("  OVER BUDGET" if over else ""))
+    if check:
+        print("OK: every instruction is within its budget." if within_budget else "Some instructions are over their token budget.")
+    return within_budget
+
+def deploy_fingerprint(name: str, profile: str = AGENT_PROFILE) -> str:
+    """Content hash of everything a deployment is built from: app/, requirements, deploy config and profile.
+
+    The agent instructions are rendered from files in app/ (prompts and schema catalog),
+    so they are covered without importing the agent.
+    """
+    digest = hashlib.sha256()
+    config = {
+        "display_name": name,
+        "staging_bucket": STAGING_BUCKET,
+        "requirements": REQUIREMENTS,
+        "extra_packages": EXTRA_PACKAGES,
+        "enable_tracing": ENABLE_TRACING,
+        "profile": profile,
+        "python_version": f"{sys.version_info.major}.{sys.version_info.minor}",
+    }
+    digest.update(json.dumps(config, sort_keys=True).encode("utf-8"))
+    for package in EXTRA_PACKAGES:
+        for root, dirs, files in os.walk(package):
+            dirs[:] = sorted(d for d in dirs if d != "__pycache__")
+            for file_name in sorted(files):
+                if file_name.endswith((".pyc", ".tmp")):
+                    continue
+                path = os.path.join(root, file_name)
+                digest.update(os.path.relpath(path, package).replace(os.sep, "/").encode("utf-8") + b"\0")
+                with open(path, "rb") as f:
+                    digest.update(hashlib.sha256(f.read()).digest())
+    return digest.hexdigest()
+
+def find_deployment(name: str):
+    """Existing engine named `name`: the registered resource name first, else a server-side display name filter."""
+    engine = get_registry().engine_by_agent_name(name)
+    resource_name = engine["resource_name"] if engine else None
+    if resource_name:
+        try:
+            return get_engine(resource_name)
+        except Exception as e:
+            print(f"Stored deployment {resource_name} is not available ({e}). Searching by name.")
+    for deployment in get_client().agent_engines.list(config={"filter": f'display_name="{name}"'}):
+        return deployment
+    return None
+
+@contextlib.contextmanager
+def _timed_phase(timings: dict, phase: str):
+    start = time.perf_counter()
     try:
-        with open(ENGINE_FILE, "r") as f:
-            data = json.load(f)
-    except FileNotFoundError:
-        data = {}
-    return data
-
-def deploy(name: str):
-    app = AdkApp(
-            agent=root_agent,
-            enable_tracing=True,
-        )
-
-    # Search for existing deployment
-    existing_deployment = None
-    print(f"Searching for existing deployments named '{name}'...")
+        yield
+    finally:
+        timings[phase] = round(timings.get(phase, 0) + time.perf_counter() - start, 2)
+
+def deploy(name: str, force: bool = False, profile: str = AGENT_PROFILE):
+    # Read when app/ is imported: by the agent built here and, through env_vars, by the deployed one.
+    os.environ["AGENT_PROFILE"] = profile
+    from app.agent_config import load_profile
     try:
-        deployments = client.agent_engines.list()
-        for deployment in deployments:
-            if deployment.api_resource.display_name == name:
-                existing_deployment = deployment
-                break
-    except Exception as e:
-        print(f"Warning: Could not list existing deployments. Will attempt to create a new one. Error: {e}")
+        settings = load_profile(profile)
+    except (OSError, ValueError) as e:
+        print(f"ERROR: Not deploying. {e}")
+        return
+    print(f"Agent profile '{profile}': " + ", ".join(
+        f"{owner}={entry.describe()}" for section in settings.values() for owner, entry in section.items()))
+
+    timings = {}
+    with _timed_phase(timings, "schema_catalog"):
+        try:
+            refresh_schema_catalog()
+        except Exception as e:
+            print(f"Warning: Could not refresh the schema catalog, deploying the current one. Error: {e}")
+
+    with _timed_phase(timings, "prompts"):
+        prompts_ok = build_prompts(check=True)
+    if not prompts_ok:
+        print("ERROR: Not deploying. Shorten the instructions or raise PROMPT_TOKEN_BUDGET_<AGENT>.")
+        return
+
+    with _timed_phase(timings, "fingerprint"):
+        fingerprint = deploy_fingerprint(name, profile)
+
+    print(f"Looking up deployment '{name}'...")
+    existing_deployment = None
+    with _timed_phase(timings, "lookup"):
+        try:
+            existing_deployment = find_deployment(name)
+        except Exception as e:
+            print(f"Warning: Could not look up existing deployments. Will attempt to create a new one. Error: {e}")
+
+    engine = get_registry().engine_by_agent_name(name) or {}
+    if (existing_deployment and not force and engine.get("deploy_hash") == fingerprint
+            and engine.get("resource_name") == existing_deployment.api_resource.name):
+        print(f"Deployment {existing_deployment.api_resource.name} is up to date ({fingerprint[:12]}). Nothing to deploy.")
+        print(f"Deploy phases (s): {json.dumps(timings)}")
+        return
+
+    with _timed_phase(timings, "build_app"):
+        from vertexai.agent_engines import AdkApp
+        from app.agent import root_agent
+
+        app = AdkApp(
+                agent=root_agent,
+                enable_tracing=ENABLE_TRACING,
+            )
+    config = {
+        "displayName": name,
+        "staging_bucket": STAGING_BUCKET,
+        "requirements": REQUIREMENTS,
+        "extra_packages": EXTRA_PACKAGES,
+        "env_vars": {"AGENT_PROFILE": profile},
+    }
 
     resource_name = None
     if existing_deployment:
         print(f"Found existing deployment: {existing_deployment.api_resource.name}. Attempting to update.")
         try:
-            remote_app = client.agent_engines.update(
-                name=existing_deployment.api_resource.name,
-                agent=app,
-                config={
-                    "displayName": name,
-                    "staging_bucket": STAGING_BUCKET,
-                    "requirements" : [
-                        "google-cloud-aiplatform[agent_engines,adk]==1.117.0",
-                        "cloudpickle==3.1.1",
-                        "pydantic==2.11.9",
-                        "google-adk==1.15.1",
-                    ],
-                    "extra_packages": ["./app"],
-                },
-            )
+            with _timed_phase(timings, "package_upload_update"):
+                remote_app = get_client().agent_engines.update(
+                    name=existing_deployment.api_resource.name,
+                    agent=app,
+                    config=config,
+                )
+            forget_engine(remote_app.api_resource.name)
             print(f"Successfully updated deployment: {remote_app.api_resource.name}")
             resource_name = remote_app.api_resource.name
         except Exception as e:
@@ -80,29 +313,41 @@ def deploy(name: str):
     else:
         print(f"No existing agent found with name '{name}'. Creating a new one.")
         try:
-            remote_app = client.agent_engines.create(
-                agent=app,
-                config={
-                    "displayName": name,
-                    "staging_bucket": STAGING_BUCKET,
-                    "requirements" : [
-                        "google-cloud-aiplatform[agent_engines,adk]==1.117.0",
-                        "cloudpickle==3.1.1",
-                        "pydantic==2.11.9",
-                        "google-adk==1.15.1",
-                    ],
-                    "extra_packages": ["./app"],
-                },
-            )
+            with _timed_phase(timings, "package_upload_create"):
+                remote_app = get_client().agent_engines.create(
+                    agent=app,
+                    config=config,
+                )
             print(f"Created remote app: {remote_app.api_resource.name}")
             resource_name = remote_app.api_resource.name
         except Exception as e:
             print(f"ERROR: Failed to create deployment: {e}")
             return # Stop if create fails
 
+    # build_app is only the agent import and AdkApp. Pickling, the staging upload and the remote build all
+    # happen inside one SDK call, so they are timed together as package_upload_update/create.
+    print(f"Deploy phases (s): {json.dumps(timings)}")
+
     if resource_name:
-        save_engine({"resource_name": resource_name, "agent_name": name})
-        print(f"Resource name and agent name saved to {ENGINE_FILE}")
+        get_registry().record_engine(resource_name, agent_name=name, deploy_hash=fingerprint)
+        print(f"Resource name, agent name and deploy hash saved to {get_registry().path}")
+
+def show_registry(agent_name: str = None, user_id: str = None) -> None:
+    """Prints the registered engines and sessions with their usage stats."""
+    registry = get_registry()
+    current = registry.current()
+    print(f"Registry: {registry.path}")
+    print("Engines:")
+    for engine in registry.engines(agent_name):
+        marker = "*" if engine["resource_name"] == current.get("resource_name") else " "
+        print(f" {marker} {engine['agent_name'] or '-'}: {engine['resource_name']} (deploy {(engine['deploy_hash'] or '-')[:12]})")
+    print("Sessions:")
+    engine = registry.engine_by_agent_name(agent_name) if agent_name else None
+    for session in registry.sessions(resource_name=engine["resource_name"] if engine else None, user_id=user_id):
+        marker = "*" if session["session_id"] == current.get("session_id") else " "
+        latency = f"{session['last_latency_s']:.2f}s" if session["last_latency_s"] is not None else "-"
+        print(f" {marker} {session['user_id']}/{session['session_id']}: {session['turns']} turns, "
+              f"{session['errors']} errors, last latency {latency}")
 
 def hello():
     print("Hello, Alifarma!")
@@ -117,16 +362,14 @@ async def create_session(resource_name: str = None, user_id: str = None):
         raise ValueError("user_id must be provided.")
 
 
+    from google.adk.sessions import VertexAiSessionService
     session_service = VertexAiSessionService(project=GCP_PROJECT, location=GCP_REGION)
 
     session_service = await session_service.create_session(app_name=resource_name, user_id=user_id)
 
     session_id = session_service.id
 
-    engine_data["user_id"] = user_id
-    engine_data["session_id"] = session_id
-    engine_data["resource_name"] = resource_name
-    save_engine(engine_data)
+    get_registry().record_session(resource_name, user_id, session_id)
 
     print(f"--- Examining Session Properties ---")
     print(f"ID (`id`):                {session_service.id}")
@@ -155,7 +398,7 @@ def get_session(resource_name: str = None, user_id: str = None, session_id: str
         if session_id is None:
             raise ValueError("session_id must be provided.")
 
-    remote_app = client.agent_engines.get(name=resource_name)
+    remote_app = get_engine(resource_name)
     session = remote_app.get_session(user_id=user_id, session_id=session_id)
     print("Session details:")
     print(f"  ID: {session['id']}")
@@ -165,7 +408,7 @@ def get_session(resource_name: str = None, user_id: str = None, session_id: str
 
 def list_deployments() -> None:
     """Lists all deployments."""
-    deployments = client.agent_engines.list()
+    deployments = get_client().agent_engines.list()
     if not deployments:
         print("No deployments found.")
         return
@@ -185,7 +428,7 @@ def list_sessions(resource_name: str = None, user_id: str = None) -> None:
         if user_id is None:
             raise ValueError("user_id must be provided.")
 
-    remote_app = client.agent_engines.get(name=resource_name)
+    remote_app = get_engine(resource_name)
     sessions = remote_app.list_sessions(user_id=user_id)
     print(f"Sessions for user '{user_id}':")
     if not sessions:
@@ -202,16 +445,33 @@ def delete_deployment(resource_name: str = None) -> None:
         if not resource_name:
             raise ValueError("No resource_name found to delete. Provide one or deploy first.")
     
-    remote_app = client.agent_engines.get(name=resource_name)
+    remote_app = get_engine(resource_name)
     remote_app.delete(force=True)
+    forget_engine(resource_name)
     print(f"Deleted remote app: {resource_name}")
-    if os.path.exists(ENGINE_FILE):
-        os.remove(ENGINE_FILE)
-        print(f"Deleted {ENGINE_FILE}")
+    get_registry().remove_engine(resource_name)
+    print(f"Removed {resource_name} and its sessions from {get_registry().path}")
+    from registry import LEGACY_ENGINE_FILE
+    if os.path.exists(LEGACY_ENGINE_FILE):
+        os.remove(LEGACY_ENGINE_FILE)
+        print(f"Deleted {LEGACY_ENGINE_FILE}")
+
+
+async def send_message(resource_name: str = None, user_id: str = None, session_id: str = None, message: str = None,
+                       jsonl_path: str = None, collect: bool = True, quiet: bool = False,
+                       new_session: bool = False, pool_size: int = 5) -> list:
+    """Sends a message to the deployed agent (asynchronous) and returns the last events received.
 
+    Events are streamed through the event pipeline as they arrive: rendered to the console,
+    appended to `jsonl_path` if given and summarized by the metrics sink. At most the last
+    1000 events are kept in memory, and none with `collect=False`.
+
+    With `new_session`, `user_id` is the end user starting a conversation: the message goes to a
+    session taken from the registry-backed session pool instead of waiting on create_session,
+    and the pool is topped up to `pool_size` once the response is in.
+    """
+    from event_pipeline import ConsoleSink, EventPipeline, JsonlSink
 
-async def send_message(resource_name: str = None, user_id: str = None, session_id: str = None, message: str = None) -> list:
-    """Sends a message to the deployed agent (asynchronous) and returns a list of events."""
     engine_data = load_engine()
     
     if resource_name is None:
@@ -224,7 +484,20 @@ async def send_message(resource_name: str = None, user_id: str = None, session_i
         if user_id is None:
             raise ValueError("user_id must be provided.")
 
-    if session_id is None:
+    pool = None
+    if new_session:
+        if not message:
+            raise ValueError("message must be provided.")
+        from google.adk.sessions import VertexAiSessionService
+        from session_pool import RegistrySessionPool
+        pool = RegistrySessionPool(VertexAiSessionService(project=GCP_PROJECT, location=GCP_REGION), resource_name,
+                                   get_registry(), size=pool_size)
+        pooled = await pool.acquire(end_user=user_id)
+        print(f"{'Pooled' if pooled.pooled else 'New'} session {pooled.session_id} for end user {user_id} "
+              f"({pool.acquire_seconds[-1]:.3f}s)")
+        user_id, session_id = pooled.user_id, pooled.session_id
+        get_registry().record_session(resource_name, user_id, session_id)
+    elif session_id is None:
         session_id = engine_data.get("session_id")
         if session_id is None:
             raise ValueError("session_id must be provided.")
@@ -233,45 +506,41 @@ async def send_message(resource_name: str = None, user_id: str = None, session_i
         raise ValueError("message must be provided.")
 
     try:
-        remote_app = client.agent_engines.get(name=resource_name)
+        remote_app = get_engine(resource_name)
     except Exception as e:
         raise RuntimeError(f"Error getting agent engine '{resource_name}': {e}")
 
-    events_list = []
+    sinks = [] if quiet else [ConsoleSink()]
+    if jsonl_path:
+        sinks.append(JsonlSink(jsonl_path))
+    pipeline = EventPipeline(sinks, collect=collect)
+
     print(f"Sending message to session {session_id}:")
     print(f"Message: {message}\n")
     print("=" * 80)
     print("Response:\n")
 
-
-        
+    start = time.perf_counter()
     try:
-        async for event in remote_app.async_stream_query(
+        summary = await pipeline.run(remote_app.async_stream_query(
             user_id=user_id,
             session_id=session_id,
             message=message,
-        ):
-            events_list.append(event)
-            print(f"Event: {event}")
-            
- 
+        ))
     except Exception as e:
+        get_registry().record_turn(resource_name, user_id, session_id, time.perf_counter() - start, error=True)
         raise RuntimeError(f"Error sending message to session '{session_id}': {e}")
+    get_registry().record_turn(resource_name, user_id, session_id, time.perf_counter() - start)
+    if pool is not None:
+        # After the response, so the user never waits on it; the next new conversation takes these.
+        await pool.replenish()
 
-    print(f"\n\n{'=' * 80}")
-    print(f"Total events received: {len(events_list)}")
-    
-    # Mostrar un resumen de los eventos si hay alguno
-    if events_list:
-        print("\nEvent types received:")
-        event_types = {}
-        for event in events_list:
-            event_type = type(event).__name__
-            event_types[event_type] = event_types.get(event_type, 0) + 1
-        for event_type, count in event_types.items():
-            print(f"  - {event_type}: {count}")
-    
-    return events_list
+    print(f"{'=' * 80}")
+    print(json.dumps(summary, indent=2, ensure_ascii=False))
+    if jsonl_path:
+        print(f"Events written to {jsonl_path}")
+
+    return list(pipeline.events)
 
 def diagnose_agent(resource_name: str = None):
     """Diagnoses the agent deployment and configuration."""
@@ -288,7 +557,7 @@ def diagnose_agent(resource_name: str = None):
     
     try:
         print("\n1. Fetching agent information...")
-        remote_app = client.agent_engines.get(name=resource_name)
+        remote_app = get_engine(resource_name)
         print(f"   ✓ Agent found: {resource_name}")
         
         print("\n2. Agent API Resource details:")
@@ -320,6 +589,215 @@ def diagnose_agent(resource_name: str = None):
         traceback.print_exc()
         print("=" * 80)
 
+async def loadtest(resource_name: str = None, corpus: str = None, users: int = 10, sessions_per_user: int = 1,
+                   turns: int = 50, concurrency: int = 10, rate: float = 0.0, local: bool = False,
+                   output: str = None, seed: int = 0) -> dict:
+    """Replays a question corpus against a deployed engine (or the local stand-in) and reports latencies."""
+    import loadtest as lt
+
+    if local:
+        agent_engines = lt.LocalAgentEngines(seed=seed)
+        resource_name = resource_name or "local"
+    else:
+        agent_engines = get_client().agent_engines
+        if resource_name is None:
+            resource_name = load_engine().get("resource_name")
+            if not resource_name:
+                raise ValueError("No resource_name found. Deploy the agent first or use --local.")
+
+    questions = lt.load_corpus(corpus or lt.DEFAULT_CORPUS_FILE)
+    print(f"Load testing {resource_name}: {users} users x {sessions_per_user} sessions, {turns} turns, "
+          f"concurrency {concurrency}, rate {rate or 'unlimited'}/s, {len(questions)} questions")
+    report, samples = await lt.run_loadtest(
+        agent_engines, resource_name, questions, users=users, sessions_per_user=sessions_per_user,
+        turns=turns, concurrency=concurrency, rate=rate, seed=seed,
+    )
+    print(json.dumps(report, indent=2))
+    print("\nLatency histogram:")
+    print(lt.histogram([s["latency"] for s in samples if s["error"] is None]))
+    if output:
+        with open(output, "w") as f:
+            json.dump({**report, "samples": samples}, f, indent=1)
+        print(f"\nReport saved to {output}")
+    return report
+
+def get_session_service(resource_name: str = None, local: bool = False, local_delay: float = 0.0) -> tuple:
+    """(session_service, app_name): Vertex AI sessions of the engine, or a local in-memory stand-in."""
+    if local:
+        from loadtest import LocalSessionService
+        return LocalSessionService(delay=local_delay), resource_name or "local"
+    from google.adk.sessions import VertexAiSessionService
+    if resource_name is None:
+        resource_name = load_engine().get("resource_name")
+        if not resource_name:
+            raise ValueError("No resource_name found. Deploy the agent first.")
+    return VertexAiSessionService(project=GCP_PROJECT, location=GCP_REGION), resource_name
+
+async def session_pool_benchmark(resource_name: str = None, size: int = 10, users: int = 50, rate: float = 2.0,
+                                 max_idle: float = 1800, local: bool = False, local_delay: float = 0.4,
+                                 seed: int = 0) -> dict:
+    """Compares the first-message session latency of new users with and without a session pool."""
+    import random
+    from stats import summarize
+    from session_pool import SessionPool
+
+    session_service, resource_name = get_session_service(resource_name, local, local_delay)
+    rng = random.Random(seed)
+    arrivals = [rng.expovariate(rate) for _ in range(users)]
+
+    async def arrive(acquire) -> list:
+        created, timings = [], []
+        for delay in arrivals:
+            await asyncio.sleep(delay)
+            start = time.perf_counter()
+            created.append(await acquire())
+            timings.append(time.perf_counter() - start)
+        return created, timings
+
+    print(f"Direct create_session for {users} new users on {resource_name}...")
+    direct, direct_timings = await arrive(lambda: session_service.create_session(app_name=resource_name, user_id=f"direct-{rng.getrandbits(48):012x}"))
+    await asyncio.gather(*[session_service.delete_session(app_name=resource_name, user_id=s.user_id, session_id=s.id) for s in direct])
+
+    print(f"Session pool of {size} for {users} new users...")
+    pool = SessionPool(session_service, resource_name, size=size, max_idle=max_idle)
+    await pool.start()
+    pooled, pooled_timings = await arrive(lambda: pool.acquire(end_user=f"user-{rng.getrandbits(48):012x}"))
+    await pool.close()
+    await asyncio.gather(*[session_service.delete_session(app_name=resource_name, user_id=s.user_id, session_id=s.session_id) for s in pooled])
+
+    report = {
+        "direct_create_s": summarize(direct_timings, digits=4),
+        "pooled_acquire_s": summarize(pooled_timings, digits=4),
+        "pool": pool.stats(),
+    }
+    print(json.dumps(report, indent=2))
+    return report
+
+async def bulk_session_operation(operation: str, resource_name: str = None, user_ids: list = None,
+                                 user_prefix: str = None, users: int = 0, sessions_per_user: int = 1,
+                                 concurrency: int = 16, local: bool = False, output: str = None) -> dict:
+    """Creates, lists, fetches or deletes the sessions of many users concurrently."""
+    from bulk_sessions import bulk_sessions
+
+    user_ids = list(user_ids or []) + [f"{user_prefix}-{i:04d}" for i in range(users if user_prefix else 0)]
+    if not user_ids:
+        raise ValueError("Provide --user-ids or --user-prefix with --users.")
+
+    session_service, resource_name = get_session_service(resource_name, local)
+
+    print(f"{operation} sessions of {len(user_ids)} users on {resource_name} (concurrency {concurrency})")
+    report = await bulk_sessions(session_service, resource_name, operation, user_ids,
+                                 sessions_per_user=sessions_per_user, concurrency=concurrency)
+    if not local and operation in ("create", "delete"):
+        registry = get_registry()
+        for item in report["items"]:
+            if not item["ok"]:
+                continue
+            if operation == "create":
+                registry.record_session(resource_name, item["item"], item["result"]["id"], make_default=False)
+            else:
+                registry.remove_session(resource_name, item["item"][1])
+    print(json.dumps({k: v for k, v in report.items() if k != "items"}, indent=2))
+    for item in report["items"]:
+        if not item["ok"]:
+            print(f"  FAILED {item['item']}: {item['error']}")
+    if output:
+        with open(output, "w") as f:
+            json.dump(report, f, indent=1, default=str)
+        print(f"Report saved to {output}")
+    return report
+
+def profile_imports(module: str = "app.agent") -> dict:
+    """Cold-imports a module in a fresh interpreter and returns its import time and module count.
+
+    Uses `python -X importtime`, so the numbers include everything the module pulls in
+    and nothing this process has already imported.
+    """
+    code = (
+        "import json, sys, time\n"
+        "before = set(sys.modules)\n"
+        "start = time.perf_counter()\n"
+        f"import {module}\n"
+        "print(json.dumps({'seconds': time.perf_counter() - start, 'modules': len(set(sys.modules) - before)}))\n"
+    )
+    result = subprocess.run([sys.executable, "-X", "importtime", "-c", code],
+                            capture_output=True, text=True, cwd=os.path.dirname(os.path.abspath(__file__)))
+    if result.returncode != 0:
+        raise RuntimeError(f"Importing {module} failed:\n{result.stderr[-2000:]}")
+    imports = []
+    for line in result.stderr.splitlines():
+        if not line.startswith("import time:") or "|" not in line:
+            continue
+        self_us, cumulative_us, name = line[len("import time:"):].split("|")
+        if self_us.strip().isdigit():
+            imports.append({"module": name.strip(), "self_ms": int(self_us) / 1000, "cumulative_ms": int(cumulative_us) / 1000})
+    profile = json.loads(result.stdout.strip().splitlines()[-1])
+    profile["imports"] = imports
+    return profile
+
+def import_profile(module: str = "app.agent", top: int = 20, check: bool = False) -> bool:
+    """Prints the slowest imports of a module. With `check`, returns False if it is over its budget."""
+    profile = profile_imports(module)
+    print(f"Cold import of '{module}': {profile['seconds']:.2f} s, {profile['modules']} modules")
+    print(f"\n{'cumulative ms':>14} {'self ms':>10}  module")
+    for entry in sorted(profile["imports"], key=lambda e: e["cumulative_ms"], reverse=True)[:top]:
+        print(f"{entry['cumulative_ms']:>14.1f} {entry['self_ms']:>10.1f}  {entry['module']}")
+    if not check:
+        return True
+    if module not in IMPORT_BUDGETS:
+        print(f"\nNo import budget defined for '{module}'.")
+        return True
+    max_seconds, max_modules = IMPORT_BUDGETS[module]
+    within_budget = profile["seconds"] <= max_seconds and profile["modules"] <= max_modules
+    status = "OK" if within_budget else "OVER BUDGET"
+    print(f"\n{status}: budget is {max_seconds:.2f} s and {max_modules} modules.")
+    return within_budget
+
+# Span attributes shown next to each slow span, with their short labels.
+TRACE_REPORT_ATTRIBUTES = {
+    "tool.status": "status",
+    "cache.outcome": "cache",
+    "tool.short_circuit": "short_circuit",
+    "db.rows": "rows",
+    "db.bytes_processed": "bytes",
+    "agent.routed_by": "routed_by",
+    "gen_ai.usage.input_tokens": "input_tokens",
+    "gen_ai.usage.output_tokens": "output_tokens",
+}
+
+def trace_report(path: str, top: int = 5) -> dict:
+    """Ranks the slowest tools and sub-agents per turn from a TELEMETRY_FILE written by the agent.
+
+    Every trace is one turn. Prints the `top` slowest tool and agent spans of each turn and
+    returns per-tool and per-agent duration percentiles.
+    """
+    from app.telemetry import load_spans
+    from stats import summarize
+
+    spans = [s for s in load_spans(path) if s["name"].startswith(("tool ", "agent "))]
+    turns = {}
+    for span in spans:
+        span["duration_s"] = span["end"] - span["start"]
+        turns.setdefault(span["trace_id"], []).append(span)
+
+    for trace_id, turn in sorted(turns.items(), key=lambda t: min(s["start"] for s in t[1])):
+        turn_s = max(s["end"] for s in turn) - min(s["start"] for s in turn)
+        print(f"\nTurn {trace_id[:12]}... ({turn_s:.2f} s, {len(turn)} spans)")
+        for span in sorted(turn, key=lambda s: s["duration_s"], reverse=True)[:top]:
+            details = ", ".join(f"{label}={span['attributes'][key]}" for key, label in TRACE_REPORT_ATTRIBUTES.items()
+                                if key in span["attributes"])
+            print(f"  {span['duration_s']:>8.3f} s  {span['name']}  {details}")
+
+    durations = {}
+    for span in spans:
+        durations.setdefault(span["name"], []).append(span["duration_s"])
+    report = {name: {**summarize(values), "total": round(sum(values), 3)}
+              for name, values in sorted(durations.items(), key=lambda d: sum(d[1]), reverse=True)}
+    print(f"\n{'span':<32} {'count':>6} {'p50 s':>8} {'p95 s':>8} {'total s':>9}")
+    for name, stats in report.items():
+        print(f"{name:<32} {stats['count']:>6} {stats['p50']:>8.3f} {stats['p95']:>8.3f} {stats['total']:>9.3f}")
+    return report
+
 async def main():
     '''Main function to parse arguments and execute commands.'''
     parser = argparse.ArgumentParser(description="Deploy and manage Alifarma agent.")
@@ -328,6 +806,9 @@ async def main():
     # Comando 'deploy'
     parser_deploy = subparsers.add_parser("deploy", help="Deploys the agent to Vertex AI Agent Engines.")
     parser_deploy.add_argument("name", type=str, help="The name for the new agent engine.")
+    parser_deploy.add_argument("--force", action="store_true", help="Deploy even if nothing changed since the last deploy.")
+    parser_deploy.add_argument("--profile", type=str, default=AGENT_PROFILE,
+                               help="Agent profile of app/agent_profiles.yaml, e.g. default, low-latency or high-accuracy.")
 
     # Comando 'hello'
     subparsers.add_parser("hello", help="Prints a hello message.")
@@ -337,6 +818,11 @@ async def main():
     parser_create_session.add_argument("--resource-name", type=str, default=None, help="Resource name of the deployed agent. If omitted, uses the last deployed engine.")
     parser_create_session.add_argument("--user-id", type=str, help="The user ID for the new session.")
 
+    # Comando 'registry'
+    parser_registry = subparsers.add_parser("registry", help="Shows the locally registered engines and sessions.")
+    parser_registry.add_argument("--agent-name", type=str, default=None, help="Only this agent's engines and sessions.")
+    parser_registry.add_argument("--user-id", type=str, default=None, help="Only this user's sessions.")
+
     # Comando 'list_deployments'
     subparsers.add_parser("list_deployments", help="Lists all deployments.")
 
@@ -361,6 +847,82 @@ async def main():
     parser_send_message.add_argument("--resource-name", type=str, default=None, help="Resource name of the deployed agent. If omitted, uses the last deployed engine.")
     parser_send_message.add_argument("--user-id", type=str, help="The user ID for the session.")
     parser_send_message.add_argument("--session-id", type=str, help="The session ID to send the message to.")
+    parser_send_message.add_argument("--jsonl", type=str, default=None, help="Append every event to this JSONL file as it arrives.")
+    parser_send_message.add_argument("--no-collect", action="store_true", help="Do not keep events in memory, only the metrics summary.")
+    parser_send_message.add_argument("--quiet", action="store_true", help="Do not render the response, only print the summary.")
+    parser_send_message.add_argument("--new-session", action="store_true", help="Start a new conversation for --user-id in a session taken from the session pool.")
+    parser_send_message.add_argument("--pool-size", type=int, default=5, help="Ready sessions kept in the pool with --new-session.")
+
+    # Comando 'refresh_schema_catalog'
+    parser_refresh_catalog = subparsers.add_parser("refresh_schema_catalog", help="Snapshots the BigQuery table schemas into app/schema_catalog.json.")
+    parser_refresh_catalog.add_argument("--check", action="store_true", help="Only report schema changes, do not write the catalog.")
+
+    # Comando 'schema_report'
+    subparsers.add_parser("schema_report", help="Reports tool calls and tokens saved per question by the schema catalog.")
+
+    # Comando 'loadtest'
+    parser_loadtest = subparsers.add_parser("loadtest", help="Replays a question corpus concurrently and reports latency percentiles.")
+    parser_loadtest.add_argument("--resource-name", type=str, default=None, help="Resource name of the deployed agent. If omitted, uses the last deployed engine.")
+    parser_loadtest.add_argument("--corpus", type=str, default=None, help="Questions to replay (JSONL with a 'question' field or one per line). Defaults to benchmarks/routing_eval.jsonl.")
+    parser_loadtest.add_argument("--users", type=int, default=10, help="Number of simulated users.")
+    parser_loadtest.add_argument("--sessions-per-user", type=int, default=1, help="Sessions created per user.")
+    parser_loadtest.add_argument("--turns", type=int, default=50, help="Total number of messages to send.")
+    parser_loadtest.add_argument("--concurrency", type=int, default=10, help="Maximum number of messages in flight.")
+    parser_loadtest.add_argument("--rate", type=float, default=0.0, help="Mean new messages per second (Poisson arrivals). 0 means as fast as concurrency allows.")
+    parser_loadtest.add_argument("--local", action="store_true", help="Run against a local simulated engine instead of Vertex AI.")
+    parser_loadtest.add_argument("--output", type=str, default=None, help="Write the JSON report with every sample to this file.")
+    parser_loadtest.add_argument("--seed", type=int, default=0, help="Random seed for question choice and arrivals.")
+
+    # Comando 'bulk_sessions'
+    parser_bulk = subparsers.add_parser("bulk_sessions", help="Creates, lists, fetches or deletes the sessions of many users concurrently.")
+    parser_bulk.add_argument("operation", choices=["create", "list", "get", "delete"], help="Operation to apply to every user's sessions.")
+    parser_bulk.add_argument("--resource-name", type=str, default=None, help="Resource name of the deployed agent. If omitted, uses the last deployed engine.")
+    parser_bulk.add_argument("--user-ids", type=lambda v: [u for u in v.split(",") if u], default=None, help="Comma separated user IDs.")
+    parser_bulk.add_argument("--user-prefix", type=str, default=None, help="Generate user IDs <prefix>-0000, <prefix>-0001, ...")
+    parser_bulk.add_argument("--users", type=int, default=0, help="Number of user IDs to generate with --user-prefix.")
+    parser_bulk.add_argument("--sessions-per-user", type=int, default=1, help="Sessions to create per user (create only).")
+    parser_bulk.add_argument("--concurrency", type=int, default=16, help="Maximum number of requests in flight.")
+    parser_bulk.add_argument("--local", action="store_true", help="Use an in-memory session service instead of Vertex AI.")
+    parser_bulk.add_argument("--output", type=str, default=None, help="Write the full report with per-item results to this file.")
+
+    # Comando 'session_pool'
+    parser_pool = subparsers.add_parser("session_pool", help="Measures new-user session latency with and without a pre-warmed session pool.")
+    parser_pool.add_argument("--resource-name", type=str, default=None, help="Resource name of the deployed agent. If omitted, uses the last deployed engine.")
+    parser_pool.add_argument("--size", type=int, default=10, help="Ready sessions kept in the pool.")
+    parser_pool.add_argument("--users", type=int, default=50, help="Number of new users arriving.")
+    parser_pool.add_argument("--rate", type=float, default=2.0, help="Mean new users per second (Poisson arrivals).")
+    parser_pool.add_argument("--max-idle", type=float, default=1800, help="Seconds a ready session may wait before it is recycled.")
+    parser_pool.add_argument("--local", action="store_true", help="Use an in-memory session service with simulated latency.")
+    parser_pool.add_argument("--local-delay", type=float, default=0.4, help="Mean simulated session service latency with --local (seconds).")
+
+    # Comando 'import_profile'
+    parser_import_profile = subparsers.add_parser("import_profile", help="Profiles the cold-import time of a module.")
+    parser_import_profile.add_argument("module", type=str, nargs="?", default="app.agent", help="Module to import (default: app.agent).")
+    parser_import_profile.add_argument("--top", type=int, default=20, help="Number of slowest imports to show.")
+    parser_import_profile.add_argument("--check", action="store_true", help="Exit with an error if the module is over its import budget.")
+
+    # Comando 'ingest_documents'
+    parser_ingest = subparsers.add_parser("ingest_documents", help="Extracts the page text of the agent's PDFs into the local page store.")
+    parser_ingest.add_argument("--uris", type=str, nargs="*", default=None, help="GCS URIs to ingest (default: every storage_uri in the agent tables).")
+    parser_ingest.add_argument("--workers", type=int, default=8, help="Parallel downloads.")
+    parser_ingest.add_argument("--processes", type=int, default=4, help="Text extraction processes (0 extracts in the download threads).")
+    parser_ingest.add_argument("--limit", type=int, default=None, help="Ingest at most this many documents.")
+    parser_ingest.add_argument("--force", action="store_true", help="Re-extract documents whose generation did not change.")
+    parser_ingest.add_argument("--prune", action="store_true", help="Remove documents that are no longer listed.")
+
+    # Comando 'sync_local_mirror'
+    parser_sync_mirror = subparsers.add_parser("sync_local_mirror", help="Snapshots the modified agent tables into the local DuckDB mirror.")
+    parser_sync_mirror.add_argument("--force", action="store_true", help="Download every table, even if it did not change.")
+
+    # Comando 'build_prompts'
+    parser_build_prompts = subparsers.add_parser("build_prompts", help="Compiles the sub-agent instructions and reports their token counts.")
+    parser_build_prompts.add_argument("--check", action="store_true", help="Exit with an error if an instruction is over its token budget.")
+    parser_build_prompts.add_argument("--count-tokens", action="store_true", help="Count tokens with the model tokenizer instead of estimating them.")
+
+    # Comando 'trace_report'
+    parser_trace_report = subparsers.add_parser("trace_report", help="Ranks the slowest tools and agents per turn from a local telemetry file.")
+    parser_trace_report.add_argument("--file", type=str, default=os.getenv("TELEMETRY_FILE") or "traces.jsonl", help="OTLP/JSON file written with TELEMETRY_FILE.")
+    parser_trace_report.add_argument("--top", type=int, default=5, help="Number of slowest spans to show per turn.")
 
     # Comando 'diagnose'
     parser_diagnose = subparsers.add_parser("diagnose", help="Diagnoses the agent deployment.")
@@ -370,11 +932,13 @@ async def main():
     args = parser.parse_args()
 
     if args.command == "deploy":
-        deploy(args.name)
+        deploy(args.name, force=args.force, profile=args.profile)
     elif args.command == "hello":
         hello()
     elif args.command == "create_session":
         await create_session(resource_name=args.resource_name, user_id=args.user_id)
+    elif args.command == "registry":
+        show_registry(agent_name=args.agent_name, user_id=args.user_id)
     elif args.command == "list_deployments":
         list_deployments()
     elif args.command == "get_session":
@@ -384,7 +948,39 @@ async def main():
     elif args.command == "delete_deployment":
         delete_deployment(resource_name=args.resource_name)
     elif args.command == "send_message":
-        await send_message(resource_name=args.resource_name, user_id=args.user_id, session_id=args.session_id, message=args.message)
+        await send_message(resource_name=args.resource_name, user_id=args.user_id, session_id=args.session_id, message=args.message,
+                           jsonl_path=args.jsonl, collect=not args.no_collect, quiet=args.quiet,
+                           new_session=args.new_session, pool_size=args.pool_size)
+    elif args.command == "refresh_schema_catalog":
+        refresh_schema_catalog(check=args.check)
+    elif args.command == "schema_report":
+        schema_report()
+    elif args.command == "loadtest":
+        await loadtest(resource_name=args.resource_name, corpus=args.corpus, users=args.users,
+                       sessions_per_user=args.sessions_per_user, turns=args.turns, concurrency=args.concurrency,
+                       rate=args.rate, local=args.local, output=args.output, seed=args.seed)
+    elif args.command == "bulk_sessions":
+        await bulk_session_operation(args.operation, resource_name=args.resource_name, user_ids=args.user_ids,
+                                     user_prefix=args.user_prefix, users=args.users,
+                                     sessions_per_user=args.sessions_per_user, concurrency=args.concurrency,
+                                     local=args.local, output=args.output)
+    elif args.command == "session_pool":
+        await session_pool_benchmark(resource_name=args.resource_name, size=args.size, users=args.users, rate=args.rate,
+                                     max_idle=args.max_idle, local=args.local, local_delay=args.local_delay)
+    elif args.command == "import_profile":
+        if not import_profile(args.module, top=args.top, check=args.check):
+            sys.exit(1)
+    elif args.command == "ingest_documents":
+        ingest_documents(uris=args.uris, workers=args.workers, processes=args.processes, limit=args.limit,
+                         force=args.force, prune=args.prune)
+    elif args.command == "sync_local_mirror":
+        if sync_local_mirror(force=args.force)["errors"]:
+            sys.exit(1)
+    elif args.command == "build_prompts":
+        if not build_prompts(check=args.check, count_tokens=args.count_tokens):
+            sys.exit(1)
+    elif args.command == "trace_report":
+        trace_report(args.file, top=args.top)
     elif args.command == "diagnose":
         diagnose_agent(resource_name=args.resource_name)
 
@@ -0,0 +1,155 @@
+"""Streaming pipeline for the events returned by `async_stream_query`.
+
+Every event is handed to a list of sinks as soon as it arrives and then dropped, so
+memory stays bounded however long the response is. Sinks render text to the console,
+append events to a JSONL file or collect metrics (time to first token, tool call
+durations, function call / response pairing).
+"""
+import collections
+import json
+import sys
+import time
+
+
+def event_to_dict(event) -> dict:
+    """Events arrive as dicts from a deployed AdkApp and as pydantic models locally."""
+    if isinstance(event, dict):
+        return event
+    if hasattr(event, "model_dump"):
+        return event.model_dump(mode="json", exclude_none=True)
+    return {"repr": repr(event)}
+
+
+def event_parts(event: dict) -> list:
+    content = event.get("content") or {}
+    return content.get("parts") or []
+
+
+class ConsoleSink:
+    """Prints model text as it streams in, and one line per tool call and response."""
+
+    def __init__(self, stream=None):
+        self.stream = stream or sys.stdout
+
+    def on_event(self, event: dict, elapsed: float):
+        for part in event_parts(event):
+            if part.get("text") and not part.get("thought"):
+                self.stream.write(part["text"])
+            elif part.get("function_call"):
+                call = part["function_call"]
+                self.stream.write(f"\n[{elapsed:6.2f}s] -> {call.get('name')}({json.dumps(call.get('args') or {}, ensure_ascii=False)})\n")
+            elif part.get("function_response"):
+                self.stream.write(f"[{elapsed:6.2f}s] <- {part['function_response'].get('name')}\n")
+        self.stream.flush()
+
+    def close(self):
+        self.stream.write("\n")
+        self.stream.flush()
+
+
+class JsonlSink:
+    """Appends every event to a JSONL file with its arrival time relative to the request."""
+
+    def __init__(self, path: str):
+        self.path = path
+        self._file = open(path, "a", encoding="utf-8")
+
+    def on_event(self, event: dict, elapsed: float):
+        self._file.write(json.dumps({"elapsed_s": round(elapsed, 4), "event": event}, ensure_ascii=False, default=str) + "\n")
+
+    def close(self):
+        self._file.close()
+
+
+class MetricsSink:
+    """Bounded summary of a response: counts, time to first token and tool call timings."""
+
+    def __init__(self, max_tool_calls: int = 200):
+        self.events = 0
+        self.event_types = collections.Counter()
+        self.authors = collections.Counter()
+        self.first_event_s = None
+        self.first_token_s = None
+        self.last_event_s = None
+        self.text_chars = 0
+        self._open_calls = {}
+        self.tool_calls = collections.deque(maxlen=max_tool_calls)
+        # Running totals per tool, so long sessions with many tool calls keep a constant size.
+        self.tool_time = collections.Counter()
+        self.tool_call_counts = collections.Counter()
+
+    def on_event(self, event: dict, elapsed: float):
+        self.events += 1
+        self.authors[event.get("author", "unknown")] += 1
+        if self.first_event_s is None:
+            self.first_event_s = elapsed
+        self.last_event_s = elapsed
+        for part in event_parts(event):
+            if part.get("text") and not part.get("thought"):
+                self.event_types["text"] += 1
+                self.text_chars += len(part["text"])
+                if self.first_token_s is None:
+                    self.first_token_s = elapsed
+            elif part.get("function_call"):
+                self.event_types["function_call"] += 1
+                call = part["function_call"]
+                self._open_calls[call.get("id") or call.get("name")] = (call.get("name"), elapsed)
+            elif part.get("function_response"):
+                self.event_types["function_response"] += 1
+                response = part["function_response"]
+                name, started = self._open_calls.pop(response.get("id") or response.get("name"), (response.get("name"), None))
+                duration = None if started is None else elapsed - started
+                self.tool_calls.append({"name": name, "called_at_s": started, "duration_s": duration})
+                if duration is not None:
+                    self.tool_time[name] += duration
+                    self.tool_call_counts[name] += 1
+        if not event_parts(event):
+            self.event_types["other"] += 1
+
+    def close(self):
+        pass
+
+    def summary(self) -> dict:
+        def rounded(value):
+            return None if value is None else round(value, 3)
+
+        return {
+            "events": self.events,
+            "event_types": dict(self.event_types),
+            "authors": dict(self.authors),
+            "time_to_first_event_s": rounded(self.first_event_s),
+            "time_to_first_token_s": rounded(self.first_token_s),
+            "total_s": rounded(self.last_event_s),
+            "text_chars": self.text_chars,
+            "tool_calls": [{k: rounded(v) if k != "name" else v for k, v in c.items()} for c in self.tool_calls],
+            "tool_time_s": {name: rounded(total) for name, total in self.tool_time.items()},
+            "tool_call_counts": dict(self.tool_call_counts),
+            # Calls whose response never arrived (the stream ended or failed first).
+            "unanswered_tool_calls": [name for name, _ in self._open_calls.values()],
+        }
+
+
+class EventPipeline:
+    """Feeds streamed events to sinks as they arrive, keeping at most `max_events` of them."""
+
+    def __init__(self, sinks: list, metrics: MetricsSink = None, collect: bool = True, max_events: int = 1000,
+                 clock=time.perf_counter):
+        self.metrics = metrics or MetricsSink()
+        self.sinks = [self.metrics] + list(sinks)
+        self.events = collections.deque(maxlen=max_events if collect else 0)
+        self._clock = clock
+
+    async def run(self, stream) -> dict:
+        """Consumes an async event stream and returns the metrics summary."""
+        start = self._clock()
+        try:
+            async for event in stream:
+                event = event_to_dict(event)
+                elapsed = self._clock() - start
+                for sink in self.sinks:
+                    sink.on_event(event, elapsed)
+                self.events.append(event)
+        finally:
+            for sink in self.sinks:
+                sink.close()
+        return self.metrics.summary()
@@ -0,0 +1,108 @@
+"""Offline ingestion of the agent's PDFs into the page store (`app/page_store.py`).
+
+Lists the `storage_uri` values of the agent tables in BigQuery and skips documents whose
+GCS generation is already in the store. The rest are downloaded in a thread pool and
+their page text is extracted in a process pool. Every document is committed on its own,
+so an interrupted run resumes where it stopped and failed documents are retried on the
+next run.
+"""
+import concurrent.futures
+import sys
+import time
+
+from app.document_cache import split_gcs_uri
+from app.pdf_chunks import extract_page_texts
+from stats import summarize
+
+
+def list_storage_uris(client, project: str, dataset: str, tables: list) -> list:
+    """Distinct `storage_uri` values of the given tables; tables without that column are skipped."""
+    uris = set()
+    for table in tables:
+        query = f"SELECT DISTINCT storage_uri FROM `{project}.{dataset}.{table}` WHERE storage_uri LIKE 'gs://%'"
+        try:
+            uris.update(row["storage_uri"] for row in client.query(query).result())
+        except Exception as e:
+            print(f"Skipping {table}: {e}")
+    return sorted(uris)
+
+
+def _fetch(storage_client, uri: str, known_generation: str, force: bool):
+    """Returns (generation, bytes), or (generation, None) when the stored version is current."""
+    bucket, name = split_gcs_uri(uri)
+    blob = storage_client.bucket(bucket).get_blob(name)
+    if blob is None:
+        raise FileNotFoundError(f"{uri} does not exist.")
+    generation = str(blob.generation or blob.etag)
+    if generation == known_generation and not force:
+        return generation, None
+    return generation, blob.download_as_bytes()
+
+
+def ingest(uris: list, store, storage_client, workers: int = 8, processes: int = 4, force: bool = False,
+           prune: bool = False, progress=None) -> dict:
+    """Brings the page store up to date with the given documents and returns a report.
+
+    `processes=0` extracts text in the download threads instead of a process pool.
+    With `prune`, documents no longer listed are removed from the store.
+    """
+    progress = progress if progress is not None else sys.stderr
+    known = store.generations()
+    counts = {"unchanged": 0, "ingested": 0, "no_text": 0, "failed": 0}
+    pages = 0
+    seconds = []
+    start = time.perf_counter()
+    extractor = concurrent.futures.ProcessPoolExecutor(processes) if processes else None
+
+    def process(uri: str):
+        item_start = time.perf_counter()
+        generation, data = _fetch(storage_client, uri, known.get(uri), force)
+        if data is None:
+            return generation, None, 0.0
+        texts = extractor.submit(extract_page_texts, data).result() if extractor else extract_page_texts(data)
+        return generation, texts, time.perf_counter() - item_start
+
+    try:
+        with concurrent.futures.ThreadPoolExecutor(workers) as executor:
+            futures = {executor.submit(process, uri): uri for uri in uris}
+            for done, future in enumerate(concurrent.futures.as_completed(futures), start=1):
+                uri = futures[future]
+                try:
+                    generation, texts, item_seconds = future.result()
+                except Exception as e:
+                    counts["failed"] += 1
+                    store.mark_failed(uri, None, f"{type(e).__name__}: {e}")
+                    print(f"\nCould not ingest {uri}: {e}")
+                else:
+                    if texts is None:
+                        counts["unchanged"] += 1
+                    else:
+                        store.replace_document(uri, generation, texts)
+                        counts["ingested" if any(t.strip() for t in texts) else "no_text"] += 1
+                        pages += len(texts)
+                        seconds.append(item_seconds)
+                progress.write(f"\ringest: {done}/{len(uris)}")
+                progress.flush()
+    finally:
+        if extractor is not None:
+            extractor.shutdown()
+    if uris:
+        progress.write("\n")
+
+    pruned = 0
+    if prune:
+        listed = set(uris)
+        for uri in set(known) - listed:
+            store.remove_document(uri)
+            pruned += 1
+    if counts["ingested"] or counts["no_text"] or pruned:
+        store.compact()
+    return {
+        "listed": len(uris),
+        **counts,
+        "pruned": pruned,
+        "pages_extracted": pages,
+        "duration_s": round(time.perf_counter() - start, 3),
+        "document_s": summarize(seconds),
+        "store": store.stats(),
+    }
@@ -0,0 +1,265 @@
+"""Concurrent load test for deployed agent engines.
+
+Creates sessions for many users, then replays a question corpus through
+`async_stream_query` with a bounded number of turns in flight and, optionally, a
+Poisson arrival rate. Reports time to first event, total latency, events per turn and
+error rate. Sessions that could not be created are reported instead of aborting the
+run, and every created session is deleted at the end. `LocalAgentEngines` stands in for `client.agent_engines` so the load test
+itself can run offline and compare builds without a deployment.
+"""
+import asyncio
+import itertools
+import json
+import math
+import os
+import random
+import time
+
+from stats import summarize
+
+DEFAULT_CORPUS_FILE = os.path.join(os.path.dirname(os.path.abspath(__file__)), "benchmarks", "routing_eval.jsonl")
+
+
+def load_corpus(path: str = DEFAULT_CORPUS_FILE) -> list:
+    """Questions to replay: JSONL with a "question" field, or plain text with one question per line."""
+    questions = []
+    with open(path, "r", encoding="utf-8") as f:
+        for line in f:
+            line = line.strip()
+            if not line:
+                continue
+            if line.startswith("{"):
+                line = json.loads(line).get("question", "")
+            if line:
+                questions.append(line)
+    if not questions:
+        raise ValueError(f"No questions found in {path}.")
+    return questions
+
+
+class LocalRemoteApp:
+    """Offline stand-in for a deployed AdkApp: scripted events with simulated latency."""
+
+    def __init__(self, engines: "LocalAgentEngines", name: str):
+        self.engines = engines
+        self.name = name
+        self._sessions = {}
+        self._ids = itertools.count(1)
+
+    async def async_create_session(self, user_id: str) -> dict:
+        await asyncio.sleep(self.engines.create_session_delay)
+        if self.engines.rng.random() < self.engines.create_error_rate:
+            raise RuntimeError("Simulated create_session error.")
+        session_id = f"local-{next(self._ids)}"
+        self._sessions[session_id] = user_id
+        return {"id": session_id, "user_id": user_id, "app_name": self.name}
+
+    async def async_delete_session(self, user_id: str, session_id: str):
+        await asyncio.sleep(self.engines.create_session_delay)
+        if self._sessions.get(session_id) != user_id:
+            raise ValueError(f"Session {session_id} not found for user {user_id}.")
+        del self._sessions[session_id]
+
+    async def async_stream_query(self, user_id: str, session_id: str, message: str):
+        if self._sessions.get(session_id) != user_id:
+            raise ValueError(f"Session {session_id} not found for user {user_id}.")
+        rng = self.engines.rng
+        # Waiting for the model's first turn dominates; longer questions take a little longer.
+        await asyncio.sleep(rng.expovariate(1 / self.engines.first_event_delay) + len(message) / 10000)
+        if rng.random() < self.engines.error_rate:
+            raise RuntimeError("Simulated engine error.")
+        events = rng.randint(1, 2 * self.engines.events_per_turn - 1)
+        for i in range(events):
+            if i:
+                await asyncio.sleep(rng.expovariate(1 / self.engines.event_delay))
+            yield {"author": "local_agent", "content": {"role": "model", "parts": [{"text": f"event {i}"}]}}
+
+
+class LocalAgentEngines:
+    """Offline stand-in for `client.agent_engines` (only `get` is needed by the load test)."""
+
+    def __init__(self, first_event_delay: float = 0.8, event_delay: float = 0.3, events_per_turn: int = 4,
+                 error_rate: float = 0.0, create_session_delay: float = 0.2, create_error_rate: float = 0.0,
+                 seed: int = 0):
+        self.first_event_delay = first_event_delay
+        self.event_delay = event_delay
+        self.events_per_turn = events_per_turn
+        self.error_rate = error_rate
+        self.create_session_delay = create_session_delay
+        self.create_error_rate = create_error_rate
+        self.rng = random.Random(seed)
+        self._apps = {}
+
+    def get(self, name: str) -> LocalRemoteApp:
+        return self._apps.setdefault(name, LocalRemoteApp(self, name))
+
+
+class LocalSessionService:
+    """Offline stand-in for `VertexAiSessionService`: an in-memory service with simulated latency."""
+
+    def __init__(self, delay: float = 0.4, seed: int = 0):
+        from google.adk.sessions import InMemorySessionService
+        self._service = InMemorySessionService()
+        self.delay = delay
+        self.rng = random.Random(seed)
+
+    async def _wait(self):
+        await asyncio.sleep(self.rng.expovariate(1 / self.delay) if self.delay else 0)
+
+    async def create_session(self, **kwargs):
+        await self._wait()
+        return await self._service.create_session(**kwargs)
+
+    async def get_session(self, **kwargs):
+        await self._wait()
+        return await self._service.get_session(**kwargs)
+
+    async def list_sessions(self, **kwargs):
+        await self._wait()
+        return await self._service.list_sessions(**kwargs)
+
+    async def delete_session(self, **kwargs):
+        await self._wait()
+        return await self._service.delete_session(**kwargs)
+
+
+def histogram(values: list, buckets: int = 12, width: int = 40) -> str:
+    """Text histogram with logarithmic buckets, suited to long-tailed latencies."""
+    values = [v for v in values if v > 0]
+    if not values:
+        return "(no samples)"
+    low, high = min(values), max(values)
+    if high <= low * 1.01:
+        return f"{low:8.3f} s | {'#' * width} {len(values)}"
+    ratio = (high / low) ** (1 / buckets)
+    edges = [low * ratio ** i for i in range(buckets + 1)]
+    counts = [0] * buckets
+    for value in values:
+        counts[min(int(math.log(value / low) / math.log(ratio)), buckets - 1)] += 1
+    peak = max(counts)
+    lines = []
+    for i, count in enumerate(counts):
+        bar = "#" * round(width * count / peak)
+        lines.append(f"{edges[i]:8.3f} - {edges[i + 1]:8.3f} s | {bar} {count}")
+    return "\n".join(lines)
+
+
+def _count_errors(errors) -> dict:
+    counts = {}
+    for error in errors:
+        key = f"{type(error).__name__}: {error}"
+        counts[key] = counts.get(key, 0) + 1
+    return counts
+
+
+async def _create_sessions(remote_app, users: int, sessions_per_user: int, concurrency: int, user_prefix: str) -> tuple:
+    """(sessions, errors): the (user_id, session_id) pairs created and the count of each creation error."""
+    semaphore = asyncio.Semaphore(concurrency)
+
+    async def create(user_id: str) -> tuple:
+        async with semaphore:
+            session = await remote_app.async_create_session(user_id=user_id)
+            return user_id, session["id"]
+
+    user_ids = [f"{user_prefix}-{u:04d}" for u in range(users)]
+    results = await asyncio.gather(*[create(u) for u in user_ids for _ in range(sessions_per_user)],
+                                   return_exceptions=True)
+    sessions = [r for r in results if not isinstance(r, BaseException)]
+    return sessions, _count_errors(r for r in results if isinstance(r, BaseException))
+
+
+async def _delete_sessions(remote_app, sessions: list, concurrency: int) -> dict:
+    """Deletes the load test sessions and returns the count of each deletion error."""
+    semaphore = asyncio.Semaphore(concurrency)
+
+    async def delete(user_id: str, session_id: str):
+        async with semaphore:
+            await remote_app.async_delete_session(user_id=user_id, session_id=session_id)
+
+    results = await asyncio.gather(*[delete(*session) for session in sessions], return_exceptions=True)
+    errors = _count_errors(r for r in results if isinstance(r, BaseException))
+    if errors:
+        print(f"Could not delete {sum(errors.values())} load test sessions: {errors}")
+    return errors
+
+
+async def _run_turn(remote_app, user_id: str, session_id: str, message: str) -> dict:
+    start = time.perf_counter()
+    sample = {"ttfe": None, "latency": None, "events": 0, "error": None}
+    try:
+        async for _ in remote_app.async_stream_query(user_id=user_id, session_id=session_id, message=message):
+            if sample["ttfe"] is None:
+                sample["ttfe"] = time.perf_counter() - start
+            sample["events"] += 1
+    except Exception as e:
+        sample["error"] = f"{type(e).__name__}: {e}"
+    sample["latency"] = time.perf_counter() - start
+    return sample
+
+
+async def run_loadtest(agent_engines, resource_name: str, questions: list, users: int = 10,
+                       sessions_per_user: int = 1, turns: int = 50, concurrency: int = 10, rate: float = 0.0,
+                       seed: int = 0, user_prefix: str = "loadtest") -> tuple:
+    """Runs the load test and returns (report, samples), one sample per turn.
+
+    Args:
+        agent_engines: `client.agent_engines` or a `LocalAgentEngines`.
+        turns: Total number of messages sent, spread round-robin over the sessions.
+        concurrency: Maximum number of turns in flight.
+        rate: Mean arrivals per second (Poisson). 0 sends a new turn as soon as one finishes.
+    """
+    rng = random.Random(seed)
+    remote_app = agent_engines.get(name=resource_name)
+
+    start = time.perf_counter()
+    sessions, session_errors = await _create_sessions(remote_app, users, sessions_per_user, concurrency, user_prefix)
+    setup_seconds = time.perf_counter() - start
+
+    semaphore = asyncio.Semaphore(concurrency)
+    # Each session handles one turn at a time, like a real user waiting for the answer.
+    session_locks = {session: asyncio.Lock() for session in sessions}
+
+    async def turn(i: int) -> dict:
+        session = sessions[i % len(sessions)]
+        async with session_locks[session], semaphore:
+            return await _run_turn(remote_app, session[0], session[1], rng.choice(questions))
+
+    start = time.perf_counter()
+    tasks = []
+    try:
+        for i in range(turns if sessions else 0):
+            if rate > 0 and i:
+                await asyncio.sleep(rng.expovariate(rate))
+            tasks.append(asyncio.ensure_future(turn(i)))
+        samples = await asyncio.gather(*tasks)
+        run_seconds = time.perf_counter() - start
+    finally:
+        for task in tasks:
+            task.cancel()
+        await asyncio.gather(*tasks, return_exceptions=True)
+        delete_errors = await _delete_sessions(remote_app, sessions, concurrency)
+
+    ok = [s for s in samples if s["error"] is None]
+    errors = {}
+    for s in samples:
+        if s["error"] is not None:
+            errors[s["error"]] = errors.get(s["error"], 0) + 1
+    report = {
+        "resource_name": resource_name,
+        "users": users,
+        "sessions": len(sessions),
+        "session_errors": session_errors,
+        "session_delete_errors": delete_errors,
+        "turns": len(samples),
+        "concurrency": concurrency,
+        "rate": rate,
+        "session_setup_s": round(setup_seconds, 3),
+        "duration_s": round(run_seconds, 3),
+        "throughput_turns_per_s": round(len(samples) / run_seconds, 3) if run_seconds else None,
+        "error_rate": round(1 - len(ok) / len(samples), 4) if samples else 0.0,
+        "errors": errors,
+        "time_to_first_event_s": summarize([s["ttfe"] for s in ok if s["ttfe"] is not None]),
+        "latency_s": summarize([s["latency"] for s in ok]),
+        "events_per_turn": summarize([s["events"] for s in ok], digits=2),
+    }
+    return report, samples
@@ -0,0 +1,245 @@
+"""Local registry of deployed engines, users and sessions, backed by SQLite.
+
+Replaces the single `engine.json` file. Every write is one transaction, so CLI commands
+running in parallel (scripts, load tests) never clobber each other, and the registry can
+hold any number of engines and sessions. The "current" engine, user and session that
+commands fall back to are stored as defaults.
+"""
+import contextlib
+import json
+import os
+import sqlite3
+import time
+
+REGISTRY_FILE = os.getenv("AGENT_REGISTRY_FILE", "agent_registry.sqlite3")
+# Imported into an empty registry the first time it is opened, and never again after that.
+LEGACY_ENGINE_FILE = "engine.json"
+
+_SCHEMA = """
+CREATE TABLE IF NOT EXISTS engines (
+    resource_name TEXT PRIMARY KEY,
+    agent_name TEXT,
+    deploy_hash TEXT,
+    created_at REAL NOT NULL,
+    updated_at REAL NOT NULL
+);
+CREATE INDEX IF NOT EXISTS engines_agent_name ON engines (agent_name);
+
+CREATE TABLE IF NOT EXISTS sessions (
+    resource_name TEXT NOT NULL,
+    session_id TEXT NOT NULL,
+    user_id TEXT NOT NULL,
+    created_at REAL NOT NULL,
+    last_used_at REAL,
+    turns INTEGER NOT NULL DEFAULT 0,
+    errors INTEGER NOT NULL DEFAULT 0,
+    last_latency_s REAL,
+    total_latency_s REAL NOT NULL DEFAULT 0,
+    PRIMARY KEY (resource_name, session_id)
+);
+CREATE INDEX IF NOT EXISTS sessions_user ON sessions (user_id, resource_name);
+
+CREATE TABLE IF NOT EXISTS defaults (
+    key TEXT PRIMARY KEY,
+    value TEXT
+);
+
+-- Ready sessions of the send_message --new-session pool, taken by exactly one command each.
+CREATE TABLE IF NOT EXISTS pooled_sessions (
+    resource_name TEXT NOT NULL,
+    session_id TEXT NOT NULL,
+    user_id TEXT NOT NULL,
+    created_at REAL NOT NULL,
+    PRIMARY KEY (resource_name, session_id)
+);
+
+CREATE TABLE IF NOT EXISTS meta (
+    key TEXT PRIMARY KEY,
+    value TEXT
+);
+"""
+
+DEFAULT_KEYS = ["resource_name", "user_id", "session_id"]
+
+
+class Registry:
+    def __init__(self, path: str = REGISTRY_FILE, legacy_file: str = LEGACY_ENGINE_FILE, clock=time.time):
+        self.path = path
+        self._clock = clock
+        with self._connect() as conn:
+            conn.executescript(_SCHEMA)
+        if legacy_file and os.path.exists(legacy_file):
+            self._import_legacy(legacy_file)
+
+    def _connect(self) -> sqlite3.Connection:
+        conn = sqlite3.connect(self.path, timeout=30, isolation_level=None)
+        conn.row_factory = sqlite3.Row
+        conn.execute("PRAGMA journal_mode=WAL")
+        conn.execute("PRAGMA busy_timeout=30000")
+        return conn
+
+    @contextlib.contextmanager
+    def _transaction(self):
+        """Write transaction that takes the write lock up front, so concurrent writers queue instead of failing."""
+        conn = self._connect()
+        try:
+            conn.execute("BEGIN IMMEDIATE")
+            try:
+                yield conn
+            except BaseException:
+                conn.execute("ROLLBACK")
+                raise
+            conn.execute("COMMIT")
+        finally:
+            conn.close()
+
+    def _query(self, sql: str, params=()) -> list:
+        conn = self._connect()
+        try:
+            return [dict(row) for row in conn.execute(sql, params)]
+        finally:
+            conn.close()
+
+    def _import_legacy(self, legacy_file: str):
+        """Imports engine.json once. The marker keeps a deleted last engine from coming back on the next run."""
+        with self._transaction() as conn:
+            if conn.execute("SELECT 1 FROM meta WHERE key = 'legacy_imported'").fetchone():
+                return
+            if conn.execute("SELECT 1 FROM engines LIMIT 1").fetchone():
+                data = {}
+            else:
+                try:
+                    with open(legacy_file, "r") as f:
+                        data = json.load(f)
+                except (OSError, ValueError):
+                    return
+            conn.execute("INSERT INTO meta (key, value) VALUES ('legacy_imported', ?)", (str(self._clock()),))
+            if data.get("resource_name"):
+                self._upsert_engine(conn, data["resource_name"], data.get("agent_name"), data.get("deploy_hash"))
+                if data.get("user_id") and data.get("session_id"):
+                    self._upsert_session(conn, data["resource_name"], data["user_id"], data["session_id"])
+                self._set_defaults(conn, data)
+
+    def _upsert_engine(self, conn, resource_name: str, agent_name: str = None, deploy_hash: str = None):
+        now = self._clock()
+        conn.execute(
+            "INSERT INTO engines (resource_name, agent_name, deploy_hash, created_at, updated_at) VALUES (?, ?, ?, ?, ?) "
+            "ON CONFLICT (resource_name) DO UPDATE SET agent_name = COALESCE(excluded.agent_name, agent_name), "
+            "deploy_hash = COALESCE(excluded.deploy_hash, deploy_hash), updated_at = excluded.updated_at",
+            (resource_name, agent_name, deploy_hash, now, now))
+
+    def _upsert_session(self, conn, resource_name: str, user_id: str, session_id: str):
+        conn.execute(
+            "INSERT INTO sessions (resource_name, session_id, user_id, created_at) VALUES (?, ?, ?, ?) "
+            "ON CONFLICT (resource_name, session_id) DO NOTHING",
+            (resource_name, session_id, user_id, self._clock()))
+
+    @staticmethod
+    def _set_defaults(conn, values: dict):
+        for key in DEFAULT_KEYS:
+            if key in values:
+                conn.execute("INSERT INTO defaults (key, value) VALUES (?, ?) "
+                             "ON CONFLICT (key) DO UPDATE SET value = excluded.value", (key, values[key]))
+
+    def current(self) -> dict:
+        """The default engine (with its agent name and deploy hash), user and session, as engine.json held them."""
+        current = {row["key"]: row["value"] for row in self._query("SELECT key, value FROM defaults")
+                   if row["value"] is not None}
+        if current.get("resource_name"):
+            for engine in self._query("SELECT agent_name, deploy_hash FROM engines WHERE resource_name = ?",
+                                      (current["resource_name"],)):
+                current.update({k: v for k, v in engine.items() if v is not None})
+        return current
+
+    def record_engine(self, resource_name: str, agent_name: str = None, deploy_hash: str = None,
+                      make_default: bool = True):
+        with self._transaction() as conn:
+            self._upsert_engine(conn, resource_name, agent_name, deploy_hash)
+            if make_default:
+                previous = conn.execute("SELECT value FROM defaults WHERE key = 'resource_name'").fetchone()
+                values = {"resource_name": resource_name}
+                if previous is None or previous["value"] != resource_name:
+                    # The default session belonged to the previous engine.
+                    values.update({"user_id": None, "session_id": None})
+                self._set_defaults(conn, values)
+
+    def remove_engine(self, resource_name: str):
+        with self._transaction() as conn:
+            conn.execute("DELETE FROM sessions WHERE resource_name = ?", (resource_name,))
+            conn.execute("DELETE FROM pooled_sessions WHERE resource_name = ?", (resource_name,))
+            conn.execute("DELETE FROM engines WHERE resource_name = ?", (resource_name,))
+            previous = conn.execute("SELECT value FROM defaults WHERE key = 'resource_name'").fetchone()
+            if previous is not None and previous["value"] == resource_name:
+                conn.execute("DELETE FROM defaults")
+
+    def record_session(self, resource_name: str, user_id: str, session_id: str, make_default: bool = True):
+        with self._transaction() as conn:
+            self._upsert_engine(conn, resource_name)
+            self._upsert_session(conn, resource_name, user_id, session_id)
+            if make_default:
+                self._set_defaults(conn, {"resource_name": resource_name, "user_id": user_id, "session_id": session_id})
+
+    def remove_session(self, resource_name: str, session_id: str):
+        with self._transaction() as conn:
+            conn.execute("DELETE FROM sessions WHERE resource_name = ? AND session_id = ?", (resource_name, session_id))
+
+    def record_turn(self, resource_name: str, user_id: str, session_id: str, latency_s: float, error: bool = False):
+        """Adds one message to the session's usage stats."""
+        with self._transaction() as conn:
+            self._upsert_session(conn, resource_name, user_id, session_id)
+            conn.execute(
+                "UPDATE sessions SET turns = turns + 1, errors = errors + ?, last_used_at = ?, last_latency_s = ?, "
+                "total_latency_s = total_latency_s + ? WHERE resource_name = ? AND session_id = ?",
+                (int(error), self._clock(), latency_s, latency_s, resource_name, session_id))
+
+    def add_pooled_session(self, resource_name: str, user_id: str, session_id: str, created_at: float):
+        with self._transaction() as conn:
+            conn.execute(
+                "INSERT OR REPLACE INTO pooled_sessions (resource_name, session_id, user_id, created_at) "
+                "VALUES (?, ?, ?, ?)", (resource_name, session_id, user_id, created_at))
+
+    def take_pooled_session(self, resource_name: str, created_after: float):
+        """Removes and returns the oldest pooled session created after `created_after`, or None."""
+        with self._transaction() as conn:
+            row = conn.execute(
+                "SELECT * FROM pooled_sessions WHERE resource_name = ? AND created_at >= ? "
+                "ORDER BY created_at LIMIT 1", (resource_name, created_after)).fetchone()
+            if row is None:
+                return None
+            conn.execute("DELETE FROM pooled_sessions WHERE resource_name = ? AND session_id = ?",
+                         (resource_name, row["session_id"]))
+            return dict(row)
+
+    def remove_pooled_sessions(self, resource_name: str, created_before: float = None) -> list:
+        """Removes and returns the pooled sessions created before `created_before`, or all of them."""
+        where, params = "resource_name = ?", [resource_name]
+        if created_before is not None:
+            where += " AND created_at < ?"
+            params.append(created_before)
+        with self._transaction() as conn:
+            rows = [dict(row) for row in conn.execute(f"SELECT * FROM pooled_sessions WHERE {where}", params)]
+            conn.execute(f"DELETE FROM pooled_sessions WHERE {where}", params)
+            return rows
+
+    def pooled_sessions(self, resource_name: str) -> list:
+        return self._query("SELECT * FROM pooled_sessions WHERE resource_name = ? ORDER BY created_at", (resource_name,))
+
+    def engines(self, agent_name: str = None) -> list:
+        if agent_name is not None:
+            return self._query("SELECT * FROM engines WHERE agent_name = ? ORDER BY updated_at DESC", (agent_name,))
+        return self._query("SELECT * FROM engines ORDER BY updated_at DESC")
+
+    def engine_by_agent_name(self, agent_name: str):
+        engines = self.engines(agent_name)
+        return engines[0] if engines else None
+
+    def sessions(self, resource_name: str = None, user_id: str = None) -> list:
+        clauses, params = [], []
+        if resource_name is not None:
+            clauses.append("resource_name = ?")
+            params.append(resource_name)
+        if user_id is not None:
+            clauses.append("user_id = ?")
+            params.append(user_id)
+        where = f"WHERE {' AND '.join(clauses)}" if clauses else ""
+        return self._query(f"SELECT * FROM sessions {where} ORDER BY COALESCE(last_used_at, created_at) DESC", params)
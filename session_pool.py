@@ -0,0 +1,225 @@
+"""Pool of pre-created sessions so that a new user's first message does not wait on create_session.
+
+A background task keeps `size` ready sessions per app and replaces each one as soon as
+it is handed out. Sessions belong to the user they are created for, so pooled sessions
+are created for pool-owned user IDs: `acquire` returns the (user_id, session_id) pair
+to use for every query of that conversation, and records which end user it went to.
+Ready sessions idle for longer than `max_idle` are deleted and replaced, so no user
+gets a session that may have been expired by the session service.
+
+`SessionPool` keeps the ready sessions in memory, for long-running processes.
+`RegistrySessionPool` keeps them in the local registry instead, so one-shot CLI commands
+(`send_message --new-session`) share the pool and take each session exactly once.
+"""
+import asyncio
+import collections
+import time
+import uuid
+from dataclasses import dataclass
+
+from stats import summarize
+
+
+@dataclass
+class PooledSession:
+    user_id: str
+    session_id: str
+    created_at: float
+    # End user this session was handed to; None while it is waiting in the pool.
+    assigned_to: str = None
+    # False if the pool was empty and the session was created on the request path.
+    pooled: bool = True
+
+
+class SessionPool:
+    """Keeps `size` ready sessions of one app, replenished in the background."""
+
+    def __init__(self, session_service, app_name: str, size: int = 10, max_idle: float = 1800,
+                 replenish_concurrency: int = 4, user_prefix: str = "pool", clock=time.monotonic):
+        self.session_service = session_service
+        self.app_name = app_name
+        self.size = size
+        self.max_idle = max_idle
+        self.replenish_concurrency = replenish_concurrency
+        self.user_prefix = user_prefix
+        self._clock = clock
+        self._ready = collections.deque()
+        # Expired sessions taken out of the pool, deleted by the next replenishment.
+        self._stale = []
+        self._wanted = asyncio.Event()
+        # Times at which handed-out sessions still wait for their replacement.
+        self._taken_at = collections.deque()
+        self._task = None
+        self.hits = 0
+        self.misses = 0
+        self.created = 0
+        self.expired = 0
+        self.failures = 0
+        self.replenish_lag = collections.deque(maxlen=1000)
+        self.acquire_seconds = collections.deque(maxlen=1000)
+
+    async def _create(self) -> PooledSession:
+        user_id = f"{self.user_prefix}-{uuid.uuid4().hex[:12]}"
+        session = await self.session_service.create_session(app_name=self.app_name, user_id=user_id)
+        self.created += 1
+        return PooledSession(user_id=session.user_id, session_id=session.id, created_at=self._clock())
+
+    async def _delete(self, pooled: PooledSession):
+        try:
+            await self.session_service.delete_session(
+                app_name=self.app_name, user_id=pooled.user_id, session_id=pooled.session_id)
+        except Exception as e:
+            print(f"Could not delete expired pooled session {pooled.session_id}: {e}")
+
+    # Storage of the ready sessions, overridden by RegistrySessionPool.
+
+    def _ready_count(self) -> int:
+        return len(self._ready)
+
+    def _push_ready(self, pooled: PooledSession):
+        self._ready.append(pooled)
+
+    def _pop_ready(self):
+        return self._ready.popleft() if self._ready else None
+
+    def _pop_expired(self, created_before: float) -> list:
+        expired = [s for s in self._ready if s.created_at < created_before]
+        if expired:
+            self._ready = collections.deque(s for s in self._ready if s.created_at >= created_before)
+        return expired
+
+    def _drain_ready(self) -> list:
+        ready, self._ready = list(self._ready), collections.deque()
+        return ready
+
+    def _expire_idle(self):
+        expired = self._pop_expired(self._clock() - self.max_idle)
+        if expired:
+            self._stale.extend(expired)
+            self.expired += len(expired)
+
+    async def replenish(self):
+        """Recycles idle sessions and creates sessions until the pool is full again."""
+        self._expire_idle()
+        stale, self._stale = self._stale, []
+        for pooled in stale:
+            await self._delete(pooled)
+        missing = self.size - self._ready_count()
+        if missing <= 0:
+            return
+        semaphore = asyncio.Semaphore(self.replenish_concurrency)
+        # Only replacements of handed-out sessions count towards the lag, not those of expired ones.
+        taken = [self._taken_at.popleft() for _ in range(min(missing, len(self._taken_at)))]
+
+        async def create_one(taken_at: float = None):
+            async with semaphore:
+                try:
+                    pooled = await self._create()
+                except Exception as e:
+                    self.failures += 1
+                    print(f"Could not create pooled session: {e}")
+                    if taken_at is not None:
+                        self._taken_at.appendleft(taken_at)
+                    return
+                self._push_ready(pooled)
+                if taken_at is not None:
+                    self.replenish_lag.append(self._clock() - taken_at)
+
+        await asyncio.gather(*[create_one(t) for t in taken], *[create_one() for _ in range(missing - len(taken))])
+
+    async def _run(self):
+        while True:
+            try:
+                await self.replenish()
+            except Exception as e:
+                print(f"Session pool replenishment failed: {e}")
+            self._wanted.clear()
+            # Wake up when a session is taken, and at least often enough to recycle idle ones.
+            try:
+                await asyncio.wait_for(self._wanted.wait(), timeout=max(self.max_idle / 4, 1))
+            except asyncio.TimeoutError:
+                pass
+
+    async def start(self, wait: bool = True):
+        """Starts the background replenisher; with `wait`, returns once the pool is full."""
+        if wait:
+            await self.replenish()
+        if self._task is None or self._task.done():
+            self._task = asyncio.get_running_loop().create_task(self._run())
+
+    async def acquire(self, end_user: str) -> PooledSession:
+        """A ready session for a new conversation, created on the spot only if the pool is empty."""
+        start = self._clock()
+        self._expire_idle()
+        pooled = self._pop_ready()
+        if pooled is not None:
+            self.hits += 1
+            self._taken_at.append(start)
+        else:
+            self.misses += 1
+            pooled = await self._create()
+            pooled.pooled = False
+        pooled.assigned_to = end_user
+        self._wanted.set()
+        self.acquire_seconds.append(self._clock() - start)
+        return pooled
+
+    async def close(self, delete_ready: bool = True):
+        """Stops replenishing and, by default, deletes the sessions nobody took."""
+        if self._task is not None:
+            self._task.cancel()
+            try:
+                await self._task
+            except asyncio.CancelledError:
+                pass
+            self._task = None
+        if delete_ready:
+            ready, self._stale = self._drain_ready() + self._stale, []
+            await asyncio.gather(*[self._delete(s) for s in ready])
+
+    def stats(self) -> dict:
+        lookups = self.hits + self.misses
+        return {
+            "size": self.size,
+            "ready": self._ready_count(),
+            "hits": self.hits,
+            "misses": self.misses,
+            "hit_rate": self.hits / lookups if lookups else 0.0,
+            "created": self.created,
+            "expired": self.expired,
+            "failures": self.failures,
+            "acquire_s": summarize(list(self.acquire_seconds), digits=4),
+            "replenish_lag_s": summarize(list(self.replenish_lag)),
+        }
+
+
+class RegistrySessionPool(SessionPool):
+    """SessionPool whose ready sessions live in the local registry, shared by every CLI process.
+
+    Taking a session is one registry transaction, so concurrent commands never get the same
+    one. Creation times are wall-clock times, since they outlive the process.
+    """
+
+    def __init__(self, session_service, app_name: str, registry, clock=time.time, **kwargs):
+        super().__init__(session_service, app_name, clock=clock, **kwargs)
+        self.registry = registry
+
+    @staticmethod
+    def _from_row(row: dict) -> PooledSession:
+        return PooledSession(user_id=row["user_id"], session_id=row["session_id"], created_at=row["created_at"])
+
+    def _ready_count(self) -> int:
+        return len(self.registry.pooled_sessions(self.app_name))
+
+    def _push_ready(self, pooled: PooledSession):
+        self.registry.add_pooled_session(self.app_name, pooled.user_id, pooled.session_id, pooled.created_at)
+
+    def _pop_ready(self):
+        row = self.registry.take_pooled_session(self.app_name, created_after=self._clock() - self.max_idle)
+        return self._from_row(row) if row else None
+
+    def _pop_expired(self, created_before: float) -> list:
+        return [self._from_row(row) for row in self.registry.remove_pooled_sessions(self.app_name, created_before)]
+
+    def _drain_ready(self) -> list:
+        return [self._from_row(row) for row in self.registry.remove_pooled_sessions(self.app_name)]
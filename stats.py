@@ -0,0 +1,26 @@
+"""Latency statistics shared by the CLI commands, the session pool, bulk operations and benchmarks."""
+import math
+
+
+def percentile(sorted_values: list, q: float):
+    """Linearly interpolated percentile (q in 0..100) of an already sorted list."""
+    if not sorted_values:
+        return None
+    position = (len(sorted_values) - 1) * q / 100
+    lower = math.floor(position)
+    upper = min(lower + 1, len(sorted_values) - 1)
+    return sorted_values[lower] + (sorted_values[upper] - sorted_values[lower]) * (position - lower)
+
+
+def summarize(values: list, digits: int = 3) -> dict:
+    values = sorted(values)
+    if not values:
+        return {"count": 0}
+    return {
+        "count": len(values),
+        "mean": round(sum(values) / len(values), digits),
+        "p50": round(percentile(values, 50), digits),
+        "p95": round(percentile(values, 95), digits),
+        "p99": round(percentile(values, 99), digits),
+        "max": round(values[-1], digits),
+    }
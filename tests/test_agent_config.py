@@ -0,0 +1,41 @@
+import pytest
+
+from app.agent_config import load_profile, profile_names
+
+PROFILES = """
+base:
+  agents:
+    bigquery_agent: {model: gemini-2.5-flash, thinking_budget: 0, max_output_tokens: 512}
+  tools: {}
+profiles:
+  default: {}
+  thinking-orchestrator:
+    agents:
+      bigquery_agent: {thinking_budget: 1024}
+  roomy-orchestrator:
+    agents:
+      bigquery_agent: {thinking_budget: 1024, max_output_tokens: 2048}
+"""
+
+
+@pytest.fixture
+def profiles_file(tmp_path):
+    path = tmp_path / "agent_profiles.yaml"
+    path.write_text(PROFILES, encoding="utf-8")
+    return str(path)
+
+
+@pytest.mark.parametrize("name", profile_names())
+def test_shipped_profiles_load(name):
+    load_profile(name)
+
+
+def test_thinking_budget_must_stay_below_max_output_tokens(profiles_file):
+    with pytest.raises(ValueError, match="thinking_budget"):
+        load_profile("thinking-orchestrator", profiles_file)
+
+
+def test_profile_overrides_base(profiles_file):
+    settings = load_profile("roomy-orchestrator", profiles_file)["agents"]["bigquery_agent"]
+    assert (settings.thinking_budget, settings.max_output_tokens) == (1024, 2048)
+    assert settings.model == "gemini-2.5-flash"
@@ -0,0 +1,210 @@
+import asyncio
+import types as pytypes
+
+import pytest
+
+from app import documents
+from app.context_cache import DocumentContextManager
+
+PDF = "gs://docs/certificado.pdf"
+
+
+class FakeClock:
+    def __init__(self):
+        self.now = 1000.0
+
+    def __call__(self):
+        return self.now
+
+
+class FakeCaches:
+    """Raises the errors in `errors` (one per call, oldest first) before creating caches."""
+
+    def __init__(self, fail: bool = False, errors: list = None):
+        self.errors = list(errors or [])
+        if fail:
+            self.errors = [RuntimeError("400 INVALID_ARGUMENT: content is below the minimum token count")] * 10
+        self.created = []
+        self.deleted = []
+
+    async def create(self, model, config):
+        if self.errors:
+            raise self.errors.pop(0)
+        name = f"cachedContents/{len(self.created) + 1}"
+        self.created.append((name, config.contents[0].parts[0].file_data.file_uri))
+        return pytypes.SimpleNamespace(name=name)
+
+    async def delete(self, name):
+        self.deleted.append(name)
+
+
+class FakeModels:
+    def __init__(self, fail_cached: bool = False):
+        self.fail_cached = fail_cached
+        self.requests = []
+
+    async def generate_content(self, model, contents, config=None):
+        cached_content = config.cached_content if config else None
+        self.requests.append({"contents": contents, "cached_content": cached_content})
+        if cached_content and self.fail_cached:
+            raise RuntimeError(f"404 NOT_FOUND: {cached_content} not found")
+        return pytypes.SimpleNamespace(text="respuesta", usage_metadata=None)
+
+
+def fake_client(caches=None, models=None):
+    return pytypes.SimpleNamespace(aio=pytypes.SimpleNamespace(caches=caches or FakeCaches(),
+                                                               models=models or FakeModels()))
+
+
+def manager(min_hits: int = 2, clock=None, **kwargs) -> DocumentContextManager:
+    return DocumentContextManager("gemini-2.5-flash", min_hits=min_hits, ttl=900, idle_timeout=300,
+                                  clock=clock or FakeClock(), **kwargs)
+
+
+def test_cache_is_created_once_min_hits_is_reached():
+    client = fake_client()
+    contexts = manager()
+
+    async def run():
+        return [await contexts.cached_content(client, PDF, "1") for _ in range(3)]
+
+    assert asyncio.run(run()) == [None, "cachedContents/1", "cachedContents/1"]
+    assert client.aio.caches.created == [("cachedContents/1", PDF)]
+    assert contexts.stats()["cached_calls"] == 2
+
+
+def test_new_generation_gets_a_new_cache():
+    client = fake_client()
+    contexts = manager(min_hits=1)
+
+    async def run():
+        return [await contexts.cached_content(client, PDF, generation) for generation in ("1", "1", "2")]
+
+    assert asyncio.run(run()) == ["cachedContents/1", "cachedContents/1", "cachedContents/2"]
+
+
+def test_unknown_generation_is_never_cached():
+    client = fake_client()
+    contexts = manager(min_hits=1)
+
+    assert asyncio.run(contexts.cached_content(client, PDF, None)) is None
+    assert client.aio.caches.created == []
+
+
+def test_expired_cache_is_forgotten_and_idle_cache_deleted():
+    client = fake_client()
+    clock = FakeClock()
+    contexts = manager(min_hits=1, clock=clock)
+    other = "gs://docs/ficha.pdf"
+
+    async def run():
+        await contexts.cached_content(client, PDF, "1")
+        clock.now += 200
+        await contexts.cached_content(client, other, "1")
+        # PDF has been idle for 300 s, other for 100 s.
+        clock.now += 100
+        await contexts.purge_expired(client)
+        assert client.aio.caches.deleted == ["cachedContents/1"]
+        # Past other's TTL: the server already dropped it, so nothing is deleted.
+        clock.now += 900
+        await contexts.purge_expired(client)
+
+    asyncio.run(run())
+    assert client.aio.caches.deleted == ["cachedContents/1"]
+    assert contexts.stats()["live_caches"] == 0
+
+
+def test_invalidate_deletes_every_generation():
+    client = fake_client()
+    contexts = manager(min_hits=1)
+
+    async def run():
+        await contexts.cached_content(client, PDF, "1")
+        await contexts.cached_content(client, PDF, "2")
+        await contexts.invalidate(client, PDF)
+
+    asyncio.run(run())
+    assert sorted(client.aio.caches.deleted) == ["cachedContents/1", "cachedContents/2"]
+    assert contexts.stats()["documents"] == 0
+
+
+def test_uncacheable_document_is_not_retried():
+    client = fake_client(caches=FakeCaches(fail=True))
+    contexts = manager(min_hits=1)
+
+    async def run():
+        return [await contexts.cached_content(client, PDF, "1") for _ in range(3)]
+
+    assert asyncio.run(run()) == [None, None, None]
+    assert contexts.stats()["failures"] == 1
+
+
+def test_transient_failure_is_retried_after_a_backoff():
+    client = fake_client(caches=FakeCaches(errors=[
+        RuntimeError("503 UNAVAILABLE: backend error"), RuntimeError("504 DEADLINE_EXCEEDED: timed out")]))
+    clock = FakeClock()
+    contexts = manager(min_hits=1, clock=clock, retry_backoff=60)
+
+    async def run():
+        names = [await contexts.cached_content(client, PDF, "1")]
+        clock.now += 59
+        names.append(await contexts.cached_content(client, PDF, "1"))
+        clock.now += 1
+        names.append(await contexts.cached_content(client, PDF, "1"))
+        # The backoff doubles after a second failure in a row.
+        clock.now += 119
+        names.append(await contexts.cached_content(client, PDF, "1"))
+        clock.now += 1
+        names.append(await contexts.cached_content(client, PDF, "1"))
+        return names
+
+    assert asyncio.run(run()) == [None, None, None, None, "cachedContents/1"]
+    assert contexts.stats()["failures"] == 2
+
+
+def test_evicted_document_deletes_its_cache():
+    client = fake_client()
+    contexts = manager(min_hits=1, max_documents=2)
+
+    async def run():
+        for uri in ("gs://docs/a.pdf", "gs://docs/b.pdf", "gs://docs/c.pdf"):
+            await contexts.cached_content(client, uri, "1")
+
+    asyncio.run(run())
+    assert client.aio.caches.deleted == ["cachedContents/1"]
+    assert contexts.stats()["documents"] == 2 and contexts.stats()["live_caches"] == 2
+
+
+@pytest.fixture
+def document_client(monkeypatch):
+    def install(client, contexts):
+        monkeypatch.setattr(documents, "get_genai_client", lambda: client)
+        monkeypatch.setattr(documents, "document_context_manager", contexts)
+        monkeypatch.setattr(documents.document_cache, "object_generation", lambda uri: "1")
+        monkeypatch.setattr(documents.gemini_limiter, "enabled", False)
+    return install
+
+
+def test_failed_cached_call_falls_back_to_the_full_pdf(document_client):
+    models = FakeModels(fail_cached=True)
+    client = fake_client(models=models)
+    contexts = manager(min_hits=1)
+    document_client(client, contexts)
+
+    response = asyncio.run(documents._generate_document_answer(PDF, "¿Qué lote aparece?"))
+
+    assert response.text == "respuesta"
+    assert [r["cached_content"] for r in models.requests] == ["cachedContents/1", None]
+    assert models.requests[1]["contents"][1].file_data.file_uri == PDF
+    assert client.aio.caches.deleted == ["cachedContents/1"]
+    assert contexts.stats()["documents"] == 0
+
+
+def test_cached_call_sends_only_the_question(document_client):
+    models = FakeModels()
+    client = fake_client(models=models)
+    document_client(client, manager(min_hits=1))
+
+    asyncio.run(documents._generate_document_answer(PDF, "¿Qué lote aparece?"))
+
+    assert models.requests == [{"contents": ["¿Qué lote aparece?"], "cached_content": "cachedContents/1"}]
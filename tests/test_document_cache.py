@@ -0,0 +1,92 @@
+from app.document_cache import DiskTier, DocumentAnswerCache, normalize_question
+
+
+class FakeClock:
+    def __init__(self):
+        self.now = 1000.0
+
+    def __call__(self):
+        return self.now
+
+
+class FakeTier:
+    """Persistent tier in a dict; `fail` makes every operation raise."""
+
+    def __init__(self):
+        self.entries = {}
+        self.fail = False
+
+    def get(self, key):
+        if self.fail:
+            raise OSError("storage unavailable")
+        return self.entries.get(key)
+
+    def put(self, key, entry):
+        if self.fail:
+            raise OSError("storage unavailable")
+        self.entries[key] = entry
+
+    def delete(self, key):
+        if self.fail:
+            raise OSError("storage unavailable")
+        self.entries.pop(key, None)
+
+
+def cache(tier=None, clock=None) -> DocumentAnswerCache:
+    return DocumentAnswerCache(ttl=100, persistent_tier=tier, clock=clock or FakeClock())
+
+
+def test_normalize_question():
+    assert normalize_question("  ¿Qué LOTE   aparece?  ") == normalize_question("qué lote aparece")
+
+
+def test_memory_hit_then_ttl_expiry():
+    clock = FakeClock()
+    answers = cache(clock=clock)
+    answers.put("k", "respuesta")
+    assert answers.get("k") == "respuesta"
+
+    clock.now += 101
+    assert answers.get("k") is None
+    assert answers.stats()["hits"] == 1 and answers.stats()["misses"] == 1
+
+
+def test_promoted_entry_keeps_its_creation_time():
+    clock, tier = FakeClock(), FakeTier()
+    cache(tier, clock).put("k", "respuesta")
+
+    clock.now += 90
+    replica = cache(tier, clock)
+    assert replica.get("k") == "respuesta"
+    assert replica.stats()["persistent_hits"] == 1
+
+    # Promoted to memory 90 s after it was created: it expires 10 s later, not 100.
+    clock.now += 11
+    assert replica.get("k") is None
+    assert "k" not in tier.entries
+
+
+def test_persistent_tier_errors_are_misses():
+    clock, tier = FakeClock(), FakeTier()
+    answers = cache(tier, clock)
+    tier.entries["k"] = {"answer": "antigua", "created": clock.now - 500}
+    tier.fail = True
+
+    answers.put("new", "respuesta")
+    assert answers.get("missing") is None
+
+    tier.get = lambda key: {"answer": "antigua", "created": clock.now - 500}
+    assert answers.get("k") is None
+    assert answers.stats()["misses"] == 2
+
+
+def test_disk_tier_round_trip_and_eviction(tmp_path):
+    tier = DiskTier(str(tmp_path), max_entries=2)
+    for key in ("a", "b", "c"):
+        tier.put(key, {"answer": key, "created": 0})
+
+    assert len(list(tmp_path.glob("*.json"))) == 2
+    kept = next(key for key in ("a", "b", "c") if tier.get(key) is not None)
+    assert tier.get(kept) == {"answer": kept, "created": 0}
+    tier.delete(kept)
+    assert tier.get(kept) is None
@@ -0,0 +1,146 @@
+import asyncio
+import io
+import re
+import types as pytypes
+
+import pytest
+from pypdf import PdfReader, PdfWriter
+from pypdf.generic import DecodedStreamObject, DictionaryObject, NameObject
+
+from app import documents
+from app.pdf_chunks import PageHintError, chunk_pages, extract_pages, page_count, parse_page_hint
+
+PDF = "gs://docs/ficha_tecnica.pdf"
+QUESTION = "¿Cuál es el punto de inflamación?"
+FACT = "Punto de inflamacion: 62 C"
+
+
+def make_pdf(pages: int, fact_pages=()) -> bytes:
+    """A text PDF whose page i reads "Pagina i." followed by FACT on `fact_pages`."""
+    writer = PdfWriter()
+    font = DictionaryObject({NameObject("/Type"): NameObject("/Font"), NameObject("/Subtype"): NameObject("/Type1"),
+                             NameObject("/BaseFont"): NameObject("/Helvetica")})
+    for number in range(1, pages + 1):
+        page = writer.add_blank_page(width=612, height=792)
+        page[NameObject("/Resources")] = DictionaryObject({NameObject("/Font"): DictionaryObject({NameObject("/F1"): font})})
+        text = f"Pagina {number}. " + (FACT if number in fact_pages else "Sin datos.")
+        stream = DecodedStreamObject()
+        stream.set_data(f"BT /F1 12 Tf 72 720 Td ({text}) Tj ET".encode("latin-1"))
+        page.replace_contents(stream)
+    output = io.BytesIO()
+    writer.write(output)
+    return output.getvalue()
+
+
+def page_numbers(data: bytes) -> list:
+    return [int(re.match(r"Pagina (\d+)", p.extract_text()).group(1)) for p in PdfReader(io.BytesIO(data)).pages]
+
+
+class StubModel:
+    """Stands in for `documents._generate`: reads the pages it is sent and answers from them."""
+
+    def __init__(self, failing_pages=()):
+        self.failing_pages = set(failing_pages)
+        self.chunks = []
+        self.reduce_prompts = []
+
+    async def __call__(self, client, contents, config=None, estimated_tokens=None):
+        if len(contents) == 1:
+            self.reduce_prompts.append(contents[0])
+            return pytypes.SimpleNamespace(text="respuesta combinada", usage_metadata=None)
+        pages = page_numbers(contents[1].inline_data.data)
+        self.chunks.append(pages)
+        if self.failing_pages & set(pages):
+            raise RuntimeError("500 INTERNAL")
+        reader = PdfReader(io.BytesIO(contents[1].inline_data.data))
+        found = [n for n, p in zip(pages, reader.pages) if FACT in p.extract_text()]
+        text = f"62 C (página {found[0]})" if found else documents.CHUNK_NOT_FOUND
+        return pytypes.SimpleNamespace(text=text, usage_metadata=None)
+
+
+@pytest.fixture
+def stub_model(monkeypatch):
+    def install(data: bytes, **kwargs) -> StubModel:
+        model = StubModel(**kwargs)
+        monkeypatch.setattr(documents, "_generate", model)
+        monkeypatch.setattr(documents, "_download", lambda uri: data)
+        monkeypatch.setattr(documents, "get_genai_client", lambda: None)
+        monkeypatch.setattr(documents, "DOCUMENT_CHUNKING_ENABLED", True)
+        monkeypatch.setattr(documents, "DOCUMENT_CHUNKED_MIN_BYTES", 1)
+        monkeypatch.setattr(documents, "DOCUMENT_CHUNKED_MIN_PAGES", 20)
+        monkeypatch.setattr(documents, "DOCUMENT_CHUNK_PAGES", 10)
+        return model
+    return install
+
+
+def answer(pages: str = "", size: int = 1) -> str:
+    return asyncio.run(documents._generate_answer(PDF, QUESTION, pages, size, {}))
+
+
+def test_page_hints():
+    assert parse_page_hint("12", 30) == [12]
+    assert parse_page_hint("3, 7-9, 28-", 30) == [3, 7, 8, 9, 28, 29, 30]
+    assert parse_page_hint("25-40", 30) == list(range(25, 31))
+    with pytest.raises(PageHintError):
+        parse_page_hint("40-", 30)
+    with pytest.raises(PageHintError):
+        parse_page_hint("doce", 30)
+
+
+def test_chunks_are_contiguous_page_ranges_of_the_pdf():
+    data = make_pdf(25)
+    chunks = chunk_pages([1, 2, 3, 4, 5, 9, 10, 11, 20], 3)
+    assert chunks == [[1, 2, 3], [4, 5], [9, 10, 11], [20]]
+
+    assert page_count(data) == 25
+    assert [page_numbers(d) for d in extract_pages(data, chunks)] == chunks
+
+
+def test_large_document_is_mapped_by_chunks_and_reduced(stub_model):
+    model = stub_model(make_pdf(45, fact_pages={7, 38}))
+
+    assert answer() == "respuesta combinada"
+
+    assert sorted(model.chunks) == [list(range(s, min(s + 10, 46))) for s in range(1, 46, 10)]
+    [prompt] = model.reduce_prompts
+    assert "Respuesta de las páginas 1-10:\n62 C (página 7)" in prompt
+    assert "Respuesta de las páginas 31-40:\n62 C (página 38)" in prompt
+    assert documents.CHUNK_NOT_FOUND not in prompt
+
+
+def test_single_matching_chunk_skips_the_reduce_step(stub_model):
+    model = stub_model(make_pdf(45, fact_pages={38}))
+
+    assert answer() == "62 C (página 38)"
+    assert model.reduce_prompts == []
+
+
+def test_page_hint_sends_only_those_pages(stub_model):
+    # Below DOCUMENT_CHUNKED_MIN_PAGES, so only the hint makes it chunked.
+    model = stub_model(make_pdf(15, fact_pages={13}))
+
+    assert answer(pages="12-14") == "62 C (página 13)"
+    assert model.chunks == [[12, 13, 14]]
+
+
+def test_small_document_without_hint_is_sent_whole(stub_model, monkeypatch):
+    stub_model(make_pdf(15, fact_pages={13}))
+    whole = []
+
+    async def generate_document_answer(gcs_file_path, question):
+        whole.append(gcs_file_path)
+        return pytypes.SimpleNamespace(text="documento completo", usage_metadata=None)
+
+    monkeypatch.setattr(documents, "_generate_document_answer", generate_document_answer)
+
+    assert answer() == "documento completo"
+    assert whole == [PDF]
+
+
+def test_failed_and_empty_chunks_are_reported(stub_model):
+    stub_model(make_pdf(30), failing_pages={25})
+
+    result = answer()
+
+    assert result.startswith("No se ha encontrado información para responder en las páginas 1-30")
+    assert result.endswith("(No se pudieron leer las páginas 21-30.)")
@@ -0,0 +1,27 @@
+import asyncio
+import gc
+import threading
+
+from app import documents
+
+
+def test_each_event_loop_keeps_its_own_document_semaphore():
+    async def semaphores():
+        return documents._document_semaphore(), documents._document_semaphore()
+
+    loop = asyncio.new_event_loop()
+    first, again = loop.run_until_complete(semaphores())
+    assert first is again
+
+    # A loop in another thread gets its own limiter and leaves this loop's one in place.
+    other = {}
+    thread = threading.Thread(target=lambda: other.update(semaphore=asyncio.run(semaphores())[0]))
+    thread.start()
+    thread.join()
+    assert other["semaphore"] is not first
+    assert loop.run_until_complete(semaphores())[0] is first
+
+    loop.close()
+    del loop
+    gc.collect()
+    assert all(semaphore is not first for semaphore in documents._semaphores.values())
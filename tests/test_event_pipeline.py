@@ -0,0 +1,42 @@
+import asyncio
+
+from event_pipeline import EventPipeline, MetricsSink
+
+
+class FakeClock:
+    def __init__(self, times: list):
+        self.times = iter(times)
+
+    def __call__(self):
+        return next(self.times)
+
+
+def call(name: str, call_id: str) -> dict:
+    return {"author": "agent", "content": {"parts": [{"function_call": {"id": call_id, "name": name, "args": {}}}]}}
+
+
+def response(name: str, call_id: str) -> dict:
+    return {"author": "agent", "content": {"parts": [{"function_response": {"id": call_id, "name": name}}]}}
+
+
+async def stream(events: list):
+    for event in events:
+        yield event
+
+
+def test_tool_time_is_summed_per_tool_in_constant_memory():
+    events = []
+    for i in range(500):
+        events += [call("execute_sql", f"sql-{i}"), response("execute_sql", f"sql-{i}")]
+    events += [call("query_gcs_document", "doc"), response("query_gcs_document", "doc"), call("execute_sql", "open")]
+    # The request starts at 0 and each event arrives one second after the previous one.
+    pipeline = EventPipeline([], metrics=MetricsSink(max_tool_calls=10), collect=False,
+                             clock=FakeClock(range(len(events) + 1)))
+
+    summary = asyncio.run(pipeline.run(stream(events)))
+
+    assert summary["tool_time_s"] == {"execute_sql": 500.0, "query_gcs_document": 1.0}
+    assert summary["tool_call_counts"] == {"execute_sql": 500, "query_gcs_document": 1}
+    assert len(summary["tool_calls"]) == 10
+    assert summary["unanswered_tool_calls"] == ["execute_sql"]
+    assert summary["event_types"] == {"function_call": 502, "function_response": 501}
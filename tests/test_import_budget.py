@@ -0,0 +1,41 @@
+import os
+import subprocess
+import sys
+
+import pytest
+
+from configure_and_deploy import IMPORT_BUDGETS, profile_imports
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+RUNS = 2
+# Wall-clock time depends on the machine and its load, so the seconds budget is only checked on demand
+# (and by `import_profile --check`); the module count is deterministic and always checked.
+CHECK_SECONDS = os.getenv("IMPORT_BUDGET_CHECK_SECONDS", "false").lower() == "true"
+
+
+@pytest.mark.parametrize("module", list(IMPORT_BUDGETS))
+def test_cold_import_within_module_budget(module):
+    _, max_modules = IMPORT_BUDGETS[module]
+    assert profile_imports(module)["modules"] <= max_modules
+
+
+@pytest.mark.skipif(not CHECK_SECONDS, reason="set IMPORT_BUDGET_CHECK_SECONDS=true to check import times")
+@pytest.mark.parametrize("module", list(IMPORT_BUDGETS))
+def test_cold_import_within_time_budget(module):
+    max_seconds, _ = IMPORT_BUDGETS[module]
+    assert min(profile_imports(module)["seconds"] for _ in range(RUNS)) <= max_seconds
+
+
+def test_importing_the_agent_resolves_no_credentials_and_skips_heavy_clients():
+    code = (
+        "import sys\n"
+        "import google.auth\n"
+        "def default(*args, **kwargs):\n"
+        "    raise AssertionError('credentials resolved at import time')\n"
+        "google.auth.default = default\n"
+        "from app import root_agent\n"
+        "loaded = sorted(m for m in ('google.cloud.bigquery', 'numpy', 'shapely') if m in sys.modules)\n"
+        "assert not loaded, loaded\n"
+    )
+    result = subprocess.run([sys.executable, "-c", code], capture_output=True, text=True, cwd=ROOT)
+    assert result.returncode == 0, result.stderr[-2000:]
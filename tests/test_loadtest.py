@@ -0,0 +1,96 @@
+import asyncio
+import collections
+
+import pytest
+
+from loadtest import LocalAgentEngines, run_loadtest
+
+ENGINE = "projects/p/locations/l/reasoningEngines/1"
+QUESTIONS = ["¿Qué pedidos tiene el cliente Acme?", "¿Qué alérgenos tiene el lote 42?"]
+
+
+def engines(**kwargs) -> LocalAgentEngines:
+    settings = {"first_event_delay": 0.005, "event_delay": 0.001, "create_session_delay": 0.001, **kwargs}
+    return LocalAgentEngines(**settings)
+
+
+def test_report_fields():
+    report, samples = asyncio.run(run_loadtest(engines(), ENGINE, QUESTIONS, users=3, sessions_per_user=2,
+                                               turns=12, concurrency=4))
+
+    assert len(samples) == 12
+    assert (report["users"], report["sessions"], report["turns"], report["concurrency"]) == (3, 6, 12, 4)
+    assert report["error_rate"] == 0.0 and report["errors"] == {}
+    for key in ("time_to_first_event_s", "latency_s", "events_per_turn"):
+        assert report[key]["count"] == 12
+    assert report["time_to_first_event_s"]["p50"] <= report["latency_s"]["p50"]
+    assert report["events_per_turn"]["max"] <= 2 * 4 - 1
+    assert report["throughput_turns_per_s"] > 0
+
+
+def test_error_rate_counts_failed_turns():
+    report, samples = asyncio.run(run_loadtest(engines(error_rate=1.0), ENGINE, QUESTIONS, users=2, turns=6))
+
+    assert report["error_rate"] == 1.0
+    assert report["errors"] == {"RuntimeError: Simulated engine error.": 6}
+    assert report["latency_s"] == {"count": 0}
+    assert all(s["events"] == 0 for s in samples)
+
+
+def test_each_session_runs_one_turn_at_a_time():
+    local = engines()
+    app = local.get(ENGINE)
+    stream_query = app.async_stream_query
+    in_flight = collections.Counter()
+    peak = collections.Counter()
+
+    async def tracked(user_id, session_id, message):
+        in_flight[session_id] += 1
+        peak[session_id] = max(peak[session_id], in_flight[session_id])
+        try:
+            async for event in stream_query(user_id=user_id, session_id=session_id, message=message):
+                yield event
+        finally:
+            in_flight[session_id] -= 1
+
+    app.async_stream_query = tracked
+    report, _ = asyncio.run(run_loadtest(local, ENGINE, QUESTIONS, users=2, turns=20, concurrency=10))
+
+    assert report["error_rate"] == 0.0
+    assert len(peak) == 2
+    assert set(peak.values()) == {1}
+
+
+def test_failed_sessions_are_reported_and_created_ones_deleted():
+    local = engines(create_error_rate=0.5, seed=1)
+    report, samples = asyncio.run(run_loadtest(local, ENGINE, QUESTIONS, users=8, turns=16))
+
+    failed = report["session_errors"].get("RuntimeError: Simulated create_session error.", 0)
+    assert failed and report["sessions"] == 8 - failed
+    assert report["error_rate"] == 0.0 and len(samples) == 16
+    assert report["session_delete_errors"] == {}
+    assert local.get(ENGINE)._sessions == {}
+
+
+def test_no_turns_when_no_session_could_be_created():
+    local = engines(create_error_rate=1.0)
+    report, samples = asyncio.run(run_loadtest(local, ENGINE, QUESTIONS, users=3, turns=5))
+
+    assert samples == []
+    assert (report["sessions"], report["turns"]) == (0, 0)
+    assert report["session_errors"] == {"RuntimeError: Simulated create_session error.": 3}
+
+
+def test_sessions_are_deleted_when_the_run_fails():
+    local = engines()
+    app = local.get(ENGINE)
+
+    async def broken_stream_query(user_id, session_id, message):
+        raise asyncio.CancelledError()
+        yield
+
+    app.async_stream_query = broken_stream_query
+    # Turn errors are caught per turn; a cancellation is not, and aborts the run.
+    with pytest.raises(asyncio.CancelledError):
+        asyncio.run(run_loadtest(local, ENGINE, QUESTIONS, users=2, turns=4))
+    assert app._sessions == {}
@@ -0,0 +1,195 @@
+import asyncio
+import datetime
+import types
+
+import pyarrow as pa
+import pytest
+
+from app.local_mirror import LocalMirror, NotMirrored, UnsupportedQuery, to_duckdb
+
+PROJECT, DATASET = "demo-project", "ventas"
+TABLES = ("pedidos", "productos")
+
+
+def translate(query: str) -> str:
+    return to_duckdb(query, PROJECT, DATASET, TABLES)[0]
+
+
+@pytest.mark.parametrize("query, expected", [
+    (f"SELECT * FROM `{PROJECT}.{DATASET}.pedidos`", 'SELECT * FROM "pedidos"'),
+    (f"SELECT * FROM `{PROJECT}`.`{DATASET}`.`pedidos`", 'SELECT * FROM "pedidos"'),
+    ("SELECT p.Menge FROM ventas.pedidos p", 'SELECT p.Menge FROM "pedidos" p'),
+    ("SELECT `Menge` FROM ventas.pedidos", 'SELECT "Menge" FROM "pedidos"'),
+    ("SELECT CAST(Menge AS STRING) FROM ventas.pedidos", 'SELECT bq_to_string(Menge) FROM "pedidos"'),
+    ("SELECT CAST(Menge AS INT64) FROM ventas.pedidos", 'SELECT CAST(Menge AS BIGINT) FROM "pedidos"'),
+    ("SELECT SAFE_CAST(Erdat AS DATE) FROM ventas.pedidos", 'SELECT TRY_CAST(Erdat AS DATE) FROM "pedidos"'),
+    ("SELECT DATE_TRUNC(Erdat, MONTH) FROM ventas.pedidos",
+     "SELECT CAST(date_trunc('month', Erdat) AS DATE) FROM \"pedidos\""),
+    ("SELECT DATE_DIFF(Eindt, Erdat, DAY) FROM ventas.pedidos", "SELECT date_diff('day', Erdat, Eindt) FROM \"pedidos\""),
+    ("SELECT DATE_ADD(Erdat, INTERVAL 7 DAY) FROM ventas.pedidos",
+     'SELECT CAST((Erdat) + INTERVAL (7) DAY AS DATE) FROM "pedidos"'),
+    ("SELECT DATE_SUB(CURRENT_DATE(), INTERVAL 1 MONTH) FROM ventas.pedidos",
+     'SELECT CAST((current_date) - INTERVAL (1) MONTH AS DATE) FROM "pedidos"'),
+    ("SELECT * EXCEPT (Notas) FROM ventas.pedidos", 'SELECT * EXCLUDE (Notas) FROM "pedidos"'),
+    ("SELECT Txz01 FROM ventas.productos WHERE Txz01 = \"O'Neil\" -- comment",
+     "SELECT Txz01 FROM \"productos\" WHERE Txz01 = 'O''Neil'"),
+    ("SELECT SAFE_DIVIDE(Netwr, Menge), Netwr / 100 FROM ventas.pedidos;",
+     'SELECT SAFE_DIVIDE(Netwr, Menge), Netwr / 100 FROM "pedidos"'),
+])
+def test_translated_constructs(query, expected):
+    assert translate(query) == expected
+
+
+def test_referenced_tables_are_reported():
+    assert to_duckdb("SELECT * FROM ventas.pedidos JOIN ventas.productos USING (Ematn)", PROJECT, DATASET,
+                     TABLES)[1] == ["pedidos", "productos"]
+
+
+@pytest.mark.parametrize("query, reason", [
+    ("SELECT x FROM ventas.pedidos, UNNEST(arr) AS x", "UNNEST"),
+    ("SELECT SAFE.PARSE_DATE('%F', Erdat) FROM ventas.pedidos", "SAFE"),
+    ("SELECT * FROM ventas.pedidos WHERE Ematn = @ematn", "@"),
+    ("SELECT EXTRACT(WEEK FROM Erdat) FROM ventas.pedidos", "WEEK"),
+    ("SELECT DATE_TRUNC(Erdat, WEEK) FROM ventas.pedidos", "WEEK"),
+    ("SELECT DATE_DIFF(Eindt, Erdat, HOUR) FROM ventas.pedidos", "date part HOUR"),
+    ("SELECT CAST(Menge AS JSON) FROM ventas.pedidos", "CAST to JSON"),
+    ("SELECT * FROM pedidos", "unqualified table pedidos"),
+    ("DELETE FROM ventas.pedidos WHERE TRUE", "DELETE statement"),
+    ("SELECT 1 FROM ventas.pedidos; SELECT 2", "multiple statements"),
+    ("SELECT 'it\\'s' FROM ventas.pedidos", "escaped string"),
+    ("SELECT Netwr / Menge FROM ventas.pedidos", "division"),
+    ("SELECT Netwr / 0 FROM ventas.pedidos", "division"),
+    ("SELECT Netwr / (Menge + 1) FROM ventas.pedidos", "division"),
+])
+def test_untranslatable_queries_fall_back(query, reason):
+    with pytest.raises(UnsupportedQuery, match=reason) as error:
+        translate(query)
+    assert not isinstance(error.value, NotMirrored)
+
+
+@pytest.mark.parametrize("query", [
+    "SELECT * FROM ventas.clientes",
+    "SELECT * FROM `other-project.ventas.pedidos`",
+    "SELECT * FROM `other-project`.compras.pedidos_compra",
+])
+def test_other_tables_are_not_mirrored(query):
+    with pytest.raises(NotMirrored):
+        translate(query)
+
+
+ROWS = {
+    "pedidos": pa.table({
+        "Ematn": ["A", "A", "B"],
+        "Menge": pa.array([2, 0, 5], pa.int64()),
+        "Netwr": [10.0, 4.0, 7.5],
+        "Erdat": pa.array([datetime.date(2024, 1, 15), datetime.date(2024, 2, 3), datetime.date(2024, 2, 20)]),
+    }),
+    "productos": pa.table({"Ematn": ["A", "B"], "Txz01": ["Vitamina C", "Magnesio"]}),
+}
+
+
+class FakeBigQuery:
+    """`get_table` returns the tables' modified times (change them in `modified`); `list_rows` their rows."""
+
+    def __init__(self):
+        self.modified = {name: datetime.datetime(2024, 5, 1, tzinfo=datetime.timezone.utc) for name in ROWS}
+
+    def get_table(self, table_id):
+        name = table_id.split(".")[-1]
+        if name not in ROWS:
+            raise LookupError(table_id)
+        return types.SimpleNamespace(name=name, modified=self.modified[name], num_bytes=1024)
+
+    def list_rows(self, table):
+        return types.SimpleNamespace(to_arrow=lambda: ROWS[table.name])
+
+
+class FakeClock:
+    def __init__(self):
+        self.now = 1000.0
+
+    def __call__(self):
+        return self.now
+
+
+@pytest.fixture
+def mirror(tmp_path):
+    bigquery = FakeBigQuery()
+    mirror = LocalMirror(lambda project: bigquery, project=PROJECT, dataset=DATASET, tables=list(ROWS),
+                         max_staleness=60, check_interval=3600, directory=str(tmp_path), clock=FakeClock())
+    mirror.bigquery = bigquery
+    report = mirror.sync()
+    assert sorted(report["downloaded"]) == ["pedidos", "productos"]
+    return mirror
+
+
+def call(mirror, query: str, project: str = PROJECT):
+    async def run():
+        return await mirror.before_tool_callback(types.SimpleNamespace(name="execute_sql"),
+                                                 {"project_id": project, "query": query}, None)
+    return asyncio.run(run())
+
+
+def test_translated_query_is_answered_locally(mirror):
+    response = call(mirror, "SELECT p.Ematn, d.Txz01, SUM(p.Netwr) AS total, CAST(SUM(p.Menge) AS STRING) "
+                            f"FROM `{PROJECT}.{DATASET}.pedidos` p JOIN ventas.productos d USING (Ematn) "
+                            "WHERE DATE_TRUNC(p.Erdat, MONTH) >= '2024-01-01' GROUP BY 1, 2 ORDER BY 1")
+
+    assert response == {"status": "SUCCESS", "rows": [
+        {"Ematn": "A", "Txz01": "Vitamina C", "total": 14.0, "f0_": "2"},
+        {"Ematn": "B", "Txz01": "Magnesio", "total": 7.5, "f0_": "5"},
+    ]}
+    assert mirror.stats()["served"] == 1
+
+
+def test_safe_divide_by_zero_is_null_like_bigquery(mirror):
+    response = call(mirror, "SELECT SAFE_DIVIDE(Netwr, Menge) AS precio FROM ventas.pedidos ORDER BY Erdat")
+
+    assert [row["precio"] for row in response["rows"]] == [5.0, None, 1.5]
+
+
+def test_division_by_a_column_runs_on_bigquery(mirror):
+    assert call(mirror, "SELECT Netwr / Menge FROM ventas.pedidos") is None
+    assert mirror.stats()["fallbacks"] == {"unsupported": 1}
+
+
+@pytest.mark.parametrize("query, reason", [
+    ("SELECT REGEXP_REPLACE(Ematn, 'A', 'B') FROM ventas.pedidos", "unsupported"),
+    ("SELECT no_such_function(Ematn) FROM ventas.pedidos", "unsupported"),
+    # Read as alias.column by the translation: DuckDB cannot plan it.
+    ("SELECT * FROM compras.pedidos_compra", "unsupported"),
+    ("SELECT * FROM ventas.clientes", "not_mirrored"),
+])
+def test_fallback_reasons(mirror, query, reason):
+    assert call(mirror, query) is None
+    assert mirror.stats()["fallbacks"] == {reason: 1}
+
+
+def test_other_project_falls_back(mirror):
+    assert call(mirror, "SELECT * FROM ventas.pedidos", project="other-project") is None
+    assert mirror.stats()["fallbacks"] == {"other_project": 1}
+
+
+def test_modified_table_is_stale_until_synced(mirror):
+    query = "SELECT COUNT(*) AS n FROM ventas.pedidos"
+    mirror.clock.now += 120
+    mirror.bigquery.modified["pedidos"] += datetime.timedelta(hours=1)
+
+    async def run():
+        first = await mirror.before_tool_callback(types.SimpleNamespace(name="execute_sql"),
+                                                  {"project_id": PROJECT, "query": query}, None)
+        await mirror._sync_task
+        return first
+
+    assert asyncio.run(run()) is None
+    assert mirror.stats()["fallbacks"] == {"stale": 1}
+    assert call(mirror, query) == {"status": "SUCCESS", "rows": [{"n": 3}]}
+    assert mirror.status()["pedidos"]["fresh"]
+
+
+def test_unmodified_table_is_confirmed_and_served(mirror):
+    mirror.clock.now += 120
+    assert not mirror.status()["pedidos"]["fresh"]
+
+    assert call(mirror, "SELECT COUNT(*) AS n FROM ventas.pedidos") == {"status": "SUCCESS", "rows": [{"n": 3}]}
+    assert mirror.status()["pedidos"]["fresh"]
@@ -0,0 +1,126 @@
+import asyncio
+
+from app.product_index import PRODUCT_FIELDS, ProductIndex, ProductResolver, normalize
+
+PRODUCTS = [
+    ("8412345678901", "ABC-100", "Vitamina C 1000 mg"),
+    ("8412345678902", "ABC-1000", "Vitamina C 500 mg"),
+    ("8412345678903", "XYZ-200", "Jabón Líquido Neutro"),
+    ("8412345678904", "QRS-300", "Ibuprofeno 600 mg comprimidos"),
+]
+
+
+class FakeClock:
+    def __init__(self):
+        self.now = 0.0
+
+    def __call__(self):
+        return self.now
+
+
+class FakeTable:
+    def __init__(self, modified):
+        self.modified = modified
+
+
+class FakeBigQuery:
+    """get_table and query_and_wait over {table: (modified, products)}."""
+
+    def __init__(self, tables: dict):
+        self.tables = tables
+        self.queries = []
+        self.fail = False
+
+    def get_table(self, table_id: str):
+        if self.fail:
+            raise RuntimeError("BigQuery unavailable")
+        return FakeTable(self.tables[table_id.rsplit(".", 1)[1]][0])
+
+    def query_and_wait(self, query: str):
+        self.queries.append(query)
+        table = query.rsplit(".", 1)[1].rstrip("`")
+        return [dict(zip(PRODUCT_FIELDS, product)) for product in self.tables[table][1]]
+
+
+def matches(results: list) -> list:
+    return [(r["Idnlf"], r["match"]) for r in results]
+
+
+def test_exact_key_ranks_before_prefixes_and_stops_looser_matches():
+    index = ProductIndex(PRODUCTS)
+    assert matches(index.search("ABC-100")) == [("ABC-100", "exact"), ("ABC-1000", "prefix")]
+    assert matches(index.search("ABC-100", limit=1)) == [("ABC-100", "exact")]
+    assert index.search("8412345678904")[0]["score"] == 1.0
+
+
+def test_prefix_matches_score_by_the_covered_share_of_the_key():
+    results = ProductIndex(PRODUCTS).search("abc 10")
+    assert matches(results) == [("ABC-100", "prefix"), ("ABC-1000", "prefix")]
+    assert results[0]["score"] > results[1]["score"]
+
+
+def test_products_containing_every_word_rank_before_fuzzy_matches():
+    results = ProductIndex(PRODUCTS).search("vitamina mg")
+    assert sorted(matches(results)[:2]) == [("ABC-100", "contains"), ("ABC-1000", "contains")]
+    assert all(match == "fuzzy" for _, match in matches(results)[2:])
+
+
+def test_misspelled_reference_finds_the_product_by_trigrams():
+    results = ProductIndex(PRODUCTS).search("ibuprofeno 600 comprimdos")
+    assert matches(results)[0] == ("QRS-300", "fuzzy")
+    assert 0.4 <= results[0]["score"] < 1.0
+    assert ProductIndex(PRODUCTS).search("zzzz qqqq") == []
+
+
+def test_accents_case_and_punctuation_are_normalized():
+    assert normalize("  Jabón LÍQUIDO-Neutro ") == "jabon liquido neutro"
+    assert normalize(None) == ""
+    index = ProductIndex(PRODUCTS)
+    assert matches(index.search("JABON liquido neutro")) == [("XYZ-200", "exact")]
+    assert matches(index.search("abc_100"))[0] == ("ABC-100", "exact")
+    assert index.search(" -- ") == []
+
+
+def tables() -> dict:
+    return {
+        "compras_confirmacion_orden_compra": (1, PRODUCTS[:2]),
+        "compras_packing_list": (1, PRODUCTS[1:3]),
+        "pedidos": (1, PRODUCTS[3:]),
+    }
+
+
+def test_refresh_skips_tables_whose_modified_time_is_unchanged():
+    client = FakeBigQuery(tables())
+    resolver = ProductResolver(lambda project: client, clock=FakeClock())
+
+    first = resolver.refresh()
+    assert len(first["changed_tables"]) == 3
+    assert (first["added"], first["products"]) == (4, 4)
+
+    # Same modified times: nothing is read, even though the rows would differ.
+    client.tables["pedidos"] = (1, [])
+    assert resolver.refresh() == {"changed_tables": [], "added": 0, "removed": 0, "products": 4}
+    assert len(client.queries) == 3
+
+    client.tables["pedidos"] = (2, [("8412345678905", "NEW-1", "Paracetamol 1 g")])
+    second = resolver.refresh()
+    assert second == {"changed_tables": ["pedidos"], "added": 1, "removed": 1, "products": 4}
+    assert len(client.queries) == 4
+    assert matches(resolver.index.search("NEW-1")) == [("NEW-1", "exact")]
+
+
+def test_failed_first_load_is_retried_on_the_next_lookup():
+    client = FakeBigQuery(tables())
+    client.fail = True
+    clock = FakeClock()
+    resolver = ProductResolver(lambda project: client, clock=clock)
+
+    async def run():
+        assert (await resolver.resolve("ABC-100"))["matches"] == []
+        assert resolver._last_check is None
+        client.fail = False
+        return await resolver.resolve("ABC-100")
+
+    result = asyncio.run(run())
+    assert matches(result["matches"]) == [("ABC-100", "exact"), ("ABC-1000", "prefix")]
+    assert resolver._last_check == clock.now
@@ -0,0 +1,19 @@
+import pytest
+
+from app.prompts import AGENT_PROMPTS, compile_prompt, compile_sections
+
+DEFAULT_VALUES_RULE = '<rule id="valores_por_defecto"'
+
+
+@pytest.mark.parametrize("agent_name", ["compras_agent", "pedidos_agent"])
+def test_default_values_rule_for_buys_and_orders(agent_name):
+    assert DEFAULT_VALUES_RULE in compile_prompt(agent_name)
+
+
+def test_quality_agent_keeps_zero_values():
+    assert DEFAULT_VALUES_RULE not in compile_prompt("calidad_agent")
+
+
+def test_common_rules_are_a_shared_prefix():
+    prefixes = {compile_sections(name)[0][1] for name in AGENT_PROMPTS}
+    assert len(prefixes) == 1
@@ -0,0 +1,259 @@
+import asyncio
+import collections
+
+import pytest
+
+from app.rate_limit import GeminiRateLimiter, RateLimitError, TokenBucket, error_code, retry_hint
+
+
+class FakeClock:
+    """Monotonic clock whose sleeps only advance the time."""
+
+    def __init__(self):
+        self.now = 0.0
+        self.sleeps = []
+
+    def __call__(self):
+        return self.now
+
+    async def sleep(self, seconds: float):
+        self.sleeps.append(seconds)
+        self.now += seconds
+
+
+class ApiError(Exception):
+    def __init__(self, code: int, message: str = "", details=None):
+        super().__init__(f"{code} {message}")
+        self.code = code
+        self.details = details
+
+
+def limiter(clock: FakeClock, **kwargs) -> GeminiRateLimiter:
+    # 60 requests per minute is one per second, with a burst of 5; the token bucket is disabled.
+    options = dict(rpm=60, tpm=0, burst_seconds=5, max_retries=3, backoff_base=1, backoff_max=8,
+                   rate_decrease=0.5, min_rate_factor=0.25, rate_recovery=0.1, hedging=False, enabled=True)
+    options.update(kwargs)
+    return GeminiRateLimiter(clock=clock, sleep=clock.sleep, **options)
+
+
+def test_bucket_refills_and_queues_reservations_as_debt():
+    bucket = TokenBucket(60, 5, now=0.0)
+    assert bucket.capacity == 5
+
+    assert bucket.reserve(5, now=0.0) == 0.0
+    # Each further reservation waits for the debt in front of it.
+    assert bucket.reserve(1, now=0.0) == 1.0
+    assert bucket.reserve(1, now=0.0) == 2.0
+    assert bucket.level == -2
+
+    assert not bucket.try_take(1, now=2.5)
+    assert bucket.try_take(1, now=3.0)
+    # Refill stops at the capacity and one reservation never takes more than a full bucket.
+    assert bucket.reserve(100, now=60.0) == 0.0
+    assert bucket.level == 0
+
+
+def test_bucket_adjusts_to_actual_usage_and_scales_its_rate():
+    bucket = TokenBucket(60, 5, now=0.0)
+    bucket.reserve(5, now=0.0)
+    bucket.adjust(2, now=0.0)
+    assert bucket.level == -2
+    bucket.adjust(-10, now=0.0)
+    assert bucket.level == 5
+
+    bucket.reserve(5, now=0.0)
+    bucket.set_scale(0.5, now=0.0)
+    assert bucket.reserve(1, now=0.0) == 2.0
+
+
+def test_drained_bucket_does_not_refill_until_the_hint():
+    bucket = TokenBucket(60, 5, now=0.0)
+    bucket.drain(until=10.0)
+    assert bucket.level == 0
+    assert not bucket.try_take(1, now=5.0)
+    assert bucket.reserve(1, now=5.0) == 6.0
+
+
+def test_disabled_bucket_never_waits():
+    bucket = TokenBucket(0, 5, now=0.0)
+    assert not bucket.enabled
+    assert bucket.reserve(1000, now=0.0) == 0.0
+    assert bucket.try_take(1000, now=0.0)
+
+
+def test_acquire_waits_for_the_reserved_quota():
+    clock = FakeClock()
+    limit = limiter(clock)
+
+    async def run():
+        return [await limit.acquire() for _ in range(7)]
+
+    waits = asyncio.run(run())
+    assert waits[:5] == [0.0] * 5
+    # The sleeps advance the clock, so the later requests are paced at one per second.
+    assert waits[5:] == [1.0, 1.0]
+    assert clock.sleeps == [1.0, 1.0]
+    stats = limit.stats()
+    assert (stats["requests"], stats["queued"], stats["queue_wait_max_s"]) == (7, 2, 1.0)
+
+
+def test_error_code_reads_the_code_status_or_text():
+    assert error_code(ApiError(503)) == 503
+
+    class StatusError(Exception):
+        status = "RESOURCE_EXHAUSTED"
+
+    assert error_code(StatusError("quota")) == 429
+    assert error_code(Exception("429 RESOURCE_EXHAUSTED. Quota exceeded")) == 429
+    assert error_code(ValueError("bad request")) is None
+
+
+def test_retry_hint_reads_the_header_retry_info_or_text():
+    class Response:
+        headers = {"retry-after": "7"}
+
+    error = ApiError(429)
+    error.response = Response()
+    assert retry_hint(error) == 7.0
+
+    details = {"error": {"details": [{"@type": "type.googleapis.com/google.rpc.QuotaFailure"},
+                                     {"@type": "type.googleapis.com/google.rpc.RetryInfo", "retryDelay": "12.5s"}]}}
+    assert retry_hint(ApiError(429, details=details)) == 12.5
+    assert retry_hint(ApiError(429, "Quota exceeded. Please retry in 3.2s.")) == 3.2
+    assert retry_hint(ApiError(429, "Quota exceeded.")) is None
+
+
+def test_429_drains_the_buckets_and_cuts_the_rate_once():
+    clock = FakeClock()
+    limit = limiter(clock)
+    clock.now = 10.0
+    limit._throttled(429, 4.0, "test", reserved_at=10.0)
+    assert limit.rate_factor == 0.5
+    assert (limit.requests.level, limit.requests.updated) == (0.0, 14.0)
+
+    # A 429 of a request reserved before that decrease was paced at the old rate and cuts nothing.
+    clock.now = 11.0
+    limit._throttled(429, None, "test", reserved_at=9.0)
+    assert limit.rate_factor == 0.5
+
+    limit._throttled(429, None, "test", reserved_at=11.0)
+    limit._throttled(429, None, "test", reserved_at=11.0)
+    assert limit.rate_factor == 0.25
+
+    # Transient server errors are retried but neither drain the buckets nor cut the rate.
+    limit._throttled(503, None, "test", reserved_at=11.0)
+    assert limit.rate_factor == 0.25
+    assert limit.stats()["throttled"] == 5
+
+
+def test_successful_requests_restore_the_rate():
+    clock = FakeClock()
+    limit = limiter(clock)
+    limit._throttled(429, None, "test", reserved_at=0.0)
+    assert limit.rate_factor == 0.5
+    clock.now = 2.0
+    limit._succeeded("test", 0.1, 0, response=None)
+    assert limit.rate_factor == pytest.approx(0.7)
+    clock.now = 100.0
+    limit._succeeded("test", 0.1, 0, response=None)
+    assert limit.rate_factor == 1.0
+
+
+def test_call_retries_after_the_server_hint():
+    clock = FakeClock()
+    limit = limiter(clock)
+    attempts = []
+
+    async def request():
+        attempts.append(clock.now)
+        if len(attempts) == 1:
+            raise ApiError(429, "RESOURCE_EXHAUSTED. Please retry in 2s.")
+        return "ok"
+
+    assert asyncio.run(limit.call(request, caller="test")) == "ok"
+    assert len(attempts) == 2
+    # The hint plus at most backoff_base of jitter, then the wait of the drained bucket.
+    assert 2.0 <= attempts[1] - attempts[0] <= 3.0 + 1 / limit.rate_factor
+    stats = limit.stats()
+    assert (stats["throttled"], stats["retries"], stats["gave_up"]) == (1, 1, 0)
+    # Cut to half by the 429 and partly restored by the success that followed it.
+    assert limit.rate_factor == pytest.approx(0.5 + 0.1 * (clock.now - attempts[0]))
+
+
+def test_call_gives_up_with_rate_limit_error_after_max_retries():
+    clock = FakeClock()
+    limit = limiter(clock, max_retries=2)
+    attempts = []
+
+    async def request():
+        attempts.append(clock.now)
+        raise ApiError(429, "RESOURCE_EXHAUSTED. Please retry in 5s.")
+
+    with pytest.raises(RateLimitError) as raised:
+        asyncio.run(limit.call(request, caller="test"))
+    assert len(attempts) == 3
+    assert 5.0 <= raised.value.retry_after <= 6.0
+    stats = limit.stats()
+    assert (stats["retries"], stats["gave_up"]) == (2, 1)
+
+
+def test_call_reraises_server_errors_and_does_not_retry_client_errors():
+    clock = FakeClock()
+    limit = limiter(clock, max_retries=1)
+    attempts = []
+
+    async def unavailable():
+        attempts.append("503")
+        raise ApiError(503, "UNAVAILABLE")
+
+    async def bad_request():
+        attempts.append("400")
+        raise ApiError(400, "INVALID_ARGUMENT")
+
+    with pytest.raises(ApiError):
+        asyncio.run(limit.call(unavailable, caller="test"))
+    with pytest.raises(ApiError):
+        asyncio.run(limit.call(bad_request, caller="test"))
+    assert attempts == ["503", "503", "400"]
+
+
+def test_hedge_wins_and_the_slow_request_is_cancelled():
+    clock = FakeClock()
+    limit = limiter(clock, hedging=True, hedge_min_delay=0.01)
+    limit._latencies["test"] = collections.deque([0.001] * 20, maxlen=200)
+    calls = []
+    cancelled = []
+
+    async def request():
+        calls.append(len(calls))
+        if len(calls) == 1:
+            try:
+                await asyncio.sleep(10)
+            except asyncio.CancelledError:
+                cancelled.append(True)
+                raise
+            return "primary"
+        return "hedge"
+
+    assert asyncio.run(limit.call(request, caller="test", idempotent=True)) == "hedge"
+    assert calls == [0, 1]
+    assert cancelled == [True]
+    stats = limit.stats()
+    assert (stats["hedges"], stats["hedge_wins"]) == (1, 1)
+
+
+def test_no_hedge_while_backing_off():
+    clock = FakeClock()
+    limit = limiter(clock, hedging=True, hedge_min_delay=0.01)
+    limit._latencies["test"] = collections.deque([0.001] * 20, maxlen=200)
+    limit._set_rate_factor(0.5, clock.now)
+    calls = []
+
+    async def request():
+        calls.append(len(calls))
+        await asyncio.sleep(0.05)
+        return "primary"
+
+    assert asyncio.run(limit.call(request, caller="test", idempotent=True)) == "primary"
+    assert calls == [0]
+    assert limit.stats()["hedges"] == 0
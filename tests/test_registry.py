@@ -0,0 +1,116 @@
+import json
+import sqlite3
+import threading
+
+from registry import Registry
+
+ENGINE = "projects/p/locations/europe-west1/reasoningEngines/1"
+OTHER = "projects/p/locations/europe-west1/reasoningEngines/2"
+
+
+class FakeClock:
+    def __init__(self):
+        self.now = 1000.0
+
+    def __call__(self):
+        self.now += 1
+        return self.now
+
+
+def write_legacy(tmp_path, **data):
+    path = tmp_path / "engine.json"
+    path.write_text(json.dumps(data))
+    return str(path)
+
+
+def registry(tmp_path, legacy_file=None):
+    return Registry(str(tmp_path / "registry.sqlite3"), legacy_file=legacy_file, clock=FakeClock())
+
+
+def test_imports_engine_json_into_an_empty_registry(tmp_path):
+    legacy = write_legacy(tmp_path, resource_name=ENGINE, agent_name="demo", user_id="u1", session_id="s1")
+    current = registry(tmp_path, legacy).current()
+    assert current == {"resource_name": ENGINE, "agent_name": "demo", "user_id": "u1", "session_id": "s1"}
+    assert [s["session_id"] for s in registry(tmp_path, legacy).sessions(ENGINE)] == ["s1"]
+
+
+def test_deleted_last_engine_is_not_reimported(tmp_path):
+    legacy = write_legacy(tmp_path, resource_name=ENGINE, agent_name="demo")
+    registry(tmp_path, legacy).remove_engine(ENGINE)
+
+    reopened = registry(tmp_path, legacy)
+    assert reopened.engines() == []
+    assert reopened.current() == {}
+
+
+def test_legacy_file_is_ignored_when_the_registry_already_has_engines(tmp_path):
+    registry(tmp_path).record_engine(OTHER, agent_name="other")
+    legacy = write_legacy(tmp_path, resource_name=ENGINE, agent_name="demo")
+
+    reopened = registry(tmp_path, legacy)
+    reopened.remove_engine(OTHER)
+    reopened = registry(tmp_path, legacy)
+    assert reopened.engines() == []
+
+
+def test_unreadable_legacy_file_is_retried(tmp_path):
+    legacy = tmp_path / "engine.json"
+    legacy.write_text("{not json")
+    assert registry(tmp_path, str(legacy)).engines() == []
+
+    legacy.write_text(json.dumps({"resource_name": ENGINE}))
+    assert [e["resource_name"] for e in registry(tmp_path, str(legacy)).engines()] == [ENGINE]
+
+
+def test_new_default_engine_clears_the_default_session(tmp_path):
+    reg = registry(tmp_path)
+    reg.record_session(ENGINE, "u1", "s1")
+    reg.record_engine(ENGINE, deploy_hash="abc")
+    assert reg.current()["session_id"] == "s1"
+
+    reg.record_engine(OTHER, agent_name="demo")
+    assert reg.current() == {"resource_name": OTHER, "agent_name": "demo"}
+    assert reg.engine_by_agent_name("demo")["resource_name"] == OTHER
+
+
+def test_remove_engine_drops_its_sessions_and_defaults(tmp_path):
+    reg = registry(tmp_path)
+    reg.record_session(OTHER, "u2", "s2", make_default=False)
+    reg.record_session(ENGINE, "u1", "s1")
+    reg.remove_engine(ENGINE)
+    assert reg.current() == {}
+    assert [s["session_id"] for s in reg.sessions()] == ["s2"]
+
+
+def test_record_turn_accumulates_usage(tmp_path):
+    reg = registry(tmp_path)
+    reg.record_turn(ENGINE, "u1", "s1", 0.5)
+    reg.record_turn(ENGINE, "u1", "s1", 1.5, error=True)
+    (session,) = reg.sessions(user_id="u1")
+    assert (session["turns"], session["errors"], session["last_latency_s"], session["total_latency_s"]) == (2, 1, 1.5, 2.0)
+
+
+def test_concurrent_writers_lose_no_turns(tmp_path):
+    reg = registry(tmp_path)
+
+    def worker():
+        for _ in range(25):
+            reg.record_turn(ENGINE, "u1", "s1", 0.1)
+
+    threads = [threading.Thread(target=worker) for _ in range(4)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    assert reg.sessions()[0]["turns"] == 100
+
+
+def test_opening_an_existing_registry_adds_the_meta_table(tmp_path):
+    path = tmp_path / "registry.sqlite3"
+    conn = sqlite3.connect(path)
+    conn.execute("CREATE TABLE engines (resource_name TEXT PRIMARY KEY, agent_name TEXT, deploy_hash TEXT, "
+                 "created_at REAL NOT NULL, updated_at REAL NOT NULL)")
+    conn.commit()
+    conn.close()
+    legacy = write_legacy(tmp_path, resource_name=ENGINE)
+    assert [e["resource_name"] for e in Registry(str(path), legacy_file=legacy).engines()] == [ENGINE]
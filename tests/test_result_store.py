@@ -0,0 +1,146 @@
+import asyncio
+import os
+import types
+
+import pytest
+
+from app.result_store import (
+    STATE_PREFIX, ResultQueryError, ResultStore, aggregate, apply_filters, rows_to_table, table_digest)
+
+QUERY = "SELECT Ematn, Txz01, Menge, Werks FROM `p.ventas.pedidos`"
+PRODUCTS = ["Vitamina C", "Magnesio", "Omega 3"]
+
+
+def make_rows(count: int = 60) -> list:
+    return [{"Ematn": f"{100 + i:06d}", "Txz01": PRODUCTS[i % 3], "Menge": f"{i}.000",
+             "Werks": None if i % 10 == 0 else f"W{i % 2}"} for i in range(count)]
+
+
+class FakeBigQuery:
+    """`query_and_wait` returns `rows` (BigQuery rows expose `items()`) and counts the queries it ran."""
+
+    def __init__(self, rows: list):
+        self.rows = rows
+        self.queries = 0
+
+    def query_and_wait(self, query, project=None, max_results=None):
+        self.queries += 1
+        return [types.SimpleNamespace(items=row.items) for row in self.rows[:max_results]]
+
+
+def store(tmp_path, bigquery, **kwargs) -> ResultStore:
+    return ResultStore(lambda project: bigquery, directory=str(tmp_path), **kwargs)
+
+
+async def summarize(result_store: ResultStore, rows: list, state: dict) -> dict:
+    return await result_store.after_tool_callback(
+        types.SimpleNamespace(name="execute_sql"), {"project_id": "p", "query": QUERY},
+        types.SimpleNamespace(state=state), {"status": "SUCCESS", "rows": rows})
+
+
+def test_apply_filters_operators():
+    table = rows_to_table(make_rows())
+
+    def ematns(*filters):
+        return apply_filters(table, list(filters)).column("Ematn").to_pylist()
+
+    assert ematns("Menge >= 57") == ["000157", "000158", "000159"]
+    assert ematns("menge < 2", "Txz01 = 'Vitamina C'") == ["000100"]
+    assert len(ematns("Txz01 contains 'VITAMINA'")) == 20
+    assert len(ematns("Txz01 starts_with 'mag'")) == 20
+    assert ematns("Menge in (1, 2)") == ["000101", "000102"]
+    assert len(ematns("Txz01 not in ('Magnesio', 'Omega 3')")) == 20
+    assert len(ematns("Werks is null")) == 6
+    assert len(ematns("Werks is not null", "Werks != 'W0'")) == 30
+    assert apply_filters(table, []) is table
+
+
+@pytest.mark.parametrize("filters, message", [
+    (["Menge bigger 3"], "Invalid filter"),
+    (["Cantidad > 3"], "Unknown column 'Cantidad'"),
+    (["Txz01 > 3"], "not numeric"),
+])
+def test_apply_filters_errors(filters, message):
+    with pytest.raises(ResultQueryError, match=message):
+        apply_filters(rows_to_table(make_rows()), filters)
+
+
+def test_aggregate_groups_and_converts_text_numbers():
+    table = aggregate(rows_to_table(make_rows()), ["count", "sum:Menge", "max:Ematn", "count_distinct:Werks"],
+                      ["Txz01"])
+
+    assert table.column_names == ["Txz01", "count", "Menge_sum", "Ematn_max", "Werks_count_distinct"]
+    first = table.to_pylist()[0]
+    assert first == {"Txz01": "Vitamina C", "count": 20, "Menge_sum": float(sum(range(0, 60, 3))),
+                     "Ematn_max": "000157", "Werks_count_distinct": 2}
+    assert aggregate(rows_to_table(make_rows()), []).to_pylist() == [{"count": 60}]
+    with pytest.raises(ResultQueryError, match="Unknown aggregation"):
+        aggregate(rows_to_table(make_rows()), ["median:Menge"])
+
+
+def test_table_digest_ignores_row_order():
+    rows = make_rows()
+    assert table_digest(rows_to_table(rows)) == table_digest(rows_to_table(rows[::-1]))
+    assert table_digest(rows_to_table(rows)) != table_digest(rows_to_table(rows[1:]))
+
+
+def test_small_results_pass_through_and_large_ones_are_summarized(tmp_path):
+    result_store = store(tmp_path, FakeBigQuery([]))
+    state = {}
+
+    assert asyncio.run(summarize(result_store, make_rows(5), state)) is None
+    summary = asyncio.run(summarize(result_store, make_rows(), state))
+
+    assert summary["row_count"] == 60 and len(summary["first_rows"]) == 10
+    assert state[STATE_PREFIX + summary["result_id"]]["row_count"] == 60
+
+
+def test_spilled_results_are_read_back(tmp_path):
+    result_store = store(tmp_path, FakeBigQuery([]), max_bytes=1)
+    first, second = rows_to_table(make_rows()), rows_to_table(make_rows(70))
+
+    result_store.put("first", first)
+    result_store.put("second", second)
+
+    assert os.path.exists(tmp_path / "first.parquet")
+    assert result_store.stats()["spilled"] == 1 and result_store.stats()["tables_in_memory"] == 1
+    assert result_store.get("first").equals(first)
+    assert result_store.get("missing") is None
+
+
+def test_other_replica_rebuilds_from_the_session_state(tmp_path):
+    rows = make_rows(120)
+    state = {}
+    result_store = store(tmp_path / "a", FakeBigQuery([]))
+    summary = asyncio.run(summarize(result_store, rows, state))
+    filtered = asyncio.run(result_store.filter(summary["result_id"], ["Menge >= 50"], "Menge", True, state))
+
+    bigquery = FakeBigQuery(rows)
+    replica = store(tmp_path / "b", bigquery)
+    page = asyncio.run(replica.rows(filtered["result_id"], 0, 3, ["Ematn"], "", False, state))
+
+    assert page["status"] == "SUCCESS" and page["row_count"] == 70
+    assert page["rows"] == [{"Ematn": "000219"}, {"Ematn": "000218"}, {"Ematn": "000217"}]
+    assert bigquery.queries == 1 and replica.stats()["rebuilt"] == 2
+
+
+def test_rebuild_that_returns_different_rows_is_refused(tmp_path):
+    rows = make_rows()
+    state = {}
+    summary = asyncio.run(summarize(store(tmp_path / "a", FakeBigQuery([])), rows, state))
+
+    changed = [dict(row) for row in rows]
+    changed[0]["Menge"] = "999.000"
+    replica = store(tmp_path / "b", FakeBigQuery(changed))
+    response = asyncio.run(replica.aggregate(summary["result_id"], ["sum:Menge"], [], [], "", False, state))
+
+    assert response["status"] == "ERROR"
+    assert "Run the query again with execute_sql" in response["error_details"]
+    assert replica.stats()["rebuild_mismatches"] == 1 and replica.get(summary["result_id"]) is None
+
+
+def test_unknown_result_id(tmp_path):
+    response = asyncio.run(store(tmp_path, FakeBigQuery([])).rows("r000", 0, 10, None, "", False, {}))
+
+    assert response == {"status": "ERROR",
+                        "error_details": "Unknown result_id 'r000'. Run the query again with execute_sql."}
@@ -0,0 +1,72 @@
+import types as pytypes
+
+from google.adk.models import LlmRequest
+from google.genai import types
+
+from app.router import KeywordClassifier, Router
+
+
+def user_message(text: str) -> types.Content:
+    return types.Content(role="user", parts=[types.Part(text=text)])
+
+
+def context(invocation_id: str, user_content: types.Content):
+    return pytypes.SimpleNamespace(invocation_id=invocation_id, user_content=user_content)
+
+
+def transferred_to(response):
+    if response is None:
+        return None
+    call = response.content.parts[0].function_call
+    assert call.name == "transfer_to_agent"
+    return call.args["agent_name"]
+
+
+def test_routes_confident_user_question():
+    router = Router([KeywordClassifier()])
+    question = user_message("¿Qué órdenes de compra tenemos del proveedor Acme?")
+
+    response = router.before_model_callback(context("inv-1", question), LlmRequest(contents=[question]))
+
+    assert transferred_to(response) == "compras_agent"
+    assert router.routed_by("inv-1") == "keywords"
+
+
+def test_transfer_back_reaches_the_orchestrator_model():
+    router = Router([KeywordClassifier()])
+    question = user_message("¿Qué órdenes de compra tenemos del proveedor Acme?")
+    assert transferred_to(router.before_model_callback(context("inv-1", question),
+                                                       LlmRequest(contents=[question]))) == "compras_agent"
+
+    # compras_agent gives control back: ADK replays its transfer as a user-role message.
+    handed_back = types.Content(role="user", parts=[
+        types.Part(text="For context:"),
+        types.Part(text="[compras_agent] called tool `transfer_to_agent` with parameters: "
+                        "{'agent_name': 'bigquery_agent'}"),
+    ])
+    request = LlmRequest(contents=[question, handed_back])
+
+    assert router.before_model_callback(context("inv-1", question), request) is None
+    assert router.stats()["direct"] == {"compras_agent": 1}
+
+
+def test_for_context_message_is_never_classified():
+    router = Router([KeywordClassifier()])
+    handed_back = user_message("For context: [pedidos_agent] called tool `transfer_to_agent` "
+                               "with parameters: {'agent_name': 'bigquery_agent'}")
+
+    response = router.before_model_callback(context("inv-2", handed_back), LlmRequest(contents=[handed_back]))
+
+    assert response is None
+    assert router.decisions == 0
+
+
+def test_unsure_question_falls_back_once_per_invocation():
+    router = Router([KeywordClassifier()])
+    question = user_message("Hola, ¿qué puedes hacer?")
+    request = LlmRequest(contents=[question])
+
+    assert router.before_model_callback(context("inv-3", question), request) is None
+    assert router.before_model_callback(context("inv-3", question), request) is None
+    assert router.routed_by("inv-3") == "orchestrator"
+    assert router.stats()["fallbacks"] == 1
@@ -0,0 +1,178 @@
+import asyncio
+
+from google.adk.sessions import InMemorySessionService
+
+from registry import Registry
+from session_pool import RegistrySessionPool, SessionPool
+
+APP = "alifarma"
+
+
+class FakeClock:
+    def __init__(self):
+        self.now = 0.0
+
+    def __call__(self):
+        return self.now
+
+
+async def sessions(service: InMemorySessionService, user_id: str) -> list:
+    return [s.id for s in (await service.list_sessions(app_name=APP, user_id=user_id)).sessions]
+
+
+def test_replenish_fills_the_pool_and_refills_taken_sessions():
+    service = InMemorySessionService()
+    pool = SessionPool(service, APP, size=3)
+
+    async def run():
+        await pool.replenish()
+        assert pool.stats()["ready"] == 3
+
+        pooled = await pool.acquire("ana")
+        assert pooled.pooled and pooled.assigned_to == "ana"
+        assert pooled.session_id in await sessions(service, pooled.user_id)
+        assert pool.stats()["ready"] == 2
+
+        await pool.replenish()
+        assert pool.stats()["ready"] == 3
+
+    asyncio.run(run())
+    stats = pool.stats()
+    assert (stats["hits"], stats["misses"], stats["created"]) == (1, 0, 4)
+    assert stats["replenish_lag_s"]["count"] == 1
+
+
+def test_background_task_replaces_taken_sessions():
+    pool = SessionPool(InMemorySessionService(), APP, size=2)
+
+    async def run():
+        await pool.start()
+        await pool.acquire("ana")
+        await pool.acquire("luis")
+        for _ in range(100):
+            if pool.stats()["ready"] == 2:
+                break
+            await asyncio.sleep(0.01)
+        await pool.close()
+
+    asyncio.run(run())
+    assert pool.stats()["created"] == 4
+    assert pool.stats()["ready"] == 0
+
+
+def test_empty_pool_creates_the_session_on_the_request_path():
+    service = InMemorySessionService()
+    pool = SessionPool(service, APP, size=2)
+
+    async def run():
+        pooled = await pool.acquire("ana")
+        assert not pooled.pooled and pooled.assigned_to == "ana"
+        assert pooled.session_id in await sessions(service, pooled.user_id)
+
+    asyncio.run(run())
+    stats = pool.stats()
+    assert (stats["hits"], stats["misses"], stats["hit_rate"]) == (0, 1, 0.0)
+
+
+def test_idle_sessions_expire_and_are_deleted():
+    service = InMemorySessionService()
+    clock = FakeClock()
+    pool = SessionPool(service, APP, size=2, max_idle=60, clock=clock)
+
+    async def run():
+        await pool.replenish()
+        stale = list(pool._ready)
+        clock.now += 61
+
+        # An expired session is never handed out: the pool is empty until it is replenished.
+        assert not (await pool.acquire("ana")).pooled
+        await pool.replenish()
+
+        for pooled in stale:
+            assert pooled.session_id not in await sessions(service, pooled.user_id)
+        assert not {s.session_id for s in pool._ready} & {s.session_id for s in stale}
+
+    asyncio.run(run())
+    stats = pool.stats()
+    assert (stats["expired"], stats["ready"]) == (2, 2)
+
+
+def test_close_deletes_sessions_nobody_took():
+    service = InMemorySessionService()
+    pool = SessionPool(service, APP, size=2)
+
+    async def run():
+        await pool.replenish()
+        ready = list(pool._ready)
+        await pool.close()
+        for pooled in ready:
+            assert await sessions(service, pooled.user_id) == []
+
+    asyncio.run(run())
+
+
+def test_replenish_lag_only_counts_replacements_of_taken_sessions():
+    clock = FakeClock()
+    pool = SessionPool(InMemorySessionService(), APP, size=3, max_idle=60, clock=clock)
+
+    async def run():
+        await pool.replenish()
+        clock.now += 30
+        await pool.acquire("ana")
+        clock.now += 31
+        # Two expired sessions and one taken session are replaced: only the taken one is lag.
+        await pool.replenish()
+
+    asyncio.run(run())
+    stats = pool.stats()
+    assert (stats["expired"], stats["ready"]) == (2, 3)
+    assert stats["replenish_lag_s"]["count"] == 1
+    assert stats["replenish_lag_s"]["max"] == 31
+
+
+def registry_pool(tmp_path, service, clock, **kwargs) -> RegistrySessionPool:
+    registry = Registry(str(tmp_path / "registry.sqlite3"), legacy_file=None, clock=clock)
+    return RegistrySessionPool(service, APP, registry, clock=clock, **kwargs)
+
+
+def test_registry_pool_is_shared_between_processes(tmp_path):
+    service = InMemorySessionService()
+    clock = FakeClock()
+
+    async def run():
+        first = registry_pool(tmp_path, service, clock, size=2)
+        await first.replenish()
+        # A later command, with its own pool object, takes the sessions the first one created.
+        second = registry_pool(tmp_path, service, clock, size=2)
+        taken = [await second.acquire("ana"), await second.acquire("luis")]
+        assert all(p.pooled for p in taken)
+        assert len({p.session_id for p in taken}) == 2
+        for pooled in taken:
+            assert pooled.session_id in await sessions(service, pooled.user_id)
+        assert not (await second.acquire("eva")).pooled
+        await second.replenish()
+        assert first.stats()["ready"] == 2
+
+    asyncio.run(run())
+
+
+def test_registry_pool_deletes_expired_sessions(tmp_path):
+    service = InMemorySessionService()
+    clock = FakeClock()
+
+    async def run():
+        pool = registry_pool(tmp_path, service, clock, size=2, max_idle=60)
+        await pool.replenish()
+        stale = pool.registry.pooled_sessions(APP)
+        clock.now += 61
+        assert not (await pool.acquire("ana")).pooled
+        await pool.replenish()
+        for row in stale:
+            assert row["session_id"] not in await sessions(service, row["user_id"])
+        ready = {row["session_id"] for row in pool.registry.pooled_sessions(APP)}
+        assert len(ready) == 2 and not ready & {row["session_id"] for row in stale}
+
+        pool.registry.remove_engine(APP)
+        assert pool.stats()["ready"] == 0
+
+    asyncio.run(run())
@@ -0,0 +1,113 @@
+import datetime
+import types
+
+import pytest
+
+from app.sql_cache import SqlResultCache, canonicalize_sql, referenced_tables
+
+PROJECT = "demo-project"
+
+
+class FakeBigQuery:
+    """`get_table` returns the table's modified time from `modified`; unknown tables raise."""
+
+    def __init__(self, modified: dict):
+        self.modified = modified
+        self.lookups = []
+
+    def get_table(self, table):
+        self.lookups.append(table)
+        if table not in self.modified:
+            raise LookupError(f"Not found: {table}")
+        return types.SimpleNamespace(modified=self.modified[table])
+
+
+class FakeClock:
+    def __init__(self):
+        self.now = 0.0
+
+    def __call__(self):
+        return self.now
+
+
+def modified(minute: int):
+    return datetime.datetime(2024, 5, 1, 10, minute, tzinfo=datetime.timezone.utc)
+
+
+def test_canonicalize_sql_normalizes_whitespace_comments_and_case():
+    first = "select  Ematn,\n  COUNT(*) -- per product\nfrom ventas.pedidos where Werks = 'Madrid' ;"
+    second = "SELECT ematn, count(*) FROM VENTAS.PEDIDOS\tWHERE werks = 'Madrid'"
+    assert canonicalize_sql(first) == canonicalize_sql(second)
+
+
+def test_canonicalize_sql_keeps_literals_and_quoted_names():
+    assert canonicalize_sql("SELECT 1 FROM t WHERE a = 'Madrid'") != canonicalize_sql("SELECT 1 FROM t WHERE a = 'madrid'")
+    assert "`Demo.Ventas.Pedidos`" in canonicalize_sql("SELECT * FROM `Demo.Ventas.Pedidos`")
+
+
+def test_referenced_tables_qualifies_and_deduplicates():
+    query = ("SELECT * FROM `other-project.ventas.pedidos` p JOIN ventas.productos d ON p.Ematn = d.Ematn "
+             "LEFT JOIN ventas.productos e ON TRUE")
+    assert referenced_tables(query, PROJECT) == ["demo-project.ventas.productos", "other-project.ventas.pedidos"]
+
+
+def test_referenced_tables_ignores_from_inside_function_calls():
+    query = ("SELECT EXTRACT(YEAR FROM p.Eindt) AS anio, SUBSTRING(p.Ematn FROM 2), TRIM(BOTH ' ' FROM p.Werks) "
+             "FROM ventas.pedidos p")
+    assert referenced_tables(query, PROJECT) == ["demo-project.ventas.pedidos"]
+
+
+def test_referenced_tables_reads_subqueries_ctes_and_parenthesized_joins():
+    query = ("WITH c AS (SELECT * FROM ventas.compras) "
+             "SELECT (SELECT MAX(Eindt) FROM ventas.pedidos) FROM (ventas.productos JOIN c USING (Ematn)) "
+             "WHERE Ematn IN (SELECT Ematn FROM ventas.stock)")
+    assert referenced_tables(query, PROJECT) == [
+        "demo-project.ventas.compras", "demo-project.ventas.pedidos", "demo-project.ventas.productos",
+        "demo-project.ventas.stock"]
+
+
+def test_referenced_tables_ignores_literals_and_comments():
+    query = "SELECT 'from ventas.fake' AS s -- join ventas.other\nFROM ventas.pedidos"
+    assert referenced_tables(query, PROJECT) == ["demo-project.ventas.pedidos"]
+
+
+def make_cache(bigquery, clock=None, **kwargs):
+    return SqlResultCache(lambda project: bigquery, clock=clock or FakeClock(), **kwargs)
+
+
+def test_make_key_is_stable_across_formatting_and_follows_table_modifications():
+    bigquery = FakeBigQuery({"demo-project.ventas.pedidos": modified(0)})
+    clock = FakeClock()
+    cache = make_cache(bigquery, clock, table_check_interval=30)
+    key = cache.make_key(PROJECT, "SELECT COUNT(*) FROM ventas.pedidos")
+    assert key == cache.make_key(PROJECT, "select count(*)\nfrom ventas.pedidos;")
+    assert len(bigquery.lookups) == 1
+
+    bigquery.modified["demo-project.ventas.pedidos"] = modified(5)
+    assert cache.make_key(PROJECT, "SELECT COUNT(*) FROM ventas.pedidos") == key
+    clock.now = 31
+    assert cache.make_key(PROJECT, "SELECT COUNT(*) FROM ventas.pedidos") != key
+
+
+def test_make_key_only_looks_up_real_tables():
+    bigquery = FakeBigQuery({"demo-project.ventas.pedidos": modified(0)})
+    cache = make_cache(bigquery)
+    assert cache.make_key(PROJECT, "SELECT EXTRACT(YEAR FROM p.Eindt) FROM ventas.pedidos p") is not None
+    assert bigquery.lookups == ["demo-project.ventas.pedidos"]
+
+
+@pytest.mark.parametrize("query", [
+    "SELECT * FROM ventas.pedidos WHERE Eindt = CURRENT_DATE()",
+    "SELECT RAND() FROM ventas.pedidos",
+    "SELECT 1",
+    "SELECT table_name FROM ventas.INFORMATION_SCHEMA.TABLES",
+])
+def test_make_key_skips_uncacheable_queries(query):
+    bigquery = FakeBigQuery({})
+    assert make_cache(bigquery).make_key(PROJECT, query) is None
+    assert bigquery.lookups == []
+
+
+def test_make_key_raises_for_unknown_tables():
+    with pytest.raises(LookupError):
+        make_cache(FakeBigQuery({})).make_key(PROJECT, "SELECT * FROM ventas.missing")
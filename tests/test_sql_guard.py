@@ -0,0 +1,177 @@
+import asyncio
+import datetime
+import types as pytypes
+
+import pytest
+from google.api_core import exceptions
+
+from app.sql_guard import SqlGuard, SqlGuardError
+
+PROJECT = "demo-project"
+QUERY = f"SELECT Ematn FROM `{PROJECT}.ventas.pedidos` LIMIT 10"
+
+
+class FakeBigQuery:
+    """Dry runs return `total_bytes` or raise `error`; real queries record their job config."""
+
+    def __init__(self, total_bytes: int = 1024, error: Exception = None):
+        self.total_bytes = total_bytes
+        self.error = error
+        self.statement_type = "SELECT"
+        self.rows = [{"Ematn": "100"}]
+        self.executed = []
+
+    def query(self, query, project=None, job_config=None):
+        if self.error is not None:
+            raise self.error
+        return pytypes.SimpleNamespace(total_bytes_processed=self.total_bytes, statement_type=self.statement_type)
+
+    def query_and_wait(self, query, job_config=None, project=None, max_results=None):
+        self.executed.append(job_config)
+        return self.rows[:max_results]
+
+
+def guard(bigquery: FakeBigQuery, **kwargs) -> SqlGuard:
+    return SqlGuard(lambda project: bigquery, max_bytes_billed=10 * 1024 ** 2, **kwargs)
+
+
+def test_query_within_budget_passes_with_its_estimate():
+    query, notes, estimated_bytes = guard(FakeBigQuery(total_bytes=2048)).check(PROJECT, QUERY)
+
+    assert (query, notes, estimated_bytes) == (QUERY, [], 2048)
+
+
+def test_query_over_budget_is_rejected():
+    sql_guard = guard(FakeBigQuery(total_bytes=50 * 1024 ** 2))
+
+    with pytest.raises(SqlGuardError, match="above the budget"):
+        sql_guard.check(PROJECT, QUERY)
+    assert sql_guard.stats()["rejected"] == 1
+
+
+def test_bad_request_rejects_the_query():
+    sql_guard = guard(FakeBigQuery(error=exceptions.BadRequest("Unrecognized name: Ematnn")))
+
+    with pytest.raises(SqlGuardError, match="not valid"):
+        sql_guard.check(PROJECT, QUERY)
+
+
+@pytest.mark.parametrize("error", [
+    exceptions.Forbidden("Access Denied"),
+    exceptions.ServiceUnavailable("backendError"),
+    exceptions.DeadlineExceeded("timed out"),
+])
+def test_infrastructure_errors_let_the_query_run(error):
+    sql_guard = guard(FakeBigQuery(error=error))
+
+    query, _, estimated_bytes = sql_guard.check(PROJECT, QUERY)
+
+    assert (query, estimated_bytes) == (QUERY, None)
+    assert sql_guard.stats()["dry_run_failures"] == 1
+    assert sql_guard.stats()["rejected"] == 0
+
+
+def test_counters_are_consistent_under_threads():
+    sql_guard = guard(FakeBigQuery(), default_limit=0)
+
+    async def run():
+        await asyncio.gather(*[asyncio.to_thread(sql_guard.check, PROJECT, f"{QUERY} -- {i}") for i in range(200)])
+
+    asyncio.run(run())
+    assert sql_guard.stats()["checked"] == 200
+
+
+def test_executed_job_is_capped_at_the_budget():
+    bigquery = FakeBigQuery()
+
+    result = guard(bigquery).execute_sql(PROJECT, QUERY, max_rows=10)
+
+    assert result == {"status": "SUCCESS", "rows": [{"Ematn": "100"}]}
+    assert [config.maximum_bytes_billed for config in bigquery.executed] == [10 * 1024 ** 2]
+
+
+def test_execute_sql_answers_like_the_adk_tool():
+    bigquery = FakeBigQuery()
+    bigquery.rows = [{"Ematn": "100", "Eindt": datetime.date(2024, 5, 1)}]
+    assert guard(bigquery).execute_sql(PROJECT, QUERY, max_rows=1) == {
+        "status": "SUCCESS", "rows": [{"Ematn": "100", "Eindt": "2024-05-01"}], "result_is_likely_truncated": True}
+
+    bigquery.statement_type = "DELETE"
+    assert guard(bigquery).execute_sql(PROJECT, "DELETE FROM ventas.pedidos WHERE TRUE") == {
+        "status": "ERROR", "error_details": "Read-only mode only supports SELECT statements."}
+
+    bigquery.error = exceptions.Forbidden("Access Denied")
+    assert guard(bigquery).execute_sql(PROJECT, QUERY)["status"] == "ERROR"
+
+
+CATALOG = {
+    "project": PROJECT,
+    "dataset": "ventas",
+    "tables": {"pedidos": {"columns": [
+        ["Ematn", "STRING", "Referencia interna del producto"],
+        ["Ebeln", "STRING", "Número de pedido"],
+        ["Menge", "NUMERIC", "Cantidad pedida"],
+        ["Netpr", "NUMERIC", "Precio neto"],
+        ["Eindt", "DATE", "Fecha de entrega"],
+        ["Notas", "STRING", "Observaciones del comprador"],
+    ]}},
+}
+
+
+def rewriter(**kwargs) -> SqlGuard:
+    return guard(FakeBigQuery(), catalog=CATALOG, default_limit=100, **kwargs)
+
+
+def test_select_star_is_pruned_to_the_columns_the_question_needs():
+    sql_guard = rewriter()
+
+    query, notes = sql_guard.rewrite(PROJECT, f"SELECT * FROM `{PROJECT}.ventas.pedidos` WHERE Menge > 10",
+                                     "¿Qué cantidad y precio tienen los pedidos grandes?")
+
+    assert query.startswith(f"SELECT Ematn, Ebeln, Menge, Netpr FROM `{PROJECT}.ventas.pedidos` WHERE Menge > 10")
+    assert query.endswith("\nLIMIT 100")
+    assert len(notes) == 2 and "SELECT * was replaced" in notes[0]
+    assert sql_guard.stats()["stars_pruned"] == 1
+
+
+def test_select_star_is_kept_when_the_question_names_no_column():
+    query, notes = rewriter().rewrite(PROJECT, "SELECT * FROM ventas.pedidos LIMIT 5", "Enséñame algo")
+
+    assert (query, notes) == ("SELECT * FROM ventas.pedidos LIMIT 5", [])
+
+
+def test_existing_limit_is_kept():
+    sql_guard = rewriter()
+    query = "SELECT Ematn, SUM(Menge) FROM ventas.pedidos GROUP BY Ematn ORDER BY 2 DESC LIMIT 3"
+
+    assert sql_guard.rewrite(PROJECT, query, "cantidad") == (query, [])
+    assert sql_guard.stats()["limits_added"] == 0
+
+
+@pytest.mark.parametrize("query", [
+    "SELECT * FROM ventas.pedidos p JOIN ventas.productos d ON p.Ematn = d.Ematn",
+    "SELECT * FROM (SELECT Ematn, Menge FROM ventas.pedidos)",
+])
+def test_select_star_over_a_join_or_subquery_is_left_untouched(query):
+    sql_guard = rewriter()
+
+    rewritten, notes = sql_guard.rewrite(PROJECT, query, "¿Qué cantidad se pidió?")
+
+    assert rewritten == f"{query}\nLIMIT 100"
+    assert len(notes) == 1 and notes[0].startswith("LIMIT 100")
+    assert sql_guard.stats()["stars_pruned"] == 0
+
+
+def test_limit_inside_a_subquery_does_not_count():
+    query, _ = rewriter().rewrite(PROJECT, "SELECT Ematn FROM (SELECT Ematn FROM ventas.pedidos LIMIT 5)", "")
+
+    assert query.endswith("\nLIMIT 100")
+
+
+def test_multiple_statements_are_rejected():
+    sql_guard = rewriter()
+
+    with pytest.raises(SqlGuardError, match="one SQL statement"):
+        sql_guard.check(PROJECT, "SELECT 1; DROP TABLE ventas.pedidos")
+    assert sql_guard.rewrite(PROJECT, "SELECT Ematn FROM ventas.pedidos LIMIT 1;", "")[0] == (
+        "SELECT Ematn FROM ventas.pedidos LIMIT 1;")
@@ -0,0 +1,15 @@
+from stats import percentile, summarize
+
+
+def test_percentile_interpolates_between_neighbours():
+    values = [1.0, 2.0, 3.0, 4.0]
+    assert percentile(values, 0) == 1.0
+    assert percentile(values, 50) == 2.5
+    assert percentile(values, 100) == 4.0
+    assert percentile([], 50) is None
+
+
+def test_summarize_sorts_and_rounds():
+    summary = summarize([0.3, 0.1, 0.2], digits=2)
+    assert summary == {"count": 3, "mean": 0.2, "p50": 0.2, "p95": 0.29, "p99": 0.3, "max": 0.3}
+    assert summarize([]) == {"count": 0}